@@ -17,13 +17,14 @@ from __future__ import unicode_literals, absolute_import
 from ci import TimeUtils, models
 from django.urls import reverse
 from django.utils.html import format_html, mark_safe
-from django.db.models import Prefetch
-import copy
+from django.db.models import Prefetch, prefetch_related_objects
 from django.utils.encoding import force_text
+import json
 
 def get_default_events_query(event_q=None):
     """
     Default events query that preloads all that will be needed in events_info()
+    The jobs are only loaded by events_info() for events whose snapshot is stale.
     Input:
       event_q: An existing models.Event query
     Return:
@@ -32,13 +33,21 @@ def get_default_events_query(event_q=None):
     if event_q == None:
         event_q = models.Event.objects
 
-    jobs_q = models.Job.objects.select_related('config', 'recipe'
-            ).prefetch_related('recipe__build_configs','recipe__depends_on',)
     return event_q.order_by('-created').select_related(
         'base__branch__repository__user__server',
         'head__branch__repository__user__server',
         'pull_request',
-        ).prefetch_related(Prefetch('jobs', queryset=jobs_q))
+        'snapshot',
+        )
+
+def get_jobs_prefetch():
+    """
+    Return:
+      Prefetch of the jobs of an event with what is needed to build its info
+    """
+    jobs_q = models.Job.objects.select_related('config', 'recipe'
+            ).prefetch_related('recipe__build_configs','recipe__depends_on',)
+    return Prefetch('jobs', queryset=jobs_q)
 
 def all_events_info(limit=30, last_modified=None):
     """
@@ -119,116 +128,221 @@ def multiline_events_info(events, last_modified=None, events_url=False, max_jobs
     ev_info = events_info(events, last_modified, events_url)
     lines = []
     for ev in ev_info:
-        new_ev = copy.deepcopy(ev)
-        new_ev["job_groups"] = []
-        # first flatten out the jobs
-        flat_jobs = []
-        for group_idx, group in enumerate(ev["job_groups"]):
-            for job in group:
-                flat_jobs.append(job)
-            if group_idx != (len(ev["job_groups"])-1):
-                flat_jobs.append({"id": 0})
+        # The jobs are already flattened out with separators between the groups
+        flat_jobs = ev.pop("jobs")
+        ev["job_groups"] = []
 
         # now break it up into max_jobs_per_line
-        multi = list(chunks(flat_jobs, max_jobs_per_line))
         line_count = 1000
-        for idx, line in enumerate(multi):
-            new_line = copy.deepcopy(ev)
+        for idx, line in enumerate(chunks(flat_jobs, max_jobs_per_line)):
+            new_line = dict(ev)
             if idx != 0:
                 new_line["description"] = ''
                 new_line["id"] = "%s_%s" % (ev["id"], line_count-idx)
                 new_line["sort_time"] = "{}{:04}".format(ev["sort_time"], line_count-idx)
                 new_line["status"] = "ContinueLine"
             new_line["jobs"] = line
-            new_line["job_groups"] = []
             lines.append(new_line)
 
     return lines
 
 def events_info(events, last_modified=None, events_url=False):
     """
-    Creates the information required for displaying events.
+    Gets the information required for displaying events from their snapshots.
+    Snapshots that are missing or stale are rebuilt.
     Input:
       events: An iterable of models.Event. Usually a query or just a list.
       last_modified: DateTime: If model.Event.last_modified is before this it won't be included
     Return:
-      list of event info dicts
+      list of event info dicts. Besides the job_groups, they also have the jobs
+        flattened out in "jobs"
     """
-    event_info = []
+    evs = []
+    stale = []
     for ev in events:
         if last_modified and ev.last_modified <= last_modified:
             continue
+        snapshot = event_snapshot(ev)
+        evs.append((ev, snapshot))
+        if snapshot is None or snapshot.stale:
+            stale.append((ev, snapshot))
 
-        repo_url = reverse("ci:view_repo", args=[ev.base.branch.repository.pk])
-        event_url = reverse("ci:view_event", args=[ev.pk])
-        repo_link = format_html('<a href="{}">{}</a>', repo_url, ev.base.branch.repository.name)
-        pr_url = ''
-        pr_desc = ''
-        if ev.pull_request:
-            pr_url = reverse("ci:view_pr", args=[ev.pull_request.pk])
-            pr_desc = clean_str_for_format(str(ev.pull_request))
-            icon_link = format_html('<a href="{}"><i class="{}"></i></a>', ev.pull_request.url, ev.base.server().icon_class())
-            if events_url:
-                event_desc = format_html('{} {} <a href="{}">{}</a>', icon_link, repo_link, event_url, pr_desc)
-            else:
-                event_desc = format_html('{} {} <a href="{}">{}</a>', icon_link, repo_link, pr_url, pr_desc)
+    rebuilt = update_snapshots(stale)
+    event_info = []
+    for ev, snapshot in evs:
+        info = rebuilt.get(ev.pk)
+        if info is None:
+            info = snapshot.get_info()
+        event_info.append(snapshot_info(info, events_url))
+    return event_info
+
+def event_snapshot(ev):
+    """
+    Input:
+      ev: models.Event: The event
+    Return:
+      models.EventSnapshot or None if the event doesn't have one yet
+    """
+    try:
+        return ev.snapshot
+    except models.EventSnapshot.DoesNotExist:
+        return None
+
+def update_snapshots(stale):
+    """
+    Rebuilds the snapshots of events.
+    A snapshot that was changed while it was rebuilt is left as stale.
+    Input:
+      stale: list of (models.Event, models.EventSnapshot) tuples. The snapshot can be None.
+    Return:
+      dict of event pk to the new info
+    """
+    if not stale:
+        return {}
+
+    missing = [models.EventSnapshot(event=ev) for ev, snapshot in stale if snapshot is None]
+    if missing:
+        # Create them before loading the jobs so that changes
+        # to the jobs from now on will mark them as stale.
+        models.EventSnapshot.objects.bulk_create(missing, ignore_conflicts=True)
+
+    evs = [ev for ev, snapshot in stale]
+    prefetch_related_objects(evs, get_jobs_prefetch())
+    infos = {}
+    for ev, snapshot in stale:
+        info = snapshot_event_info(ev)
+        version = snapshot.version if snapshot else 0
+        models.EventSnapshot.objects.filter(event=ev, version=version).update(info=json.dumps(info), stale=False)
+        infos[ev.pk] = info
+    return infos
+
+def snapshot_info(info, events_url):
+    """
+    Gets the event info from the info stored in a snapshot.
+    Input:
+      info: dict: Info as returned by snapshot_event_info()
+      events_url: bool: Whether the description links to the event instead of the pull request
+    Return:
+      dict of event info
+    """
+    info = dict(info)
+    url_description = info.pop("url_description")
+    if events_url:
+        info["description"] = url_description
+    info["description"] = mark_safe(info["description"])
+    # Groups and flat jobs share the same job dicts
+    jobs = {}
+    for job in info["jobs"]:
+        if job["id"]:
+            job = dict(job, description=mark_safe(job["description"]))
+            jobs[job["id"]] = job
+    info["jobs"] = [jobs.get(job["id"], job) for job in info["jobs"]]
+    info["job_groups"] = [[jobs[job["id"]] for job in group] for group in info["job_groups"]]
+    return info
+
+def snapshot_event_info(ev):
+    """
+    Creates the information stored in the snapshot of an event.
+    Input:
+      ev: models.Event: The event, with the jobs preferably already loaded
+    Return:
+      dict of event info. Besides what single_event_info() returns there is
+        url_description: The description that links to the event
+        jobs: The jobs flattened out with {"id": 0} between the job groups
+    """
+    info = single_event_info(ev)
+    info["url_description"] = event_description(ev, True)
+    flat_jobs = []
+    for group_idx, group in enumerate(info["job_groups"]):
+        flat_jobs.extend(group)
+        if group_idx != (len(info["job_groups"])-1):
+            flat_jobs.append({"id": 0})
+    info["jobs"] = flat_jobs
+    return info
+
+def event_description(ev, events_url=False):
+    """
+    Input:
+      ev: models.Event: The event
+      events_url: bool: Whether the description links to the event instead of the pull request
+    Return:
+      str: HTML description of the event
+    """
+    repo_url = reverse("ci:view_repo", args=[ev.base.branch.repository.pk])
+    event_url = reverse("ci:view_event", args=[ev.pk])
+    repo_link = format_html('<a href="{}">{}</a>', repo_url, ev.base.branch.repository.name)
+    if ev.pull_request:
+        pr_url = reverse("ci:view_pr", args=[ev.pull_request.pk])
+        pr_desc = clean_str_for_format(str(ev.pull_request))
+        icon_link = format_html('<a href="{}"><i class="{}"></i></a>', ev.pull_request.url, ev.base.server().icon_class())
+        if events_url:
+            event_desc = format_html('{} {} <a href="{}">{}</a>', icon_link, repo_link, event_url, pr_desc)
         else:
-            event_desc = format_html('{} <a href="{}">{}', repo_link, event_url, ev.base.branch.name)
-            if ev.description:
-                event_desc = format_html('{} : {}', mark_safe(event_desc), clean_str_for_format(ev.description))
-            event_desc += '</a>'
-
-        info = { 'id': ev.pk,
-            'status': ev.status_slug(),
-            'sort_time': TimeUtils.sortable_time_str(ev.created),
-            'description': format_html(event_desc),
-            'pr_id': 0,
-            'pr_title': "",
-            'pr_status': "",
-            'pr_number': 0,
-            'pr_url': "",
-            'git_pr_url': "",
-            'pr_username': "",
-            'pr_name': "",
-            }
-        if ev.pull_request:
-            info["pr_id"] = ev.pull_request.pk
-            info["pr_title"] = ev.pull_request.title
-            info["pr_status"] = ev.pull_request.status_slug()
-            info["pr_number"] = ev.pull_request.number
-            info["git_pr_url"] = ev.pull_request.url
-            info["pr_url"] = pr_url
-            info["pr_username"] = ev.pull_request.username
-            info["pr_name"] = pr_desc
-
-        job_info = []
-        for job_group in ev.get_sorted_jobs():
-            job_group_info = []
-            for job in job_group:
-                if int(job.seconds.total_seconds()) == 0:
-                    job_seconds = ""
-                else:
-                    job_seconds = str(job.seconds)
-
-                jurl = reverse("ci:view_job", args=[job.pk])
-
-                jinfo = { 'id': job.pk,
-                    'status': job.status_slug(),
-                    }
-                job_desc = format_html('<a href="{}">{}</a>', jurl, format_html(job.unique_name()))
-                if job_seconds:
-                    job_desc += format_html('<br />{}', job_seconds)
-                if job.failed_step:
-                    job_desc += format_html('<br />{}', job.failed_step)
-                if job.running_step:
-                    job_desc += format_html('<br />{}', job.running_step)
-                if job.invalidated:
-                    job_desc += '<br />(Invalidated)'
-                jinfo["description"] = job_desc
-                job_group_info.append(jinfo)
-            job_info.append(job_group_info)
-        info['job_groups'] = job_info
-
-        event_info.append(info)
+            event_desc = format_html('{} {} <a href="{}">{}</a>', icon_link, repo_link, pr_url, pr_desc)
+    else:
+        event_desc = format_html('{} <a href="{}">{}', repo_link, event_url, ev.base.branch.name)
+        if ev.description:
+            event_desc = format_html('{} : {}', mark_safe(event_desc), clean_str_for_format(ev.description))
+        event_desc += '</a>'
+    return format_html(event_desc)
 
-    return event_info
+def single_event_info(ev, events_url=False):
+    """
+    Creates the information required for displaying an event.
+    Input:
+      ev: models.Event: The event
+      events_url: bool: Whether the description links to the event instead of the pull request
+    Return:
+      dict of event info
+    """
+    info = { 'id': ev.pk,
+        'status': ev.status_slug(),
+        'sort_time': TimeUtils.sortable_time_str(ev.created),
+        'description': event_description(ev, events_url),
+        'pr_id': 0,
+        'pr_title': "",
+        'pr_status': "",
+        'pr_number': 0,
+        'pr_url': "",
+        'git_pr_url': "",
+        'pr_username': "",
+        'pr_name': "",
+        }
+    if ev.pull_request:
+        info["pr_id"] = ev.pull_request.pk
+        info["pr_title"] = ev.pull_request.title
+        info["pr_status"] = ev.pull_request.status_slug()
+        info["pr_number"] = ev.pull_request.number
+        info["git_pr_url"] = ev.pull_request.url
+        info["pr_url"] = reverse("ci:view_pr", args=[ev.pull_request.pk])
+        info["pr_username"] = ev.pull_request.username
+        info["pr_name"] = clean_str_for_format(str(ev.pull_request))
+
+    job_info = []
+    for job_group in ev.get_sorted_jobs():
+        job_group_info = []
+        for job in job_group:
+            if int(job.seconds.total_seconds()) == 0:
+                job_seconds = ""
+            else:
+                job_seconds = str(job.seconds)
+
+            jurl = reverse("ci:view_job", args=[job.pk])
+
+            jinfo = { 'id': job.pk,
+                'status': job.status_slug(),
+                }
+            job_desc = format_html('<a href="{}">{}</a>', jurl, format_html(job.unique_name()))
+            if job_seconds:
+                job_desc += format_html('<br />{}', job_seconds)
+            if job.failed_step:
+                job_desc += format_html('<br />{}', job.failed_step)
+            if job.running_step:
+                job_desc += format_html('<br />{}', job.running_step)
+            if job.invalidated:
+                job_desc += '<br />(Invalidated)'
+            jinfo["description"] = job_desc
+            job_group_info.append(jinfo)
+        job_info.append(job_group_info)
+    info['job_groups'] = job_info
+    return info
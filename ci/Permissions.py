@@ -15,14 +15,86 @@
 
 from __future__ import unicode_literals, absolute_import
 import logging
+import hashlib
 from ci import models, TimeUtils
 from django.conf import settings
+from django.core.cache import cache
 logger = logging.getLogger('ci')
 
+# Collaborator and team membership results are also stored in the Django cache
+# so that they are shared between sessions and users instead of each new
+# session asking the git server again. Each user has a version number that is
+# part of the key so that all their cached permissions can be invalidated at once.
+
+def _user_version_key(user):
+    return "permissions_version_%s" % user.pk
+
+def _shared_key(kind, user, name):
+    """
+    Input:
+      kind[str]: The kind of permission, "collaborator" or "team"
+      user[models.GitUser]: The user the permission is for
+      name[str]: The repository or team name
+    Return:
+      str: The key in the Django cache
+    """
+    version = cache.get(_user_version_key(user), 0)
+    name_hash = hashlib.md5(name.encode("utf-8")).hexdigest()
+    return "permissions_%s_%s_%s_%s_%s" % (kind, user.server_id, user.pk, version, name_hash)
+
+def get_shared(kind, user, name):
+    """
+    Get a cached permission.
+    Input:
+      kind[str]: The kind of permission, "collaborator" or "team"
+      user[models.GitUser]: The user the permission is for
+      name[str]: The repository or team name
+    Return:
+      bool if it was cached, else None
+    """
+    return cache.get(_shared_key(kind, user, name))
+
+def set_shared(kind, user, name, value):
+    """
+    Cache a permission for settings.COLLABORATOR_CACHE_TIMEOUT seconds.
+    Input:
+      kind[str]: The kind of permission, "collaborator" or "team"
+      user[models.GitUser]: The user the permission is for
+      name[str]: The repository or team name
+      value[bool]: The permission
+    """
+    cache.set(_shared_key(kind, user, name), value, settings.COLLABORATOR_CACHE_TIMEOUT)
+
+def invalidate_shared(kind, user, name):
+    """
+    Remove a cached permission.
+    Input:
+      kind[str]: The kind of permission, "collaborator" or "team"
+      user[models.GitUser]: The user the permission is for
+      name[str]: The repository or team name
+    """
+    cache.delete(_shared_key(kind, user, name))
+
+def invalidate_user(user):
+    """
+    Invalidates all the cached permissions of a user.
+    Input:
+      user[models.GitUser]: The user to invalidate
+    """
+    key = _user_version_key(user)
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Expired or evicted in between
+        cache.set(key, 1, None)
+
 def is_collaborator(request_session, build_user, repo, user=None):
     """
     Checks to see if the signed in user is a collaborator on a repo.
     This will cache the value for a time specified by settings.COLLABORATOR_CACHE_TIMEOUT
+    in the session. Only positive values are put in the shared cache so that
+    a failed request to the git server doesn't lock the user out everywhere.
     Input:
       request_session: A session from HttpRequest.session
       build_user: models.GitUser who has access to check collaborators
@@ -47,13 +119,17 @@ def is_collaborator(request_session, build_user, repo, user=None):
         if val and timestamp < val[1]:
             return val[0]
 
-    api = build_user.api()
-
     collab_dict = request_session.get(auth._collaborators_key, {})
-    val = api.is_collaborator(user, repo)
+    val = get_shared("collaborator", user, str(repo))
+    if val is None:
+        api = build_user.api()
+        val = api.is_collaborator(user, repo)
+        if val:
+            # False might just be a failed request, so only the session keeps it
+            set_shared("collaborator", user, str(repo), val)
+        logger.info("Is collaborator for user '%s' on %s: %s" % (user, repo, val))
     collab_dict[str(repo)] = (val, TimeUtils.get_local_timestamp() + settings.COLLABORATOR_CACHE_TIMEOUT)
     request_session[auth._collaborators_key] = collab_dict
-    logger.info("Is collaborator for user '%s' on %s: %s" % (user, repo, val))
     return val
 
 def job_permissions(session, job):
@@ -143,14 +219,19 @@ def can_see_results(session, recipe):
 def is_team_member(session, api, team, user):
     """
     Checks to see if a user is a team member and caches the results
+    in the session, and in the shared cache if they are a member.
     """
     teams = session.get("teams", {})
     # Check to see if their permissions are still valid
     if teams and team in teams and TimeUtils.get_local_timestamp() < teams[team][1]:
         return teams[team][0]
 
-    is_member = api.is_member(team, user)
-    logger.info("User '%s' member status of '%s': %s" % (user, team, is_member))
+    is_member = get_shared("team", user, team)
+    if is_member is None:
+        is_member = api.is_member(team, user)
+        if is_member:
+            set_shared("team", user, team, is_member)
+        logger.info("User '%s' member status of '%s': %s" % (user, team, is_member))
     teams[team] = (is_member, TimeUtils.get_local_timestamp() + settings.COLLABORATOR_CACHE_TIMEOUT)
     session["teams"] = teams
     return is_member
@@ -0,0 +1,90 @@
+
+# Copyright 2016 Battelle Energy Alliance, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import unicode_literals, absolute_import
+from django.core.cache import cache
+from django.db import transaction
+import threading
+import time
+
+# Lets requests that are waiting for jobs to become ready be woken up.
+# Each build key has a generation number stored in the cache that gets
+# bumped whenever jobs for that build key become ready. Waiters in the
+# same process are woken up immediately, waiters in other processes
+# see the new generation the next time they check the cache.
+_condition = threading.Condition()
+
+# How often (in seconds) the cache is checked for a new generation
+# while waiting.
+CHECK_INTERVAL = 1
+
+def _cache_key(build_key):
+    return "ready_jobs_generation_%s" % build_key
+
+def get_generation(build_key):
+    """
+    Input:
+      build_key[str]: The build key to check
+    Return:
+      int: The current generation for the build key
+    """
+    return cache.get(_cache_key(build_key), 0)
+
+def notify(build_keys):
+    """
+    Wake up anything waiting on jobs for the build keys.
+    Input:
+      build_keys[iterable]: The build keys that have new ready jobs
+    """
+    for build_key in build_keys:
+        key = _cache_key(build_key)
+        cache.add(key, 0, None)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Expired or evicted in between
+            cache.set(key, 1, None)
+    with _condition:
+        _condition.notify_all()
+
+def notify_on_commit(build_keys):
+    """
+    Same as notify() but waits until the current transaction is committed,
+    otherwise the waiters might not see the new jobs.
+    Input:
+      build_keys[iterable]: The build keys that have new ready jobs
+    """
+    build_keys = list(build_keys)
+    if build_keys:
+        transaction.on_commit(lambda: notify(build_keys))
+
+def wait(build_key, generation, timeout):
+    """
+    Wait for the generation of a build key to change.
+    Input:
+      build_key[str]: The build key to wait on
+      generation[int]: The generation that was last seen
+      timeout[float]: Maximum number of seconds to wait
+    Return:
+      bool: True if the generation changed, False if we timed out
+    """
+    end = time.time() + timeout
+    while get_generation(build_key) == generation:
+        remaining = end - time.time()
+        if remaining <= 0:
+            return False
+        with _condition:
+            _condition.wait(min(CHECK_INTERVAL, remaining))
+    return True
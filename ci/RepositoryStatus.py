@@ -15,9 +15,12 @@
 
 from __future__ import unicode_literals, absolute_import
 from ci import models
-from django.db.models import Prefetch
+from django.db.models import Prefetch, OuterRef, Subquery, Count, IntegerField
 from django.urls import reverse
 from django.utils.html import format_html, escape
+from django.core.cache import cache
+from django.conf import settings
+import hashlib
 
 def main_repos_status(last_modified=None):
     """
@@ -71,7 +74,7 @@ def get_repos_status(repo_q, last_modified=None):
                 .prefetch_related(Prefetch('badges', queryset=badge_q, to_attr="active_badges"))
                 .select_related("user__server"))
 
-    return get_repos_data(repos)
+    return get_repos_data(repos, "all", last_modified)
 
 def get_user_repos_with_open_prs_status(username, last_modified=None):
     """
@@ -91,52 +94,164 @@ def get_user_repos_with_open_prs_status(username, last_modified=None):
                 .prefetch_related(Prefetch('pull_requests', queryset=pr_q, to_attr='open_prs'))
                 .select_related("user__server"))
 
-    return get_repos_data(repos)
+    return get_repos_data(repos, "user:%s" % username, last_modified)
 
 
-def get_repos_data(repos):
-    repos_data = []
-    for repo in repos.all():
-        repo_git_url = repo.repo_html_url()
-        repo_url = reverse('ci:view_repo', args=[repo.pk,])
-        repo_desc = format_html('<span><a href="{}"><i class="{}"></i></a></span>', repo_git_url, repo.server().icon_class())
-        repo_desc += format_html(' <span class="repo_name"><a href="{}">{}</a></span>', repo_url, repo.name)
-
-        branches = []
-        if hasattr(repo, "active_branches"):
-            for branch in repo.active_branches:
-                b_desc = '<a href="%s">%s</a>' % (reverse('ci:view_branch', args=[branch.pk,]), branch.name)
-                branches.append({"id": branch.pk, "status": branch.status_slug(), "description": b_desc})
-
-        badges = []
-        if hasattr(repo, "active_badges"):
-            for badge in repo.active_badges:
-                b_desc = '<a href="%s">%s</a>' % (badge.url, badge.name)
-                badges.append({"id": badge.pk, "status": models.JobStatus.to_slug(badge.status), "description": b_desc})
-
-        prs = []
-        for pr in repo.open_prs:
-            url = reverse('ci:view_pr', args=[pr.pk])
-            pr_desc = format_html('<span><a href="{}"><i class="{}"></i></a></span>',
-                    pr.url,
-                    pr.repository.server().icon_class())
-            pr_desc += format_html(' <span class="boxed_job_status_{}" id="pr_status_{}"><a href="{}">#{}</a></span>',
-                    pr.status_slug(),
-                    pr.pk,
-                    url,
-                    pr.number)
-            pr_desc += ' <span> %s by %s </span>' % (escape(pr.title), pr.username)
-
-            prs.append({'id': pr.pk,
-                'description': pr_desc,
-                'number': pr.number,
-                })
-
-        if prs or branches or repo.active:
-            repos_data.append({'id': repo.pk,
-                'branches': branches,
-                'badges': badges,
-                'description': repo_desc,
-                'prs': prs })
+# The related records that go into the status of a repository
+REPO_STATUS_MODELS = [models.Branch, models.PullRequest, models.RepositoryBadge]
+
+def _latest_change(model):
+    """
+    Input:
+      model: One of REPO_STATUS_MODELS
+    Return:
+      Subquery: The newest last_modified of the records for a repository
+    """
+    q = model.objects.filter(repository=OuterRef('pk')).order_by('-last_modified').values('last_modified')[:1]
+    return Subquery(q)
+
+def _record_count(model):
+    """
+    Input:
+      model: One of REPO_STATUS_MODELS
+    Return:
+      Subquery: The number of records for a repository
+    """
+    q = (model.objects.filter(repository=OuterRef('pk'))
+            .order_by()
+            .values('repository')
+            .annotate(count=Count('pk'))
+            .values('count'))
+    return Subquery(q, output_field=IntegerField())
+
+def get_repos_data(repos, variant, last_modified=None):
+    """
+    Gets the status of each repository, using the cached status when nothing has changed.
+    First only the repositories and when their records were last changed are loaded.
+    The full query is only done for the repositories that aren't cached.
+    Input:
+      repos: A query on models.Repository with open_prs and optionally active_branches and active_badges prefetched
+      variant: str: Identifies the filters used to get the related records
+      last_modified: DateTime: The related records were filtered to ones modified after this
+    Return:
+      list of dicts containing repository information
+    """
+    stamps_q = repos.prefetch_related(None).select_related(None).only("pk", "active", "last_modified")
+    for model in REPO_STATUS_MODELS:
+        stamps_q = stamps_q.annotate(**{"%s_changed" % model.__name__: _latest_change(model),
+            "%s_count" % model.__name__: _record_count(model)})
+
+    keys = []
+    for repo in stamps_q:
+        if last_modified is None:
+            keys.append((repo, repo_data_cache_key(repo, variant)))
+        elif not repo_changed_since(repo, last_modified):
+            # None of the related records are included so the status
+            # doesn't depend on the time
+            keys.append((repo, repo_data_cache_key(repo, "%s:unchanged" % variant)))
+        else:
+            # These are only used once, not worth caching
+            keys.append((repo, None))
 
+    if not keys:
+        return []
+    cached = cache.get_many([key for repo, key in keys if key])
+    missing = {repo.pk: key for repo, key in keys if key not in cached}
+    if missing:
+        new_data = {}
+        for repo in repos.filter(pk__in=missing.keys()):
+            key = missing[repo.pk]
+            if key:
+                new_data[key] = single_repo_data(repo)
+            else:
+                cached[repo.pk] = single_repo_data(repo)
+        cache.set_many(new_data, settings.EVENTS_INFO_CACHE_TIMEOUT)
+        cached.update(new_data)
+
+    repos_data = []
+    for repo, key in keys:
+        data = cached[key or repo.pk]
+        if data['prs'] or data['branches'] or repo.active:
+            repos_data.append(data)
     return repos_data
+
+def repo_changed_since(repo, last_modified):
+    """
+    Input:
+      repo: models.Repository: Annotated by get_repos_data() with when its records were changed
+      last_modified: DateTime: Time to check
+    Return:
+      bool: Whether any of the related records were changed at or after last_modified
+    """
+    for model in REPO_STATUS_MODELS:
+        changed = getattr(repo, "%s_changed" % model.__name__)
+        if changed is not None and changed >= last_modified:
+            return True
+    return False
+
+def repo_data_cache_key(repo, variant):
+    """
+    The cache key for the status of a repository.
+    The key includes when the repository and its related records were last
+    changed so that whenever any of them are saved a new key is used.
+    Input:
+      repo: models.Repository: Annotated by get_repos_data() with when its records were changed
+      variant: str: Identifies the filters used to get the related records
+    Return:
+      str: The cache key
+    """
+    stamps = [variant, repo.last_modified.isoformat()]
+    for model in REPO_STATUS_MODELS:
+        changed = getattr(repo, "%s_changed" % model.__name__)
+        stamps.append("%s:%s" % (changed.isoformat() if changed else None, getattr(repo, "%s_count" % model.__name__)))
+    digest = hashlib.md5(",".join(stamps).encode("utf-8")).hexdigest()
+    return "repo_data_%s_%s" % (repo.pk, digest)
+
+def single_repo_data(repo):
+    """
+    Get the status information of a repository
+    Input:
+      repo: models.Repository: With open_prs and optionally active_branches and active_badges loaded
+    Return:
+      dict of repository information
+    """
+    repo_git_url = repo.repo_html_url()
+    repo_url = reverse('ci:view_repo', args=[repo.pk,])
+    repo_desc = format_html('<span><a href="{}"><i class="{}"></i></a></span>', repo_git_url, repo.server().icon_class())
+    repo_desc += format_html(' <span class="repo_name"><a href="{}">{}</a></span>', repo_url, repo.name)
+
+    branches = []
+    if hasattr(repo, "active_branches"):
+        for branch in repo.active_branches:
+            b_desc = '<a href="%s">%s</a>' % (reverse('ci:view_branch', args=[branch.pk,]), branch.name)
+            branches.append({"id": branch.pk, "status": branch.status_slug(), "description": b_desc})
+
+    badges = []
+    if hasattr(repo, "active_badges"):
+        for badge in repo.active_badges:
+            b_desc = '<a href="%s">%s</a>' % (badge.url, badge.name)
+            badges.append({"id": badge.pk, "status": models.JobStatus.to_slug(badge.status), "description": b_desc})
+
+    prs = []
+    for pr in repo.open_prs:
+        url = reverse('ci:view_pr', args=[pr.pk])
+        pr_desc = format_html('<span><a href="{}"><i class="{}"></i></a></span>',
+                pr.url,
+                pr.repository.server().icon_class())
+        pr_desc += format_html(' <span class="boxed_job_status_{}" id="pr_status_{}"><a href="{}">#{}</a></span>',
+                pr.status_slug(),
+                pr.pk,
+                url,
+                pr.number)
+        pr_desc += ' <span> %s by %s </span>' % (escape(pr.title), pr.username)
+
+        prs.append({'id': pr.pk,
+            'description': pr_desc,
+            'number': pr.number,
+            })
+
+    return {'id': repo.pk,
+        'branches': branches,
+        'badges': badges,
+        'description': repo_desc,
+        'prs': prs }
@@ -0,0 +1,265 @@
+
+# Copyright 2016 Battelle Energy Alliance, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import unicode_literals, absolute_import
+from django.conf import settings
+from django.db import connection
+import collections
+import threading
+import time
+import math
+
+# Per view timing and query statistics for requests.
+# RequestStatsMiddleware records a sample for each request. The most recent
+# samples are kept in a ring buffer and are used for the summary shown on
+# the request stats page. Running totals are also kept since the metrics
+# endpoint needs counters that only go up.
+# Everything is kept in memory so each server process has its own stats.
+
+UNRESOLVED_VIEW = "<unresolved>"
+
+Sample = collections.namedtuple("Sample",
+        ["view", "method", "status", "duration", "queries", "query_time", "duplicate_queries", "size", "timestamp"])
+
+class RequestStatsStore(object):
+    """
+    Thread safe storage of request samples.
+    """
+    def __init__(self, size):
+        """
+        Input:
+          size[int]: The maximum number of samples to keep
+        """
+        self._lock = threading.Lock()
+        self._samples = collections.deque(maxlen=size)
+        self._totals = {}
+
+    def add(self, sample):
+        """
+        Input:
+          sample[Sample]: The request to record
+        """
+        with self._lock:
+            self._samples.append(sample)
+            totals = self._totals.get(sample.view)
+            if totals is None:
+                totals = {"requests": 0,
+                        "duration": 0.0,
+                        "queries": 0,
+                        "query_time": 0.0,
+                        "duplicate_queries": 0,
+                        "size": 0,
+                        }
+                self._totals[sample.view] = totals
+            totals["requests"] += 1
+            totals["duration"] += sample.duration
+            totals["queries"] += sample.queries
+            totals["query_time"] += sample.query_time
+            totals["duplicate_queries"] += sample.duplicate_queries
+            totals["size"] += sample.size
+
+    def samples(self):
+        """
+        Return:
+          list[Sample]: The samples currently in the ring buffer, oldest first
+        """
+        with self._lock:
+            return list(self._samples)
+
+    def totals(self):
+        """
+        Return:
+          dict: view name => dict of running totals since the process started
+        """
+        with self._lock:
+            return {view: dict(totals) for view, totals in self._totals.items()}
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+            self._totals = {}
+
+    def summary(self):
+        """
+        Summarizes the samples in the ring buffer by view.
+        Return:
+          list[dict]: One entry per view, sorted by total time spent in the view
+        """
+        by_view = collections.OrderedDict()
+        for sample in self.samples():
+            by_view.setdefault(sample.view, []).append(sample)
+
+        summary = []
+        for view, samples in by_view.items():
+            durations = sorted(s.duration for s in samples)
+            queries = [s.queries for s in samples]
+            count = len(samples)
+            summary.append({"view": view,
+                "requests": count,
+                "total_time": sum(durations),
+                "avg_time": sum(durations)/count,
+                "p50_time": percentile(durations, 50),
+                "p95_time": percentile(durations, 95),
+                "max_time": durations[-1],
+                "avg_queries": float(sum(queries))/count,
+                "max_queries": max(queries),
+                "avg_query_time": sum(s.query_time for s in samples)/count,
+                "duplicate_queries": sum(s.duplicate_queries for s in samples),
+                "avg_size": float(sum(s.size for s in samples))/count,
+                "max_size": max(s.size for s in samples),
+                })
+        summary.sort(key=lambda s: s["total_time"], reverse=True)
+        return summary
+
+def percentile(values, pct):
+    """
+    Input:
+      values[list]: Sorted values
+      pct[int]: Percentile to get
+    Return:
+      The value at the percentile using the nearest rank method
+    """
+    if not values:
+        return 0
+    rank = int(math.ceil(pct/100.0 * len(values)))
+    return values[max(rank, 1) - 1]
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    """
+    Return:
+      RequestStatsStore: The store for this process
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = RequestStatsStore(settings.REQUEST_STATS_BUFFER_SIZE)
+        return _store
+
+class QueryRecorder(object):
+    """
+    A database execute wrapper that counts the queries done
+    during a request and how long they took.
+    A query is a duplicate if the same SQL with the same parameters
+    was already done during the request.
+    """
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+        self.duplicates = 0
+        self._seen = set()
+
+    def __call__(self, execute, sql, params, many, context):
+        key = (sql, repr(params))
+        if key in self._seen:
+            self.duplicates += 1
+        else:
+            self._seen.add(key)
+        start = time.time()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.query_time += time.time() - start
+            self.queries += 1
+
+def view_name(request):
+    """
+    Input:
+      request[HttpRequest]: A request that has been processed
+    Return:
+      str: The name of the URL pattern the request was resolved to
+    """
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return UNRESOLVED_VIEW
+    if match.view_name:
+        return match.view_name
+    return match._func_path
+
+def response_size(response):
+    """
+    Input:
+      response[HttpResponse]: The response
+    Return:
+      int: The size of the response body. Streaming responses are not
+        consumed here so they are counted as 0.
+    """
+    if getattr(response, "streaming", False):
+        return 0
+    return len(response.content)
+
+class RequestStatsMiddleware(object):
+    """
+    Records how long each request takes, how many database queries
+    it does and how big the response is.
+    This isn't on by default since wrapping every query has a cost.
+    Add "ci.RequestStats.RequestStatsMiddleware" to MIDDLEWARE to enable it.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        start = time.time()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        duration = time.time() - start
+
+        get_store().add(Sample(view=view_name(request),
+            method=request.method,
+            status=response.status_code,
+            duration=duration,
+            queries=recorder.queries,
+            query_time=recorder.query_time,
+            duplicate_queries=recorder.duplicates,
+            size=response_size(response),
+            timestamp=start,
+            ))
+        return response
+
+def _escape_label(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+# name, type, help, key into the totals
+METRICS = [
+    ("civet_requests_total", "counter", "Number of requests", "requests"),
+    ("civet_request_duration_seconds_total", "counter", "Time spent handling requests", "duration"),
+    ("civet_request_queries_total", "counter", "Database queries done", "queries"),
+    ("civet_request_query_seconds_total", "counter", "Time spent in database queries", "query_time"),
+    ("civet_request_duplicate_queries_total", "counter", "Database queries that were repeated in the same request",
+        "duplicate_queries"),
+    ("civet_response_bytes_total", "counter", "Size of the response bodies", "size"),
+    ]
+
+def prometheus_text(store=None):
+    """
+    Input:
+      store[RequestStatsStore]: The store to use. Defaults to the one for this process.
+    Return:
+      str: The running totals in the Prometheus text format
+    """
+    if store is None:
+        store = get_store()
+    totals = store.totals()
+    views = sorted(totals.keys())
+    lines = []
+    for name, metric_type, help_text, key in METRICS:
+        lines.append("# HELP %s %s" % (name, help_text))
+        lines.append("# TYPE %s %s" % (name, metric_type))
+        for view in views:
+            lines.append('%s{view="%s"} %s' % (name, _escape_label(view), totals[view][key]))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,262 @@
+
+# Copyright 2016 Battelle Energy Alliance, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import unicode_literals, absolute_import
+from django.conf import settings
+from collections import OrderedDict
+import atexit
+import threading
+import time
+import logging
+logger = logging.getLogger('ci')
+
+# Sends commit status updates to the git servers from a pool of background threads.
+# Updates are keyed by what they are setting the status of (the commit and context),
+# and if a newer update comes in for a key before the older one has been sent then
+# only the newer one is sent. All the updates go through a single token bucket
+# so that we don't trip the rate limits of the git servers.
+# Failed updates are remembered until the caller that queued them calls
+# flush(), so that the task that queued them can be retried. Each thread
+# keeps track of the keys it queued so it only waits for, and only sees
+# the failures of, its own updates.
+
+class StatusDispatchError(Exception):
+    pass
+
+# The maximum number of failed updates remembered
+MAX_FAILURES = 100
+
+class TokenBucket(object):
+    """
+    Allows an average of "rate" operations per second, with
+    bursts of up to "capacity" operations.
+    """
+    def __init__(self, rate, capacity):
+        self._rate = float(rate)
+        self._capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.time()
+        self._tokens = min(self._capacity, self._tokens + (now - self._last)*self._rate)
+        self._last = now
+
+    def try_acquire(self):
+        """
+        Return:
+          float: 0 if a token was taken, otherwise the number of seconds until one is available
+        """
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens)/self._rate
+
+    def acquire(self):
+        """
+        Take a token, waiting until one is available.
+        """
+        wait = self.try_acquire()
+        while wait > 0:
+            time.sleep(wait)
+            wait = self.try_acquire()
+
+class StatusDispatcher(object):
+    def __init__(self, num_threads, bucket):
+        """
+        Input:
+          num_threads[int]: Number of threads sending updates
+          bucket[TokenBucket]: Limits how fast updates are sent
+        """
+        self._num_threads = num_threads
+        self._bucket = bucket
+        self._pending = OrderedDict()
+        self._in_flight = set()
+        self._condition = threading.Condition()
+        self._threads = []
+        self._failures = OrderedDict()
+        self.coalesced = 0
+
+    def _start_threads(self):
+        # Needs to be called with the lock held
+        while len(self._threads) < self._num_threads:
+            t = threading.Thread(target=self._run, name="StatusDispatcher%s" % len(self._threads))
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, key, send):
+        """
+        Queue a status update.
+        If an update with the same key is waiting to be sent it is replaced.
+        Input:
+          key[tuple]: What the status is for
+          send[function]: Called with no arguments to send the update
+        """
+        with self._condition:
+            if key in self._pending:
+                self.coalesced += 1
+            self._pending[key] = send
+            # The new update replaces an older failure
+            self._failures.pop(key, None)
+            self._start_threads()
+            self._condition.notify_all()
+
+    def _next(self):
+        """
+        Waits for an update that isn't already being sent for the same key,
+        so that updates for a key are always sent in order.
+        Return:
+          (tuple, function): The key and the function to send the update
+        """
+        with self._condition:
+            while True:
+                for key in self._pending:
+                    if key not in self._in_flight:
+                        self._in_flight.add(key)
+                        return key, self._pending.pop(key)
+                self._condition.wait()
+
+    def _run(self):
+        while True:
+            key, send = self._next()
+            error = None
+            try:
+                self._bucket.acquire()
+                send()
+            except Exception as e:
+                logger.warning("Failed to send status update for %s: %s" % (key, e))
+                error = e
+            finally:
+                with self._condition:
+                    self._in_flight.discard(key)
+                    # A newer update for the key replaces an older failure
+                    self._failures.pop(key, None)
+                    if error is not None:
+                        self._failures[key] = error
+                        while len(self._failures) > MAX_FAILURES:
+                            self._failures.popitem(last=False)
+                    self._condition.notify_all()
+
+    def _busy(self, keys):
+        # Needs to be called with the lock held
+        if keys is None:
+            return bool(self._pending or self._in_flight)
+        return any(key in self._pending or key in self._in_flight for key in keys)
+
+    def flush(self, timeout=None, keys=None):
+        """
+        Wait for the queued updates to be sent.
+        Input:
+          timeout[float]: Maximum seconds to wait, None to wait forever
+          keys[set]: Only wait for the updates with these keys, None to wait for all of them
+        Return:
+          bool: True if everything was sent
+        """
+        end = None
+        if timeout is not None:
+            end = time.time() + timeout
+        with self._condition:
+            while self._busy(keys):
+                remaining = None
+                if end is not None:
+                    remaining = end - time.time()
+                    if remaining <= 0:
+                        return False
+                self._condition.wait(remaining)
+        return True
+
+    def take_failures(self, keys=None):
+        """
+        Input:
+          keys[set]: Only take the failures of the updates with these keys, None for all of them
+        Return:
+          list[(tuple, Exception)]: The updates that failed since the last call
+        """
+        with self._condition:
+            if keys is None:
+                failures = list(self._failures.items())
+                self._failures.clear()
+            else:
+                failures = [(key, self._failures.pop(key)) for key in list(self._failures) if key in keys]
+            return failures
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+# The keys queued by each thread since its last flush()
+_submitted = threading.local()
+
+def _submitted_keys():
+    if not hasattr(_submitted, "keys"):
+        _submitted.keys = set()
+    return _submitted.keys
+
+def get_dispatcher():
+    """
+    Return:
+      StatusDispatcher: The dispatcher shared by all the git servers
+    """
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            bucket = TokenBucket(settings.GIT_STATUS_RATE, settings.GIT_STATUS_BURST)
+            _dispatcher = StatusDispatcher(settings.GIT_STATUS_THREADS, bucket)
+            # The threads are daemons so anything not sent at exit would be lost
+            atexit.register(_flush_at_exit)
+        return _dispatcher
+
+def submit(key, send):
+    """
+    Queue a status update on the shared dispatcher. See StatusDispatcher.submit()
+    """
+    _submitted_keys().add(key)
+    get_dispatcher().submit(key, send)
+
+def forget():
+    """
+    Stop tracking the updates queued by this thread, so that
+    the next flush() doesn't wait for them or report their failures.
+    """
+    _submitted_keys().clear()
+
+def flush(timeout=None):
+    """
+    Wait for the updates this thread queued on the shared dispatcher to be sent.
+    Input:
+      timeout[float]: Maximum seconds to wait, None to wait forever
+    Exceptions:
+      StatusDispatchError: If any of the updates failed, or they weren't sent in time
+    """
+    keys = set(_submitted_keys())
+    forget()
+    if _dispatcher is None or not keys:
+        return
+    _raise_failures(_dispatcher.flush(timeout, keys), _dispatcher.take_failures(keys))
+
+def _raise_failures(sent, failures):
+    if failures:
+        raise StatusDispatchError("Failed to send status updates:\n%s"
+                % "\n".join("%s: %s" % (key, e) for key, e in failures))
+    if not sent:
+        raise StatusDispatchError("Timed out sending status updates")
+
+def _flush_at_exit():
+    try:
+        _raise_failures(_dispatcher.flush(settings.GIT_STATUS_EXIT_TIMEOUT), _dispatcher.take_failures())
+    except StatusDispatchError as e:
+        logger.warning("%s" % e)
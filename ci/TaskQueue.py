@@ -0,0 +1,149 @@
+
+# Copyright 2016 Battelle Energy Alliance, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import unicode_literals, absolute_import
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from ci import models, StatusDispatcher
+from datetime import timedelta
+import json
+import traceback
+import logging
+logger = logging.getLogger('ci')
+
+# A work queue stored in the database.
+# Tasks are plain functions that take JSON serializable keyword arguments.
+# They are run by the "process_tasks" management command, and retried
+# with a backoff if they raise an exception.
+# Since a task might be retried, or run again if a worker dies while running it,
+# tasks should be safe to run more than once.
+
+def task_name(func):
+    """
+    Input:
+      func[function]: A module level function
+    Return:
+      str: The dotted path to the function
+    """
+    return "%s.%s" % (func.__module__, func.__name__)
+
+def enqueue(func, **kwargs):
+    """
+    Queue a function to be run.
+    If TASK_QUEUE_INLINE is set then the function is run immediately instead.
+    Input:
+      func[function]: A module level function
+      kwargs: JSON serializable keyword arguments to pass to the function
+    Return:
+      models.QueuedTask: The queued task, or None if it was run inline
+    """
+    if settings.TASK_QUEUE_INLINE:
+        func(**kwargs)
+        return None
+    return models.QueuedTask.objects.create(name=task_name(func),
+            args=json.dumps(kwargs),
+            max_attempts=settings.TASK_QUEUE_MAX_ATTEMPTS)
+
+def claim_next(limit=10):
+    """
+    Claim the next task that is ready to run.
+    Tasks that have been running for longer than TASK_QUEUE_STALE_TIMEOUT
+    are assumed to belong to a worker that died and can be claimed again.
+    Input:
+      limit[int]: How many candidates to try to claim
+    Return:
+      models.QueuedTask: The claimed task, None if there aren't any
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.TASK_QUEUE_STALE_TIMEOUT)
+    task_q = models.QueuedTask.objects.filter(Q(status=models.QueuedTask.PENDING, run_after__lte=now) |
+            Q(status=models.QueuedTask.RUNNING, last_modified__lt=stale))
+    for task in task_q[:limit]:
+        # Only claim it if another worker hasn't already
+        claimed = (models.QueuedTask.objects
+                .filter(pk=task.pk, status=task.status, last_modified=task.last_modified)
+                .update(status=models.QueuedTask.RUNNING, attempts=F("attempts") + 1, last_modified=now))
+        if claimed:
+            task.refresh_from_db()
+            return task
+    return None
+
+def run_task(task):
+    """
+    Run a claimed task.
+    On failure it is retried after TASK_QUEUE_RETRY_DELAY seconds,
+    doubling for each attempt, until it has used max_attempts.
+    Input:
+      task[models.QueuedTask]: The task to run
+    Return:
+      bool: True if the task succeeded
+    """
+    try:
+        # Only this task's status updates are checked below
+        StatusDispatcher.forget()
+        func = import_string(task.name)
+        func(**json.loads(task.args))
+        # Status updates sent in the background are part of the task
+        StatusDispatcher.flush()
+    except Exception:
+        task.error = traceback.format_exc()
+        if task.attempts >= task.max_attempts:
+            logger.warning("Task %s failed, giving up after %s attempts:\n%s" % (task, task.attempts, task.error))
+            task.status = models.QueuedTask.FAILED
+        else:
+            delay = settings.TASK_QUEUE_RETRY_DELAY * 2**(task.attempts - 1)
+            logger.info("Task %s failed, retrying in %s seconds:\n%s" % (task, delay, task.error))
+            task.status = models.QueuedTask.PENDING
+            task.run_after = timezone.now() + timedelta(seconds=delay)
+        task.save()
+        return False
+
+    task.status = models.QueuedTask.DONE
+    task.error = ""
+    task.save()
+    return True
+
+def run_pending(max_tasks=None):
+    """
+    Run tasks until there are no more ready to run.
+    Input:
+      max_tasks[int]: If not None, the maximum number of tasks to run
+    Return:
+      int: The number of tasks that were run
+    """
+    count = 0
+    while max_tasks is None or count < max_tasks:
+        task = claim_next()
+        if task is None:
+            break
+        run_task(task)
+        count += 1
+    return count
+
+def remove_finished(days):
+    """
+    Delete tasks that finished more than a number of days ago.
+    Input:
+      days[int]: Number of days to keep finished tasks
+    Return:
+      int: The number of tasks deleted
+    """
+    cutoff = timezone.now() - timedelta(days=days)
+    task_q = models.QueuedTask.objects.filter(status__in=[models.QueuedTask.DONE, models.QueuedTask.FAILED],
+            last_modified__lt=cutoff)
+    count, deleted = task_q.delete()
+    return count
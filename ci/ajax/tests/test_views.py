@@ -21,6 +21,8 @@ from ci.tests import utils
 from mock import patch
 from ci.github import api
 from ci import models, Permissions
+from ci.ajax import views
+import json
 from ci.tests import DBTester
 from django.test import override_settings
 
@@ -204,6 +206,117 @@ class Tests(DBTester.DBTester):
         self.assertEqual([], json_data['results'])
         self.assertEqual(json_data['job_info']['client_name'], '')
 
+    def stream_events(self, url, data={}, **extra):
+        response = self.client.get(url, data, **extra)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        content = b"".join(response.streaming_content).decode("utf-8")
+        events = []
+        for msg in content.split("\n\n"):
+            fields = dict(line.split(": ", 1) for line in msg.split("\n") if ": " in line)
+            if "event" in fields:
+                events.append((fields["event"], json.loads(fields["data"]), fields.get("id")))
+        return events
+
+    @patch.object(api.GitHubAPI, 'is_collaborator')
+    @override_settings(JOB_OUTPUT_STREAM=True, JOB_OUTPUT_STREAM_INTERVAL=0, JOB_OUTPUT_STREAM_TIMEOUT=0)
+    def test_job_output_stream(self, mock_is_collaborator):
+        mock_is_collaborator.return_value = False
+        step_result = utils.create_step_result(status=models.JobStatus.RUNNING)
+        step_result.output = "first\n"
+        step_result.save()
+        job = step_result.job
+        url = reverse('ci:ajax:job_output_stream', args=[job.pk])
+
+        response = self.client.get(reverse('ci:ajax:job_output_stream', args=[job.pk+1]))
+        self.assertEqual(response.status_code, 404)
+
+        job.recipe.private = True
+        job.recipe.save()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 403)
+        job.recipe.private = False
+        job.recipe.save()
+
+        response = self.client.get(url, {"last_chunk": "foo"})
+        self.assertEqual(response.status_code, 400)
+
+        with self.settings(JOB_OUTPUT_STREAM=False):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 404)
+
+        # Too many streams open
+        with self.settings(JOB_OUTPUT_STREAM_MAX=0):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 503)
+
+        # Nothing appended yet
+        events = self.stream_events(url)
+        self.assertEqual([e[0] for e in events], ["job", "step"])
+        self.assertEqual(events[0][1]["id"], job.pk)
+        self.assertEqual(events[1][1]["id"], step_result.pk)
+        self.assertNotIn("output", events[1][1])
+
+        step_result.append_output("<second>\n")
+        step_result.save()
+        chunk = step_result.output_chunks.last()
+        events = self.stream_events(url, {"last_chunk": 0})
+        self.assertEqual([e[0] for e in events], ["job", "step", "output"])
+        output = events[2][1]
+        self.assertEqual(output["id"], step_result.pk)
+        self.assertEqual(output["offset"], len("first\n"))
+        self.assertEqual(output["length"], len("<second>\n"))
+        self.assertIn("&lt;second&gt;", output["output"])
+        self.assertNotIn("first", output["output"])
+        self.assertEqual(events[2][2], str(chunk.pk))
+
+        # Already seen the chunk
+        events = self.stream_events(url, HTTP_LAST_EVENT_ID=str(chunk.pk))
+        self.assertEqual([e[0] for e in events], ["job", "step"])
+
+        # Output replaced with the same thing, no need to send it
+        step_result.output = "first\n<second>\n"
+        step_result.save()
+        events = self.stream_events(url, {"last_chunk": chunk.pk})
+        self.assertEqual([e[0] for e in events], ["job", "step"])
+
+        job.complete = True
+        job.save()
+        events = self.stream_events(url, {"last_chunk": 0})
+        self.assertEqual([e[0] for e in events], ["job", "step", "done"])
+        # All the streams were closed
+        self.assertEqual(views._open_streams, 0)
+
+    def test_job_output_events_replace(self):
+        step_result = utils.create_step_result(status=models.JobStatus.RUNNING)
+        step_result.append_output("partial")
+        step_result.save()
+        job = step_result.job
+        chunk = step_result.output_chunks.last()
+        gen = views.job_output_events(job.pk, chunk.pk, False)
+        self.assertTrue(next(gen).startswith("retry:"))
+        with patch.object(views, "time") as mock_time:
+            mock_time.time.return_value = 0
+            msgs = next(gen)
+            self.assertIn("event: job", msgs)
+            self.assertNotIn("event: output", msgs)
+
+            step_result.output = "different"
+            step_result.complete = True
+            step_result.save()
+            msgs = next(gen)
+            self.assertIn("event: step", msgs)
+            self.assertIn("event: output", msgs)
+            self.assertIn('"replace": true', msgs)
+            self.assertIn("different", msgs)
+
+            job.complete = True
+            job.save()
+            msgs = next(gen)
+            self.assertIn("event: done", msgs)
+            with self.assertRaises(StopIteration):
+                next(gen)
+
     def test_repo_update(self):
         url = reverse('ci:ajax:repo_update')
         # no parameters
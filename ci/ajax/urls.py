@@ -26,6 +26,7 @@ urlpatterns = [
   url(r'^pr_update/(?P<pr_id>[0-9]+)/$', views.pr_update, name='pr_update'),
   url(r'^event_update/(?P<event_id>[0-9]+)/$', views.event_update, name='event_update'),
   url(r'^job_results/', views.job_results, name='job_results'),
+  url(r'^job_output_stream/(?P<job_id>[0-9]+)/$', views.job_output_stream, name='job_output_stream'),
   url(r'^job_results_html/', views.job_results_html, name='job_results_html'),
   url(r'^repo_update/', views.repo_update, name='repo_update'),
   url(r'^clients/', views.clients_update, name='clients'),
@@ -15,11 +15,20 @@
 
 from __future__ import unicode_literals, absolute_import
 from django.utils import timezone
-from django.http import JsonResponse, HttpResponseBadRequest, HttpResponseForbidden
+from django.http import JsonResponse, HttpResponseBadRequest, HttpResponseForbidden, StreamingHttpResponse
+from django.http import Http404, HttpResponse
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q, Sum
+from django.db.models.functions import Length
 from django.shortcuts import get_object_or_404, render
 from django.urls import reverse
 from ci import models, views
 import datetime
+import json
+import time
+import threading
+from collections import OrderedDict
 from ci import Permissions, TimeUtils, EventsStatus, RepositoryStatus
 import logging
 logger = logging.getLogger('ci')
@@ -140,6 +149,34 @@ def job_results(request):
     if not Permissions.can_see_results(request.session, job.recipe):
         return HttpResponseForbidden("Can't see results")
 
+    if job.last_modified < dt:
+        # always return the basic info since we need to update the
+        # "natural" time
+        return JsonResponse({'job_info': get_job_info(job), 'results': [], 'last_request': this_request})
+
+    can_see_client = job.client is not None and Permissions.is_allowed_to_see_clients(request.session)
+    job_info = get_job_info(job, can_see_client)
+
+    result_info = []
+
+    for result in job.step_results.all():
+        if dt > result.last_modified:
+            continue
+        info = get_step_result_info(result, result.output_size())
+        info['output'] = result.clean_output()
+        result_info.append(info)
+
+    return JsonResponse({'job_info': job_info, 'results': result_info, 'last_request': this_request})
+
+def get_job_info(job, can_see_client=False):
+    """
+    Get the information about a job that is shown on the job page.
+    Input:
+      job[models.Job]: The job, with recipe and client loaded
+      can_see_client[bool]: Whether to include the client information
+    Return:
+      dict of job information
+    """
     job_info = {
         'id': job.pk,
         'complete': job.complete,
@@ -156,38 +193,225 @@ def job_results(request):
         'recipe_sha': job.recipe.filename_sha[:6],
         }
 
-    if job.last_modified < dt:
-        # always return the basic info since we need to update the
-        # "natural" time
-        return JsonResponse({'job_info': job_info, 'results': [], 'last_request': this_request})
+    if job.client and can_see_client:
+        job_info['client_name'] = job.client.name
+        job_info['client_url'] = reverse('ci:view_client', args=[job.client.pk,])
+    return job_info
+
+def get_step_result_info(result, output_size):
+    """
+    Get the information about a step result that is shown on the job page, without the output.
+    Input:
+      result[models.StepResult]: The step result
+      output_size[str]: The displayed size of the output
+    Return:
+      dict of step result information
+    """
+    exit_status = ''
+    if result.complete:
+        exit_status = result.exit_status
+    return {'id': result.id,
+        'name': result.name,
+        'runtime': str(result.seconds),
+        'exit_status': exit_status,
+        'status': result.status_slug(),
+        'running': result.status != models.JobStatus.NOT_STARTED,
+        'complete': result.complete,
+        'output_size': output_size,
+        }
 
-    if job.client:
-        can_see_client = Permissions.is_allowed_to_see_clients(request.session)
-        if can_see_client:
-            job_info['client_name'] = job.client.name
-            job_info['client_url'] = reverse('ci:view_client', args=[job.client.pk,])
+def sse_message(event, data, event_id=None):
+    """
+    Format a server-sent event
+    Input:
+      event[str]: The event type
+      data: JSON serializable data for the event
+      event_id: If not None, the id of the event
+    Return:
+      str: The message to send
+    """
+    msg = ""
+    if event_id is not None:
+        msg += "id: %s\n" % event_id
+    msg += "event: %s\ndata: %s\n\n" % (event, json.dumps(data, cls=DjangoJSONEncoder))
+    return msg
 
-    result_info = []
+def job_output_events(job_id, last_chunk, can_see_client):
+    """
+    Generator of server-sent events for a job.
+    "job" events have the job information when the job changes.
+    "step" events have the step result information when a step result changes.
+    "output" events have newly appended output of a step result, along with
+    the offset in the full output where it starts. The id of these events is the
+    last StepResultChunk sent so that a reconnecting browser can continue where it left off.
+    If the output of a step result gets replaced with something different than what was
+    sent, the whole output is sent with "replace" set.
+    "done" is sent when the job is complete.
+    Input:
+      job_id[int]: The pk of the job
+      last_chunk[int]: The pk of the last StepResultChunk that has already been seen
+      can_see_client[bool]: Whether to include the client information in the job info
+    """
+    step_q = (models.StepResult.objects
+            .filter(job__pk=job_id)
+            .defer("stored_output", "output_html", "render_state")
+            .annotate(stored_length=Length("stored_output"))
+            .order_by("position"))
+    chunk_q = models.StepResultChunk.objects.filter(step_result__job__pk=job_id)
+
+    # The length of the output of each step that the browser has
+    lengths = {}
+    stored_lengths = {}
+    seen_chunks = Sum(Length("output_chunks__output"), filter=Q(output_chunks__pk__lte=last_chunk))
+    for step in step_q.annotate(chunks_length=seen_chunks):
+        lengths[step.pk] = step.stored_length + (step.chunks_length or 0)
+        stored_lengths[step.pk] = step.stored_length
+
+    job_modified = None
+    step_modified = {}
+    end = time.time() + settings.JOB_OUTPUT_STREAM_TIMEOUT
+    last_sent = time.time()
+    yield "retry: %s\n\n" % (settings.JOB_OUTPUT_STREAM_INTERVAL*1000)
+
+    while True:
+        messages = []
+        job = models.Job.objects.select_related("recipe", "client").filter(pk=job_id).first()
+        if job is None:
+            return
+        if job.last_modified != job_modified:
+            job_modified = job.last_modified
+            messages.append(sse_message("job", get_job_info(job, can_see_client)))
+
+        steps = list(step_q.all())
+        chunks = list(chunk_q.filter(pk__gt=last_chunk).order_by("pk").values_list("pk", "step_result_id", "output", "html"))
+        new_output = OrderedDict()
+        new_html = OrderedDict()
+        for pk, step_id, output, html in chunks:
+            last_chunk = pk
+            if output and not html:
+                # Added before output was rendered as it arrived
+                html = models.terminalize_output(output)
+            new_output.setdefault(step_id, []).append(output)
+            new_html.setdefault(step_id, []).append(html)
+
+        for step in steps:
+            lengths.setdefault(step.pk, step.stored_length)
+            stored_lengths.setdefault(step.pk, step.stored_length)
+            output = "".join(new_output.get(step.pk, []))
+            if step.stored_length != stored_lengths[step.pk]:
+                # The output was replaced. Normally it is the same as what we
+                # have already sent so there is no need to send it again.
+                stored_lengths[step.pk] = step.stored_length
+                if step.stored_length != lengths[step.pk] + len(output):
+                    full_output = models.StepResult.objects.get(pk=step.pk).clean_output()
+                    lengths[step.pk] = step.stored_length
+                    messages.append(sse_message("output",
+                        {"id": step.pk, "offset": 0, "length": step.stored_length, "output": full_output, "replace": True}))
+                    output = ""
+
+            if step.last_modified != step_modified.get(step.pk):
+                step_modified[step.pk] = step.last_modified
+                size = models.humanize_bytes(lengths[step.pk] + len(output))
+                messages.append(sse_message("step", get_step_result_info(step, size)))
+
+            if output:
+                messages.append(sse_message("output",
+                    {"id": step.pk, "offset": lengths[step.pk], "length": len(output), "output": "".join(new_html[step.pk])},
+                    last_chunk))
+                lengths[step.pk] += len(output)
+
+        if job.complete:
+            messages.append(sse_message("done", {"id": job.pk}))
+
+        now = time.time()
+        if messages:
+            last_sent = now
+            yield "".join(messages)
+        elif now - last_sent >= settings.JOB_OUTPUT_STREAM_KEEPALIVE:
+            # A comment to keep the connection from timing out
+            last_sent = now
+            yield ":\n\n"
+
+        if job.complete or now >= end:
+            # If we timed out the browser will reconnect
+            return
+        time.sleep(settings.JOB_OUTPUT_STREAM_INTERVAL)
+
+# The number of job output streams open in this process
+_open_streams = 0
+_open_streams_lock = threading.Lock()
+
+def open_stream_slot():
+    """
+    Return:
+      bool: True if another job output stream can be opened. close_stream_slot()
+        needs to be called when it is done.
+    """
+    global _open_streams
+    with _open_streams_lock:
+        if _open_streams >= settings.JOB_OUTPUT_STREAM_MAX:
+            return False
+        _open_streams += 1
+        return True
+
+def close_stream_slot():
+    global _open_streams
+    with _open_streams_lock:
+        _open_streams -= 1
+
+class StreamSlotIterator(object):
+    """
+    Wraps the events of a job output stream so that its slot gets
+    released when the response is closed, even if it was never read.
+    """
+    def __init__(self, events):
+        self.events = events
+        self.closed = False
 
-    for result in job.step_results.all():
-        if dt > result.last_modified:
-            continue
-        exit_status = ''
-        if result.complete:
-            exit_status = result.exit_status
-        info = {'id': result.id,
-            'name': result.name,
-            'runtime': str(result.seconds),
-            'exit_status': exit_status,
-            'output': result.clean_output(),
-            'status': result.status_slug(),
-            'running': result.status != models.JobStatus.NOT_STARTED,
-            'complete': result.complete,
-            'output_size': result.output_size(),
-            }
-        result_info.append(info)
+    def __iter__(self):
+        return iter(self.events)
 
-    return JsonResponse({'job_info': job_info, 'results': result_info, 'last_request': this_request})
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.events.close()
+            close_stream_slot()
+
+def job_output_stream(request, job_id):
+    """
+    Streams the changes to a job as server-sent events.
+    See job_output_events() for the events.
+    Only available when JOB_OUTPUT_STREAM is set. There can be at most
+    JOB_OUTPUT_STREAM_MAX streams open in a process.
+    GET parameters:
+      last_chunk: The pk of the last StepResultChunk that the browser has.
+        The Last-Event-ID header, sent when the browser reconnects, takes precedence.
+    """
+    if not settings.JOB_OUTPUT_STREAM:
+        raise Http404("Job output streaming is disabled")
+    job = get_object_or_404(models.Job.objects.select_related("recipe"), pk=job_id)
+    if not Permissions.can_see_results(request.session, job.recipe):
+        return HttpResponseForbidden("Can't see results")
+
+    last_chunk = request.META.get("HTTP_LAST_EVENT_ID", request.GET.get("last_chunk"))
+    try:
+        if last_chunk is None:
+            last_chunk = views.chunk_watermark(job)
+        last_chunk = int(last_chunk)
+    except ValueError:
+        return HttpResponseBadRequest('Bad last_chunk')
+
+    if not open_stream_slot():
+        # The browser will fall back to polling
+        return HttpResponse("Too many streams", status=503)
+
+    can_see_client = Permissions.is_allowed_to_see_clients(request.session)
+    events = StreamSlotIterator(job_output_events(job.pk, last_chunk, can_see_client))
+    response = StreamingHttpResponse(events, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # Tell nginx not to buffer the stream
+    response["X-Accel-Buffering"] = "no"
+    return response
 
 def job_results_html(request):
     """
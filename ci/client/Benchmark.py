@@ -0,0 +1,356 @@
+
+# Copyright 2016 Battelle Energy Alliance, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from ci import models
+from django.conf import settings
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+import json
+import math
+import time
+
+# Benchmarks the client REST API endpoints that the build clients hit the most.
+# A synthetic set of repositories, recipes, events and jobs is created and then
+# the jobs are run through the same calls a client would do with Django's test
+# client. Everything is done inside a transaction that is rolled back at the end
+# so it can be run against a real database.
+
+SERVER_NAME = "civet-benchmark"
+CLIENT_NAME = "civet-benchmark-client"
+BUILD_CONFIG = "civet-benchmark-config"
+
+# Added to settings.INSTALLED_GITSERVERS while running.
+# remote_update is off so nothing gets sent to a Git server.
+SERVER_CONFIG = {"type": settings.GITSERVER_GITHUB,
+        "api_url": "https://%s" % SERVER_NAME,
+        "html_url": "https://%s" % SERVER_NAME,
+        "hostname": SERVER_NAME,
+        "post_event_summary": False,
+        "post_job_status": False,
+        "remote_update": False,
+        "install_webhook": False,
+        "authorized_users": [],
+        "icon_class": "",
+        }
+
+ENDPOINTS = ["ready_jobs",
+        "claim_job",
+        "start_step_result",
+        "update_step_result",
+        "complete_step_result",
+        "job_finished",
+        ]
+
+class QueryCounter(object):
+    """
+    Installed with connection.execute_wrapper() to count the SQL queries
+    and the rows they touched.
+    Some backends (like SQLite) don't report the number of rows for
+    a SELECT so those are not counted.
+    """
+    def __init__(self):
+        self.queries = 0
+        self.rows = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        result = execute(sql, params, many, context)
+        self.queries += 1
+        rowcount = getattr(context["cursor"], "rowcount", -1)
+        if rowcount is not None and rowcount > 0:
+            self.rows += rowcount
+        return result
+
+class EndpointStats(object):
+    """
+    The measurements of all the calls to one endpoint
+    """
+    def __init__(self, name):
+        self.name = name
+        self.times = []
+        self.queries = []
+        self.rows = []
+
+    def add(self, seconds, queries, rows):
+        self.times.append(seconds)
+        self.queries.append(queries)
+        self.rows.append(rows)
+
+    def summary(self):
+        """
+        Return:
+          dict of the stats. Times are in milliseconds.
+        """
+        count = len(self.times)
+        return {"calls": count,
+            "p50_ms": percentile(self.times, 50)*1000,
+            "p95_ms": percentile(self.times, 95)*1000,
+            "max_ms": max(self.times or [0])*1000,
+            "queries_avg": float(sum(self.queries))/count if count else 0,
+            "queries_max": max(self.queries or [0]),
+            "rows_avg": float(sum(self.rows))/count if count else 0,
+            }
+
+def percentile(values, pct):
+    """
+    Nearest rank percentile.
+    Input:
+      values[list]: The values
+      pct[float]: The percentile, 0-100
+    Return:
+      The value at the percentile or 0 if there are no values
+    """
+    if not values:
+        return 0
+    ordered = sorted(values)
+    rank = int(math.ceil(pct / 100.0 * len(ordered))) - 1
+    return ordered[min(max(rank, 0), len(ordered) - 1)]
+
+def create_data(num_repos, num_events, num_recipes, num_steps, pull_requests=True):
+    """
+    Creates a synthetic set of jobs.
+    Each repository has a set of recipes where the first one is a dependency
+    of all the others except the last one, which depends on all the others.
+    The events are spread over the repositories, alternating between pull requests
+    and pushes, and have a job for each of the recipes of their repository.
+    Input:
+      num_repos[int]: Number of repositories
+      num_events[int]: Total number of events
+      num_recipes[int]: Number of recipes, and thus jobs per event, for each repository
+      num_steps[int]: Number of steps in each recipe
+      pull_requests[bool]: If False then all the events are pushes. Pull requests need
+          the git server to be configured in settings.INSTALLED_GITSERVERS.
+    Return:
+      models.GitUser: The build user of all the jobs
+    """
+    server, created = models.GitServer.objects.get_or_create(name=SERVER_NAME,
+            host_type=settings.GITSERVER_GITHUB)
+    build_user, created = models.GitUser.objects.get_or_create(name="benchmark_build_user", server=server)
+    build_user.token = json.dumps({"access_token": "benchmark", "token_type": "bearer", "scope": ["scope"]})
+    build_user.save()
+    config, created = models.BuildConfig.objects.get_or_create(name=BUILD_CONFIG)
+
+    repos = []
+    for repo_idx in range(num_repos):
+        owner, created = models.GitUser.objects.get_or_create(name="benchmark_owner%s" % repo_idx, server=server)
+        repo, created = models.Repository.objects.get_or_create(name="repo%s" % repo_idx, user=owner)
+        branch, created = models.Branch.objects.get_or_create(name="devel", repository=repo)
+        recipes = {}
+        for cause in [models.Recipe.CAUSE_PULL_REQUEST, models.Recipe.CAUSE_PUSH]:
+            recipes[cause] = create_recipes(build_user, repo, branch, cause, config, num_recipes, num_steps)
+        repos.append((repo, branch, recipes))
+
+    for ev_idx in range(num_events):
+        repo, branch, recipes = repos[ev_idx % len(repos)]
+        head, created = models.Commit.objects.get_or_create(branch=branch, sha="%040x" % (ev_idx+1))
+        base, created = models.Commit.objects.get_or_create(branch=branch, sha="%040x" % 0)
+        if pull_requests and ev_idx % 2 == 0:
+            cause = models.Recipe.CAUSE_PULL_REQUEST
+            pr = models.PullRequest.objects.create(repository=repo,
+                    number=ev_idx+1,
+                    title="Benchmark PR %s" % (ev_idx+1),
+                    url="https://%s/pull/%s" % (SERVER_NAME, ev_idx+1),
+                    username=build_user.name)
+            ev = models.Event.objects.create(build_user=build_user,
+                    head=head,
+                    base=base,
+                    cause=models.Event.PULL_REQUEST,
+                    pull_request=pr)
+        else:
+            cause = models.Recipe.CAUSE_PUSH
+            ev = models.Event.objects.create(build_user=build_user,
+                    head=head,
+                    base=base,
+                    cause=models.Event.PUSH)
+        for recipe in recipes[cause]:
+            models.Job.objects.create(recipe=recipe, event=ev, config=config)
+        ev.make_jobs_ready()
+    return build_user
+
+def create_recipes(build_user, repo, branch, cause, config, num_recipes, num_steps):
+    """
+    Creates the recipes for a repository
+    Return:
+      list[models.Recipe]: The new recipes
+    """
+    recipes = []
+    for recipe_idx in range(num_recipes):
+        name = "Benchmark %s %s" % (models.Recipe.CAUSE_CHOICES[cause][1], recipe_idx)
+        recipe = models.Recipe.objects.create(name=name,
+                display_name=name,
+                filename="benchmark/%s/%s_%s.cfg" % (repo.name, cause, recipe_idx),
+                build_user=build_user,
+                repository=repo,
+                branch=branch if cause == models.Recipe.CAUSE_PUSH else None,
+                cause=cause,
+                active=True,
+                current=True,
+                )
+        recipe.build_configs.add(config)
+        models.RecipeEnvironment.objects.create(recipe=recipe, name="BENCHMARK", value="1")
+        for step_idx in range(num_steps):
+            step = models.Step.objects.create(recipe=recipe,
+                    name="Step %s" % step_idx,
+                    filename="scripts/benchmark_%s.sh" % step_idx,
+                    position=step_idx)
+            models.StepEnvironment.objects.create(step=step, name="STEP", value=str(step_idx))
+        if 0 < recipe_idx < num_recipes - 1:
+            recipe.depends_on.add(recipes[0])
+        elif recipe_idx > 0:
+            recipe.depends_on.add(*recipes)
+        recipes.append(recipe)
+    return recipes
+
+class Runner(object):
+    """
+    Runs the jobs like a client would and keeps the stats
+    """
+    def __init__(self, build_key, num_updates, output_size):
+        """
+        Input:
+          build_key[int]: Build key of the build user
+          num_updates[int]: Number of output updates for each step
+          output_size[int]: Bytes of output sent in each update
+        """
+        self.build_key = build_key
+        self.num_updates = num_updates
+        self.output_line = ("x" * 79 + "\n")
+        self.output_size = output_size
+        self.client = Client(REMOTE_ADDR="127.0.0.1")
+        self.stats = dict([(name, EndpointStats(name)) for name in ENDPOINTS])
+        self.jobs_run = 0
+
+    def call(self, name, url_args, data=None):
+        """
+        Does a request to an endpoint and records the stats.
+        Input:
+          name[str]: Name of the endpoint
+          url_args[list]: Arguments to reverse() the URL
+          data[dict]: If given, it is POSTed as JSON, otherwise it is a GET
+        Return:
+          dict: The JSON response
+        """
+        url = reverse("ci:client:%s" % name, args=url_args)
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            start = time.time()
+            if data is None:
+                response = self.client.get(url)
+            else:
+                response = self.client.post(url, json.dumps(data), content_type="application/json")
+            elapsed = time.time() - start
+        if response.status_code != 200:
+            raise Exception("%s returned %s: %s" % (url, response.status_code, response.content))
+        self.stats[name].add(elapsed, counter.queries, counter.rows)
+        return response.json()
+
+    def output(self, update_idx):
+        lines = max(1, self.output_size // len(self.output_line))
+        return "Update %s\n%s" % (update_idx, self.output_line * lines)
+
+    def step_data(self, step, output, complete=False):
+        return {"step_num": step["step_num"],
+            "output": output,
+            "time": 1,
+            "complete": complete,
+            "exit_status": 0,
+            }
+
+    def run_job(self, job):
+        """
+        Claims and runs a job through all of its steps
+        Input:
+          job[dict]: The job as returned by ready_jobs
+        Return:
+          bool: Whether the job was claimed
+        """
+        config = job["config"]
+        try:
+            reply = self.call("claim_job", [self.build_key, config, CLIENT_NAME], {"job_id": job["id"]})
+        except Exception:
+            # Somebody else got it
+            return False
+        job_info = reply["job_info"]
+        for step in job_info["steps"]:
+            args = [self.build_key, CLIENT_NAME, step["stepresult_id"]]
+            self.call("start_step_result", args, self.step_data(step, ""))
+            output = ""
+            for update_idx in range(self.num_updates):
+                # Like the real client, updates only have the new output
+                # and completing the step sends all of it.
+                new_output = self.output(update_idx)
+                output += new_output
+                self.call("update_step_result", args, self.step_data(step, new_output))
+            self.call("complete_step_result", args, self.step_data(step, output, complete=True))
+        self.call("job_finished", [self.build_key, CLIENT_NAME, job["id"]],
+                {"seconds": len(job_info["steps"]), "complete": True})
+        self.jobs_run += 1
+        return True
+
+    def run(self, max_jobs=None):
+        """
+        Keeps getting ready jobs and running them until there are no more.
+        Input:
+          max_jobs[int]: Stop after this many jobs
+        """
+        while max_jobs is None or self.jobs_run < max_jobs:
+            reply = self.call("ready_jobs", [self.build_key, CLIENT_NAME])
+            jobs = [job for job in reply["jobs"] if job["config"] == BUILD_CONFIG]
+            if not jobs or not self.run_job(jobs[0]):
+                break
+
+def run(num_repos=5, num_events=20, num_recipes=5, num_steps=4, num_updates=3, output_size=1024, max_jobs=None):
+    """
+    Creates the synthetic data, runs all the jobs and then rolls everything back.
+    Input:
+      num_repos[int]: Number of repositories
+      num_events[int]: Total number of events
+      num_recipes[int]: Number of jobs in each event
+      num_steps[int]: Number of steps in each job
+      num_updates[int]: Number of output updates for each step
+      output_size[int]: Bytes of output sent in each update
+      max_jobs[int]: Stop after running this many jobs
+    Return:
+      dict: Endpoint name to the summary of its stats, plus "jobs" with the number of jobs run
+    """
+    hosts = list(settings.ALLOWED_HOSTS) + ["testserver"]
+    servers = list(settings.INSTALLED_GITSERVERS) + [SERVER_CONFIG]
+    with override_settings(ALLOWED_HOSTS=hosts, INSTALLED_GITSERVERS=servers), transaction.atomic():
+        build_user = create_data(num_repos, num_events, num_recipes, num_steps)
+        runner = Runner(build_user.build_key, num_updates, output_size)
+        runner.run(max_jobs)
+        transaction.set_rollback(True)
+
+    results = dict([(name, stats.summary()) for name, stats in runner.stats.items()])
+    results["jobs"] = runner.jobs_run
+    return results
+
+def format_results(results):
+    """
+    Input:
+      results[dict]: As returned by run()
+    Return:
+      str: A table of the results
+    """
+    lines = ["Jobs run: %s" % results["jobs"],
+        "%-22s %7s %9s %9s %9s %9s %9s %9s" % ("endpoint", "calls", "p50 ms", "p95 ms", "max ms",
+            "queries", "max q", "rows"),
+        ]
+    for name in ENDPOINTS:
+        s = results[name]
+        lines.append("%-22s %7d %9.2f %9.2f %9.2f %9.1f %9d %9.1f" % (name, s["calls"], s["p50_ms"],
+            s["p95_ms"], s["max_ms"], s["queries_avg"], s["queries_max"], s["rows_avg"]))
+    return "\n".join(lines)
@@ -0,0 +1,127 @@
+
+# Copyright 2016 Battelle Energy Alliance, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import unicode_literals, absolute_import
+from django.conf import settings
+from django.core.cache import cache
+from ci.recipe import file_utils
+import hashlib
+
+# The part of the claim payload that only depends on the recipe.
+# Recipes don't change once they are loaded (a change creates a new
+# Recipe record) but the scripts they point to are read from the recipe
+# repository so the SHA of the repository is part of the cache key.
+# Clients that keep their own copies of the scripts only get the SHA of
+# the contents and fetch the ones they don't have. See get_script().
+# The SHA of the repository is recorded on the job when it is claimed
+# so the scripts can still be found after the repository has moved on.
+
+def _cache_key(recipe, repo_sha):
+    key = "%s:%s:%s" % (recipe.pk, recipe.filename_sha, repo_sha)
+    return "job_payload_%s" % hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+def build_recipe_payload(recipe, base_dir, repo_sha=""):
+    """
+    Reads everything needed for the claim payload of a recipe.
+    Input:
+      recipe[models.Recipe]: The recipe
+      base_dir[str]: The directory holding the recipe repository
+      repo_sha[str]: The SHA of the recipe repository to read the scripts at.
+        If it isn't the current SHA then the scripts are read from git.
+    Return:
+      dict: With the following keys
+        environment: list of (name, value) of the recipe environment variables
+        prestep_sources: list of the contents of the prestep sources
+        prestep_source_shas: list of the content SHAs of the prestep sources
+        steps: list of dicts for each step, in order of their position
+    """
+    from_git = repo_sha and repo_sha != file_utils.get_repo_sha(base_dir)
+
+    def get_contents(filename):
+        if from_git:
+            return file_utils.get_contents_at(base_dir, repo_sha, filename)
+        return file_utils.get_contents(base_dir, filename)
+
+    environment = [(env.name, env.value) for env in recipe.environment_vars.all()]
+
+    prestep_sources = []
+    for prestep in recipe.prestepsources.all():
+        if prestep.filename:
+            contents = get_contents(prestep.filename)
+            if contents:
+                prestep_sources.append(contents)
+
+    steps = []
+    for step in recipe.steps.order_by('position').prefetch_related('step_environment'):
+        step_dict = {
+            'name': step.name,
+            'position': step.position,
+            'abort_on_failure': step.abort_on_failure,
+            'allowed_to_fail': step.allowed_to_fail,
+            'filename': step.filename,
+            'environment': [(env.name, env.value) for env in step.step_environment.all()],
+            }
+        if step.filename:
+            contents = get_contents(step.filename)
+            step_dict['script'] = str(contents) # in case of empty file, use str
+            step_dict['script_sha'] = file_utils.get_contents_sha(step_dict['script'])
+        steps.append(step_dict)
+
+    return {'environment': environment,
+            'prestep_sources': prestep_sources,
+            'prestep_source_shas': [file_utils.get_contents_sha(contents) for contents in prestep_sources],
+            'steps': steps,
+            }
+
+def get_recipe_payload(recipe, base_dir, repo_sha):
+    """
+    Same as build_recipe_payload() but the result is cached.
+    Input:
+      recipe[models.Recipe]: The recipe
+      base_dir[str]: The directory holding the recipe repository
+      repo_sha[str]: The SHA of the recipe repository
+    Return:
+      dict: See build_recipe_payload()
+    """
+    if not repo_sha:
+        # We can't tell if the scripts have changed
+        return build_recipe_payload(recipe, base_dir)
+
+    key = _cache_key(recipe, repo_sha)
+    payload = cache.get(key)
+    if payload is None:
+        payload = build_recipe_payload(recipe, base_dir, repo_sha)
+        cache.set(key, payload, settings.JOB_PAYLOAD_CACHE_TIMEOUT)
+    return payload
+
+def get_script(recipe, base_dir, repo_sha, sha):
+    """
+    Gets the contents of a script of a recipe by its SHA.
+    Input:
+      recipe[models.Recipe]: The recipe that uses the script
+      base_dir[str]: The directory holding the recipe repository
+      repo_sha[str]: The SHA of the recipe repository when the job was claimed
+      sha[str]: The content SHA of the script
+    Return:
+      str: The contents of the script or None if the recipe doesn't have a script with that SHA
+    """
+    payload = get_recipe_payload(recipe, base_dir, repo_sha)
+    for contents, prestep_sha in zip(payload['prestep_sources'], payload['prestep_source_shas']):
+        if prestep_sha == sha:
+            return contents
+    for step in payload['steps']:
+        if step.get('script_sha') == sha:
+            return step['script']
+    return None
@@ -93,19 +93,21 @@ def set_job_os(job, output):
     job.operating_system = os_record
 
 def set_job_stats(job):
+    """
+    Sets the test statistics of the job from the tests counted
+    in the output of each step as it arrived.
+    """
     if not job.step_results.exists():
         return
     passed = 0
     failed = 0
     skipped = 0
-    for s in job.step_results.all():
-        output = "\n".join(s.clean_output().split("<br/>"))
-        matches = re.findall(r'>(?P<passed>\d+) passed<.*, .*>(?P<skipped>\d+) skipped<.*, .*>(?P<failed>\d+) failed',
-                output, flags=re.IGNORECASE)
-        for match in matches:
-            passed += int(match[0])
-            failed += int(match[2])
-            skipped += int(match[1])
+    fields = ["tests_passed", "tests_skipped", "tests_failed", "test_stats_state"]
+    for s in job.step_results.only(*fields):
+        step_passed, step_skipped, step_failed = s.test_stats()
+        passed += step_passed
+        failed += step_failed
+        skipped += step_skipped
     job.test_stats.all().delete()
     if passed or failed or skipped:
         models.JobTestStatistics.objects.create(job=job, passed=passed, failed=failed, skipped=skipped)
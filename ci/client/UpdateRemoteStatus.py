@@ -13,7 +13,7 @@
 # limitations under the License.
 
 from __future__ import unicode_literals, absolute_import
-from ci import models
+from ci import models, TaskQueue
 from django.urls import reverse
 from ci.client import ProcessCommands
 from ci.client import ParseOutput
@@ -170,14 +170,16 @@ def job_wont_run(job):
             git_api.STATUS_JOB_COMPLETE,
             )
 
-def create_event_summary(event):
+def create_event_summary(event, graph=None):
     """
     Posts a comment on a PR with a summary of all the job statuses.
     """
     if event.cause != models.Event.PULL_REQUEST or not event.comments_url or not event.base.server().post_event_summary():
         return
-    unrunnable = event.get_unrunnable_jobs()
-    sorted_jobs = event.get_sorted_jobs()
+    if graph is None:
+        graph = event.get_job_graph()
+    unrunnable = graph.unrunnable_jobs()
+    sorted_jobs = event.get_sorted_jobs(graph)
     msg = "CIVET Testing summary for %s\n\n" % event.head.short_sha()
     msg_re = r"^%s" % msg
     for group in sorted_jobs:
@@ -200,7 +202,7 @@ def create_event_summary(event):
     git_api = event.build_user.api()
     ProcessCommands.edit_comment(git_api, event.build_user, event.comments_url, msg, msg_re)
 
-def event_complete(event):
+def event_complete(event, graph=None):
     """
     The event is complete (all jobs have finished).
     Check to see if there are "Failed but allowed"
@@ -211,7 +213,7 @@ def event_complete(event):
     if event.cause != models.Event.PULL_REQUEST or not event.complete:
         return
 
-    create_event_summary(event)
+    create_event_summary(event, graph)
 
     check_automerge(event)
 
@@ -286,23 +288,60 @@ def uncancel_previous_event(ev, msg):
 def job_complete(job):
     """
     Should be called whenever a job is completed.
-    This will update the Git server status and make
-    any additional jobs ready.
+    This will update the database status and make any additional
+    jobs ready. Updating the Git server and parsing the output are
+    queued to be done by the task queue.
+    Return:
+      bool: True if the event is done
     """
-    job_complete_pr_status(job)
-    create_issue_on_fail(job)
     start_canceled_on_fail(job)
-
-    ParseOutput.set_job_info(job)
-    ProcessCommands.process_commands(job)
     job.update_badge()
 
-    all_done = job.event.set_complete_if_done()
+    # None of the jobs change while finishing up the event,
+    # so the same dependency graph can be used throughout
+    graph = job.event.get_job_graph()
+    all_done = job.event.set_complete_if_done(graph)
+
+    for name in ["pr_status", "issue", "info", "commands"]:
+        TaskQueue.enqueue(job_task, name=name, job_id=job.pk)
 
     if all_done:
-        event_complete(job.event)
-        unrunnable = job.event.get_unrunnable_jobs()
+        TaskQueue.enqueue(event_complete_task, event_id=job.event.pk)
+        unrunnable = graph.unrunnable_jobs()
         for norun in unrunnable:
             logger.info("Job %s: %s will not run due to failed dependencies" % (norun.pk, norun))
-            job_wont_run(norun)
+            TaskQueue.enqueue(job_task, name="wont_run", job_id=norun.pk)
     return all_done
+
+# The parts of job_complete() that are done by the task queue.
+JOB_TASKS = {"pr_status": job_complete_pr_status,
+        "issue": create_issue_on_fail,
+        "info": ParseOutput.set_job_info,
+        "commands": ProcessCommands.process_commands,
+        "wont_run": job_wont_run,
+        }
+
+def job_task(name, job_id):
+    """
+    Task queue entry point for job_complete()
+    Input:
+      name[str]: Key in JOB_TASKS of the function to call
+      job_id[int]: The pk of the job
+    """
+    job = (models.Job.objects
+            .select_related("recipe__repository__user__server",
+                "event__build_user__server",
+                "event__base__branch__repository__user",
+                "event__head__branch__repository__user",
+                "event__pull_request")
+            .get(pk=job_id))
+    JOB_TASKS[name](job)
+
+def event_complete_task(event_id):
+    """
+    Task queue entry point for event_complete()
+    Input:
+      event_id[int]: The pk of the event
+    """
+    event = models.Event.objects.select_related("build_user__server", "pull_request").get(pk=event_id)
+    event_complete(event)
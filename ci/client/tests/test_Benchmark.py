@@ -0,0 +1,82 @@
+
+# Copyright 2016 Battelle Energy Alliance, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import unicode_literals, absolute_import
+from django.core.management import call_command
+from django.test import override_settings
+from django.utils.six import StringIO
+from ci.client import Benchmark
+from ci.tests import DBTester
+from ci import models
+import json
+from mock import patch
+
+@override_settings(INSTALLED_GITSERVERS=[])
+class Tests(DBTester.DBTester):
+    def test_percentile(self):
+        self.assertEqual(Benchmark.percentile([], 50), 0)
+        self.assertEqual(Benchmark.percentile([3, 1, 2], 50), 2)
+        self.assertEqual(Benchmark.percentile(list(range(1, 101)), 95), 95)
+        self.assertEqual(Benchmark.percentile([1], 95), 1)
+
+    def test_run(self):
+        # Check the stored output of the steps before everything gets rolled back
+        outputs = []
+        call = Benchmark.Runner.call
+        def check_call(runner, name, url_args, data=None):
+            ret = call(runner, name, url_args, data)
+            if name in ("update_step_result", "complete_step_result"):
+                outputs.append(models.StepResult.objects.get(pk=url_args[2]).output)
+            return ret
+
+        self.set_counts()
+        with patch.object(Benchmark.Runner, "call", autospec=True, side_effect=check_call):
+            results = Benchmark.run(num_repos=2, num_events=2, num_recipes=3, num_steps=2, num_updates=2, output_size=100)
+        # Each update is only stored once
+        runner = Benchmark.Runner("0", 2, 100)
+        step_outputs = [runner.output(0),
+                runner.output(0) + runner.output(1),
+                runner.output(0) + runner.output(1)]
+        self.assertEqual(outputs, step_outputs * 12)
+        # Everything gets rolled back
+        self.compare_counts()
+        self.assertEqual(models.QueuedTask.objects.count(), 0)
+
+        # All the jobs should have run, the dependent jobs after their dependencies
+        self.assertEqual(results["jobs"], 6)
+        self.assertEqual(results["claim_job"]["calls"], 6)
+        self.assertEqual(results["job_finished"]["calls"], 6)
+        self.assertEqual(results["start_step_result"]["calls"], 12)
+        self.assertEqual(results["update_step_result"]["calls"], 24)
+        self.assertEqual(results["complete_step_result"]["calls"], 12)
+        # One more to find out there are no more jobs
+        self.assertEqual(results["ready_jobs"]["calls"], 7)
+        for name in Benchmark.ENDPOINTS:
+            self.assertGreater(results[name]["queries_avg"], 0)
+            self.assertGreaterEqual(results[name]["p95_ms"], results[name]["p50_ms"])
+
+        results = Benchmark.run(num_repos=1, num_events=1, num_recipes=3, num_steps=1, max_jobs=1)
+        self.assertEqual(results["jobs"], 1)
+
+    def test_command(self):
+        out = StringIO()
+        call_command("benchmark_client", "--repos=1", "--events=1", "--jobs=1", "--steps=1", stdout=out)
+        self.assertIn("Jobs run: 1", out.getvalue())
+        self.assertIn("claim_job", out.getvalue())
+
+        out = StringIO()
+        call_command("benchmark_client", "--repos=1", "--events=1", "--jobs=1", "--steps=1", "--json", stdout=out)
+        results = json.loads(out.getvalue())
+        self.assertEqual(results["jobs"], 1)
@@ -0,0 +1,81 @@
+
+# Copyright 2016 Battelle Energy Alliance, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import unicode_literals, absolute_import
+from django.test import override_settings
+from django.core.cache import cache
+from ci.client.tests import ClientTester
+from ci.client import JobPayload
+from ci.recipe import file_utils
+from ci.tests import utils
+from mock import patch
+import os
+import subprocess
+
+@override_settings(INSTALLED_GITSERVERS=[utils.github_config()])
+class Tests(ClientTester.ClientTester):
+    def create_recipe(self):
+        recipe = utils.create_recipe()
+        utils.create_recipe_environment(recipe=recipe)
+        utils.create_prestepsource(filename="scripts/1.sh", recipe=recipe)
+        step1 = utils.create_step(recipe=recipe, name="step1", position=1, filename="scripts/2.sh")
+        utils.create_step(recipe=recipe, name="step0", position=0, filename="scripts/1.sh")
+        utils.create_step_environment(step=step1)
+        return recipe
+
+    def test_build_recipe_payload(self):
+        with utils.RecipeDir() as recipe_dir:
+            recipe = self.create_recipe()
+            payload = JobPayload.build_recipe_payload(recipe, recipe_dir)
+            self.assertEqual(payload["environment"], [("testEnv", "testValue")])
+            self.assertEqual(len(payload["prestep_sources"]), 1)
+            self.assertEqual([s["name"] for s in payload["steps"]], ["step0", "step1"])
+            self.assertEqual(payload["steps"][0]["environment"], [])
+            self.assertEqual(payload["steps"][1]["environment"], [("testEnv", "testValue")])
+            self.assertEqual(payload["steps"][1]["script"], "2.sh")
+
+    def test_get_recipe_payload(self):
+        with utils.RecipeDir() as recipe_dir:
+            recipe = self.create_recipe()
+            repo_sha = file_utils.get_repo_sha(recipe_dir)
+            payload = JobPayload.get_recipe_payload(recipe, recipe_dir, repo_sha)
+
+            # Cached, no files are read or queries done
+            with patch.object(file_utils, 'get_contents') as mock_contents:
+                with self.assertNumQueries(0):
+                    self.assertEqual(JobPayload.get_recipe_payload(recipe, recipe_dir, repo_sha), payload)
+                self.assertEqual(mock_contents.call_count, 0)
+
+                # Without a SHA nothing is cached
+                mock_contents.return_value = "contents"
+                JobPayload.get_recipe_payload(recipe, recipe_dir, "")
+                JobPayload.get_recipe_payload(recipe, recipe_dir, "")
+                self.assertEqual(mock_contents.call_count, 6)
+
+            # A new SHA of the recipe repo means the scripts might have changed
+            with open(os.path.join(recipe_dir, "scripts", "1.sh"), "w") as f:
+                f.write("new contents")
+            subprocess.check_output(["git", "commit", "-a", "-m", "Changed"], cwd=recipe_dir)
+            new_sha = file_utils.get_repo_sha(recipe_dir)
+            new_payload = JobPayload.get_recipe_payload(recipe, recipe_dir, new_sha)
+            self.assertEqual(new_payload["steps"][0]["script"], "new contents")
+
+            # Older SHAs, like from when a job was claimed, are read from git
+            cache.clear()
+            self.assertEqual(JobPayload.get_recipe_payload(recipe, recipe_dir, repo_sha), payload)
+            self.assertEqual(JobPayload.get_script(recipe, recipe_dir, repo_sha,
+                file_utils.get_contents_sha("1.sh")), "1.sh")
+            self.assertIsNone(JobPayload.get_script(recipe, recipe_dir, new_sha,
+                file_utils.get_contents_sha("1.sh")))
@@ -16,6 +16,7 @@
 from __future__ import unicode_literals, absolute_import
 from ci.client.tests import ClientTester
 from ci.client import ParseOutput
+from mock import patch
 from ci.tests import utils
 from ci import models
 
@@ -73,3 +74,31 @@ class Tests(ClientTester.ClientTester):
         self.assertEqual(js.passed, 123)
         self.assertEqual(js.skipped, 456)
         self.assertEqual(js.failed, 789)
+
+    def test_set_job_stats_incremental(self):
+        job = utils.create_job()
+        step_result = utils.create_step_result(job=job)
+        step_result.append_output("foo\n\33[1m\33[32m12 passed\33[0m, \33[1m3 sk")
+        step_result.save()
+        step_result.append_output("ipped\33[0m, \33[1m0 pending\33[0m, \33[1m1 failed\33[0m\n")
+        step_result.save()
+        step_result.append_output("\33[1m\33[32m1 passed\33[0m, \33[1m0 skipped\33[0m, \33[1m0 pending\33[0m, \33[1m2 failed\33[0m")
+        step_result.save()
+        step_result.refresh_from_db()
+        self.assertEqual(step_result.tests_passed, 12)
+        self.assertEqual(step_result.tests_failed, 1)
+        self.assertEqual(step_result.test_stats(), (13, 3, 3))
+
+        with patch.object(models.StepResult, "clean_output") as mock_clean:
+            ParseOutput.set_job_stats(job)
+            self.assertEqual(mock_clean.call_count, 0)
+        js = models.JobTestStatistics.objects.get(job=job)
+        self.assertEqual(js.passed, 13)
+        self.assertEqual(js.skipped, 3)
+        self.assertEqual(js.failed, 3)
+
+        # Not counted as it arrived
+        models.StepResult.objects.filter(pk=step_result.pk).update(test_stats_state=None)
+        ParseOutput.set_job_stats(job)
+        js = models.JobTestStatistics.objects.get(job=job)
+        self.assertEqual(js.passed, 13)
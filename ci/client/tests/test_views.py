@@ -17,9 +17,10 @@ from __future__ import unicode_literals, absolute_import
 from django.urls import reverse
 from django.http import HttpResponseNotAllowed, HttpResponseBadRequest
 from django.test import override_settings
-import json
+from django.core.cache import cache
+import json, gzip, io, base64, os, subprocess
 from mock import patch
-from ci import models, Permissions
+from ci import models, Permissions, ReadyJobsNotifier, TaskQueue
 from ci.client import views
 from ci.recipe import file_utils
 from ci.tests import utils
@@ -82,6 +83,101 @@ class Tests(ClientTester.ClientTester):
         self.compare_counts()
         self.assertEqual(response.status_code, 200)
 
+    @override_settings(READY_JOBS_LONG_POLL_MAX_WAIT=5, READY_JOBS_LONG_POLL_RECHECK=1)
+    def test_ready_jobs_long_poll(self):
+        user = utils.get_test_user()
+        job = utils.create_job(user=user)
+        utils.update_job(job, ready=False, active=True)
+        url = reverse('ci:client:ready_jobs', args=[user.build_key, 'client'])
+
+        # bad wait
+        response = self.client.get(url, {'wait': 'foo'})
+        self.assertEqual(response.status_code, 400)
+
+        # Nothing becomes ready, times out
+        with patch.object(ReadyJobsNotifier, 'wait') as mock_wait:
+            mock_wait.return_value = False
+            with patch.object(views, 'time') as mock_time:
+                mock_time.time.side_effect = [0, 0, 2, 4, 6]
+                response = self.client.get(url, {'wait': 30, 'configs': [job.config.name]})
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            self.assertTrue(data['long_poll'])
+            self.assertEqual(data['jobs'], [])
+            # max wait of 5 seconds with a recheck every second
+            self.assertEqual(mock_wait.call_count, 3)
+            self.assertEqual(mock_wait.call_args[0][2], 1)
+
+        def make_ready(build_key, generation, timeout):
+            utils.update_job(job, ready=True)
+            return True
+
+        # Job for a different config doesn't wake us
+        with patch.object(ReadyJobsNotifier, 'wait') as mock_wait:
+            mock_wait.side_effect = make_ready
+            with patch.object(views, 'time') as mock_time:
+                mock_time.time.side_effect = [0, 0, 2, 4, 6]
+                response = self.client.get(url, {'wait': 5, 'configs': ['otherconfig']})
+            data = response.json()
+            self.assertEqual(len(data['jobs']), 1)
+            self.assertEqual(mock_wait.call_count, 3)
+
+        # Woken up when the job becomes ready
+        utils.update_job(job, ready=False)
+        with patch.object(ReadyJobsNotifier, 'wait') as mock_wait:
+            mock_wait.side_effect = make_ready
+            response = self.client.get(url, {'wait': 5, 'configs': [job.config.name]})
+            data = response.json()
+            self.assertTrue(data['long_poll'])
+            self.assertEqual(len(data['jobs']), 1)
+            self.assertEqual(data['jobs'][0]['id'], job.pk)
+            self.assertEqual(mock_wait.call_count, 1)
+
+        # Already a ready job, no waiting
+        with patch.object(ReadyJobsNotifier, 'wait') as mock_wait:
+            response = self.client.get(url, {'wait': 5})
+            data = response.json()
+            self.assertEqual(len(data['jobs']), 1)
+            self.assertEqual(mock_wait.call_count, 0)
+
+    @override_settings(READY_JOBS_LONG_POLL_MAX_WAITERS=1)
+    def test_ready_jobs_long_poll_max_waiters(self):
+        user = utils.get_test_user()
+        job = utils.create_job(user=user)
+        utils.update_job(job, ready=False, active=True)
+        url = reverse('ci:client:ready_jobs', args=[user.build_key, 'client'])
+
+        # Another request is already being held, reply right away
+        self.assertTrue(views.open_long_poll_slot())
+        try:
+            with patch.object(ReadyJobsNotifier, 'wait') as mock_wait:
+                response = self.client.get(url, {'wait': 5})
+                self.assertEqual(response.status_code, 200)
+                data = response.json()
+                self.assertNotIn('long_poll', data)
+                self.assertEqual(data['jobs'], [])
+                self.assertEqual(mock_wait.call_count, 0)
+        finally:
+            views.close_long_poll_slot()
+
+        # The slot is given back when the wait is done, even on errors
+        with patch.object(ReadyJobsNotifier, 'wait') as mock_wait:
+            mock_wait.side_effect = Exception("Bam!")
+            with self.assertRaises(Exception):
+                self.client.get(url, {'wait': 5})
+            self.assertEqual(mock_wait.call_count, 1)
+        self.assertTrue(views.open_long_poll_slot())
+        views.close_long_poll_slot()
+
+        with patch.object(ReadyJobsNotifier, 'wait') as mock_wait:
+            mock_wait.return_value = False
+            with patch.object(views, 'time') as mock_time:
+                mock_time.time.side_effect = [0, 0, 6]
+                response = self.client.get(url, {'wait': 5})
+            data = response.json()
+            self.assertTrue(data['long_poll'])
+            self.assertEqual(mock_wait.call_count, 1)
+
     def test_ready_jobs(self):
         url = reverse('ci:client:ready_jobs', args=['123', 'client'])
         # only get allowed
@@ -276,6 +372,23 @@ class Tests(ClientTester.ClientTester):
         self.assertNotEqual(data, None)
         self.assertTrue(isinstance(response, HttpResponseBadRequest))
 
+        # gzipped body
+        buf = io.BytesIO()
+        with gzip.GzipFile(fileobj=buf, mode="wb") as f:
+            f.write(json.dumps({'foo': 'bar'}).encode('utf-8'))
+        body = buf.getvalue()
+        request = self.factory.post('/', body, content_type='application/json', HTTP_CONTENT_ENCODING='gzip')
+        data, response = views.check_post(request, required)
+        self.assertEqual(data, {'foo': 'bar'})
+        self.assertEqual(None, response)
+
+        # claims to be gzipped but isn't
+        request = self.factory.post('/', json.dumps({'foo': 'bar'}), content_type='application/json',
+                HTTP_CONTENT_ENCODING='gzip')
+        data, response = views.check_post(request, required)
+        self.assertEqual(data, None)
+        self.assertTrue(isinstance(response, HttpResponseBadRequest))
+
     @patch.object(file_utils, 'get_contents')
     def test_get_job_info(self, contents_mock):
         with utils.RecipeDir():
@@ -299,6 +412,139 @@ class Tests(ClientTester.ClientTester):
             self.assertIn('job_id', data)
             self.assertIn('prestep_sources', data)
             self.assertIn('steps', data)
+            self.assertEqual(len(data['steps']), 1)
+            step_result = job.step_results.get()
+            self.assertEqual(data['steps'][0]['stepresult_id'], step_result.pk)
+            self.assertEqual(data['steps'][0]['environment']['stepresult_id'], step_result.pk)
+            self.assertEqual(data['steps'][0]['environment']['testEnv'], 'testValue')
+            self.assertEqual(data['steps'][0]['script'], 'contents')
+            self.assertEqual(step_result.name, step.name)
+            self.assertEqual(step_result.status, models.JobStatus.NOT_STARTED)
+            # Appended output gets rendered as it comes in
+            self.assertEqual(step_result.output_html, "")
+            self.assertEqual(step_result.render_state, "")
+            self.assertEqual(step_result.test_stats_state, "")
+            step_result.append_output("\33[1mbold\33[0m\n")
+            step_result.save()
+            chunk = step_result.output_chunks.get()
+            self.assertIn("bold", chunk.html)
+            self.assertNotIn("\33", chunk.html)
+            self.assertEqual(step_result.clean_output(), chunk.html)
+
+            # Claiming again replaces the step results
+            data = views.get_job_info(job)
+            self.assertEqual(job.step_results.count(), 1)
+            self.assertNotEqual(data['steps'][0]['stepresult_id'], step_result.pk)
+
+            # Only the SHA of the scripts
+            data = views.get_job_info(job, script_shas=True)
+            self.assertNotIn('script', data['steps'][0])
+            self.assertNotIn('prestep_sources', data)
+            self.assertEqual(data['steps'][0]['script_sha'], file_utils.get_contents_sha('contents'))
+            self.assertEqual(data['prestep_source_shas'], [file_utils.get_contents_sha('contents')])
+
+    def test_get_script(self):
+        with utils.RecipeDir() as recipes_dir:
+            user = utils.get_test_user()
+            job = utils.create_job(user=user)
+            utils.create_step(recipe=job.recipe, filename="scripts/1.sh")
+            client = utils.create_client()
+            job.client = client
+            job.save()
+            data = views.get_job_info(job, script_shas=True)
+            sha = data['steps'][0]['script_sha']
+            self.assertEqual(sha, file_utils.get_contents_sha("1.sh"))
+            url = reverse('ci:client:get_script', args=[user.build_key, client.name, job.pk, sha])
+
+            response = self.client_post_json(url, {})
+            self.assertEqual(response.status_code, 405)
+
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content, b"1.sh")
+
+            # Not a script of the job
+            url = reverse('ci:client:get_script', args=[user.build_key, client.name, job.pk, "1"*40])
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 404)
+
+            # Wrong client
+            url = reverse('ci:client:get_script', args=[user.build_key, "other_client", job.pk, sha])
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 404)
+
+            # Wrong build key
+            other = utils.create_user(name="other")
+            url = reverse('ci:client:get_script', args=[other.build_key, client.name, job.pk, sha])
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 404)
+
+            # The script changed in the recipe repository after the job was claimed
+            with open(os.path.join(recipes_dir, "scripts", "1.sh"), "w") as f:
+                f.write("new contents")
+            subprocess.check_output(["git", "commit", "-a", "-m", "Changed"], cwd=recipes_dir)
+            cache.clear()
+            url = reverse('ci:client:get_script', args=[user.build_key, client.name, job.pk, sha])
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content, b"1.sh")
+
+            # Jobs run by a client runner user use their build key, like when claiming
+            job.recipe.client_runner_user = other
+            job.recipe.save()
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 404)
+            url = reverse('ci:client:get_script', args=[other.build_key, client.name, job.pk, sha])
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content, b"1.sh")
+
+    def test_release_job(self):
+        user = utils.get_test_user()
+        job = utils.create_job(user=user)
+        client = utils.create_client()
+        client2 = utils.create_client(name='other_client')
+        job.client = client
+        job.status = models.JobStatus.RUNNING
+        job.save()
+        utils.create_step_result(job=job)
+        post_data = {'message': 'No scripts'}
+
+        url = reverse('ci:client:release_job', args=[user.build_key, client.name, job.pk])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 405)
+
+        # bad job
+        url = reverse('ci:client:release_job', args=[user.build_key, client.name, 0])
+        response = self.client_post_json(url, post_data)
+        self.assertEqual(response.status_code, 400)
+
+        # bad client
+        url = reverse('ci:client:release_job', args=[user.build_key, client2.name, job.pk])
+        response = self.client_post_json(url, post_data)
+        self.assertEqual(response.status_code, 400)
+
+        # no message
+        url = reverse('ci:client:release_job', args=[user.build_key, client.name, job.pk])
+        response = self.client_post_json(url, {})
+        self.assertEqual(response.status_code, 400)
+
+        # should be ok
+        response = self.client_post_json(url, post_data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'OK')
+        job.refresh_from_db()
+        self.assertEqual(job.status, models.JobStatus.NOT_STARTED)
+        self.assertIsNone(job.client)
+        self.assertTrue(job.ready)
+        self.assertEqual(job.step_results.count(), 0)
+        self.assertIn("No scripts", job.changelog.order_by("pk").last().message)
+        client.refresh_from_db()
+        self.assertEqual(client.status, models.Client.IDLE)
+
+        # Not running anymore
+        response = self.client_post_json(url, post_data)
+        self.assertEqual(response.status_code, 400)
 
     def test_claim_job(self):
         post_data = {'job_id': 0}
@@ -444,6 +690,153 @@ class Tests(ClientTester.ClientTester):
         # there is a newer event so this event doesn't update the PullRequest status
         self.assertEqual(job.event.pull_request.status, models.JobStatus.SUCCESS)
 
+    def test_claim_next_job(self):
+        user = utils.get_test_user()
+        url = reverse('ci:client:claim_next_job', args=[user.build_key, 'testClient'])
+        post_data = {'configs': ['testBuildConfig']}
+
+        # only post allowed
+        self.set_counts()
+        response = self.client.get(url)
+        self.compare_counts()
+        self.assertEqual(response.status_code, 405) # not allowed
+
+        # bad post data
+        self.set_counts()
+        response = self.client_post_json(url, {})
+        self.compare_counts()
+        self.assertEqual(response.status_code, 400)
+
+        # no jobs
+        self.set_counts()
+        response = self.client_post_json(url, post_data)
+        self.compare_counts(num_clients=1)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertFalse(data['success'])
+        self.assertEqual(data['job_id'], None)
+
+        r0 = utils.create_recipe(name='recipe0', user=user)
+        r1 = utils.create_recipe(name='recipe1', user=user)
+        r1.priority = 10
+        r1.save()
+        j0 = utils.create_job(recipe=r0, user=user)
+        j1 = utils.create_job(recipe=r1, user=user)
+        utils.update_job(j0, ready=True, active=True)
+        utils.update_job(j1, ready=True, active=True)
+
+        # unknown config
+        self.set_counts()
+        response = self.client_post_json(url, {'configs': ['otherConfig']})
+        self.compare_counts()
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.json()['success'])
+
+        # highest priority job first
+        url = reverse('ci:client:claim_next_job', args=[user.build_key, 'client0'])
+        self.set_counts()
+        response = self.client_post_json(url, post_data)
+        self.compare_counts(num_clients=1, active_branches=1)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertTrue(data['success'])
+        self.assertEqual(data['job_id'], j1.pk)
+        self.assertEqual(data['config'], j1.config.name)
+        self.assertIn('steps', data['job_info'])
+        j1.refresh_from_db()
+        self.assertEqual(j1.status, models.JobStatus.RUNNING)
+        self.assertEqual(j1.client.name, 'client0')
+
+        # job was invalidated to run on another client
+        utils.update_job(j0, invalidated=True, client=j1.client)
+        j0.same_client = True
+        j0.save()
+        url = reverse('ci:client:claim_next_job', args=[user.build_key, 'client1'])
+        self.set_counts()
+        response = self.client_post_json(url, post_data)
+        self.compare_counts(num_clients=1)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.json()['success'])
+
+        j0.same_client = False
+        j0.save()
+        self.set_counts()
+        response = self.client_post_json(url, post_data)
+        self.compare_counts()
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertTrue(data['success'])
+        self.assertEqual(data['job_id'], j0.pk)
+
+        # client0 asks for another job, so its running job gets canceled
+        url = reverse('ci:client:claim_next_job', args=[user.build_key, 'client0'])
+        self.set_counts()
+        response = self.client_post_json(url, post_data)
+        self.compare_counts(canceled=1, num_jobs_completed=1, num_changelog=1)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.json()['success'])
+        j1.refresh_from_db()
+        self.assertEqual(j1.status, models.JobStatus.CANCELED)
+
+    def test_claim_next_job_with_current_event(self):
+        """
+        Should have the same order as ready_jobs()
+        """
+        user = utils.get_test_user()
+        r0 = utils.create_recipe(name='recipe0', user=user)
+        r0.priority = 30
+        r0.save()
+        r1 = utils.create_recipe(name='recipe1', user=user)
+        r1.priority = 20
+        r1.save()
+        e0 = utils.create_event(user=user, cause=models.Event.PUSH)
+        j0 = utils.create_job(recipe=r0, event=e0, user=user)
+        j1 = utils.create_job(recipe=r1, event=e0, user=user)
+        e1 = utils.create_event(user=user, cause=models.Event.PUSH, commit1='12345')
+        j2 = utils.create_job(recipe=r0, event=e1, user=user)
+        j3 = utils.create_job(recipe=r1, event=e1, user=user)
+        for j in models.Job.objects.all():
+            utils.update_job(j, ready=True, active=True)
+
+        client = utils.create_client()
+        jobs = views.next_job_query(user.build_key, [j0.config.name], client)
+        self.assertEqual([j.pk for j in jobs], [j0.pk, j2.pk, j1.pk, j3.pk])
+
+        repo_name = "%s/%s" % (e0.base.branch.repository.user.name, e0.base.branch.repository.name)
+        branch_name = e0.base.branch.name
+        branch_settings = {branch_name: {"auto_cancel_push_events_except_current": True}}
+        repo_settings = {repo_name: {"branch_settings": branch_settings}}
+        with self.settings(INSTALLED_GITSERVERS=[utils.github_config(repo_settings=repo_settings)]):
+            jobs = views.next_job_query(user.build_key, [j0.config.name], client)
+            self.assertEqual([j.pk for j in jobs], [j0.pk, j1.pk, j2.pk, j3.pk])
+
+            # jobs on other events still come first
+            r2 = utils.create_recipe(name='recipe2', user=user)
+            e2 = utils.create_event(user=user, commit1='23456')
+            j4 = utils.create_job(recipe=r2, event=e2, user=user)
+            utils.update_job(j4, ready=True, active=True)
+            jobs = views.next_job_query(user.build_key, [j0.config.name], client)
+            self.assertEqual([j.pk for j in jobs], [j4.pk, j0.pk, j1.pk, j2.pk, j3.pk])
+
+            url = reverse('ci:client:claim_next_job', args=[user.build_key, client.name])
+            response = self.client_post_json(url, {'configs': [j0.config.name]})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()['job_id'], j4.pk)
+
+        # branch settings on the server apply to repositories without their own
+        config = utils.github_config()
+        config["branch_settings"] = branch_settings
+        with self.settings(INSTALLED_GITSERVERS=[config]):
+            jobs = views.next_job_query(user.build_key, [j0.config.name], client)
+            self.assertEqual([j.pk for j in jobs], [j0.pk, j1.pk, j2.pk, j3.pk])
+
+        # but not to ones that have their own
+        config["repository_settings"] = {repo_name: {"branch_settings": {}}}
+        with self.settings(INSTALLED_GITSERVERS=[config]):
+            jobs = views.next_job_query(user.build_key, [j0.config.name], client)
+            self.assertEqual([j.pk for j in jobs], [j0.pk, j2.pk, j1.pk, j3.pk])
+
+    @override_settings(TASK_QUEUE_INLINE=False)
     def test_job_finished_status(self):
         user = utils.get_test_user()
         recipe = utils.create_recipe(user=user)
@@ -472,6 +865,9 @@ class Tests(ClientTester.ClientTester):
             response = self.client_post_json(url, post_data)
             self.compare_counts(num_events_completed=1, num_jobs_completed=1)
             self.assertEqual(response.status_code, 200)
+            # The Git server is updated by the task queue
+            self.assertFalse(mock_api.called)
+            self.assertEqual(TaskQueue.run_pending(), 5)
             self.assertTrue(mock_api.called)
             self.assertTrue(mock_api.return_value.update_pr_status.called)
             job.refresh_from_db()
@@ -490,6 +886,7 @@ class Tests(ClientTester.ClientTester):
             response = self.client_post_json(url, post_data)
             self.compare_counts()
             self.assertEqual(response.status_code, 200)
+            TaskQueue.run_pending()
             self.assertTrue(mock_api.called)
             self.assertTrue(mock_api.return_value.update_pr_status.called)
             job.refresh_from_db()
@@ -505,6 +902,7 @@ class Tests(ClientTester.ClientTester):
             response = self.client_post_json(url, post_data)
             self.compare_counts()
             self.assertEqual(response.status_code, 200)
+            TaskQueue.run_pending()
             self.assertTrue(mock_api.called)
             self.assertTrue(mock_api.return_value.update_pr_status.called)
             job.refresh_from_db()
@@ -520,6 +918,7 @@ class Tests(ClientTester.ClientTester):
             response = self.client_post_json(url, post_data)
             self.compare_counts()
             self.assertEqual(response.status_code, 200)
+            TaskQueue.run_pending()
             self.assertTrue(mock_api.called)
             self.assertTrue(mock_api.return_value.update_pr_status.called)
             job.refresh_from_db()
@@ -577,6 +976,7 @@ class Tests(ClientTester.ClientTester):
         data = response.json()
         self.assertIn('message', data)
         self.assertEqual(data['status'], 'OK')
+        TaskQueue.run_pending()
         job.refresh_from_db()
         self.assertTrue(job.complete)
         self.assertEqual(job.operating_system.name, "Ubuntu")
@@ -635,6 +1035,7 @@ class Tests(ClientTester.ClientTester):
         response = self.client_post_json(url, post_data)
         self.compare_counts(num_events_completed=1, num_jobs_completed=1, active_branches=1)
         self.assertEqual(response.status_code, 200)
+        TaskQueue.run_pending()
         self.assertEqual(mock_status.call_count, 3) # 1 for the job complete update and 2 for the won't run update
 
         step_result.status = models.JobStatus.SUCCESS
@@ -643,6 +1044,7 @@ class Tests(ClientTester.ClientTester):
         response = self.client_post_json(url, post_data)
         self.compare_counts(ready=1)
         self.assertEqual(response.status_code, 200)
+        TaskQueue.run_pending()
         self.assertEqual(mock_status.call_count, 4) # 1 for the job complete update
 
     def test_start_step_result(self):
@@ -774,6 +1176,16 @@ class Tests(ClientTester.ClientTester):
         self.assertEqual(data["command"], None)
         result.refresh_from_db()
         self.assertEqual(result.status, models.JobStatus.RUNNING)
+        self.assertEqual(result.output, 'output')
+
+        # new output gets appended
+        self.set_counts()
+        response = self.client_post_json(url, post_data)
+        self.compare_counts()
+        self.assertEqual(response.status_code, 200)
+        result.refresh_from_db()
+        self.assertEqual(result.output, 'outputoutput')
+        self.assertEqual(result.output_chunks.count(), 2)
 
         # test when the user invalidates a job while it is running
         job.status = models.JobStatus.NOT_STARTED
@@ -814,6 +1226,142 @@ class Tests(ClientTester.ClientTester):
         self.assertEqual(result.exit_status, 1)
         self.assertEqual(result.status, models.JobStatus.RUNNING)
 
+    def gzip_output(self, output):
+        buf = io.BytesIO()
+        with gzip.GzipFile(fileobj=buf, mode="wb") as f:
+            f.write(output.encode("utf-8"))
+        return base64.b64encode(buf.getvalue()).decode("ascii")
+
+    def test_decode_output(self):
+        data = {"output": "output"}
+        self.assertTrue(views.decode_output(data))
+        self.assertEqual(data, {"output": "output"})
+
+        data = {"output": self.gzip_output("output"), "output_encoding": "gzip"}
+        self.assertTrue(views.decode_output(data))
+        self.assertEqual(data, {"output": "output"})
+
+        # bad data
+        data = {"output": base64.b64encode(b"output").decode("ascii"), "output_encoding": "gzip"}
+        self.assertFalse(views.decode_output(data))
+        data = {"output": "not base 64", "output_encoding": "gzip"}
+        self.assertFalse(views.decode_output(data))
+
+        # unknown encoding
+        data = {"output": self.gzip_output("output"), "output_encoding": "foo"}
+        self.assertFalse(views.decode_output(data))
+
+        self.assertIn("gzip", views.json_claim_response(1, "config", True, "msg")[views.OUTPUT_ENCODINGS_HEADER])
+
+    def test_update_step_result_encoded(self):
+        job, result = self.create_running_job()
+        post_data = self.create_complete_step_result_post_data(result.position, output=self.gzip_output("output"))
+        post_data["output_encoding"] = "gzip"
+        url = reverse('ci:client:update_step_result', args=[job.event.build_user.build_key, job.client.name, result.pk])
+        self.set_counts()
+        response = self.client_post_json(url, post_data)
+        self.compare_counts()
+        self.assertEqual(response.status_code, 200)
+        result.refresh_from_db()
+        self.assertEqual(result.output, "output")
+
+        post_data["output"] = "bad"
+        self.set_counts()
+        response = self.client_post_json(url, post_data)
+        self.compare_counts()
+        self.assertEqual(response.status_code, 400)
+
+    def test_update_step_results(self):
+        job, result = self.create_running_job()
+        result2 = utils.create_step_result(job=job, position=1)
+        client = job.client
+        client2 = utils.create_client(name='other_client')
+        user = job.event.build_user
+
+        def update(stage, step_result, output, complete=False, exit_status=0):
+            return {"stage": stage,
+                "stepresult_id": step_result.pk,
+                "payload": self.create_complete_step_result_post_data(step_result.position,
+                    output=output, complete=complete, exit_status=exit_status),
+                }
+
+        post_data = {"updates": [
+            update("start", result, ""),
+            update("update", result, "out1"),
+            update("update", result, "out2"),
+            update("complete", result, "out1out2out3", complete=True),
+            update("start", result2, ""),
+            update("update", result2, "fail"),
+            ]}
+
+        url = reverse('ci:client:update_step_results', args=[user.build_key, client.name, job.pk])
+        # only post allowed
+        self.set_counts()
+        response = self.client.get(url)
+        self.compare_counts()
+        self.assertEqual(response.status_code, 405) # not allowed
+
+        # bad job
+        bad_url = reverse('ci:client:update_step_results', args=[user.build_key, client.name, 0])
+        self.set_counts()
+        response = self.client_post_json(bad_url, post_data)
+        self.compare_counts()
+        self.assertEqual(response.status_code, 400) # bad request
+
+        # bad client
+        bad_url = reverse('ci:client:update_step_results', args=[user.build_key, client2.name, job.pk])
+        self.set_counts()
+        response = self.client_post_json(bad_url, post_data)
+        self.compare_counts()
+        self.assertEqual(response.status_code, 400) # bad request
+
+        # A bad update means nothing gets applied
+        bad_data = {"updates": post_data["updates"] + [{"stage": "foo", "stepresult_id": result.pk, "payload": {}}]}
+        self.set_counts()
+        response = self.client_post_json(url, bad_data)
+        self.compare_counts()
+        self.assertEqual(response.status_code, 400) # bad request
+        bad_update = update("update", result, "out")
+        bad_update["stepresult_id"] = 0
+        bad_data = {"updates": post_data["updates"] + [bad_update]}
+        self.set_counts()
+        response = self.client_post_json(url, bad_data)
+        self.compare_counts()
+        self.assertEqual(response.status_code, 400) # bad request
+        result.refresh_from_db()
+        self.assertEqual(result.output, "")
+        self.assertEqual(result.status, models.JobStatus.NOT_STARTED)
+
+        # ok
+        self.set_counts()
+        response = self.client_post_json(url, post_data)
+        self.compare_counts()
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["status"], "OK")
+        self.assertEqual(data["command"], None)
+        result.refresh_from_db()
+        self.assertEqual(result.status, models.JobStatus.SUCCESS)
+        self.assertEqual(result.output, "out1out2out3")
+        self.assertTrue(result.complete)
+        result2.refresh_from_db()
+        self.assertEqual(result2.status, models.JobStatus.RUNNING)
+        self.assertEqual(result2.output, "fail")
+        job.refresh_from_db()
+        self.assertEqual(job.running_step, "2/2")
+
+        # the job got canceled
+        job.status = models.JobStatus.CANCELED
+        job.save()
+        self.set_counts()
+        response = self.client_post_json(url, {"updates": [update("update", result2, "more")]})
+        self.compare_counts()
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["command"], "cancel")
+        result2.refresh_from_db()
+        self.assertEqual(result2.output, "failmore")
+
     def create_running_job(self):
         user = utils.get_test_user()
         job = utils.create_job(user=user)
@@ -887,6 +1435,8 @@ class Tests(ClientTester.ClientTester):
 
     def test_complete_step_result_ok(self):
         job, result = self.create_running_job()
+        result.append_output("partial output")
+        result.save()
         post_data = self.create_complete_step_result_post_data(result.position)
         # ok
         url = self.complete_step_result_url(job)
@@ -897,6 +1447,9 @@ class Tests(ClientTester.ClientTester):
         result.refresh_from_db()
         self.assertEqual(result.status, models.JobStatus.SUCCESS)
         self.assertEqual(result.job.failed_step, "")
+        # The complete output replaces any partial output
+        self.assertEqual(result.output, "output")
+        self.assertEqual(result.output_chunks.count(), 0)
 
     def test_complete_step_result_intermittent_ok(self):
         job, result = self.create_running_job()
@@ -22,6 +22,12 @@ app_name = "client"
 urlpatterns = [
   url(r'^claim_job/(?P<build_key>[0-9]+)/(?P<config_name>[-\w]+)/(?P<client_name>[-\w.]+)/$',
       views.claim_job, name='claim_job'),
+  url(r'^claim_next_job/(?P<build_key>[0-9]+)/(?P<client_name>[-\w.]+)/$',
+      views.claim_next_job, name='claim_next_job'),
+  url(r'^script/(?P<build_key>[0-9]+)/(?P<client_name>[-\w.]+)/(?P<job_id>[0-9]+)/(?P<sha>[0-9a-f]{40})/$',
+      views.get_script, name='get_script'),
+  url(r'^release_job/(?P<build_key>[0-9]+)/(?P<client_name>[-\w.]+)/(?P<job_id>[0-9]+)/$',
+      views.release_job, name='release_job'),
   url(r'^ready_jobs/(?P<build_key>[0-9]+)/(?P<client_name>[-\w.]+)/$', views.ready_jobs, name='ready_jobs'),
   url(r'^ready_jobs_html/(?P<build_key>[0-9]+)/(?P<client_name>[-\w.]+)/$', views.ready_jobs_html, name='ready_jobs_html'),
   url(r'^job_finished/(?P<build_key>[0-9]+)/(?P<client_name>[-\w.]+)/(?P<job_id>[0-9]+)/$',
@@ -32,6 +38,8 @@ urlpatterns = [
       views.start_step_result, name='start_step_result'),
   url(r'^complete_step_result/(?P<build_key>[0-9]+)/(?P<client_name>[-\w.]+)/(?P<stepresult_id>[0-9]+)/$',
       views.complete_step_result, name='complete_step_result'),
+  url(r'^update_step_results/(?P<build_key>[0-9]+)/(?P<client_name>[-\w.]+)/(?P<job_id>[0-9]+)/$',
+      views.update_step_results, name='update_step_results'),
   url(r'^ping/(?P<client_name>[-\w.]+)/$', views.client_ping, name='client_ping'),
   url(r'^update_remote_job_status/(?P<job_id>[0-9]+)/$', views.update_remote_job_status, name='update_remote_job_status'),
   ]
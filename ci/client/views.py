@@ -15,19 +15,31 @@
 
 from __future__ import unicode_literals, absolute_import
 from django.views.decorators.csrf import csrf_exempt
-from django.http import JsonResponse, HttpResponseNotAllowed, HttpResponseBadRequest
+from django.http import HttpResponse, JsonResponse, HttpResponseNotAllowed, HttpResponseBadRequest, Http404
 import json
-from ci import models, views, Permissions
+import zlib
+import base64
+from collections import OrderedDict
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+from ci import models, views, Permissions, ReadyJobsNotifier
 from ci.recipe import file_utils
 import logging
 from django.conf import settings
-from django.db import transaction
+from django.db import transaction, connection
 from datetime import timedelta
-from ci.client import UpdateRemoteStatus
+import time
+import threading
+from ci.client import UpdateRemoteStatus, JobPayload
 from django.shortcuts import render, redirect, get_object_or_404
-from django.db.models import Q
+from django.db.models import Q, F, Case, When, Value, IntegerField
 logger = logging.getLogger('ci')
 
+# Response header that lists the encodings the client can use for step output
+OUTPUT_ENCODINGS_HEADER = 'X-CIVET-Output-Encodings'
+
 def get_client_ip(request):
     x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
     if x_forwarded_for:
@@ -42,7 +54,96 @@ def get_or_create_client(name, ip):
         logger.debug('New client %s : %s seen' % (name, ip))
     return client
 
+def cancel_client_running_jobs(client):
+    """
+    If a client is looking for work then any jobs that
+    are still running on it need to be canceled.
+    Input:
+        client[models.Client]: The client looking for work
+    """
+    past_running_jobs = models.Job.objects.filter(client=client, complete=False, status=models.JobStatus.RUNNING)
+    msg = "Canceled due to client %s not finishing job" % client.name
+    for j in past_running_jobs.all():
+        views.set_job_canceled(j, msg)
+        UpdateRemoteStatus.job_complete(j)
+
+def build_key_q(build_key):
+    """
+    Filter for the jobs that clients with the given build key can run.
+    """
+    return ((Q(recipe__client_runner_user=None) & Q(recipe__build_user__build_key=build_key)) |
+            Q(recipe__client_runner_user__build_key=build_key))
+
+def ready_jobs_query(build_key):
+    """
+    The jobs that are ready to be run by clients with the given build key.
+    """
+    return (models.Job.objects
+            .filter(build_key_q(build_key),
+                complete=False,
+                active=True,
+                ready=True,
+                status=models.JobStatus.NOT_STARTED,))
+
+_long_poll_waiters = 0
+_long_poll_waiters_lock = threading.Lock()
+
+def open_long_poll_slot():
+    """
+    Return:
+      bool: True if another ready jobs request can be held. close_long_poll_slot()
+        needs to be called when it is done.
+    """
+    global _long_poll_waiters
+    with _long_poll_waiters_lock:
+        if _long_poll_waiters >= settings.READY_JOBS_LONG_POLL_MAX_WAITERS:
+            return False
+        _long_poll_waiters += 1
+        return True
+
+def close_long_poll_slot():
+    global _long_poll_waiters
+    with _long_poll_waiters_lock:
+        _long_poll_waiters -= 1
+
+def wait_for_ready_jobs(build_key, config_names, client, timeout):
+    """
+    Hold the request until there is a job that the client could claim.
+    Woken up by ReadyJobsNotifier when jobs become ready.
+    The database is also checked every READY_JOBS_LONG_POLL_RECHECK seconds
+    in case the notification happened in a process that doesn't share our cache.
+    Input:
+        build_key[str]: The build key of the client
+        config_names[list[str]]: Names of the build configs the client supports.
+            If empty then any config matches.
+        client[models.Client]: The client that is waiting
+        timeout[float]: Maximum number of seconds to wait
+    Return:
+        bool: True if there are jobs available, False if we timed out
+    """
+    end = time.time() + timeout
+    while True:
+        generation = ReadyJobsNotifier.get_generation(build_key)
+        if config_names:
+            jobs = next_job_query(build_key, config_names, client)
+        else:
+            jobs = ready_jobs_query(build_key)
+        if jobs.exists():
+            return True
+        remaining = end - time.time()
+        if remaining <= 0:
+            return False
+        ReadyJobsNotifier.wait(build_key, generation, min(remaining, settings.READY_JOBS_LONG_POLL_RECHECK))
+
 def ready_jobs(request, build_key, client_name):
+    """
+    Get a list of the jobs that are ready to run.
+    If the "wait" GET parameter is given then the request is held
+    for up to that many seconds until there are jobs available.
+    If too many requests are already being held then we reply right away
+    without "long_poll" set so that the client falls back to polling.
+    The "configs" GET parameter(s) limit which jobs we wait on.
+    """
     if request.method != 'GET':
         return HttpResponseNotAllowed(['GET'])
 
@@ -52,28 +153,31 @@ def ready_jobs(request, build_key, client_name):
     else:
         # if a client is talking to us here then if they have any running jobs assigned to them they need
         # to be canceled
-        past_running_jobs = models.Job.objects.filter(client=client, complete=False, status=models.JobStatus.RUNNING)
-        msg = "Canceled due to client %s not finishing job" % client.name
-        for j in past_running_jobs.all():
-            views.set_job_canceled(j, msg)
-            UpdateRemoteStatus.job_complete(j)
+        cancel_client_running_jobs(client)
 
     client.status_message = 'Looking for work'
     client.status = models.Client.IDLE
     client.save()
 
+    reply = {}
+    try:
+        wait = min(float(request.GET.get('wait', 0)), settings.READY_JOBS_LONG_POLL_MAX_WAIT)
+    except ValueError:
+        return HttpResponseBadRequest('Invalid wait')
+    if wait > 0 and open_long_poll_slot():
+        try:
+            configs = request.GET.getlist('configs')
+            wait_for_ready_jobs(build_key, configs, client, wait)
+        finally:
+            close_long_poll_slot()
+        reply['long_poll'] = True
+
     # We need to see if any jobs are part of a push event on a repo
     # where we want to do custom handling.
     # Then we need to remove those jobs from the list and do
     # a separate query with a different sort order and add those
     # to the list.
-    jobs = (models.Job.objects
-            .filter((Q(recipe__client_runner_user=None) & Q(recipe__build_user__build_key=build_key)) |
-                    Q(recipe__client_runner_user__build_key=build_key),
-                complete=False,
-                active=True,
-                ready=True,
-                status=models.JobStatus.NOT_STARTED,)
+    jobs = (ready_jobs_query(build_key)
             .select_related('config', 'event__base__branch__repository__user__server')
             .order_by('-recipe__priority', 'created'))
     jobs_json = []
@@ -97,7 +201,7 @@ def ready_jobs(request, build_key, client_name):
                 }
             jobs_json.append(data)
 
-    reply = { 'jobs': jobs_json }
+    reply['jobs'] = jobs_json
     return JsonResponse(reply)
 
 def ready_jobs_html(request, build_key, client_name):
@@ -107,11 +211,27 @@ def ready_jobs_html(request, build_key, client_name):
     response = ready_jobs(request, build_key, client_name)
     return render(request, 'ci/ajax_test.html', {'content': response.content})
 
+def get_request_body(request):
+    """
+    Get the body of the request.
+    Clients can compress the body with gzip and set the Content-Encoding header.
+    Return:
+        bytes: The uncompressed body
+    Raises:
+        ValueError: If the body couldn't be decompressed
+    """
+    if request.META.get('HTTP_CONTENT_ENCODING', '').lower() == 'gzip':
+        try:
+            return gzip_decompress(request.body)
+        except zlib.error:
+            raise ValueError('Invalid gzip data')
+    return request.body
+
 def check_post(request, required_keys):
     if request.method != 'POST':
         return None, HttpResponseNotAllowed(['POST'])
     try:
-        data = json.loads(request.body)
+        data = json.loads(get_request_body(request))
         required = set(required_keys)
         available = set(data.keys())
         if not required.issubset(available):
@@ -121,13 +241,17 @@ def check_post(request, required_keys):
     except ValueError:
         return None, HttpResponseBadRequest('Invalid JSON')
 
-def get_job_info(job):
+def get_job_info(job, script_shas=False):
     """
     Gather all the information required to run a job to
     send to a client.
     We do it like this because we don't want the chance
     of the user changing the recipe while a job is running
     and causing problems.
+    Input:
+      job[models.Job]: The job being claimed
+      script_shas[bool]: If True then the scripts are replaced by the SHA of their contents.
+        The client gets the scripts it doesn't have from get_script().
     """
     job_dict = {
         'recipe_name': job.recipe.name,
@@ -160,8 +284,12 @@ def get_job_info(job):
     else:
         recipe_env["pr_num"] = "0"
 
-    for env in job.recipe.environment_vars.all():
-        recipe_env[env.name] = env.value
+    base_file_dir = settings.RECIPE_BASE_DIR
+    repo_sha = file_utils.get_repo_sha(base_file_dir)
+    payload = JobPayload.get_recipe_payload(job.recipe, base_file_dir, repo_sha)
+
+    for name, value in payload['environment']:
+        recipe_env[name] = value
 
     recipe_env["CIVET_JOB_ID"] = recipe_env["job_id"]
     recipe_env["CIVET_RECIPE_NAME"] = recipe_env["recipe_name"]
@@ -183,46 +311,44 @@ def get_job_info(job):
 
     job_dict['environment'] = recipe_env
 
-    base_file_dir = settings.RECIPE_BASE_DIR
-    prestep_env = []
-    for prestep in job.recipe.prestepsources.all():
-        if prestep.filename:
-            contents = file_utils.get_contents(base_file_dir, prestep.filename)
-            if contents:
-                prestep_env.append(contents)
-
-    job_dict['prestep_sources'] = prestep_env
+    if script_shas:
+        job_dict['prestep_source_shas'] = list(payload['prestep_source_shas'])
+    else:
+        job_dict['prestep_sources'] = list(payload['prestep_sources'])
 
     job.step_results.all().delete()
+    # bulk_create() doesn't call save(), so mark the empty output as
+    # already rendered and counted so that appended output gets processed.
+    step_results = [models.StepResult(job=job,
+            name=step['name'],
+            position=step['position'],
+            abort_on_failure=step['abort_on_failure'],
+            allowed_to_fail=step['allowed_to_fail'],
+            filename=step['filename'],
+            output_html="",
+            render_state="",
+            test_stats_state="",
+            ) for step in payload['steps']]
+    models.StepResult.objects.bulk_create(step_results)
+    if step_results and step_results[0].pk is None:
+        # Not all databases give us back the IDs
+        step_results = list(job.step_results.order_by('pk'))
+    logger.info('Created {} step results for {}: {}'.format(len(step_results), job.pk, job))
+
     step_recipes = []
-    for step in job.recipe.steps.order_by('position'):
+    for step, step_result in zip(payload['steps'], step_results):
         step_dict = {
-            'step_num': step.position,
-            'step_position': step.position,
-            'step_name': step.name,
-            'abort_on_failure': step.abort_on_failure,
-            'allowed_to_fail': step.allowed_to_fail,
+            'step_num': step['position'],
+            'step_position': step['position'],
+            'step_name': step['name'],
+            'abort_on_failure': step['abort_on_failure'],
+            'allowed_to_fail': step['allowed_to_fail'],
+            'stepresult_id': step_result.pk,
             }
 
-        step_result, created = models.StepResult.objects.get_or_create(
-            job=job,
-            name=step.name,
-            position=step.position,
-            abort_on_failure=step.abort_on_failure,
-            allowed_to_fail=step.allowed_to_fail,
-            filename=step.filename)
-
-        logger.info('Created step result for {}: {}: {}: {}'.format(job.pk, job, step_result.pk, step.name))
-        step_result.output = ''
-        step_result.complete = False
-        step_result.seconds = timedelta(seconds=0)
-        step_result.status = models.JobStatus.NOT_STARTED
-        step_result.save()
-        step_dict['stepresult_id'] = step_result.pk
-
         step_env = step_dict.copy()
-        for env in step.step_environment.all():
-            step_env[env.name] = env.value
+        for name, value in step['environment']:
+            step_env[name] = value
 
         step_env["CIVET_STEP_NUM"] = step_env["step_num"]
         step_env["CIVET_STEP_POSITION"] = step_env["step_position"]
@@ -230,20 +356,21 @@ def get_job_info(job):
         step_env["CIVET_STEP_ABORT_ON_FAILURE"] = step_env["abort_on_failure"]
         step_env["CIVET_STEP_ALLOWED_TO_FAIL"] = step_env["allowed_to_fail"]
         step_dict['environment'] = step_env
-        if step.filename:
-            contents = file_utils.get_contents(base_file_dir, step.filename)
-            step_dict['script'] = str(contents) # in case of empty file, use str
+        if 'script' in step and script_shas:
+            step_dict['script_sha'] = step['script_sha']
+        elif 'script' in step:
+            step_dict['script'] = step['script']
 
         step_recipes.append(step_dict)
 
     job_dict['steps'] = step_recipes
-    job.recipe_repo_sha = file_utils.get_repo_sha(base_file_dir)
+    job.recipe_repo_sha = repo_sha
     job.save()
 
     return job_dict
 
 def json_claim_response(job_id, config_name, claimed, msg, job_info=None):
-    return JsonResponse({
+    response = JsonResponse({
       'job_id': job_id,
       'config': config_name,
       'success': claimed,
@@ -251,6 +378,9 @@ def json_claim_response(job_id, config_name, claimed, msg, job_info=None):
       'status': 'OK',
       'job_info': job_info,
       })
+    # Let the client know how it can compress the step output
+    response[OUTPUT_ENCODINGS_HEADER] = ', '.join(output_decoders().keys())
+    return response
 
 def claim_job_check(request, build_key, config_name, client_name):
     data, response = check_post(request, ['job_id'])
@@ -298,7 +428,7 @@ def claim_job(request, build_key, config_name, client_name):
         logger.info('{} requested job {}: {} but waiting for client {}'.format(client, job.pk, job, job.client))
         return HttpResponseBadRequest('Wrong client')
 
-    job_info = get_job_info(job)
+    job_info = get_job_info(job, data.get('script_cache', False))
 
     # The client definitely has the job now
     job.client = client
@@ -313,6 +443,210 @@ def claim_job(request, build_key, config_name, client_name):
     UpdateRemoteStatus.job_started(job)
     return json_claim_response(job.pk, config_name, True, 'Success', job_info)
 
+def auto_cancel_push_jobs_q():
+    """
+    Filter for jobs on push events against branches that have
+    "auto_cancel_push_events_except_current" set.
+    This mirrors Branch.get_branch_setting() but can be used in a query.
+    Return:
+        Q: The filter, or None if no branches have the setting
+    """
+    setting = "auto_cancel_push_events_except_current"
+    prefix = "event__base__branch__"
+    q = None
+    for config in settings.INSTALLED_GITSERVERS:
+        server_q = Q(**{prefix + "repository__user__server__name": config.get("hostname", ""),
+            prefix + "repository__user__server__host_type": config.get("type", -1)})
+        repos_q = None
+        for repo_name, repo_settings in (config.get("repository_settings") or {}).items():
+            branch_settings = repo_settings.get("branch_settings")
+            if branch_settings is None:
+                continue
+            owner, name = repo_name.split("/", 1)
+            repo_q = Q(**{prefix + "repository__user__name": owner, prefix + "repository__name": name})
+            repos_q = repo_q if repos_q is None else repos_q | repo_q
+            branches = [b for b, val in branch_settings.items() if val.get(setting, False)]
+            if branches:
+                branch_q = server_q & repo_q & Q(**{prefix + "name__in": branches})
+                q = branch_q if q is None else q | branch_q
+
+        # Repositories without their own branch settings use the ones on the server
+        branches = [b for b, val in (config.get("branch_settings") or {}).items() if val.get(setting, False)]
+        if branches:
+            branch_q = server_q & Q(**{prefix + "name__in": branches})
+            if repos_q is not None:
+                branch_q &= ~repos_q
+            q = branch_q if q is None else q | branch_q
+
+    if q is not None:
+        q &= Q(event__cause=models.Event.PUSH)
+    return q
+
+def next_job_query(build_key, config_names, client):
+    """
+    Get the ready jobs that can be run by a client, in the order they should be run.
+    This uses the same ordering as ready_jobs() which is normally (-priority, created).
+    Jobs on push events against branches with "auto_cancel_push_events_except_current"
+    go after all the other jobs and are sorted by (created, -priority) so that
+    the current event gets finished first.
+    Input:
+        build_key[str]: The build key of the client
+        config_names[list[str]]: Names of the build configs the client supports
+        client[models.Client]: The client that will run the job
+    Return:
+        QuerySet of models.Job
+    """
+    jobs = (ready_jobs_query(build_key)
+            .filter(config__name__in=config_names)
+            # Jobs that were invalidated to run on a different client
+            .exclude(Q(invalidated=True) & Q(same_client=True) & Q(client__isnull=False) & ~Q(client=client)))
+
+    auto_cancel_q = auto_cancel_push_jobs_q()
+    if auto_cancel_q is None:
+        return jobs.order_by('-recipe__priority', 'created')
+
+    jobs = jobs.annotate(
+            auto_cancel_group=Case(When(auto_cancel_q, then=Value(1)), default=Value(0), output_field=IntegerField()),
+            group_priority=Case(When(auto_cancel_q, then=Value(0)), default=F('recipe__priority'),
+                output_field=IntegerField()),
+            )
+    return jobs.order_by('auto_cancel_group', '-group_priority', 'created', '-recipe__priority')
+
+def claim_next_query_job(jobs):
+    """
+    Grab the first job of the query and mark it as running so that
+    no other client can get it.
+    On databases that support it, the job is locked with
+    SELECT ... FOR UPDATE SKIP LOCKED so that concurrent clients skip
+    over jobs that are currently being claimed.
+    Otherwise (like sqlite, where writes are serialized anyway) we
+    rely on only one conditional update succeeding.
+    Input:
+        jobs[QuerySet]: The result of next_job_query()
+    Return:
+        models.Job that was claimed or None
+    """
+    if connection.features.has_select_for_update_skip_locked:
+        if connection.features.has_select_for_update_of:
+            jobs = jobs.select_for_update(skip_locked=True, of=('self',))
+        else:
+            jobs = jobs.select_for_update(skip_locked=True)
+        # The job is locked so nobody else can claim it
+        candidates = jobs[:1]
+    else:
+        # Only a few tries in case other clients keep getting there first
+        candidates = jobs[:5]
+
+    for job in candidates:
+        claimed = (models.Job.objects
+                .filter(pk=job.pk, status=models.JobStatus.NOT_STARTED)
+                .update(status=models.JobStatus.RUNNING))
+        if claimed:
+            job.status = models.JobStatus.RUNNING
+            return job
+    return None
+
+@csrf_exempt
+@transaction.atomic
+def claim_next_job(request, build_key, client_name):
+    """
+    Called by the client to claim the next job it can run.
+    This replaces getting the list from ready_jobs() and then calling claim_job()
+    on each one until one succeeds.
+    The POST data should have a "configs" entry with a list of the
+    build configs the client supports.
+    If there is no job to run then "success" will be False in the response.
+    """
+    data, response = check_post(request, ['configs'])
+    if response:
+        return response
+
+    client, created = models.Client.objects.get_or_create(name=client_name, ip=get_client_ip(request))
+    if created:
+        logger.debug('New client %s : %s seen' % (client_name, get_client_ip(request)))
+    else:
+        cancel_client_running_jobs(client)
+
+    jobs = (next_job_query(build_key, data['configs'], client)
+            .select_related('config',
+                'recipe',
+                'event__head__branch__repository__user',
+                'event__base__branch__repository__user__server'))
+    job = claim_next_query_job(jobs)
+    if not job:
+        client.status_message = 'Looking for work'
+        client.status = models.Client.IDLE
+        client.save()
+        return json_claim_response(None, None, False, 'No jobs')
+
+    job_info = get_job_info(job, data.get('script_cache', False))
+
+    # The client definitely has the job now
+    job.client = client
+    job.set_status(models.JobStatus.RUNNING)
+
+    client.status = models.Client.RUNNING
+    client.status_message = 'Job {}: {}'.format(job.pk, job)
+    client.save()
+
+    logger.info('Client %s got job %s: %s: on %s' % (client_name, job.pk, job, job.recipe.repository))
+
+    UpdateRemoteStatus.job_started(job)
+    return json_claim_response(job.pk, job.config.name, True, 'Success', job_info)
+
+def get_script(request, build_key, client_name, job_id, sha):
+    """
+    Get the contents of a script used by a job.
+    Clients that claim jobs with "script_cache" only get the SHA of the
+    scripts and use this to get the ones they don't already have.
+    The scripts are the ones from when the job was claimed, even if
+    the recipe repository has changed since.
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+
+    job = get_object_or_404(models.Job.objects.select_related('recipe'),
+            build_key_q(build_key),
+            pk=job_id,
+            client__name=client_name)
+    contents = JobPayload.get_script(job.recipe, settings.RECIPE_BASE_DIR, job.recipe_repo_sha, sha)
+    if contents is None:
+        raise Http404('Script not found')
+    return HttpResponse(contents, content_type='text/plain; charset=utf-8')
+
+@csrf_exempt
+def release_job(request, build_key, client_name, job_id):
+    """
+    Called by a client that claimed a job but can't run it, like when it
+    couldn't get the scripts of the job.
+    The job is put back so that it can be claimed again.
+    The POST data should have a "message" entry with the reason.
+    """
+    data, response = check_post(request, ['message'])
+    if response:
+        return response
+
+    try:
+        client = models.Client.objects.get(name=client_name, ip=get_client_ip(request))
+    except models.Client.DoesNotExist:
+        return HttpResponseBadRequest('Invalid client')
+
+    try:
+        job = models.Job.objects.get(build_key_q(build_key),
+                pk=job_id,
+                client=client,
+                status=models.JobStatus.RUNNING)
+    except models.Job.DoesNotExist:
+        return HttpResponseBadRequest('Invalid job/build_key')
+
+    logger.info('Client %s released job %s: %s: %s' % (client_name, job.pk, job, data['message']))
+    job.set_invalidated("Released by client %s: %s" % (client_name, data['message']), check_ready=True)
+
+    client.status = models.Client.IDLE
+    client.status_message = 'Released job {}: {}'.format(job.pk, job)
+    client.save()
+    return json_finished_response('OK', 'Success')
+
 def json_finished_response(status, msg):
     return JsonResponse({'status': status, 'message': msg})
 
@@ -378,6 +712,50 @@ def json_update_response(status, msg, cmd=None):
     data = {'status': status, 'message': msg, 'command': cmd}
     return JsonResponse(data)
 
+def gzip_decompress(data):
+    return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+def zstd_decompress(data):
+    return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+
+def output_decoders():
+    """
+    The encodings that clients can use for step output.
+    zstd is only available if the zstandard module is installed.
+    Return:
+        OrderedDict: encoding name -> function to decompress bytes, in order of preference
+    """
+    decoders = OrderedDict()
+    if zstandard is not None:
+        decoders['zstd'] = zstd_decompress
+    decoders['gzip'] = gzip_decompress
+    return decoders
+
+def decode_output(data):
+    """
+    Clients can send the step output compressed and base64 encoded.
+    In that case "output_encoding" is set to the compression used.
+    This replaces data["output"] with the decoded output.
+    Input:
+        data[dict]: The step result data posted by the client
+    Return:
+        bool: True if the output is valid
+    """
+    encoding = data.pop('output_encoding', None)
+    if not encoding:
+        return True
+    decoder = output_decoders().get(encoding)
+    if decoder is None:
+        logger.debug('Unknown output encoding %s' % encoding)
+        return False
+    try:
+        output = decoder(base64.b64decode(data['output']))
+        data['output'] = output.decode('utf-8', 'replace')
+        return True
+    except Exception as e:
+        logger.debug('Failed to decode %s output: %s' % (encoding, e))
+        return False
+
 def check_step_result_post(request, build_key, client_name, stepresult_id):
     data, response = check_post(request,
         ['step_num', 'output', 'time', 'complete', 'exit_status'])
@@ -385,6 +763,9 @@ def check_step_result_post(request, build_key, client_name, stepresult_id):
     if response:
         return response, None, None, None
 
+    if not decode_output(data):
+        return HttpResponseBadRequest('Invalid output'), None, None, None
+
     try:
         step_result = (models.StepResult.objects
                 .select_related('job',
@@ -392,6 +773,7 @@ def check_step_result_post(request, build_key, client_name, stepresult_id):
                     'job__event__base__branch__repository',
                     'job__client',
                     'job__event__pull_request')
+                .defer('stored_output', 'output_html')
                 .get(pk=stepresult_id))
     except models.StepResult.DoesNotExist:
         return HttpResponseBadRequest('Invalid stepresult id'), None, None, None
@@ -411,6 +793,19 @@ def start_step_result(request, build_key, client_name, stepresult_id):
     if response:
         return response
 
+    cmd = apply_start_step_result(step_result, data, client)
+    return json_update_response('OK', 'success', cmd)
+
+def apply_start_step_result(step_result, data, client):
+    """
+    Marks the step result as started.
+    Input:
+        step_result[models.StepResult]: The step result that was started
+        data[dict]: The POST data from the client
+        client[models.Client]: The client running the job
+    Return:
+        None or "cancel" if the job got canceled
+    """
     cmd = None
     # could have been canceled in between getting the job and starting the job
     status = models.JobStatus.RUNNING
@@ -427,7 +822,7 @@ def start_step_result(request, build_key, client_name, stepresult_id):
     client.save()
     step_result.job.event.save() # update timestamp
     UpdateRemoteStatus.step_start_pr_status(step_result, step_result.job)
-    return json_update_response('OK', 'success', cmd)
+    return cmd
 
 def save_step_result(step_result):
     try:
@@ -439,9 +834,12 @@ def save_step_result(step_result):
         step_result.output = "Failed to save output:\n%s" % e
         step_result.save()
 
-def step_result_from_data(step_result, data, status):
+def step_result_from_data(step_result, data, status, replace_output=False):
     step_result.seconds = timedelta(seconds=data['time'])
-    step_result.output = step_result.output + data['output']
+    if replace_output:
+        step_result.output = data['output']
+    else:
+        step_result.append_output(data['output'])
     step_result.complete = data['complete']
     step_result.exit_status = int(data['exit_status'])
     step_result.status = status
@@ -453,6 +851,19 @@ def complete_step_result(request, build_key, client_name, stepresult_id):
     if response:
         return response
 
+    cmd = apply_complete_step_result(step_result, data, client)
+    return json_update_response('OK', 'success', cmd)
+
+def apply_complete_step_result(step_result, data, client):
+    """
+    Sets the final status and output of the step result.
+    Input:
+        step_result[models.StepResult]: The step result that was completed
+        data[dict]: The POST data from the client
+        client[models.Client]: The client running the job
+    Return:
+        None
+    """
     status = models.JobStatus.SUCCESS
     if data.get('canceled'):
         status = models.JobStatus.CANCELED
@@ -466,19 +877,16 @@ def complete_step_result(request, build_key, client_name, stepresult_id):
         if step_result.allowed_to_fail:
             status = models.JobStatus.FAILED_OK
 
-    step_result_from_data(step_result, data, status)
+    # When the step is complete the client sends all of the output
+    step_result_from_data(step_result, data, status, replace_output=data['complete'])
 
     step_result.job.seconds = step_result.job.calc_total_time()
     step_result.job.save() # update timestamp
     step_result.job.event.save() # update timestamp
     if data['complete']:
-        step_result.output = data['output']
-        save_step_result(step_result)
-
         client.status_msg = 'Completed {}: {}'.format(step_result.job, step_result.name)
         client.save()
-
-    return json_update_response('OK', 'success')
+    return None
 
 @csrf_exempt
 def update_step_result(request, build_key, client_name, stepresult_id):
@@ -486,6 +894,19 @@ def update_step_result(request, build_key, client_name, stepresult_id):
     if response:
         return response
 
+    cmd = apply_update_step_result(step_result, data, client)
+    return json_update_response('OK', 'success', cmd)
+
+def apply_update_step_result(step_result, data, client):
+    """
+    Adds the output of a running step result.
+    Input:
+        step_result[models.StepResult]: The step result that is running
+        data[dict]: The POST data from the client
+        client[models.Client]: The client running the job
+    Return:
+        None or "cancel" if the job got canceled
+    """
     step_result_from_data(step_result, data, models.JobStatus.RUNNING)
     job = step_result.job
 
@@ -505,6 +926,69 @@ def update_step_result(request, build_key, client_name, stepresult_id):
     job.seconds = job.calc_total_time()
     job.save()
     job.event.save() # update timestamp
+    return cmd
+
+STEP_RESULT_UPDATES = {
+        "start": apply_start_step_result,
+        "update": apply_update_step_result,
+        "complete": apply_complete_step_result,
+        }
+
+@csrf_exempt
+@transaction.atomic
+def update_step_results(request, build_key, client_name, job_id):
+    """
+    Applies an ordered batch of step result updates for a job.
+    Each entry in "updates" is a dict with the keys:
+        stage: One of "start", "update" or "complete"
+        stepresult_id: The step result to update
+        payload: The same data that would be posted to the individual endpoint
+    Either all the updates are valid and they are all applied or none are.
+    """
+    data, response = check_post(request, ['updates'])
+    if response:
+        return response
+
+    try:
+        client = models.Client.objects.get(name=client_name, ip=get_client_ip(request))
+    except models.Client.DoesNotExist:
+        return HttpResponseBadRequest('Invalid client')
+
+    try:
+        job = (models.Job.objects
+                .select_related('event',
+                    'event__base__branch__repository',
+                    'client',
+                    'event__pull_request')
+                .get(pk=job_id, event__build_user__build_key=build_key))
+    except models.Job.DoesNotExist:
+        return HttpResponseBadRequest('Invalid job/build_key')
+
+    if client != job.client:
+        return HttpResponseBadRequest('Same client that started is required')
+
+    step_results = {}
+    for step_result in job.step_results.defer('stored_output', 'output_html'):
+        step_result.job = job
+        step_results[step_result.pk] = step_result
+
+    required = set(['step_num', 'output', 'time', 'complete', 'exit_status'])
+    updates = []
+    for update in data['updates']:
+        try:
+            apply_update = STEP_RESULT_UPDATES[update['stage']]
+            step_result = step_results[update['stepresult_id']]
+            payload = update['payload']
+            if not required.issubset(set(payload.keys())) or not decode_output(payload):
+                raise ValueError()
+        except (KeyError, TypeError, AttributeError, ValueError):
+            logger.debug('Bad step result update.\nRequest: %s' % update)
+            return HttpResponseBadRequest('Bad POST data')
+        updates.append((apply_update, step_result, payload))
+
+    cmd = None
+    for apply_update, step_result, payload in updates:
+        cmd = apply_update(step_result, payload, client) or cmd
 
     return json_update_response('OK', 'success', cmd)
 
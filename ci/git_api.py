@@ -22,8 +22,19 @@ class GitException(Exception):
 import logging
 import json
 import requests
+import threading
+import copy
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from ci import StatusDispatcher
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+try:
+    from urllib.parse import urlparse, urlunparse, parse_qs, urlencode
+except ImportError:
+    from urlparse import urlparse, urlunparse, parse_qs
+    from urllib import urlencode
 logger = logging.getLogger('ci')
 
 def copydoc(fromfunc, sep="\n"):
@@ -39,6 +50,51 @@ def copydoc(fromfunc, sep="\n"):
         return func
     return _decorator
 
+class ResponseCache(object):
+    """
+    A LRU cache of GET responses that had an ETag or Last-Modified header.
+    The cached response is sent back if the server replies with
+    304 Not Modified to a conditional request.
+    """
+    def __init__(self, max_size):
+        self._max_size = max_size
+        self._responses = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            response = self._responses.pop(key, None)
+            if response is not None:
+                self._responses[key] = response
+            return response
+
+    def set(self, key, response):
+        if self._max_size <= 0:
+            return
+        with self._lock:
+            self._responses.pop(key, None)
+            self._responses[key] = response
+            while len(self._responses) > self._max_size:
+                self._responses.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._responses.clear()
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+def get_response_cache():
+    """
+    Return:
+      ResponseCache: The cache shared by all the git servers
+    """
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache(settings.GIT_API_RESPONSE_CACHE_SIZE)
+        return _response_cache
+
 class GitAPI(object):
     __metaclass__ = abc.ABCMeta
     PENDING = 0
@@ -61,6 +117,7 @@ class GitAPI(object):
         self._request_timeout = config.get("request_timeout", 5)
         self._install_webhook = config.get("install_webhook", False)
         self._update_remote = config.get("remote_update", False)
+        self._async_status_update = config.get("async_status_update", False)
         self._remove_pr_labels = config.get("remove_pr_label_prefix", [])
         self._ssl_cert = config.get("ssl_cert", True)
         self._civet_url = config.get("civet_base_url", "")
@@ -104,6 +161,41 @@ class GitAPI(object):
     def errors(self):
         return self._errors
 
+    def _send_status(self, key, send):
+        """
+        Sends a commit status update. If "async_status_update" is set
+        then it is sent by the StatusDispatcher in the background, and
+        replaces any update with the same key that hasn't been sent yet.
+        Input:
+          key[tuple]: What the status is for, typically the status URL and context
+          send[function]: Called with the GitAPI object to use to send the update
+        """
+        if self._async_status_update:
+            api = self._thread_copy()
+            def dispatch():
+                send(api)
+                if api._bad_response:
+                    raise GitException("Failed to send status update for %s" % (key,))
+            StatusDispatcher.submit(key, dispatch)
+        else:
+            send(self)
+
+    def _thread_copy(self):
+        """
+        A copy of this object to be used in another thread.
+        It has its own session and errors so that the threads
+        don't interfere with each other.
+        Return:
+          GitAPI: The copy
+        """
+        api = copy.copy(self)
+        api._errors = []
+        api._bad_response = False
+        api._headers = dict(self._headers)
+        if self._access_user is not None:
+            api._session = self._access_user.start_session()
+        return api
+
     def _response_exception(self, url, method, e, data=None, params=None):
         data_str = ""
         if not data:
@@ -162,15 +254,50 @@ class GitAPI(object):
             requests.Reponse or None if there was a requests exception
         """
         self._bad_response = False
+        cache = get_response_cache()
         try:
             timeout = self._timeout(timeout)
             params = self._params(params, True)
+            key = self._response_cache_key(url, params)
+            cached = cache.get(key)
+            headers = self._headers
+            if cached is not None:
+                headers = dict(self._headers)
+                if cached.headers.get("ETag"):
+                    headers["If-None-Match"] = cached.headers["ETag"]
+                if cached.headers.get("Last-Modified"):
+                    headers["If-Modified-Since"] = cached.headers["Last-Modified"]
             response = self._session.get(url,
-                    params=params, timeout=timeout, headers=self._headers, verify=self._ssl_cert)
+                    params=params, timeout=timeout, headers=headers, verify=self._ssl_cert)
         except Exception as e:
             return self._response_exception(url, "GET", e, params=params)
 
-        return self._check_response(response, params=params, log=log)
+        if cached is not None and response.status_code == 304:
+            return cached
+
+        response = self._check_response(response, params=params, log=log)
+        if not self._bad_response and response.status_code == 200:
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+            if isinstance(etag, str) or isinstance(last_modified, str):
+                cache.set(key, response)
+        return response
+
+    def _response_cache_key(self, url, params):
+        """
+        The key for caching a GET response. Responses depend on who is asking,
+        so this includes the user or token being used.
+        Input:
+            url[str]: URL to get
+            params[dict]: Parameters sent in the request
+        Return:
+            tuple: The key
+        """
+        if self._access_user is not None:
+            who = "user:%s" % self._access_user.pk
+        else:
+            who = "token:%s" % self._token
+        return (who, url, json.dumps(params, sort_keys=True))
 
     def post(self, url, params=None, data=None, timeout=None, log=True):
         """
@@ -285,6 +412,10 @@ class GitAPI(object):
             return None
 
         all_json = response.json()
+        page_urls = self._remaining_page_urls(response)
+        if page_urls:
+            return self._get_pages_concurrently(all_json, page_urls, params, timeout, log)
+
         try:
             while 'next' in response.links:
                 response = self.get(response.links["next"]["url"],
@@ -298,6 +429,72 @@ class GitAPI(object):
                 url, self._format_json(params), e), log)
         return all_json
 
+    def _remaining_page_urls(self, response):
+        """
+        Get the URLs of the rest of the pages using the "last" link on the first page.
+        Input:
+            response[requests.Response]: The response for the first page
+        Return:
+            list[str]: The URLs of pages 2 through the last page, or None if they can't be determined
+        """
+        try:
+            next_url = response.links["next"]["url"]
+            last_url = response.links["last"]["url"]
+            parsed = urlparse(last_url)
+            query = parse_qs(parsed.query)
+            last_page = int(query["page"][0])
+            if int(parse_qs(urlparse(next_url).query)["page"][0]) != 2:
+                return None
+        except Exception:
+            return None
+
+        urls = []
+        for page in range(2, last_page+1):
+            query["page"] = [str(page)]
+            urls.append(urlunparse(parsed._replace(query=urlencode(query, doseq=True))))
+        return urls
+
+    def _get_pages_concurrently(self, all_json, page_urls, params, timeout, log):
+        """
+        Get pages with a pool of GIT_API_PAGE_THREADS threads.
+        Each page uses a copy of this object from _thread_copy() so that
+        they don't share a session or response state. Their errors are
+        added to ours once all the pages are done.
+        Input:
+            all_json[list]: The data of the first page
+            page_urls[list[str]]: URLs of the rest of the pages
+            params[dict]: Parameters to send in each request
+            timeout[int]: Specify a timeout other than the default.
+        Return:
+            list: The data of all the pages, in order, up to the first page that failed
+        """
+        def get_page(url):
+            api = self._thread_copy()
+            response = api.get(url, params=dict(params), timeout=timeout, log=log)
+            if api._bad_response or response is None:
+                return api, None
+            return api, response.json()
+
+        with ThreadPoolExecutor(max_workers=settings.GIT_API_PAGE_THREADS) as pool:
+            results = list(pool.map(get_page, page_urls))
+
+        pages = []
+        for api, page in results:
+            self._errors.extend(api.errors())
+            pages.append(page)
+
+        for url, page in zip(page_urls, pages):
+            if page is None:
+                self._bad_response = True
+                break
+            try:
+                all_json.extend(page)
+            except Exception as e:
+                self._add_error("Error getting multiple pages at %s\nSent data:\n%s\nError: %s" % (
+                    url, self._format_json(params), e), log)
+                break
+        return all_json
+
     @abc.abstractmethod
     def sign_in_url(self):
         """
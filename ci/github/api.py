@@ -164,9 +164,12 @@ class GitHubAPI(GitAPI):
             # decrease the timeout since it is not a big deal if these don't get set
             timeout = 2
 
-        self.post(url, data=data, timeout=timeout)
-        if not self._bad_response:
-            logger.info("Set pr status %s:\nSent Data:\n%s" % (url, self._format_json(data)))
+        def send(api):
+            api.post(url, data=data, timeout=timeout)
+            if not api._bad_response:
+                logger.info("Set pr status %s:\nSent Data:\n%s" % (url, api._format_json(data)))
+
+        self._send_status((url, context), send)
 
     def _remove_pr_todo_labels(self, owner, repo, pr_num):
         """
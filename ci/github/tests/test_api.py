@@ -19,6 +19,7 @@ from django.test import override_settings
 import requests
 from ci.tests import utils
 from ci.git_api import GitException
+from ci import StatusDispatcher
 from mock import patch
 import os, json
 from ci.tests import DBTester
@@ -118,7 +119,7 @@ class Tests(DBTester.DBTester):
         ev.save()
         # no state is set so just run for coverage
         with self.settings(INSTALLED_GITSERVERS=[utils.github_config(remote_update=True)]):
-            mock_post.return_value = utils.Response(status_code=404)
+            mock_post.return_value = utils.Response(status_code=404, do_raise=True)
             api = self.server.api()
             api.update_pr_status(ev.base,
                     ev.head, api.PENDING, 'event', 'desc', 'context', api.STATUS_JOB_STARTED)
@@ -150,6 +151,34 @@ class Tests(DBTester.DBTester):
         self.assertEqual(mock_post.call_count, 0)
         self.assertEqual(api.errors(), [])
 
+    @patch.object(requests, 'post')
+    def test_update_pr_status_async(self, mock_post):
+        ev = utils.create_event(user=self.build_user)
+        config = utils.github_config(remote_update=True)
+        config["async_status_update"] = True
+        mock_post.return_value = utils.Response()
+        dispatcher = StatusDispatcher.StatusDispatcher(1, StatusDispatcher.TokenBucket(1000, 1000))
+        with self.settings(INSTALLED_GITSERVERS=[config]):
+            with patch.object(StatusDispatcher, "get_dispatcher") as mock_dispatcher:
+                mock_dispatcher.return_value = dispatcher
+                api = self.server.api()
+                api.update_pr_status(ev.base,
+                        ev.head, api.PENDING, 'event', 'desc', 'context', api.STATUS_JOB_STARTED)
+                self.assertTrue(dispatcher.flush(5))
+                self.assertEqual(mock_post.call_count, 1)
+                self.assertEqual(mock_post.call_args[1]["json"]["state"], "pending")
+                self.assertEqual(dispatcher.take_failures(), [])
+
+                # Sent with a copy of the API so the errors are kept separate
+                mock_post.return_value = utils.Response(status_code=404, do_raise=True)
+                api.update_pr_status(ev.base,
+                        ev.head, api.PENDING, 'event', 'desc', 'context', api.STATUS_JOB_STARTED)
+                self.assertTrue(dispatcher.flush(5))
+                self.assertEqual(mock_post.call_count, 2)
+                self.assertEqual(api.errors(), [])
+                self.assertFalse(api._bad_response)
+                self.assertEqual(len(dispatcher.take_failures()), 1)
+
     @patch.object(requests, 'get')
     def test_is_collaborator(self, mock_get):
         # user is repo owner
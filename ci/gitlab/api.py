@@ -216,12 +216,16 @@ class GitLabAPI(GitAPI):
         url = "%s/statuses/%s?state=%s" % (self._repo_url(path_with_namespace),
                                            head.sha,
                                            self._status_str(state))
-        response = self.post(url, data=data)
-        if not self._bad_response and response.status_code not in [200, 201, 202]:
-            logger.warning("Error setting pr status %s\nSent data:\n%s\nReply:\n%s" % \
-                    (url, self._format_json(data), self._format_json(response.json())))
-        elif not self._bad_response:
-            logger.info("Set pr status %s:\nSent Data:\n%s" % (url, self._format_json(data)))
+        def send(api):
+            response = api.post(url, data=data)
+            if not api._bad_response and response.status_code not in [200, 201, 202]:
+                logger.warning("Error setting pr status %s\nSent data:\n%s\nReply:\n%s" % \
+                        (url, api._format_json(data), api._format_json(response.json())))
+            elif not api._bad_response:
+                logger.info("Set pr status %s:\nSent Data:\n%s" % (url, api._format_json(data)))
+
+        key = ("%s/statuses/%s" % (self._repo_url(path_with_namespace), head.sha), context)
+        self._send_status(key, send)
 
     def _is_group_member(self, group_id, username):
         """
@@ -0,0 +1,46 @@
+
+# Copyright 2016 Battelle Energy Alliance, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import unicode_literals, absolute_import
+from django.core.management.base import BaseCommand
+from ci.client import Benchmark
+import json
+
+class Command(BaseCommand):
+    help = 'Benchmark the client API (ready_jobs, claim_job, step results, job_finished) on synthetic jobs.' \
+            ' All the data created is rolled back at the end.'
+    def add_arguments(self, parser):
+        parser.add_argument('--repos', type=int, default=5, help="Number of repositories")
+        parser.add_argument('--events', type=int, default=20, help="Total number of events")
+        parser.add_argument('--jobs', type=int, default=5, help="Number of jobs in each event")
+        parser.add_argument('--steps', type=int, default=4, help="Number of steps in each job")
+        parser.add_argument('--updates', type=int, default=3, help="Number of output updates for each step")
+        parser.add_argument('--output-size', type=int, default=1024, help="Bytes of output in each update")
+        parser.add_argument('--max-jobs', type=int, help="Stop after running this many jobs")
+        parser.add_argument('--json', default=False, action='store_true',
+                help="Write the results as JSON so they can be compared between runs")
+
+    def handle(self, *args, **options):
+        results = Benchmark.run(num_repos=options["repos"],
+                num_events=options["events"],
+                num_recipes=options["jobs"],
+                num_steps=options["steps"],
+                num_updates=options["updates"],
+                output_size=options["output_size"],
+                max_jobs=options["max_jobs"])
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2, sort_keys=True))
+        else:
+            self.stdout.write(Benchmark.format_results(results))
@@ -0,0 +1,37 @@
+
+# Copyright 2016 Battelle Energy Alliance, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import unicode_literals, absolute_import
+from django.core.management.base import BaseCommand
+from ci.client import Benchmark
+
+class Command(BaseCommand):
+    help = 'Create synthetic jobs for client/load_generator.py to run.' \
+            ' All the events are pushes so nothing is sent to a git server.'
+    def add_arguments(self, parser):
+        parser.add_argument('--repos', type=int, default=5, help="Number of repositories")
+        parser.add_argument('--events', type=int, default=100, help="Total number of events")
+        parser.add_argument('--jobs', type=int, default=5, help="Number of jobs in each event")
+        parser.add_argument('--steps', type=int, default=4, help="Number of steps in each job")
+
+    def handle(self, *args, **options):
+        build_user = Benchmark.create_data(options["repos"],
+                options["events"],
+                options["jobs"],
+                options["steps"],
+                pull_requests=False)
+        self.stdout.write("Created %s events with %s jobs each" % (options["events"], options["jobs"]))
+        self.stdout.write("Run them with: client/load_generator.py --url <server URL> --build-key %s --configs %s"
+                % (build_user.build_key, Benchmark.BUILD_CONFIG))
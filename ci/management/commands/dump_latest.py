@@ -71,6 +71,8 @@ class Command(BaseCommand):
             for tmp in j.recipe.steps.all():
                 self.add_query(tmp.step_environment, collected)
             self.add_query(j.step_results, collected)
+            for tmp in j.step_results.all():
+                self.add_query(tmp.output_chunks, collected)
 
     def handle(self, *args, **options):
         num_events = options.get('num')
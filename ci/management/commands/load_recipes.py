@@ -23,7 +23,7 @@ import traceback
 class Command(BaseCommand):
     help = 'Load recipes from RECIPE_BASE_DIR into the DB'
     def add_arguments(self, parser):
-        parser.add_argument('--force', default=False, action='store_true', help='Force reloading the recipes'),
+        parser.add_argument('--force', default=False, action='store_true', help='Force reloading all the recipes, not just the ones changed since the last load'),
         parser.add_argument('--dryrun', default=False, action='store_true', help='Just show what recipes would have changed'),
         parser.add_argument('--recipes', default=settings.RECIPE_BASE_DIR, dest='recipes', help='Recipes directory'),
         parser.add_argument('--install-webhooks', default=False, action='store_true', help='Try to install webhooks'),
@@ -0,0 +1,44 @@
+
+# Copyright 2016 Battelle Energy Alliance, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import unicode_literals, absolute_import
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from ci import TaskQueue
+import time
+
+class Command(BaseCommand):
+    help = 'Run the tasks that have been queued, like updating the Git server after a job finishes.'
+    def add_arguments(self, parser):
+        parser.add_argument('--once', default=False, action='store_true',
+                help="Run the tasks that are ready then exit instead of waiting for more")
+        parser.add_argument('--poll', type=float, default=1,
+                help="Seconds to wait between checking for new tasks")
+        parser.add_argument('--remove-days', type=int, default=7,
+                help="Remove finished tasks older than this many days")
+
+    def handle(self, *args, **options):
+        removed = TaskQueue.remove_finished(options["remove_days"])
+        if removed:
+            self.stdout.write("Removed %s old tasks" % removed)
+
+        while True:
+            count = TaskQueue.run_pending()
+            if count:
+                self.stdout.write("Ran %s tasks" % count)
+            if options["once"]:
+                break
+            close_old_connections()
+            time.sleep(options["poll"])
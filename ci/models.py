@@ -14,7 +14,7 @@
 # limitations under the License.
 
 from __future__ import unicode_literals, absolute_import
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 from django.urls import reverse
 from django.utils.encoding import python_2_unicode_compatible
@@ -27,11 +27,14 @@ from ci.github import oauth as github_auth
 import random, re
 from django.utils import timezone
 from datetime import timedelta, datetime
-from ci import TimeUtils
+from ci import TimeUtils, ReadyJobsNotifier
 import json
 import ansi2html
 import logging
-from django.db.models import Sum
+from django.db.models import Sum, Max
+from django.db.models.functions import Length
+from django.db.models.signals import post_delete, m2m_changed
+from django.dispatch import receiver
 logger = logging.getLogger('ci')
 
 class DBException(Exception):
@@ -326,6 +329,12 @@ class PullRequest(models.Model):
     def status_slug(self):
         return JobStatus.to_slug(self.status)
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super(PullRequest, self).save(*args, **kwargs)
+        if not adding:
+            EventSnapshot.mark_stale(event__pull_request=self)
+
     def set_status_from_event(self, ev):
         latest_event = Event.objects.filter(pull_request=self).order_by('-created').first()
         if latest_event != ev:
@@ -381,6 +390,12 @@ class Event(models.Model):
         get_latest_by = 'last_modified'
         unique_together = ['build_user', 'head', 'base', 'duplicates']
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super(Event, self).save(*args, **kwargs)
+        if not adding:
+            EventSnapshot.mark_stale(event=self)
+
     def cause_str(self):
         if self.PUSH == self.cause:
             return 'Push {}'.format(self.base.branch.name)
@@ -414,47 +429,46 @@ class Event(models.Model):
         data = json.loads(self.json_data)
         return data
 
-    def get_job_depends_on(self):
+    def get_job_graph(self):
+        """
+        Get the dependency graph of the jobs attached to this event.
+        If the jobs have already been prefetched they will be used,
+        otherwise they are loaded in a single query.
+        The graph holds the current job statuses so it can be passed
+        to the functions below to avoid rebuilding it, as long as
+        the jobs haven't changed in between.
+        Return:
+          JobDependencyGraph
+        """
+        if 'jobs' in getattr(self, '_prefetched_objects_cache', {}):
+            jobs = self.jobs.all()
+        else:
+            jobs = self.jobs.select_related('recipe', 'config').prefetch_related('recipe__depends_on')
+        return JobDependencyGraph(jobs)
+
+    def get_job_depends_on(self, graph=None):
         """
         For each job attached to this event, get a list of dependencies.
+        Input:
+          graph[JobDependencyGraph]: Graph to use instead of building a new one
         Return:
           dict: jobs are keys with a list of jobs as values
         """
-        depends_on = {}
-        all_jobs = [j for j in self.jobs.all()]
-        for j in all_jobs:
-            deps = []
-            for r in j.recipe.depends_on.all():
-                for j2 in all_jobs:
-                    if j2 != j and j2.recipe.filename == r.filename:
-                        deps.append(j2)
-            depends_on[j] = deps
-        return depends_on
-
-    def get_unrunnable_jobs(self):
+        if graph is None:
+            graph = self.get_job_graph()
+        return graph.depends_on
+
+    def get_unrunnable_jobs(self, graph=None):
         """
         Get a list of jobs that won't run due to failed dependencies.
+        Input:
+          graph[JobDependencyGraph]: Graph to use instead of building a new one
         Return:
           list[Job]: jobs that won't run
         """
-        wont_run = []
-        depends = self.get_job_depends_on()
-        # We want to check the whole dependecy chain.
-        # So if we have j0 -> j1 -> j2 and j0 fails
-        # we want the list to have j1 and j2.
-        while True:
-            added = False
-            for job, deps in depends.items():
-                if job in wont_run:
-                    continue
-                for d in deps:
-                    if (d in wont_run or
-                            (d.complete and d.status in [JobStatus.FAILED, JobStatus.CANCELED])):
-                        wont_run.append(job)
-                        added = True
-            if not added:
-                break
-        return wont_run
+        if graph is None:
+            graph = self.get_job_graph()
+        return graph.unrunnable_jobs()
 
     @staticmethod
     def sorted_jobs(jobs):
@@ -466,59 +480,44 @@ class Event(models.Model):
         jobs = sorted(jobs, key=lambda obj: obj.recipe.priority, reverse=True)
         return jobs
 
-    def get_sorted_jobs(self):
+    def get_sorted_jobs(self, graph=None):
         """
         Get a list of job groups based on dependencies.
         These will be sorted by priority, then name
+        Input:
+          graph[JobDependencyGraph]: Graph to use instead of building a new one
         Return:
           list: Each entry is a list of sorted jobs
         """
-        job_depends = self.get_job_depends_on()
-        added_jobs = set()
-        other = []
-        job_groups = []
-
-        other = list(job_depends.keys())
-        while other:
-            new_other = []
-            new_group = []
-            for job in other:
-                deps = set(job_depends.get(job, []))
-                if deps.issubset(added_jobs):
-                    new_group.append(job)
-                else:
-                    new_other.append(job)
-            if not new_group:
-                """
-                If we haven't made any progress just stop.
-                """
-                new_group.extend(other)
-                other = []
-            else:
-                other = new_other
-            added_jobs |= set(new_group)
-            job_groups.append(self.sorted_jobs(new_group))
-
-        return job_groups
-
-    def check_done(self):
+        if graph is None:
+            graph = self.get_job_graph()
+        return [self.sorted_jobs(group) for group in graph.job_groups()]
+
+    def check_done(self, graph=None):
         """
         Check to see if the event is done running jobs
+        Input:
+          graph[JobDependencyGraph]: Graph to use instead of building a new one
         """
-        unrunnable_jobs = self.get_unrunnable_jobs()
-        for j in self.jobs.all():
-            if not j.complete and j not in unrunnable_jobs:
+        if graph is None:
+            graph = self.get_job_graph()
+        for j in graph.jobs:
+            if not j.complete and not graph.is_unrunnable(j):
                 return False
         return True
 
-    def set_complete_if_done(self):
+    def set_complete_if_done(self, graph=None):
         """
         If all the jobs are done, set the
         event to complete and update the status
+        Input:
+          graph[JobDependencyGraph]: Graph to use instead of building a new one
         """
-        ret = self.check_done()
+        if graph is None:
+            graph = self.get_job_graph()
+        ret = self.check_done(graph)
         if ret:
-            self.set_complete()
+            self.set_complete(graph)
         return ret
 
     def status_from_jobs(self):
@@ -551,17 +550,20 @@ class Event(models.Model):
             self.base.branch.status = self.status
             self.base.branch.save()
 
-    def set_complete(self):
+    def set_complete(self, graph=None):
         """
         Set the event to complete
         and update the status along
         with associated branch of pull request
+        Input:
+          graph[JobDependencyGraph]: Graph to use instead of building a new one
         """
+        if graph is None:
+            graph = self.get_job_graph()
         self.complete = True
         status = set()
-        unrunnable_jobs = self.get_unrunnable_jobs()
-        for j in self.jobs.all():
-            if j.complete and j not in unrunnable_jobs:
+        for j in graph.jobs:
+            if j.complete and not graph.is_unrunnable(j):
                 status.add(j.status)
         self.set_status(complete_status(status))
 
@@ -572,19 +574,19 @@ class Event(models.Model):
         Jobs are checked to see if dependencies are met and
         if so, then they are marked as ready.
         """
-
-        if self.check_done():
+        graph = self.get_job_graph()
+        if self.check_done(graph):
             self.complete = True
             self.save()
             logger.info('Event {}: {} complete'.format(self.pk, self))
             return
 
-        job_depends = self.get_job_depends_on()
-        for job, deps in job_depends.items():
+        build_user_ids = set()
+        for job in graph.jobs:
             if job.complete or job.ready or not job.active:
                 continue
             ready = True
-            for d in deps:
+            for d in graph.depends_on[job]:
                 if not d.complete or d.status not in [JobStatus.FAILED_OK, JobStatus.SUCCESS, JobStatus.INTERMITTENT_FAILURE]:
                     logger.info('job {}: {} does not have depends met: {}'.format(job.pk, job, d))
                     ready = False
@@ -595,6 +597,12 @@ class Event(models.Model):
                 job.save()
                 logger.info('{}: {}: {} : ready: {} : on {}'.format(job.event,
                     job.pk, job, job.ready, job.recipe.repository))
+                build_user_ids.add(job.recipe.client_runner_user_id or job.recipe.build_user_id)
+
+        if build_user_ids:
+            # Wake up any clients waiting on these jobs
+            build_keys = GitUser.objects.filter(pk__in=build_user_ids).values_list('build_key', flat=True)
+            ReadyJobsNotifier.notify_on_commit(build_keys)
 
     def auto_cancel_event_except_current(self):
         return self.base.branch.get_branch_setting("auto_cancel_push_events_except_current", False)
@@ -602,7 +610,139 @@ class Event(models.Model):
     def auto_uncancel_previous_event(self):
         return self.base.branch.get_branch_setting("auto_uncancel_previous_event", False)
 
+class JobDependencyGraph(object):
+    """
+    The dependencies between the jobs of an event.
+    Dependencies are found by looking up the filenames of the
+    depends_on recipes in an index of the jobs, so building
+    the graph and everything computed from it is linear in the
+    number of jobs and dependencies.
+    The job statuses are not reloaded, so a graph should only be
+    used while the jobs aren't changing, like within a single request.
+    """
+    def __init__(self, jobs):
+        """
+        Input:
+          jobs[list[Job]]: Jobs of an event, preferably with recipe, config and recipe__depends_on loaded
+        """
+        self.jobs = list(jobs)
+        by_filename = {}
+        for job in self.jobs:
+            by_filename.setdefault(job.recipe.filename, []).append(job)
+
+        self.depends_on = {}
+        self.dependents = {job: [] for job in self.jobs}
+        for job in self.jobs:
+            deps = []
+            seen = set([job])
+            for recipe in job.recipe.depends_on.all():
+                for dep in by_filename.get(recipe.filename, []):
+                    if dep not in seen:
+                        seen.add(dep)
+                        deps.append(dep)
+                        self.dependents[dep].append(job)
+            self.depends_on[job] = deps
+
+        self._unrunnable = None
+        self._groups = None
+
+    def unrunnable_jobs(self):
+        """
+        Get the jobs that won't run due to failed dependencies.
+        This includes the whole dependency chain, so if we have
+        j0 -> j1 -> j2 and j0 fails then both j1 and j2 won't run.
+        Return:
+          list[Job]: jobs that won't run
+        """
+        if self._unrunnable is None:
+            wont_run = set()
+            pending = []
+            for job in self.jobs:
+                for dep in self.depends_on[job]:
+                    if dep.complete and dep.status in [JobStatus.FAILED, JobStatus.CANCELED]:
+                        wont_run.add(job)
+                        pending.append(job)
+                        break
+            while pending:
+                for job in self.dependents[pending.pop()]:
+                    if job not in wont_run:
+                        wont_run.add(job)
+                        pending.append(job)
+            self._unrunnable = wont_run
+        return [job for job in self.jobs if job in self._unrunnable]
+
+    def is_unrunnable(self, job):
+        """
+        Return:
+          bool: Whether the job won't run due to failed dependencies
+        """
+        if self._unrunnable is None:
+            self.unrunnable_jobs()
+        return job in self._unrunnable
+
+    def job_groups(self):
+        """
+        Groups the jobs in topological order. The first group has
+        the jobs without dependencies and each following group has the
+        jobs whose dependencies are all in previous groups.
+        Any jobs that are part of (or depend on) a circular dependency
+        are put into a final group.
+        Return:
+          list[list[Job]]: The groups of jobs
+        """
+        if self._groups is None:
+            remaining = {job: len(deps) for job, deps in self.depends_on.items()}
+            group = [job for job in self.jobs if remaining[job] == 0]
+            groups = []
+            num_placed = 0
+            while group:
+                groups.append(group)
+                num_placed += len(group)
+                next_group = []
+                for job in group:
+                    for dependent in self.dependents[job]:
+                        remaining[dependent] -= 1
+                        if remaining[dependent] == 0:
+                            next_group.append(dependent)
+                group = next_group
+
+            if num_placed < len(self.jobs):
+                groups.append([job for job in self.jobs if remaining[job] > 0])
+            self._groups = groups
+        return self._groups
+
 @python_2_unicode_compatible
+class EventSnapshot(models.Model):
+    """
+    The precomputed display information of an event and its jobs,
+    as shown on the dashboard and the events tables.
+    It is marked as stale whenever the event, its pull request or
+    one of its jobs is saved, a job is deleted, or a recipe or its
+    build configs or dependencies change. It gets rebuilt the next time
+    it is needed.
+    The version is bumped on every change so that a rebuild that raced with
+    a change doesn't mark the snapshot as up to date.
+    """
+    event = models.OneToOneField(Event, related_name='snapshot', on_delete=models.CASCADE)
+    info = models.TextField(blank=True) # JSON of the event info
+    stale = models.BooleanField(default=True)
+    version = models.IntegerField(default=0)
+    last_modified = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return "Snapshot of event %s" % self.event_id
+
+    @classmethod
+    def mark_stale(cls, **filters):
+        """
+        Input:
+          filters: Passed to filter() to select the snapshots to mark
+        """
+        cls.objects.filter(**filters).update(stale=True, version=models.F("version") + 1)
+
+    def get_info(self):
+        return json.loads(self.info)
+
 class BuildConfig(models.Model):
     """
     Different names for build configurations.
@@ -710,6 +850,13 @@ class Recipe(models.Model):
     class Meta:
         get_latest_by = 'last_modified'
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super(Recipe, self).save(*args, **kwargs)
+        if not adding:
+            # The display name is part of the job descriptions
+            EventSnapshot.mark_stale(event__jobs__recipe=self)
+
     def cause_str(self):
         if self.CAUSE_PUSH == self.cause:
             return 'Push {}'.format(self.branch.name)
@@ -909,6 +1056,10 @@ class Job(models.Model):
     def __str__(self):
         return '{}:{}'.format(self.recipe.name, self.config.name)
 
+    def save(self, *args, **kwargs):
+        super(Job, self).save(*args, **kwargs)
+        EventSnapshot.mark_stale(event=self.event_id)
+
     def str_with_client(self):
         if self.client:
             return "%s on %s" % (self, self.client)
@@ -941,7 +1092,7 @@ class Job(models.Model):
     def total_output_size(self):
         total = 0
         for result in self.step_results.all():
-            total += len(result.output)
+            total += result.output_length()
         return humanize_bytes(total)
 
     def unique_name(self):
@@ -1040,6 +1191,40 @@ class Job(models.Model):
                 rec.save()
                 break
 
+@receiver(post_delete, sender=Job)
+def job_deleted(sender, instance, **kwargs):
+    """
+    Deleting a job removes it from the snapshot of its event.
+    """
+    EventSnapshot.mark_stale(event=instance.event_id)
+
+@receiver(m2m_changed, sender=Recipe.build_configs.through)
+def recipe_build_configs_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    The build configs of a recipe are part of the job descriptions.
+    """
+    if action == "pre_clear" and reverse:
+        # pk_set isn't available when clearing from the build config side
+        EventSnapshot.mark_stale(event__jobs__recipe__build_configs=instance)
+    elif action in ("post_add", "post_remove", "post_clear"):
+        if reverse:
+            EventSnapshot.mark_stale(event__jobs__recipe__in=pk_set or [])
+        else:
+            EventSnapshot.mark_stale(event__jobs__recipe=instance)
+
+@receiver(m2m_changed, sender=Recipe.depends_on.through)
+def recipe_depends_on_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    The dependencies of a recipe determine the job groups.
+    """
+    if action == "pre_clear" and reverse:
+        EventSnapshot.mark_stale(event__jobs__recipe__depends_on=instance)
+    elif action in ("post_add", "post_remove", "post_clear"):
+        if reverse:
+            EventSnapshot.mark_stale(event__jobs__recipe__in=pk_set or [])
+        else:
+            EventSnapshot.mark_stale(event__jobs__recipe=instance)
+
 @python_2_unicode_compatible
 class JobTestStatistics(models.Model):
     """
@@ -1073,6 +1258,54 @@ class JobChangeLog(models.Model):
         ordering = ['-created',]
 
 def terminalize_output(output):
+    """
+    Converts terminal output to HTML.
+    Input:
+      output[str]: The terminal output
+    Return:
+      str: The HTML
+    """
+    return terminalize_output_chunk(output, "", hold_incomplete=False)[0]
+
+# Matches SGR (color, bold, etc) escape sequences
+ANSI_SGR_RE = re.compile(r"\x1b\[([0-9;]*)m")
+# Matches an escape sequence that has been cut off at the end of the output
+ANSI_INCOMPLETE_RE = re.compile(r"\x1b(\[[0-9;]*)?$")
+# The maximum number of SGR sequences kept in the render state
+MAX_RENDER_STATE_CODES = 10
+
+def terminalize_output_chunk(output, state, hold_incomplete=True):
+    """
+    Converts a piece of terminal output to HTML, continuing from the
+    end of the previous piece.
+    The state is the escape sequences needed to get the terminal back
+    to the same colors as at the end of the previous piece, followed by
+    any escape sequence that was cut off at the end of it.
+    Input:
+      output[str]: The new terminal output
+      state[str]: The state returned for the previous piece, "" if this is the start of the output
+      hold_incomplete[bool]: Whether to hold back an escape sequence that is cut off at the end
+    Return:
+      (str, str): The HTML of the new output, the state at the end of it
+    """
+    output = state + output
+    held = ""
+    if hold_incomplete:
+        match = ANSI_INCOMPLETE_RE.search(output)
+        if match:
+            held = match.group(0)
+            output = output[:match.start()]
+
+    codes = []
+    for match in ANSI_SGR_RE.finditer(output):
+        params = match.group(1).split(";")
+        if params[0] in ("", "0"):
+            codes = []
+            params = params[1:]
+        if params:
+            codes.append("\x1b[%sm" % ";".join(params))
+    new_state = "".join(codes[-MAX_RENDER_STATE_CODES:]) + held
+
     # Replace "<,&,>" signs
     output = output.replace("&", "&amp;")
     output = output.replace("<", "&lt;")
@@ -1085,7 +1318,42 @@ def terminalize_output(output):
        closing tag. Just ignore it in that case.
     '''
     conv = ansi2html.Ansi2HTMLConverter(escaped=False, scheme="xterm")
-    return conv.convert(output, full=False)
+    return conv.convert(output, full=False), new_state
+
+# Matches the summary line of the test harness, like "123 passed, 4 skipped, 0 pending, 1 failed",
+# where the numbers are highlighted with escape sequences.
+TEST_STATS_RE = re.compile(r"\x1b\[[0-9;]*m(?P<passed>\d+) passed\x1b\[[0-9;]*m.*, "
+        r".*\x1b\[[0-9;]*m(?P<skipped>\d+) skipped\x1b\[[0-9;]*m.*, "
+        r".*\x1b\[[0-9;]*m(?P<failed>\d+) failed", flags=re.IGNORECASE)
+# The maximum length of an incomplete line kept in the test stats state
+MAX_TEST_STATS_STATE = 4096
+
+def count_test_stats(output, state, final=False):
+    """
+    Counts the tests in a piece of output, continuing from the end
+    of the previous piece.
+    The state is the last line of the previous piece if it didn't end with a newline.
+    Input:
+      output[str]: The new output
+      state[str]: The state returned for the previous piece, "" if this is the start of the output
+      final[bool]: Whether this is the end of the output so the last line is complete
+    Return:
+      (int, int, int, str): Number passed, skipped, failed and the state at the end of the output
+    """
+    output = state + output
+    if final:
+        new_state = ""
+    else:
+        end = output.rfind("\n") + 1
+        output, new_state = output[:end], output[end:]
+    passed = 0
+    skipped = 0
+    failed = 0
+    for match in TEST_STATS_RE.finditer(output):
+        passed += int(match.group("passed"))
+        skipped += int(match.group("skipped"))
+        failed += int(match.group("failed"))
+    return passed, skipped, failed, new_state[-MAX_TEST_STATS_STATE:]
 
 @python_2_unicode_compatible
 class StepResult(models.Model):
@@ -1108,10 +1376,32 @@ class StepResult(models.Model):
     exit_status = models.IntegerField(default=0) # return value of the script
     status = models.IntegerField(choices=JobStatus.STATUS_CHOICES, default=JobStatus.NOT_STARTED)
     complete = models.BooleanField(default=False)
-    output = models.TextField(blank=True) # output of the step
+    # Output of the step, not including any StepResultChunk records.
+    # Use the "output" property to get the full output.
+    stored_output = models.TextField(blank=True, db_column='output')
+    # stored_output converted to HTML
+    output_html = models.TextField(blank=True)
+    # The terminal state at the end of the output so that appended output
+    # can be converted to HTML. See terminalize_output_chunk().
+    # None if the HTML hasn't been rendered.
+    render_state = models.TextField(null=True, blank=True)
+    # Test counts found in the output. See count_test_stats()
+    tests_passed = models.IntegerField(default=0)
+    tests_skipped = models.IntegerField(default=0)
+    tests_failed = models.IntegerField(default=0)
+    # The incomplete last line of the output for counting tests.
+    # None if the output hasn't been counted.
+    test_stats_state = models.TextField(null=True, blank=True)
     seconds = models.DurationField(default=timedelta) #run time
     last_modified = models.DateTimeField(auto_now=True)
 
+    # The full output, assembled on first access
+    _output = None
+    # Output added with append_output() that will be written on save()
+    _pending_output = ""
+    # Whether the output was set and any existing chunks need to be removed on save()
+    _replace_output = False
+
     def __str__(self):
         return '{}:{}'.format(self.job, self.name)
 
@@ -1119,14 +1409,149 @@ class StepResult(models.Model):
         unique_together = ['job', 'position']
         ordering = ['position',]
 
+    @property
+    def output(self):
+        """
+        The full output of the step. This is the stored output
+        followed by all the chunks that have been appended.
+        """
+        if self._output is None:
+            output = self.stored_output
+            if self.pk is not None and not self._replace_output:
+                output += "".join(self.output_chunks.values_list('output', flat=True))
+            self._output = output + self._pending_output
+        return self._output
+
+    @output.setter
+    def output(self, value):
+        """
+        Replaces all of the output of the step.
+        Any existing chunks will be removed on save()
+        """
+        self.stored_output = value
+        self._output = value
+        self._pending_output = ""
+        self._replace_output = True
+
+    def append_output(self, output):
+        """
+        Adds to the output of the step.
+        The new output is written as a single StepResultChunk on save()
+        so that the existing output doesn't need to be read or rewritten.
+        Input:
+          output[str]: The output to add
+        """
+        if not output:
+            return
+        if self._output is not None:
+            self._output += output
+        self._pending_output += output
+
+    def process_stored_output(self):
+        """
+        Renders the HTML of the stored output and counts its tests.
+        """
+        self.output_html, self.render_state = terminalize_output_chunk(self.stored_output, "")
+        passed, skipped, failed, self.test_stats_state = count_test_stats(self.stored_output, "")
+        self.tests_passed = passed
+        self.tests_skipped = skipped
+        self.tests_failed = failed
+
+    def keep_processed_output(self):
+        """
+        When the output is replaced, it is normally with the same output that was
+        already stored and appended. In that case the HTML and test counts are still
+        valid and don't need to be redone.
+        Return:
+          bool: True if the HTML and test counts are still valid and have been set
+        """
+        fields = ["stored_output", "output_html", "render_state",
+                "tests_passed", "tests_skipped", "tests_failed", "test_stats_state"]
+        prev = StepResult.objects.filter(pk=self.pk).values(*fields).first()
+        if prev is None or prev["render_state"] is None or prev["test_stats_state"] is None:
+            return False
+        chunks = list(self.output_chunks.values_list("output", "html"))
+        if prev["stored_output"] + "".join([c[0] for c in chunks]) != self.stored_output:
+            return False
+        self.output_html = prev["output_html"] + "".join([c[1] for c in chunks])
+        self.render_state = prev["render_state"]
+        self.tests_passed = prev["tests_passed"]
+        self.tests_skipped = prev["tests_skipped"]
+        self.tests_failed = prev["tests_failed"]
+        self.test_stats_state = prev["test_stats_state"]
+        return True
+
+    def save(self, *args, **kwargs):
+        if self.pk is None or (self._replace_output and not self.keep_processed_output()):
+            self.process_stored_output()
+        if self._replace_output and self.pk is not None:
+            self.output_chunks.all().delete()
+
+        pending = self._pending_output
+        html = ""
+        if pending and self.render_state is not None:
+            html, self.render_state = terminalize_output_chunk(pending, self.render_state)
+        if pending and self.test_stats_state is not None:
+            passed, skipped, failed, self.test_stats_state = count_test_stats(pending, self.test_stats_state)
+            self.tests_passed += passed
+            self.tests_skipped += skipped
+            self.tests_failed += failed
+
+        with transaction.atomic():
+            if pending and self.pk is not None:
+                # Lock the step so that concurrent appends get different sequence numbers
+                list(StepResult.objects.select_for_update().filter(pk=self.pk).values_list("pk", flat=True))
+            super(StepResult, self).save(*args, **kwargs)
+            self._replace_output = False
+            if pending:
+                self._pending_output = ""
+                last = self.output_chunks.aggregate(Max("sequence"))["sequence__max"]
+                StepResultChunk.objects.create(step_result=self,
+                        sequence=0 if last is None else last + 1,
+                        output=pending,
+                        html=html)
+
+    def refresh_from_db(self, *args, **kwargs):
+        super(StepResult, self).refresh_from_db(*args, **kwargs)
+        self._output = None
+        self._pending_output = ""
+        self._replace_output = False
+
     def status_slug(self):
         return JobStatus.to_slug(self.status)
 
+    def output_length(self):
+        """
+        Return:
+          int: The number of characters in the output, without loading the chunks
+        """
+        if self._output is not None:
+            return len(self._output)
+        length = len(self.stored_output) + len(self._pending_output)
+        if self.pk is not None and not self._replace_output:
+            chunks = self.output_chunks.aggregate(length=Sum(Length('output')))['length']
+            length += chunks or 0
+        return length
+
     def clean_output(self):
         # If the output is over 2Mb then just return a too big message.
-        if len(self.output) > (1024*1024*2):
+        if self.output_length() > (1024*1024*2):
             return "Output too large. You will need to download the results to see this."
-        return terminalize_output(self.output)
+        if self.render_state is None or self._replace_output or self._pending_output:
+            # Not rendered yet
+            return terminalize_output(self.output)
+        return self.output_html + "".join(self.output_chunks.values_list('html', flat=True))
+
+    def test_stats(self):
+        """
+        Return:
+          (int, int, int): The number of tests passed, skipped and failed in the output
+        """
+        if self.test_stats_state is None or self._replace_output or self._pending_output:
+            # Not counted yet
+            return count_test_stats(self.output, "", final=True)[:3]
+        passed, skipped, failed, state = count_test_stats(self.test_stats_state, "", final=True)
+        return self.tests_passed + passed, self.tests_skipped + skipped, self.tests_failed + failed
 
     def plain_output(self):
         prefix = re.escape("\33[")
@@ -1135,7 +1560,27 @@ class StepResult(models.Model):
         return new_out
 
     def output_size(self):
-        return humanize_bytes(len(self.output))
+        return humanize_bytes(self.output_length())
+
+@python_2_unicode_compatible
+class StepResultChunk(models.Model):
+    """
+    A piece of output that was appended to a StepResult while
+    the step was running. This allows for adding output without
+    rewriting all the output that has already been received.
+    """
+    step_result = models.ForeignKey(StepResult, related_name='output_chunks', on_delete=models.CASCADE)
+    sequence = models.PositiveIntegerField(default=0)
+    output = models.TextField(blank=True)
+    # output converted to HTML, continuing from the previous chunks
+    html = models.TextField(blank=True)
+
+    def __str__(self):
+        return '{}:{}'.format(self.step_result, self.sequence)
+
+    class Meta:
+        unique_together = ['step_result', 'sequence']
+        ordering = ['sequence',]
 
 def incomplete_status(status):
     """
@@ -1197,3 +1642,39 @@ class RepositoryBadge(models.Model):
     def __str__(self):
         return "%s:%s" % (self.repository, self.name)
 
+@python_2_unicode_compatible
+class QueuedTask(models.Model):
+    """
+    Work that is done outside of a request by the process_tasks command.
+    See ci/TaskQueue.py
+    """
+    PENDING = 0
+    RUNNING = 1
+    DONE = 2
+    FAILED = 3
+    STATUS_CHOICES = ((PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+        )
+    # Dotted path of the function to call
+    name = models.CharField(max_length=200)
+    # JSON encoded keyword arguments for the function
+    args = models.TextField(default="{}")
+    status = models.IntegerField(choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    last_modified = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['run_after', 'pk']
+
+    def __str__(self):
+        return "%s: %s(%s)" % (self.pk, self.name, self.args)
+
+    def status_str(self):
+        return self.get_status_display()
+
@@ -18,6 +18,7 @@ from django.shortcuts import redirect
 from requests_oauthlib import OAuth2Session
 from django.contrib import messages
 import ci.models
+import ci.Permissions
 import json
 import logging
 
@@ -178,6 +179,7 @@ class OAuth(object):
     def update_user(self, session):
         """
         Update the token for the user in the DB.
+        Logging in also refreshes the cached permissions of the user.
         """
         user = session[self._user_key]
         token = session[self._token_key]
@@ -186,6 +188,7 @@ class OAuth(object):
         gituser, created = ci.models.GitUser.objects.get_or_create(server=server, name=user)
         gituser.token = json.dumps(token)
         gituser.save()
+        ci.Permissions.invalidate_user(gituser)
 
     def get_json_value(self, response, name):
         """
@@ -27,9 +27,9 @@ class RecipeCreator(object):
         super(RecipeCreator, self).__init__()
         self._recipes_dir = recipes_dir
         self._sorted_recipes = {}
+        self._recipes_by_filename = {}
         self._repo_reader = None
-        self._load_reader()
-        self._sort_recipes()
+        self._read_all = False
         self._recipe_repo_rec = models.RecipeRepository.load()
         self._repo_sha = file_utils.get_repo_sha(self._recipes_dir)
 
@@ -48,15 +48,45 @@ class RecipeCreator(object):
                 models.Recipe.CAUSE_RELEASE: {"key": "release_dependencies"},
                 }
 
-    def _load_reader(self):
+    def _load_reader(self, filenames=None):
         """
         Try load load all the recipes from the recipes directory.
+        Input:
+          filenames[list]: If not None then only load these recipes (and the ones they depend on)
         """
         try:
-            self._repo_reader = RecipeRepoReader.RecipeRepoReader(self._recipes_dir)
+            self._repo_reader = RecipeRepoReader.RecipeRepoReader(self._recipes_dir, filenames)
         except Exception as e:
             print("Failed to load RecipeRepoReader: %s" % e)
             raise e
+        self._read_all = filenames is None
+        self._sort_recipes()
+
+    def _changed_recipe_files(self):
+        """
+        Use git to find which recipes need to be read again since the recipes were last loaded.
+        These are the recipes that were added or changed and the recipes that
+        depend on changed or removed recipes, or use a removed file.
+        Return:
+          (set, set): The recipe filenames to read and the filenames that were changed or removed,
+            or None if we couldn't get the changes and need to read all the recipes.
+        """
+        changes = file_utils.get_changed_files(self._recipes_dir, self._recipe_repo_rec.sha)
+        if changes is None:
+            return None
+
+        removed = set(fname for fname, status in changes.items() if status == "D")
+        changed_recipes = set(fname for fname, status in changes.items()
+                if status != "D" and fname.startswith("recipes/") and fname.endswith(".cfg"))
+
+        current = models.Recipe.objects.filter(current=True)
+        affected = set(current.filter(depends_on__filename__in=changed_recipes | removed).values_list("filename", flat=True))
+        if removed:
+            affected.update(current.filter(steps__filename__in=removed).values_list("filename", flat=True))
+            affected.update(current.filter(prestepsources__filename__in=removed).values_list("filename", flat=True))
+
+        to_read = (changed_recipes | affected) - removed
+        return to_read, changed_recipes | removed
 
     def _sort_recipes(self):
         """
@@ -76,12 +106,21 @@ class RecipeCreator(object):
             self._sorted_recipes[recipe["repository_server"]] = server_dict
             self._recipes_by_filename[recipe["filename"]] = recipe
 
-    def _update_repo_recipes(self, recipes, build_user, repo, dryrun=False):
+    def _update_repo_recipes(self, recipes, build_user, repo, dryrun=False, only=None):
         """
         Updates the recipes for a repository
         We break the recipes into 3 categories: no longer active, new, and changed.
+        Input:
+          recipes[list]: Recipe dicts for the repository
+          build_user[models.GitUser]: The build user of the recipes
+          repo[models.Repository]: The repository
+          dryrun[bool]: Don't actually change anything
+          only[set]: If not None then only some of the recipes were read. Current recipes that
+            aren't in "recipes" are only removed if their filename is in this set.
         """
         current = models.Recipe.objects.filter(current=True, repository=repo)
+        if only is not None:
+            current = current.filter(filename__in=only | set(r["filename"] for r in recipes))
         current_data = {}
         current_filenames = set()
         for r in current.all():
@@ -156,8 +195,10 @@ class RecipeCreator(object):
         Goes through all the recipes on disk and creates recipes in the database.
         Since there are various checks that are done, this is an atomic operation
         so that we can roll back if something goes wrong.
+        If the recipes have been loaded before then git is used to find what changed
+        since then and only those recipes (and the ones that depend on them) are read.
         Input:
-            force[bool]: Try to reload the recipes, ignoring if the repo SHA hasn't changed
+            force[bool]: Try to reload all the recipes, ignoring if the repo SHA hasn't changed
             dryrun[bool]: Don't actually create the recipes
         Exceptions:
           RecipeRepoReader.InvalidRecipe for a bad recipe
@@ -171,23 +212,52 @@ class RecipeCreator(object):
             print("Repo the same, not loading recipes: %s" % self._repo_sha[:8])
             return 0, 0, 0
 
+        changes = None
+        if not force and self._recipe_repo_rec.sha:
+            changes = self._changed_recipe_files()
+
+        if changes is None:
+            self._load_reader()
+            only = None
+        else:
+            to_read, only = changes
+            print("Changes since %s, reading %s recipes" % (self._recipe_repo_rec.sha[:8], len(to_read)))
+            self._load_reader(to_read)
+
         removed = 0
         new = 0
         changed = 0
         for server in settings.INSTALLED_GITSERVERS:
             server_rec, created = models.GitServer.objects.get_or_create(host_type=server["type"], name=server["hostname"])
+            seen_repos = set()
             for build_user, owners_dict in self._sorted_recipes.get(server_rec.name, {}).items():
                 build_user_rec, created = models.GitUser.objects.get_or_create(name=build_user, server=server_rec)
                 for owner, repo_dict in owners_dict.items():
                     owner_rec, created = models.GitUser.objects.get_or_create(name=owner, server=server_rec)
                     for repo, recipes in repo_dict.items():
                         repo_rec, created = models.Repository.objects.get_or_create(name=repo, user=owner_rec)
+                        seen_repos.add(repo_rec.pk)
                         print("%s: %s:%s" % (build_user_rec, server_rec, repo_rec))
-                        r, n, c = self._update_repo_recipes(recipes, build_user_rec, repo_rec, dryrun)
+                        r, n, c = self._update_repo_recipes(recipes, build_user_rec, repo_rec, dryrun, only)
                         removed += r
                         new += n
                         changed += c
 
+            if only:
+                # Repositories that don't have any of the recipes we read but might have had some removed
+                other_repos = (models.Recipe.objects
+                        .filter(current=True, filename__in=only, repository__user__server=server_rec)
+                        .exclude(repository__in=seen_repos)
+                        .select_related("build_user", "repository")
+                        .order_by("repository__pk"))
+                for recipe_rec in other_repos:
+                    if recipe_rec.repository.pk in seen_repos:
+                        continue
+                    seen_repos.add(recipe_rec.repository.pk)
+                    print("%s: %s:%s" % (recipe_rec.build_user, server_rec, recipe_rec.repository))
+                    r, n, c = self._update_repo_recipes([], recipe_rec.build_user, recipe_rec.repository, dryrun, only)
+                    removed += r
+
         if not dryrun:
             self._recipe_repo_rec.sha = self._repo_sha
             self._recipe_repo_rec.save()
@@ -204,6 +274,9 @@ class RecipeCreator(object):
                 print("Not trying to install/update webhooks for %s" % server_rec)
                 continue
 
+            if not self._read_all:
+                self._load_reader()
+
             for build_user, owners_dict in self._sorted_recipes.get(server_rec.name, {}).items():
                 build_user_rec, created = models.GitUser.objects.get_or_create(name=build_user, server=server_rec)
                 api = build_user_rec.api()
@@ -260,32 +333,38 @@ class RecipeCreator(object):
             return recipe_rec
 
         self._set_recipe(recipe_rec, recipe, cause)
-        for step in recipe["steps"]:
-            self._create_step(recipe_rec, step)
+        self._create_steps(recipe_rec, recipe["steps"])
         self._create_recipe_env(recipe_rec, recipe)
         self._create_prestep(recipe_rec, recipe)
         return recipe_rec
 
-    def _create_step(self, recipe_rec, step_dict):
+    def _create_steps(self, recipe_rec, step_dicts):
         """
-        Create a step and its environment.
+        Create the steps of a new recipe and their environment.
         Input:
-          recipe_rec: models.Recipe: Recipe to attach step to.
-          step_dict: dict: A step dictionary as produced by RecipeReader in recipe["steps"]
+          recipe_rec: models.Recipe: Recipe to attach the steps to.
+          step_dicts: list: Step dictionaries as produced by RecipeReader in recipe["steps"]
         Return:
-          models.Step
+          list[models.Step]
         """
-        step_rec, created = models.Step.objects.get_or_create(recipe=recipe_rec,
+        steps = [models.Step(recipe=recipe_rec,
             name=step_dict["name"],
             filename=step_dict["script"],
             position=step_dict["position"],
             abort_on_failure=step_dict["abort_on_failure"],
             allowed_to_fail=step_dict["allowed_to_fail"],
-            )
-        if created:
+            ) for step_dict in step_dicts]
+        models.Step.objects.bulk_create(steps)
+        if steps and steps[0].pk is None:
+            # Not all databases give us back the IDs
+            steps = list(recipe_rec.steps.order_by("pk"))
+
+        step_envs = []
+        for step_rec, step_dict in zip(steps, step_dicts):
             for name, value in step_dict["environment"].items():
-                step_env, created = models.StepEnvironment.objects.get_or_create(step=step_rec, name=name, value=value)
-        return step_rec
+                step_envs.append(models.StepEnvironment(step=step_rec, name=name, value=value))
+        models.StepEnvironment.objects.bulk_create(step_envs)
+        return steps
 
     def _create_recipe_env(self, recipe_rec, recipe_dict):
         """
@@ -294,8 +373,8 @@ class RecipeCreator(object):
           recipe_rec: models.Recipe: Recipe to attach step to.
           recipe_dict: dict: A recipe dictionary as produced by RecipeReader
         """
-        for name, value in recipe_dict["global_env"].items():
-            recipe_env, created = models.RecipeEnvironment.objects.get_or_create(recipe=recipe_rec, name=name, value=value)
+        models.RecipeEnvironment.objects.bulk_create([models.RecipeEnvironment(recipe=recipe_rec, name=name, value=value)
+            for name, value in recipe_dict["global_env"].items()])
 
     def _create_prestep(self, recipe_rec, recipe_dict):
         """
@@ -304,8 +383,12 @@ class RecipeCreator(object):
           recipe_rec: models.Recipe: Recipe to attach step to.
           recipe_dict: dict: A recipe dictionary as produced by RecipeReader
         """
+        sources = []
         for source in recipe_dict["global_sources"]:
-            recipe_source, created = models.PreStepSource.objects.get_or_create(recipe=recipe_rec, filename=source)
+            if source not in sources:
+                sources.append(source)
+        models.PreStepSource.objects.bulk_create([models.PreStepSource(recipe=recipe_rec, filename=source)
+            for source in sources])
 
     def _update_depends(self, recipe, repo_recipes):
         for cause in models.Recipe.CAUSE_CHOICES:
@@ -26,15 +26,19 @@ class RecipeReader(object):
     Reads a .cfg file and converts into a dict.
     The syntax of a file follows the ConfigParser syntax.
     """
-    def __init__(self, recipe_dir, filename):
+    def __init__(self, recipe_dir, filename, sha=None, repo_sha=None):
         """
         Constructor.
         Input:
           recipe_dir: str: Path to the recipe repo
           filename: .cfg file to read
+          sha: str: The git SHA of the file, if already known
+          repo_sha: str: The SHA of the recipe repo, if already known
         """
         self.recipe_dir = recipe_dir
         self.filename = filename
+        self.sha = sha
+        self.repo_sha = repo_sha
         self.hardcoded_sections = [
                 "Main",
                 "Global Sources",
@@ -285,8 +289,14 @@ class RecipeReader(object):
         Return:
           dict of values read in from the .cfg file or an empty dict if there was a problem.
         """
-        recipe = {"sha": file_utils.get_file_sha(self.recipe_dir, self.filename)}
-        recipe["repo_sha"] = file_utils.get_repo_sha(self.recipe_dir)
+        sha = self.sha
+        if sha is None:
+            sha = file_utils.get_file_sha(self.recipe_dir, self.filename)
+        repo_sha = self.repo_sha
+        if repo_sha is None:
+            repo_sha = file_utils.get_repo_sha(self.recipe_dir)
+        recipe = {"sha": sha}
+        recipe["repo_sha"] = repo_sha
         recipe["filename"] = self.filename
         recipe["name"] = self.get_option("Main", "name", "")
         recipe["display_name"] = self.get_option("Main", "display_name", "")
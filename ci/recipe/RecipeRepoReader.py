@@ -16,26 +16,81 @@
 
 from __future__ import unicode_literals, absolute_import
 import os, fnmatch
+import hashlib
+import json
+import multiprocessing
+import tempfile
 from ci.recipe.RecipeReader import RecipeReader
+from ci.recipe import file_utils
 
 class InvalidDependency(Exception):
     pass
 class InvalidRecipe(Exception):
     pass
 
+# Bump this when the recipe dicts created by RecipeReader change
+# so that old cached recipes aren't used.
+CACHE_VERSION = 1
+
+# Recipes are only parsed in a process pool when there are at least this many to parse.
+PARALLEL_MIN_RECIPES = 20
+
+# The keys of a recipe dict that hold other files in the repo
+FILE_KEYS = ["global_sources",
+        "pullrequest_dependencies",
+        "push_dependencies",
+        "manual_dependencies",
+        "release_dependencies",
+        ]
+
+def default_cache_dir(recipe_dir):
+    """
+    Input:
+      recipe_dir: str: Path to the recipe repo.
+    Return:
+      str: Directory in the .git directory of the repo to cache parsed recipes in,
+        or None if recipe_dir isn't the top of a repo.
+    """
+    git_dir = os.path.join(recipe_dir, ".git")
+    if os.path.isdir(git_dir):
+        return os.path.join(git_dir, "civet_recipe_cache")
+    return None
+
+def _parse_recipe(args):
+    """
+    Parse a single recipe. This is a function so that it can be used in a process pool.
+    Input:
+      args: tuple: (recipe_dir, filename, sha, repo_sha) as passed to RecipeReader
+    Return:
+      dict: The recipe, or an empty dict if it isn't valid
+    """
+    recipe_dir, filename, sha, repo_sha = args
+    return RecipeReader(recipe_dir, filename, sha, repo_sha).read()
+
 class RecipeRepoReader(object):
     """
     Reads all the recipes in a repository
     """
-    def __init__(self, recipe_dir):
+    def __init__(self, recipe_dir, filenames=None, cache_dir=None, processes=None):
         """
         Constructor.
         Input:
           recipe_dir: str: Path to the recipe repo.
+          filenames: list[str]: If not None then only these recipes are read, along with
+            the recipes they depend on so that their dependencies can be checked.
+          cache_dir: str: Where to cache parsed recipes. Defaults to default_cache_dir().
+            False to not cache them.
+          processes: int: Number of processes to parse recipes with. Defaults to the number of CPUs.
         """
         super(RecipeRepoReader, self).__init__()
         self.recipe_dir = recipe_dir
-        self.recipes = self.read_recipes()
+        if cache_dir is None:
+            cache_dir = default_cache_dir(recipe_dir)
+        self.cache_dir = cache_dir
+        self.processes = processes
+        self.repo_sha = file_utils.get_repo_sha(recipe_dir)
+        self._tracked = None
+        self.recipes = self.read_recipes(filenames)
 
     def get_recipe_files(self):
         """
@@ -52,57 +107,216 @@ class RecipeRepoReader(object):
                 recipes.append(os.path.relpath(path, self.recipe_dir))
         return recipes
 
-    def read_recipes(self):
+    def file_sha(self, filename):
         """
-        Converts all the recipes found by get_recipe_files() and converts them into dicts
+        Input:
+          filename: str: Path relative to the recipe repo
         Return:
-          list of recipe dicts
+          str: The git SHA of the file, or "" if git doesn't track the file
         """
-        all_recipes = []
-        for recipe_file in self.get_recipe_files():
-            reader = RecipeReader(self.recipe_dir, recipe_file)
-            recipe = reader.read()
-            if recipe:
-                all_recipes.append(recipe)
+        if self._tracked is None:
+            self._tracked = file_utils.get_tracked_files(self.recipe_dir) or set()
+        if filename not in self._tracked:
+            return ""
+        return file_utils.get_blob_sha(os.path.join(self.recipe_dir, filename))
+
+    def file_state(self, filename):
+        """
+        Used to tell whether a file used by a recipe has changed.
+        Input:
+          filename: str: Path relative to the recipe repo
+        Return:
+          str: The SHA of the contents of the file, "" if it doesn't exist
+        """
+        path = os.path.join(self.recipe_dir, filename)
+        if os.path.isdir(path):
+            return "dir"
+        if not os.path.exists(path):
+            return ""
+        return file_utils.get_blob_sha(path)
+
+    def _cache_path(self, filename, sha):
+        key = "%s:%s:%s" % (CACHE_VERSION, filename, sha)
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+
+    def get_cached_recipe(self, filename, sha):
+        """
+        Get a recipe that was already parsed.
+        The cached recipe is only used if the files it uses haven't changed.
+        Input:
+          filename: str: Path to the recipe, relative to the recipe repo
+          sha: str: The git SHA of the recipe
+        Return:
+          dict: The recipe or None if it isn't cached
+        """
+        if not self.cache_dir or not sha:
+            return None
+        try:
+            with open(self._cache_path(filename, sha), "r") as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+        for fname, state in data["files"].items():
+            if self.file_state(fname) != state:
+                return None
+        recipe = data["recipe"]
+        recipe["repo_sha"] = self.repo_sha
+        return recipe
+
+    def cache_recipe(self, recipe):
+        """
+        Save a parsed recipe, along with the SHAs of the files it uses.
+        Input:
+          recipe: dict: The recipe as returned by RecipeReader
+        """
+        if not self.cache_dir or not recipe["sha"]:
+            return
+        files = set(step["script"] for step in recipe["steps"])
+        for key in FILE_KEYS:
+            files.update(recipe[key])
+        data = {"recipe": recipe, "files": {fname: self.file_state(fname) for fname in files}}
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            # Write to a temporary file first so that we never read a partial file
+            f = tempfile.NamedTemporaryFile(mode="w", dir=self.cache_dir, delete=False)
+            with f:
+                json.dump(data, f)
+            os.rename(f.name, self._cache_path(recipe["filename"], recipe["sha"]))
+        except (IOError, OSError) as e:
+            print("Failed to cache recipe %s: %s" % (recipe["filename"], e))
+
+    def read_recipe(self, recipe_file):
+        """
+        Input:
+          recipe_file: str: Path to the recipe, relative to the recipe repo
+        Return:
+          dict: The recipe
+        Exceptions:
+          InvalidRecipe if the recipe isn't valid
+        """
+        sha = self.file_sha(recipe_file)
+        recipe = self.get_cached_recipe(recipe_file, sha)
+        if recipe is None:
+            recipe = _parse_recipe((self.recipe_dir, recipe_file, sha, self.repo_sha))
+            if not recipe:
+                raise InvalidRecipe(recipe_file)
+            self.cache_recipe(recipe)
+        return recipe
+
+    def read_recipe_files(self, recipe_files):
+        """
+        Reads a list of recipes.
+        If there are a lot of recipes that aren't cached then they are parsed in a process pool.
+        Input:
+          recipe_files: list[str]: Paths to the recipes, relative to the recipe repo
+        Return:
+          list of recipe dicts, in the same order as recipe_files
+        Exceptions:
+          InvalidRecipe if a recipe isn't valid
+        """
+        if self.processes == 1 or len(recipe_files) < PARALLEL_MIN_RECIPES:
+            return [self.read_recipe(recipe_file) for recipe_file in recipe_files]
+
+        recipes = {}
+        to_parse = []
+        for recipe_file in recipe_files:
+            sha = self.file_sha(recipe_file)
+            recipe = self.get_cached_recipe(recipe_file, sha)
+            if recipe is None:
+                to_parse.append((self.recipe_dir, recipe_file, sha, self.repo_sha))
             else:
+                recipes[recipe_file] = recipe
+
+        if len(to_parse) < PARALLEL_MIN_RECIPES:
+            parsed = [_parse_recipe(args) for args in to_parse]
+        else:
+            pool = multiprocessing.Pool(self.processes)
+            try:
+                parsed = pool.map(_parse_recipe, to_parse)
+            finally:
+                pool.close()
+                pool.join()
+
+        for args, recipe in zip(to_parse, parsed):
+            if recipe:
+                self.cache_recipe(recipe)
+                recipes[args[1]] = recipe
+
+        for recipe_file in recipe_files:
+            if recipe_file not in recipes:
                 raise InvalidRecipe(recipe_file)
+        return [recipes[recipe_file] for recipe_file in recipe_files]
+
+    def read_recipes(self, filenames=None):
+        """
+        Converts all the recipes found by get_recipe_files() and converts them into dicts
+        Input:
+          filenames: list[str]: If not None then only read these recipes and the ones they depend on
+        Return:
+          list of recipe dicts
+        """
+        if filenames is None:
+            all_recipes = self.read_recipe_files(self.get_recipe_files())
+        else:
+            all_recipes = self.read_recipe_files(sorted(set(filenames)))
+            read_files = set(filenames)
+            deps = set()
+            for recipe in all_recipes:
+                for key in ["pullrequest_dependencies", "push_dependencies", "manual_dependencies"]:
+                    deps.update(recipe[key])
+            all_recipes += self.read_recipe_files(sorted(deps - read_files))
+
         if not self.check_dependencies(all_recipes):
             raise InvalidDependency("Invalid dependencies!")
         return all_recipes
 
     def check_dependencies(self, all_recipes):
         ret = True
+        by_filename = {recipe["filename"]: recipe for recipe in all_recipes}
         for recipe in all_recipes:
             # the reader already checks for file existence.
             # We need to check for the same build user, repo and event type
             if not recipe["active"]:
                 continue
-            if not self.check_depend(recipe, all_recipes, "push_dependencies", "trigger_push", "trigger_push_branch"):
+            if not self.check_depend(recipe, by_filename, "push_dependencies", "trigger_push", "trigger_push_branch"):
                 ret = False
-            if not self.check_depend(recipe, all_recipes, "manual_dependencies", "trigger_manual", "trigger_manual_branch"):
+            if not self.check_depend(recipe, by_filename, "manual_dependencies", "trigger_manual", "trigger_manual_branch"):
                 ret = False
-            if not self.check_depend(recipe, all_recipes, "pullrequest_dependencies", "trigger_pull_request", None):
+            if not self.check_depend(recipe, by_filename, "pullrequest_dependencies", "trigger_pull_request", None):
                 ret = False
         return ret
 
-    def check_depend(self, recipe, all_recipes, dep_key, trigger_key, branch_key, alt_branch=None):
+    def check_depend(self, recipe, by_filename, dep_key, trigger_key, branch_key, alt_branch=None):
+        """
+        Input:
+          recipe: dict: The recipe to check
+          by_filename: dict: filename => recipe dict of all the recipes
+          dep_key: str: Key of the dependencies to check
+          trigger_key: str: Key that the dependencies need to have set
+          branch_key: str: Key of the branch that needs to be the same, or None
+          alt_branch: str: Key of another branch that can be used
+        Return:
+          bool: True if the dependencies are valid
+        """
         ret = True
         for dep in recipe[dep_key]:
-            for dep_recipe in all_recipes:
-                if dep_recipe["filename"] == dep:
-                    branch_same = True
-                    if branch_key:
-                        branch_same = dep_recipe[branch_key] == recipe[branch_key]
-                        if not branch_same and alt_branch and recipe[alt_branch]:
-                            branch_same = dep_recipe[branch_key] == recipe[alt_branch]
-                    if (not branch_same
-                        or not dep_recipe["active"]
-                        or dep_recipe["build_user"] != recipe["build_user"]
-                        or dep_recipe["repository"] != recipe["repository"]
-                        or not dep_recipe[trigger_key]):
-                        print("Recipe: %s: has invalid %s : %s" % (recipe["filename"], dep_key, dep))
-                        ret = False
-                    break
+            dep_recipe = by_filename.get(dep)
+            if dep_recipe is None:
+                continue
+            branch_same = True
+            if branch_key:
+                branch_same = dep_recipe[branch_key] == recipe[branch_key]
+                if not branch_same and alt_branch and recipe[alt_branch]:
+                    branch_same = dep_recipe[branch_key] == recipe[alt_branch]
+            if (not branch_same
+                or not dep_recipe["active"]
+                or dep_recipe["build_user"] != recipe["build_user"]
+                or dep_recipe["repository"] != recipe["repository"]
+                or not dep_recipe[trigger_key]):
+                print("Recipe: %s: has invalid %s : %s" % (recipe["filename"], dep_key, dep))
+                ret = False
         return ret
 
 if __name__ == "__main__":
@@ -16,6 +16,7 @@
 from __future__ import unicode_literals, absolute_import
 import os
 import subprocess
+import hashlib
 
 def is_subdir(suspect_child, suspect_parent):
     """
@@ -68,6 +69,44 @@ def is_valid_file(base_dir, filename):
     full_path = os.path.realpath(os.path.join(base_dir,  filename, ''))
     return is_subdir(full_path, base_dir) and os.path.exists(full_path)
 
+def _read_file(filename):
+    try:
+        with open(filename, 'r') as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return None
+
+def read_head_sha(base_dir):
+    """
+    Get the current sha for a repo by reading the files in the .git directory.
+    This avoids starting a git process but only handles the simple cases:
+    base_dir is the top of the repo and HEAD is either detached or points
+    to a loose or packed ref.
+    Input:
+      base_dir: str: path to where the repo resides
+    Return:
+      str: current SHA of repo, or None if it couldn't be determined
+    """
+    git_dir = os.path.join(base_dir, '.git')
+    head = _read_file(os.path.join(git_dir, 'HEAD'))
+    if not head:
+        return None
+    if not head.startswith('ref: '):
+        return head if len(head) == 40 else None
+
+    ref = head[5:].strip()
+    sha = _read_file(os.path.join(git_dir, ref))
+    if sha:
+        return sha if len(sha) == 40 else None
+
+    packed = _read_file(os.path.join(git_dir, 'packed-refs'))
+    if packed:
+        for line in packed.splitlines():
+            parts = line.split()
+            if len(parts) == 2 and parts[1] == ref and len(parts[0]) == 40:
+                return parts[0]
+    return None
+
 def get_repo_sha(base_dir):
     """
     Get the current sha for a repo.
@@ -76,6 +115,9 @@ def get_repo_sha(base_dir):
     Return:
       str: current SHA of repo, or "" if not a valid repo
     """
+    sha = read_head_sha(base_dir)
+    if sha:
+        return sha
     try:
         sha = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=base_dir)
         return sha.decode('utf-8').strip()
@@ -83,6 +125,70 @@ def get_repo_sha(base_dir):
         print("Failed to get repo sha for '%s': %s" % (base_dir, e))
         return ""
 
+def get_contents_sha(contents):
+    """
+    Get the SHA that git would give some contents, like "git hash-object".
+    Input:
+      contents: str or bytes: The contents. str is encoded as UTF-8.
+    Return:
+      str: SHA of the contents
+    """
+    if not isinstance(contents, bytes):
+        contents = contents.encode('utf-8')
+    header = ("blob %d\0" % len(contents)).encode('utf-8')
+    return hashlib.sha1(header + contents).hexdigest()
+
+def get_blob_sha(filename):
+    """
+    Get the SHA that git would give the contents of a file, without running git.
+    Input:
+      filename: str: Full path to the file
+    Return:
+      str: SHA of the contents, or "" if the file can't be read
+    """
+    try:
+        with open(filename, 'rb') as f:
+            data = f.read()
+    except (IOError, OSError):
+        return ""
+    return get_contents_sha(data)
+
+def get_contents_at(repo_dir, sha, filename):
+    """
+    Gets the contents of a file as it was in a commit.
+    Input:
+      repo_dir: str: The full directory to the repository
+      sha: str: The commit
+      filename: str: Filename relative to repo_dir
+    Return:
+      str: The contents of the file, or None if it wasn't in the commit
+    """
+    if not is_subdir(os.path.join(repo_dir, filename), repo_dir):
+        return None
+    try:
+        output = subprocess.check_output(['git', 'show', '%s:%s' % (sha, filename)],
+                cwd=repo_dir, stderr=subprocess.PIPE)
+    except Exception as e:
+        print("Failed to get '%s' at '%s' in '%s': %s" % (filename, sha, repo_dir, e))
+        return None
+    # Same newlines as get_contents() would give
+    return output.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+
+def get_tracked_files(repo_dir):
+    """
+    Get all the files that git tracks in a repo.
+    Input:
+      repo_dir: str: The full directory to the repository
+    Return:
+      set[str]: Filenames relative to repo_dir, or None if not a valid repo
+    """
+    try:
+        output = subprocess.check_output(['git', 'ls-files', '-z'], cwd=repo_dir, stderr=subprocess.PIPE)
+    except Exception as e:
+        print("Failed to get tracked files for '%s': %s" % (repo_dir, e))
+        return None
+    return set(f for f in output.decode('utf-8').split('\0') if f)
+
 def get_file_sha(repo_dir, filename):
     """
     Get the SHA for a filename in a repo.
@@ -101,3 +207,28 @@ def get_file_sha(repo_dir, filename):
     except Exception as e:
         print("Failed to get sha for '%s/%s': %s" % (repo_dir, filename, e))
         return ""
+
+def get_changed_files(repo_dir, sha):
+    """
+    Get the files that have changed in a repo since a commit.
+    The files are compared against what is currently on disk.
+    Input:
+      repo_dir: str: The full directory to the repository
+      sha: str: The commit to compare against
+    Return:
+      dict: filename relative to repo_dir => git status letter ("A", "M", "D", etc),
+        or None if the changes couldn't be determined (like sha isn't in the repo)
+    """
+    try:
+        output = subprocess.check_output(['git', 'diff', '--name-status', '--no-renames', '-z', sha, '--'],
+                cwd=repo_dir, stderr=subprocess.PIPE)
+    except Exception as e:
+        print("Failed to get changed files since '%s' in '%s': %s" % (sha, repo_dir, e))
+        return None
+
+    parts = output.decode('utf-8').split('\0')
+    changed = {}
+    for status, filename in zip(parts[0::2], parts[1::2]):
+        if status and filename:
+            changed[filename] = status[0]
+    return changed
@@ -20,7 +20,8 @@ from ci import models
 from mock import patch
 from django.test import override_settings
 from ci.github import api
-from ci.recipe import RecipeCreator
+from ci.recipe import RecipeCreator, RecipeRepoReader
+import subprocess
 
 @override_settings(INSTALLED_GITSERVERS=[test_utils.github_config()])
 class Tests(RecipeTester.RecipeTester):
@@ -398,6 +399,44 @@ class Tests(RecipeTester.RecipeTester):
             self.assertEqual(q.count(), 2)
             self.assertEqual(q.filter(active=True).count(), 2)
 
+    def test_incremental(self):
+        with test_utils.RecipeDir() as recipes_dir:
+            self.create_valid_with_check(recipes_dir)
+            pr_recipe = self.find_recipe_dict("recipes/pr_dep.cfg")
+            pr_recipe["priority_pull_request"] = 100
+            self.write_recipe_to_repo(recipes_dir, pr_recipe, "pr_dep.cfg")
+
+            # Only the changed recipe, the recipes that depend on it and
+            # the other dependencies of those recipes get read
+            read_recipe = RecipeRepoReader.RecipeRepoReader.read_recipe
+            with patch.object(RecipeRepoReader.RecipeRepoReader, 'read_recipe', autospec=True) as mock_read:
+                mock_read.side_effect = read_recipe
+                self.set_counts()
+                self.check_load_recipes(recipes_dir, changed=1)
+                self.compare_counts(sha_changed=True)
+                read = sorted(call[0][1] for call in mock_read.call_args_list)
+                self.assertEqual(read, ["recipes/all.cfg", "recipes/alt.cfg", "recipes/pr_dep.cfg", "recipes/push_dep.cfg"])
+            self.assertEqual(models.Recipe.objects.get(filename="recipes/pr_dep.cfg", current=True).priority, 100)
+            r = models.Recipe.objects.get(filename="recipes/all.cfg", current=True, cause=models.Recipe.CAUSE_PULL_REQUEST)
+            self.assertEqual(r.depends_on.get().priority, 100)
+
+            # Only a script changed, nothing to read
+            self.write_script_to_repo(recipes_dir, "new contents", "1.sh")
+            with patch.object(RecipeRepoReader.RecipeRepoReader, 'read_recipe', autospec=True) as mock_read:
+                mock_read.side_effect = read_recipe
+                self.set_counts()
+                self.check_load_recipes(recipes_dir)
+                self.compare_counts(sha_changed=True)
+                self.assertEqual(mock_read.call_count, 0)
+
+            # Recipes that use a removed script are checked again
+            subprocess.check_output(["git", "rm", "scripts/2.sh"], cwd=recipes_dir)
+            subprocess.check_output(["git", "commit", "-m", "Remove script"], cwd=recipes_dir)
+            self.set_counts()
+            with self.assertRaises(RecipeRepoReader.InvalidRecipe):
+                self.check_load_recipes(recipes_dir)
+            self.compare_counts()
+
     @patch.object(api.GitHubAPI, 'install_webhooks')
     def test_install_webhooks(self, mock_install):
         mock_install.side_effect = Exception("Bam!")
@@ -15,6 +15,8 @@
 
 from __future__ import unicode_literals, absolute_import
 from ci.recipe import RecipeWriter, RecipeRepoReader
+from mock import patch
+import os
 from ci.tests import utils
 from ci.recipe.tests import RecipeTester
 
@@ -51,3 +53,75 @@ class Tests(RecipeTester.RecipeTester):
                     break
             with self.assertRaises(RecipeRepoReader.InvalidDependency):
                 reader = RecipeRepoReader.RecipeRepoReader(recipes_dir)
+
+    def create_valid_recipes(self, recipes_dir):
+        self.write_script_to_repo(recipes_dir, "contents", "1.sh")
+        self.write_script_to_repo(recipes_dir, "contents", "2.sh")
+        self.create_recipe_in_repo(recipes_dir, "recipe_all.cfg", "recipe.cfg")
+        self.create_recipe_in_repo(recipes_dir, "recipe_pr.cfg", "dep1.cfg")
+        self.create_recipe_in_repo(recipes_dir, "pr_dep.cfg", "pr_dep.cfg")
+        self.create_recipe_in_repo(recipes_dir, "push_dep.cfg", "push_dep.cfg")
+
+    @patch.object(RecipeRepoReader, '_parse_recipe', side_effect=RecipeRepoReader._parse_recipe)
+    def test_cache(self, mock_parse):
+        with utils.RecipeDir() as recipes_dir:
+            self.create_valid_recipes(recipes_dir)
+            reader = RecipeRepoReader.RecipeRepoReader(recipes_dir)
+            self.assertEqual(reader.cache_dir, os.path.join(recipes_dir, ".git", "civet_recipe_cache"))
+            self.assertEqual(mock_parse.call_count, 4)
+            recipes = sorted(reader.recipes, key=lambda r: r["filename"])
+
+            # Everything is cached now
+            mock_parse.reset_mock()
+            reader = RecipeRepoReader.RecipeRepoReader(recipes_dir)
+            self.assertEqual(mock_parse.call_count, 0)
+            self.assertEqual(sorted(reader.recipes, key=lambda r: r["filename"]), recipes)
+
+            # A new commit changes repo_sha but cached recipes should still be used
+            self.write_script_to_repo(recipes_dir, "other", "other.sh")
+            reader = RecipeRepoReader.RecipeRepoReader(recipes_dir)
+            self.assertEqual(mock_parse.call_count, 0)
+            self.assertNotEqual(reader.repo_sha, recipes[0]["repo_sha"])
+            for r in reader.recipes:
+                self.assertEqual(r["repo_sha"], reader.repo_sha)
+
+            # Changing a script used by a recipe means it needs to be parsed again
+            uses_script = [r["filename"] for r in recipes if "scripts/2.sh" in r["global_sources"]]
+            self.assertNotEqual(uses_script, [])
+            self.write_script_to_repo(recipes_dir, "new contents", "2.sh")
+            reader = RecipeRepoReader.RecipeRepoReader(recipes_dir)
+            self.assertEqual(sorted(c[0][0][1] for c in mock_parse.call_args_list), uses_script)
+
+            # Changing the recipe itself. Recipes that depend on it are parsed again as well.
+            for r in reader.recipes:
+                if r["filename"] == "recipes/pr_dep.cfg":
+                    r["display_name"] = "New name"
+                    RecipeWriter.write_recipe_to_repo(recipes_dir, r, r["filename"])
+                    break
+            mock_parse.reset_mock()
+            reader = RecipeRepoReader.RecipeRepoReader(recipes_dir)
+            uses_dep = [r["filename"] for r in recipes if "recipes/pr_dep.cfg" in r["pullrequest_dependencies"]]
+            self.assertEqual(sorted(c[0][0][1] for c in mock_parse.call_args_list),
+                    sorted(["recipes/pr_dep.cfg"] + uses_dep))
+            r = [r for r in reader.recipes if r["filename"] == "recipes/pr_dep.cfg"][0]
+            self.assertEqual(r["display_name"], "New name")
+
+            # No caching
+            mock_parse.reset_mock()
+            reader = RecipeRepoReader.RecipeRepoReader(recipes_dir, cache_dir=False)
+            self.assertEqual(mock_parse.call_count, 4)
+
+    def test_parallel(self):
+        with utils.RecipeDir() as recipes_dir:
+            self.create_valid_recipes(recipes_dir)
+            serial = RecipeRepoReader.RecipeRepoReader(recipes_dir, cache_dir=False, processes=1)
+            with patch.object(RecipeRepoReader, 'PARALLEL_MIN_RECIPES', 0):
+                reader = RecipeRepoReader.RecipeRepoReader(recipes_dir, processes=2)
+                self.assertEqual(reader.recipes, serial.recipes)
+                # now read from the cache
+                reader = RecipeRepoReader.RecipeRepoReader(recipes_dir, processes=2)
+                self.assertEqual(reader.recipes, serial.recipes)
+
+                self.remove_recipe_from_repo(recipes_dir, "pr_dep.cfg")
+                with self.assertRaises(RecipeRepoReader.InvalidRecipe):
+                    RecipeRepoReader.RecipeRepoReader(recipes_dir, processes=2)
@@ -18,6 +18,7 @@ from ci.recipe import file_utils
 from ci.recipe.tests import RecipeTester
 from ci.tests import utils
 import os
+import subprocess
 
 class Tests(RecipeTester.RecipeTester):
     def test_is_subdir(self):
@@ -74,6 +75,64 @@ class Tests(RecipeTester.RecipeTester):
             sha = file_utils.get_repo_sha("/tmp")
             self.assertEqual(sha, "")
 
+    def test_read_head_sha(self):
+        with utils.RecipeDir() as recipes_dir:
+            git_sha = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=recipes_dir).decode('utf-8').strip()
+            self.assertEqual(file_utils.read_head_sha(recipes_dir), git_sha)
+
+            # packed refs
+            subprocess.check_output(['git', 'pack-refs', '--all'], cwd=recipes_dir)
+            self.assertEqual(file_utils.read_head_sha(recipes_dir), git_sha)
+
+            # new commit creates a loose ref again
+            self.write_script_to_repo(recipes_dir, "contents", "1.sh")
+            new_sha = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=recipes_dir).decode('utf-8').strip()
+            self.assertNotEqual(new_sha, git_sha)
+            self.assertEqual(file_utils.read_head_sha(recipes_dir), new_sha)
+
+            # detached HEAD
+            subprocess.check_output(['git', 'checkout', '-q', git_sha], cwd=recipes_dir)
+            self.assertEqual(file_utils.read_head_sha(recipes_dir), git_sha)
+
+            # not the top of the repo
+            self.assertIsNone(file_utils.read_head_sha(os.path.join(recipes_dir, "scripts")))
+            self.assertEqual(file_utils.get_repo_sha(os.path.join(recipes_dir, "scripts")), git_sha)
+
+    def test_get_changed_files(self):
+        with utils.RecipeDir() as recipes_dir:
+            sha = file_utils.get_repo_sha(recipes_dir)
+            self.assertEqual(file_utils.get_changed_files(recipes_dir, sha), {})
+            self.write_script_to_repo(recipes_dir, "contents", "1.sh")
+            self.write_script_to_repo(recipes_dir, "contents", "3.sh")
+            subprocess.check_output(['git', 'rm', '-q', 'scripts/2.sh'], cwd=recipes_dir)
+            self.assertEqual(file_utils.get_changed_files(recipes_dir, sha),
+                    {"scripts/1.sh": "M", "scripts/2.sh": "D", "scripts/3.sh": "A"})
+            self.assertIsNone(file_utils.get_changed_files(recipes_dir, "1"*40))
+
+    def test_get_blob_sha(self):
+        with utils.RecipeDir() as recipes_dir:
+            self.write_script_to_repo(recipes_dir, "contents", "1.sh")
+            sha = file_utils.get_blob_sha(os.path.join(recipes_dir, "scripts", "1.sh"))
+            self.assertEqual(sha, file_utils.get_file_sha(recipes_dir, "scripts/1.sh"))
+            self.assertEqual(file_utils.get_blob_sha(os.path.join(recipes_dir, "noexist")), "")
+            self.assertEqual(file_utils.get_contents_sha("contents"), sha)
+            self.assertEqual(file_utils.get_contents_sha(b"contents"), sha)
+
+    def test_get_contents_at(self):
+        with utils.RecipeDir() as recipes_dir:
+            sha = file_utils.get_repo_sha(recipes_dir)
+            self.write_script_to_repo(recipes_dir, "contents", "1.sh")
+            self.assertEqual(file_utils.get_contents_at(recipes_dir, sha, "scripts/1.sh"), "1.sh")
+            self.assertEqual(file_utils.get_contents(recipes_dir, "scripts/1.sh"), "contents")
+            self.assertIsNone(file_utils.get_contents_at(recipes_dir, sha, "scripts/noexist"))
+            self.assertIsNone(file_utils.get_contents_at(recipes_dir, "1"*40, "scripts/1.sh"))
+            self.assertIsNone(file_utils.get_contents_at(recipes_dir, sha, "../scripts/1.sh"))
+
+    def test_get_tracked_files(self):
+        with utils.RecipeDir() as recipes_dir:
+            self.assertEqual(file_utils.get_tracked_files(recipes_dir), {"README.md", "scripts/1.sh", "scripts/2.sh"})
+            self.assertIsNone(file_utils.get_tracked_files("/tmp"))
+
     def test_get_file_sha(self):
         with utils.RecipeDir() as recipes_dir:
             self.write_script_to_repo(recipes_dir, "contents", "1.sh")
@@ -18,6 +18,7 @@ from __future__ import unicode_literals, absolute_import
 from ci.tests import DBTester, utils
 import datetime
 from ci import EventsStatus, models
+from django.urls import reverse
 
 class Tests(DBTester.DBTester):
     def create_events(self):
@@ -84,14 +85,24 @@ class Tests(DBTester.DBTester):
     def test_all_events_info(self):
         self.create_events()
 
-        with self.assertNumQueries(4):
+        # 1. events query
+        # 2. create the missing snapshots
+        # 3-5. jobs, build configs and dependencies
+        # 6-8. save each snapshot
+        with self.assertNumQueries(8):
             info = EventsStatus.all_events_info()
             self.assertEqual(len(info), 3)
             # pre, blank, test, test1, blank, merge
             self.assertEqual(len(info[0]["jobs"]), 6)
 
+        # Now the snapshots are up to date
+        with self.assertNumQueries(1):
+            info = EventsStatus.all_events_info()
+            self.assertEqual(len(info), 3)
+            self.assertEqual(len(info[0]["jobs"]), 6)
+
         # make sure limit works
-        with self.assertNumQueries(4):
+        with self.assertNumQueries(1):
             info = EventsStatus.all_events_info(limit=1)
             self.assertEqual(len(info), 1)
             self.assertEqual(len(info[0]["jobs"]), 6)
@@ -100,7 +111,7 @@ class Tests(DBTester.DBTester):
         last_modified = last_modified + datetime.timedelta(0,10)
 
         # make sure last_modified works
-        with self.assertNumQueries(4):
+        with self.assertNumQueries(1):
             info = EventsStatus.all_events_info(last_modified=last_modified)
             self.assertEqual(len(info), 0)
 
@@ -133,6 +144,106 @@ class Tests(DBTester.DBTester):
         info = EventsStatus.events_info(ev)
         self.assertEqual(len(info), 3)
 
+    def test_events_info_snapshot(self):
+        self.create_events()
+        ev = models.Event.objects.first()
+        self.assertEqual(models.EventSnapshot.objects.count(), 0)
+        info = EventsStatus.events_info([ev])
+        snapshot = models.EventSnapshot.objects.get(event=ev)
+        self.assertFalse(snapshot.stale)
+        self.assertEqual(snapshot.get_info()["job_groups"], info[0]["job_groups"])
+
+        # Up to date so only the query for the snapshot
+        with self.assertNumQueries(1):
+            self.assertEqual(EventsStatus.events_info([ev]), info)
+
+        # Only the description is different when linking to the event
+        url_info = EventsStatus.events_info([ev], events_url=True)[0]
+        self.assertNotEqual(url_info["description"], info[0]["description"])
+        self.assertIn('href="%s"' % reverse("ci:view_event", args=[ev.pk]), url_info["description"])
+        self.assertEqual(url_info["job_groups"], info[0]["job_groups"])
+
+        # Updating a job should make it stale
+        job = ev.jobs.first()
+        job.status = models.JobStatus.SUCCESS
+        job.save()
+        snapshot.refresh_from_db()
+        self.assertTrue(snapshot.stale)
+        # Fresh copies of the event since it caches its snapshot
+        info = EventsStatus.events_info(models.Event.objects.filter(pk=ev.pk))
+        statuses = [j["status"] for group in info[0]["job_groups"] for j in group if j["id"] == job.pk]
+        self.assertEqual(statuses, [job.status_slug()])
+        snapshot.refresh_from_db()
+        self.assertFalse(snapshot.stale)
+
+        # Same for the event, the pull request and recipes
+        ev.status = models.JobStatus.FAILED
+        ev.save()
+        self.assertTrue(models.EventSnapshot.objects.get(event=ev).stale)
+        info = EventsStatus.events_info(models.Event.objects.filter(pk=ev.pk))
+        self.assertEqual(info[0]["status"], ev.status_slug())
+
+        ev.pull_request.title = "New title"
+        ev.pull_request.save()
+        self.assertTrue(models.EventSnapshot.objects.get(event=ev).stale)
+        info = EventsStatus.events_info(models.Event.objects.filter(pk=ev.pk))
+        self.assertEqual(info[0]["pr_title"], "New title")
+
+        job.recipe.display_name = "New name"
+        job.recipe.save()
+        self.assertTrue(models.EventSnapshot.objects.get(event=ev).stale)
+        info = EventsStatus.events_info(models.Event.objects.filter(pk=ev.pk))
+        self.assertIn("New name", str(info[0]["job_groups"]))
+
+        # A snapshot that changed while it was being rebuilt is left as stale
+        models.EventSnapshot.mark_stale(event=ev)
+        snapshot = models.EventSnapshot.objects.get(event=ev)
+        models.EventSnapshot.mark_stale(event=ev)
+        EventsStatus.update_snapshots([(ev, snapshot)])
+        self.assertTrue(models.EventSnapshot.objects.get(event=ev).stale)
+
+    def test_events_info_snapshot_related_changes(self):
+        self.create_events()
+        ev = models.Event.objects.first()
+
+        def is_stale():
+            return models.EventSnapshot.objects.get(event=ev).stale
+
+        def refresh():
+            EventsStatus.events_info(models.Event.objects.filter(pk=ev.pk))
+            self.assertFalse(is_stale())
+
+        refresh()
+        job = ev.jobs.order_by("pk").last()
+        recipe = job.recipe
+
+        # Changing the build configs of a recipe, from either side
+        config = utils.create_build_config(name="New config")
+        recipe.build_configs.add(config)
+        self.assertTrue(is_stale())
+        refresh()
+        config.recipe_set.remove(recipe)
+        self.assertTrue(is_stale())
+        refresh()
+        recipe.build_configs.add(config)
+        refresh()
+        config.recipe_set.clear()
+        self.assertTrue(is_stale())
+        refresh()
+
+        # Changing the dependencies of a recipe
+        recipe.depends_on.clear()
+        self.assertTrue(is_stale())
+        info = EventsStatus.events_info(models.Event.objects.filter(pk=ev.pk))
+        self.assertEqual(len(info[0]["job_groups"]), 2)
+
+        # Deleting a job
+        job_pk = job.pk
+        job.delete()
+        self.assertTrue(is_stale())
+        info = EventsStatus.events_info(models.Event.objects.filter(pk=ev.pk))
+        self.assertNotIn(job_pk, [j["id"] for group in info[0]["job_groups"] for j in group])
+
     def test_multi_line(self):
         self.create_events()
         e = utils.create_event(user=self.owner, commit1='456', branch1=self.branch, branch2=self.branch, cause=models.Event.PUSH)
@@ -69,6 +69,7 @@ class Tests(DBTester.DBTester):
         with self.settings(COLLABORATOR_CACHE_TIMEOUT=0):
             # now start over with no timeout
             session.clear()
+            Permissions.invalidate_user(user)
             utils.simulate_login(session, user)
             mock_get.return_value = utils.Response(status_code=404) # not a collaborator
             mock_get.call_count = 0
@@ -144,6 +145,7 @@ class Tests(DBTester.DBTester):
         # user is a collaborator now
         mock_get.return_value = utils.Response(status_code=204)
         session = self.client.session
+        Permissions.invalidate_user(user)
         ret = Permissions.job_permissions(session, job)
         self.assertFalse(ret['is_owner'])
         self.assertTrue(ret['can_see_results'])
@@ -184,6 +186,7 @@ class Tests(DBTester.DBTester):
 
         # there was an exception somewhere
         session = self.client.session
+        Permissions.invalidate_user(user)
         mock_get.side_effect = Exception("Boom!")
         ret = Permissions.job_permissions(session, job)
         self.assertFalse(ret['is_owner'])
@@ -301,6 +304,7 @@ class Tests(DBTester.DBTester):
 
         # A normal user that is a collaborator
         session = self.client.session # so we don't hit the cache
+        Permissions.invalidate_user(user)
         mock_get.return_value = utils.Response(status_code=204) # a collaborator
         mock_get.call_count = 0
         ret = Permissions.can_see_results(session, recipe)
@@ -315,6 +319,7 @@ class Tests(DBTester.DBTester):
 
         # Now try with teams
         session = self.client.session # so we don't hit the cache
+        Permissions.invalidate_user(user)
         data = {"login": "some team"}
         mock_get.return_value = utils.Response([data])
         models.RecipeViewableByTeam.objects.create(team="foo", recipe=recipe)
@@ -332,6 +337,7 @@ class Tests(DBTester.DBTester):
 
         # A valid member of the team
         session = self.client.session # clear the cache
+        Permissions.invalidate_user(user)
         data["login"] = "foo"
         mock_get.return_value = utils.Response([data])
         ret = Permissions.can_see_results(session, recipe)
@@ -343,3 +349,60 @@ class Tests(DBTester.DBTester):
         ret = Permissions.can_see_results(session, recipe)
         self.assertTrue(ret)
         self.assertEqual(mock_get.call_count, 0)
+
+    @patch.object(OAuth2Session, 'get')
+    def test_shared_cache(self, mock_get):
+        build_user = utils.create_user_with_token(name="build user")
+        repo = utils.create_repo()
+        user = utils.create_user(name="auth user")
+        other_user = utils.create_user(name="other user")
+        mock_get.return_value = utils.Response(status_code=204) # is a collaborator
+        allowed = Permissions.is_collaborator(self.client.session, build_user, repo, user=user)
+        self.assertIs(allowed, True)
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertIs(Permissions.get_shared("collaborator", user, str(repo)), True)
+        self.assertIsNone(Permissions.get_shared("collaborator", other_user, str(repo)))
+
+        # A new session uses the shared value
+        allowed = Permissions.is_collaborator(self.client.session, build_user, repo, user=user)
+        self.assertIs(allowed, True)
+        self.assertEqual(mock_get.call_count, 1)
+
+        # Other users still need to check
+        mock_get.return_value = utils.Response(status_code=404) # not a collaborator
+        allowed = Permissions.is_collaborator(self.client.session, build_user, repo, user=other_user)
+        self.assertIs(allowed, False)
+        self.assertEqual(mock_get.call_count, 2)
+        # Negative answers aren't shared since they could be from an error
+        self.assertIsNone(Permissions.get_shared("collaborator", other_user, str(repo)))
+        mock_get.return_value = utils.Response(status_code=204)
+        allowed = Permissions.is_collaborator(self.client.session, build_user, repo, user=other_user)
+        self.assertIs(allowed, True)
+        self.assertEqual(mock_get.call_count, 3)
+        Permissions.invalidate_user(other_user)
+
+        # Team membership is shared as well
+        mock_get.return_value = utils.Response([{"login": "team"}])
+        api = user.api()
+        self.assertIs(Permissions.is_team_member(self.client.session, api, "team", user), True)
+        self.assertEqual(mock_get.call_count, 4)
+        self.assertIs(Permissions.is_team_member(self.client.session, api, "team", user), True)
+        self.assertEqual(mock_get.call_count, 4)
+
+        # Invalidate a single value
+        Permissions.invalidate_shared("team", user, "team")
+        self.assertIsNone(Permissions.get_shared("team", user, "team"))
+        self.assertIs(Permissions.get_shared("collaborator", user, str(repo)), True)
+
+        # Invalidate everything for the user
+        Permissions.invalidate_user(user)
+        self.assertIsNone(Permissions.get_shared("collaborator", user, str(repo)))
+        allowed = Permissions.is_collaborator(self.client.session, build_user, repo, user=user)
+        self.assertIs(allowed, False)
+        self.assertEqual(mock_get.call_count, 5)
+        # A failed request only affects the session
+        self.assertIsNone(Permissions.get_shared("collaborator", user, str(repo)))
+        mock_get.return_value = utils.Response(status_code=204)
+        allowed = Permissions.is_collaborator(self.client.session, build_user, repo, user=user)
+        self.assertIs(allowed, True)
+        self.assertEqual(mock_get.call_count, 6)
@@ -0,0 +1,48 @@
+
+# Copyright 2016 Battelle Energy Alliance, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import unicode_literals, absolute_import
+from django.test import SimpleTestCase
+from django.core.cache import cache
+from ci import ReadyJobsNotifier
+import threading
+import time
+
+class Tests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_notify(self):
+        self.assertEqual(ReadyJobsNotifier.get_generation(123), 0)
+        ReadyJobsNotifier.notify([123])
+        self.assertEqual(ReadyJobsNotifier.get_generation(123), 1)
+        ReadyJobsNotifier.notify([123, 456])
+        self.assertEqual(ReadyJobsNotifier.get_generation(123), 2)
+        self.assertEqual(ReadyJobsNotifier.get_generation(456), 1)
+        self.assertEqual(ReadyJobsNotifier.get_generation(789), 0)
+
+    def test_wait(self):
+        # Already changed
+        self.assertTrue(ReadyJobsNotifier.wait(123, 1, 10))
+        # Times out
+        self.assertFalse(ReadyJobsNotifier.wait(123, 0, .01))
+
+        # Woken up by another thread
+        timer = threading.Timer(.1, ReadyJobsNotifier.notify, args=([123],))
+        timer.start()
+        start = time.time()
+        self.assertTrue(ReadyJobsNotifier.wait(123, 0, 10))
+        self.assertLess(time.time() - start, 5)
+        timer.join()
@@ -17,6 +17,7 @@ from __future__ import unicode_literals, absolute_import
 from ci.tests import DBTester, utils
 import datetime
 from ci import RepositoryStatus, models
+from django.core.cache import cache
 
 class Tests(DBTester.DBTester):
     def create_repos(self, active=False):
@@ -54,7 +55,7 @@ class Tests(DBTester.DBTester):
             repo.save()
 
         # All repos active, no branches have their status set
-        with self.assertNumQueries(4):
+        with self.assertNumQueries(5):
             repos = RepositoryStatus.main_repos_status()
             self.assertEqual(len(repos), 3)
             for repo in repos:
@@ -66,7 +67,7 @@ class Tests(DBTester.DBTester):
             branch.save()
 
         # All repos active, all branches active
-        with self.assertNumQueries(4):
+        with self.assertNumQueries(5):
             repos = RepositoryStatus.main_repos_status()
             self.assertEqual(len(repos), 3)
             for repo in repos:
@@ -75,7 +76,7 @@ class Tests(DBTester.DBTester):
 
         last_modified = models.Repository.objects.first().last_modified + datetime.timedelta(0,10)
         # Nothing
-        with self.assertNumQueries(4):
+        with self.assertNumQueries(5):
             repos = RepositoryStatus.main_repos_status(last_modified=last_modified)
             self.assertEqual(len(repos), 3)
             for repo in repos:
@@ -87,7 +88,7 @@ class Tests(DBTester.DBTester):
             pr.closed = True
             pr.save()
         # All repos active, all branches active, PRs closed
-        with self.assertNumQueries(4):
+        with self.assertNumQueries(5):
             repos = RepositoryStatus.main_repos_status()
             self.assertEqual(len(repos), 3)
             for repo in repos:
@@ -99,7 +100,7 @@ class Tests(DBTester.DBTester):
 
         # All repos active, no branches have their status set
         pks = [models.Repository.objects.first().pk]
-        with self.assertNumQueries(4):
+        with self.assertNumQueries(5):
             repos = RepositoryStatus.filter_repos_status(pks)
             self.assertEqual(len(repos), 1)
             for repo in repos:
@@ -111,7 +112,7 @@ class Tests(DBTester.DBTester):
 
         # None active
         q = models.Repository.objects
-        with self.assertNumQueries(4):
+        with self.assertNumQueries(5):
             repos = RepositoryStatus.get_repos_status(repo_q=q)
             self.assertEqual(len(repos), 3)
 
@@ -123,14 +124,46 @@ class Tests(DBTester.DBTester):
         last_modified = models.Repository.objects.first().last_modified + datetime.timedelta(0,10)
         # None active
         q = models.Repository.objects
-        with self.assertNumQueries(4):
+        with self.assertNumQueries(5):
             repos = RepositoryStatus.get_repos_status(repo_q=q, last_modified=last_modified)
             self.assertEqual(len(repos), 0)
 
+    def test_get_repos_data_cache(self):
+        self.create_repos(active=True)
+        cache.clear()
+        repos = RepositoryStatus.main_repos_status()
+        self.assertEqual(len(repos), 3)
+        # Everything is cached, only the query to check for changes
+        with self.assertNumQueries(1):
+            self.assertEqual(RepositoryStatus.main_repos_status(), repos)
+
+        pr = models.PullRequest.objects.first()
+        pr.title = "Changed"
+        pr.save()
+        repos = RepositoryStatus.main_repos_status()
+        descs = [p["description"] for r in repos for p in r["prs"] if p["id"] == pr.pk]
+        self.assertEqual(len(descs), 1)
+        self.assertIn("Changed", descs[0])
+
+        # Deleting a record changes the key as well
+        pr_pk = pr.pk
+        pr.delete()
+        repos = RepositoryStatus.main_repos_status()
+        self.assertEqual([p for r in repos for p in r["prs"] if p["id"] == pr_pk], [])
+
+        # Different filters are cached separately
+        last_modified = models.Repository.objects.first().last_modified + datetime.timedelta(0,10)
+        for repo in RepositoryStatus.main_repos_status(last_modified):
+            self.assertEqual(repo["prs"], [])
+        # Nothing changed since then so it doesn't matter what the time is
+        with self.assertNumQueries(1):
+            for repo in RepositoryStatus.main_repos_status(last_modified + datetime.timedelta(0,10)):
+                self.assertEqual(repo["prs"], [])
+
     def test_get_user_repos_with_open_prs_status(self):
         self.create_repos()
 
-        with self.assertNumQueries(2):
+        with self.assertNumQueries(3):
             repos = RepositoryStatus.get_user_repos_with_open_prs_status('pr_user')
             self.assertEqual(len(repos), 3)
 
@@ -140,11 +173,11 @@ class Tests(DBTester.DBTester):
             self.assertEqual(len(repos), 0)
 
         last_modified = models.Repository.objects.first().last_modified
-        with self.assertNumQueries(2):
+        with self.assertNumQueries(3):
             repos = RepositoryStatus.get_user_repos_with_open_prs_status('pr_user', last_modified)
             self.assertEqual(len(repos), 3)
 
         last_modified = last_modified + datetime.timedelta(0,10)
-        with self.assertNumQueries(2):
+        with self.assertNumQueries(3):
             repos = RepositoryStatus.get_user_repos_with_open_prs_status('pr_user', last_modified)
             self.assertEqual(len(repos), 0)
@@ -0,0 +1,113 @@
+
+# Copyright 2016 Battelle Energy Alliance, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import unicode_literals, absolute_import
+from django.urls import reverse
+from django.test import override_settings, Client
+from django.conf import settings
+from ci import RequestStats
+from ci.tests import DBTester, utils
+
+def sample(view="ci:main", duration=1.0, queries=2, query_time=.5, duplicates=0, size=10):
+    return RequestStats.Sample(view=view,
+            method="GET",
+            status=200,
+            duration=duration,
+            queries=queries,
+            query_time=query_time,
+            duplicate_queries=duplicates,
+            size=size,
+            timestamp=0)
+
+@override_settings(INSTALLED_GITSERVERS=[utils.github_config()])
+class Tests(DBTester.DBTester):
+    def setUp(self):
+        super(Tests, self).setUp()
+        RequestStats.get_store().clear()
+
+    def tearDown(self):
+        super(Tests, self).tearDown()
+        RequestStats.get_store().clear()
+
+    def test_store(self):
+        store = RequestStats.RequestStatsStore(3)
+        self.assertEqual(store.summary(), [])
+        store.add(sample(duration=1, queries=1))
+        store.add(sample(duration=3, queries=3, duplicates=1, size=20))
+        store.add(sample(view="ci:view_pr", duration=5))
+        summary = store.summary()
+        self.assertEqual([s["view"] for s in summary], ["ci:view_pr", "ci:main"])
+        main = summary[1]
+        self.assertEqual(main["requests"], 2)
+        self.assertEqual(main["total_time"], 4)
+        self.assertEqual(main["avg_time"], 2)
+        self.assertEqual(main["p50_time"], 1)
+        self.assertEqual(main["p95_time"], 3)
+        self.assertEqual(main["max_time"], 3)
+        self.assertEqual(main["avg_queries"], 2)
+        self.assertEqual(main["max_queries"], 3)
+        self.assertEqual(main["duplicate_queries"], 1)
+        self.assertEqual(main["avg_size"], 15)
+        self.assertEqual(main["max_size"], 20)
+
+        # The oldest sample falls out of the ring buffer but stays in the totals
+        store.add(sample(view="ci:view_pr", duration=5))
+        summary = store.summary()
+        self.assertEqual(summary[1]["requests"], 1)
+        self.assertEqual(store.totals()["ci:main"]["requests"], 2)
+        self.assertEqual(store.totals()["ci:view_pr"]["duration"], 10)
+
+    def test_prometheus_text(self):
+        store = RequestStats.RequestStatsStore(3)
+        store.add(sample(view='odd"view', duplicates=2))
+        text = RequestStats.prometheus_text(store)
+        self.assertIn("# TYPE civet_requests_total counter\n", text)
+        self.assertIn('civet_requests_total{view="odd\\"view"} 1\n', text)
+        self.assertIn('civet_request_duplicate_queries_total{view="odd\\"view"} 2\n', text)
+
+    def test_middleware(self):
+        middleware = list(settings.MIDDLEWARE) + ["ci.RequestStats.RequestStatsMiddleware"]
+        ev = utils.create_event()
+        utils.create_job(event=ev)
+        store = RequestStats.get_store()
+        with override_settings(MIDDLEWARE=middleware):
+            # The test client loads the middleware on its first request
+            client = Client()
+            response = client.get(reverse('ci:view_event', args=[ev.pk]))
+            self.assertEqual(response.status_code, 200)
+            size = len(response.content)
+            response = client.get("/does_not_exist/")
+            self.assertEqual(response.status_code, 404)
+
+        samples = store.samples()
+        self.assertEqual(len(samples), 2)
+        self.assertEqual(samples[0].view, "ci:view_event")
+        self.assertEqual(samples[0].status, 200)
+        self.assertGreater(samples[0].queries, 0)
+        self.assertEqual(samples[0].size, size)
+        self.assertEqual(samples[1].view, RequestStats.UNRESOLVED_VIEW)
+
+        # Not recorded when not enabled
+        self.client.get(reverse('ci:main'))
+        self.assertEqual(len(store.samples()), 2)
+
+    def test_query_recorder(self):
+        recorder = RequestStats.QueryRecorder()
+        execute = lambda sql, params, many, context: None
+        recorder(execute, "select 1", (1,), False, None)
+        recorder(execute, "select 1", (2,), False, None)
+        recorder(execute, "select 1", (1,), False, None)
+        self.assertEqual(recorder.queries, 3)
+        self.assertEqual(recorder.duplicates, 1)
@@ -0,0 +1,135 @@
+
+# Copyright 2016 Battelle Energy Alliance, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import unicode_literals, absolute_import
+from django.test import SimpleTestCase
+from mock import patch
+from ci import StatusDispatcher
+import threading
+
+class Tests(SimpleTestCase):
+    @patch.object(StatusDispatcher, 'time')
+    def test_token_bucket(self, mock_time):
+        mock_time.time.return_value = 100
+        bucket = StatusDispatcher.TokenBucket(2, 3)
+        for i in range(3):
+            self.assertEqual(bucket.try_acquire(), 0)
+        self.assertAlmostEqual(bucket.try_acquire(), 0.5)
+
+        mock_time.time.return_value = 100.5
+        self.assertEqual(bucket.try_acquire(), 0)
+        self.assertAlmostEqual(bucket.try_acquire(), 0.5)
+
+        # Doesn't go over the capacity
+        mock_time.time.return_value = 200
+        for i in range(3):
+            self.assertEqual(bucket.try_acquire(), 0)
+        self.assertGreater(bucket.try_acquire(), 0)
+
+        mock_time.time.side_effect = [200, 200.5]
+        bucket.acquire()
+        mock_time.sleep.assert_called_once_with(0.5)
+
+    def test_dispatcher(self):
+        dispatcher = StatusDispatcher.StatusDispatcher(2, StatusDispatcher.TokenBucket(1000, 1000))
+        sent = []
+        blocked = threading.Event()
+        release = threading.Event()
+
+        def blocking_send():
+            blocked.set()
+            release.wait(5)
+            sent.append(("a", 0))
+
+        def make_send(key, num):
+            def send():
+                sent.append((key, num))
+            return send
+
+        dispatcher.submit("a", blocking_send)
+        self.assertTrue(blocked.wait(5))
+        # "a" is being sent, so these have to wait for it
+        dispatcher.submit("a", make_send("a", 1))
+        dispatcher.submit("a", make_send("a", 2))
+        dispatcher.submit("b", make_send("b", 1))
+        self.assertFalse(dispatcher.flush(0.1))
+        release.set()
+        self.assertTrue(dispatcher.flush(5))
+        self.assertEqual(dispatcher.coalesced, 1)
+        self.assertIn(("b", 1), sent)
+        a_sent = [s for s in sent if s[0] == "a"]
+        self.assertEqual(a_sent, [("a", 0), ("a", 2)])
+
+        # Exceptions don't stop the workers
+        def bad_send():
+            raise Exception("BAM!")
+        dispatcher.submit("c", bad_send)
+        dispatcher.submit("d", make_send("d", 1))
+        self.assertTrue(dispatcher.flush(5))
+        self.assertIn(("d", 1), sent)
+        failures = dispatcher.take_failures()
+        self.assertEqual([f[0] for f in failures], ["c"])
+        self.assertEqual(dispatcher.take_failures(), [])
+
+        # A newer update replaces the failure
+        dispatcher.submit("c", bad_send)
+        self.assertTrue(dispatcher.flush(5))
+        dispatcher.submit("c", make_send("c", 1))
+        self.assertTrue(dispatcher.flush(5))
+        self.assertEqual(dispatcher.take_failures(), [])
+
+    def test_flush(self):
+        dispatcher = StatusDispatcher.StatusDispatcher(1, StatusDispatcher.TokenBucket(1000, 1000))
+        with patch.object(StatusDispatcher, "_dispatcher", dispatcher):
+            sent = []
+            StatusDispatcher.submit("a", lambda: sent.append("a"))
+            StatusDispatcher.flush(5)
+            self.assertEqual(sent, ["a"])
+
+            def bad_send():
+                raise Exception("BAM!")
+            StatusDispatcher.submit("b", bad_send)
+            with self.assertRaises(StatusDispatcher.StatusDispatchError):
+                StatusDispatcher.flush(5)
+            # Failures are only reported once
+            StatusDispatcher.flush(5)
+
+            release = threading.Event()
+            StatusDispatcher.submit("c", lambda: release.wait(5))
+            with self.assertRaises(StatusDispatcher.StatusDispatchError):
+                StatusDispatcher.flush(0.1)
+            release.set()
+            StatusDispatcher.flush(5)
+
+            # Only the updates queued by this thread are checked
+            thread = threading.Thread(target=StatusDispatcher.submit, args=("d", bad_send))
+            thread.start()
+            thread.join()
+            self.assertTrue(dispatcher.flush(5))
+            StatusDispatcher.submit("e", lambda: sent.append("e"))
+            StatusDispatcher.flush(5)
+            self.assertEqual([f[0] for f in dispatcher.take_failures(set(["d"]))], ["d"])
+
+            # Forgotten updates aren't checked either
+            StatusDispatcher.submit("f", bad_send)
+            StatusDispatcher.forget()
+            StatusDispatcher.flush(5)
+            self.assertTrue(dispatcher.flush(5))
+            StatusDispatcher._flush_at_exit()
+            self.assertEqual(dispatcher.take_failures(), [])
+
+        with patch.object(StatusDispatcher, "_dispatcher", None):
+            # Nothing was ever sent
+            StatusDispatcher.flush()
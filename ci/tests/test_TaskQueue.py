@@ -0,0 +1,132 @@
+
+# Copyright 2016 Battelle Energy Alliance, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import unicode_literals, absolute_import
+from django.test import override_settings
+from django.core import management
+from django.utils import timezone
+from django.utils.six import StringIO
+from ci import models, TaskQueue, StatusDispatcher
+from ci.tests import DBTester
+from datetime import timedelta
+from mock import patch
+
+task_calls = []
+
+def record_task(value):
+    task_calls.append(value)
+
+def failing_task(value):
+    raise Exception("Failed %s" % value)
+
+def status_task(value):
+    def send():
+        task_calls.append(value)
+        if value == "bad":
+            raise Exception("Failed to send")
+    StatusDispatcher.submit(("status", value), send)
+
+@override_settings(TASK_QUEUE_INLINE=False)
+class Tests(DBTester.DBTester):
+    def setUp(self):
+        super(Tests, self).setUp()
+        del task_calls[:]
+
+    def test_enqueue(self):
+        task = TaskQueue.enqueue(record_task, value=1)
+        self.assertEqual(task.name, "ci.tests.test_TaskQueue.record_task")
+        self.assertEqual(task.status, models.QueuedTask.PENDING)
+        self.assertEqual(task_calls, [])
+
+        self.assertEqual(TaskQueue.run_pending(), 1)
+        self.assertEqual(task_calls, [1])
+        task.refresh_from_db()
+        self.assertEqual(task.status, models.QueuedTask.DONE)
+        self.assertEqual(task.attempts, 1)
+        self.assertEqual(TaskQueue.run_pending(), 0)
+
+        with override_settings(TASK_QUEUE_INLINE=True):
+            self.assertIsNone(TaskQueue.enqueue(record_task, value=2))
+            self.assertEqual(task_calls, [1, 2])
+
+    @override_settings(TASK_QUEUE_MAX_ATTEMPTS=2, TASK_QUEUE_RETRY_DELAY=10)
+    def test_retry(self):
+        task = TaskQueue.enqueue(failing_task, value=1)
+        self.assertEqual(TaskQueue.run_pending(), 1)
+        task.refresh_from_db()
+        self.assertEqual(task.status, models.QueuedTask.PENDING)
+        self.assertIn("Failed 1", task.error)
+        self.assertGreater(task.run_after, timezone.now() + timedelta(seconds=5))
+        # Not ready to retry yet
+        self.assertEqual(TaskQueue.run_pending(), 0)
+
+        models.QueuedTask.objects.filter(pk=task.pk).update(run_after=timezone.now())
+        self.assertEqual(TaskQueue.run_pending(), 1)
+        task.refresh_from_db()
+        self.assertEqual(task.status, models.QueuedTask.FAILED)
+        self.assertEqual(task.attempts, 2)
+        self.assertEqual(TaskQueue.run_pending(), 0)
+
+    def test_status_updates(self):
+        dispatcher = StatusDispatcher.StatusDispatcher(1, StatusDispatcher.TokenBucket(1000, 1000))
+        with patch.object(StatusDispatcher, "_dispatcher", dispatcher):
+            good = TaskQueue.enqueue(status_task, value="good")
+            bad = TaskQueue.enqueue(status_task, value="bad")
+            self.assertEqual(TaskQueue.run_pending(), 2)
+            # The updates were sent before the tasks were done
+            self.assertEqual(task_calls, ["good", "bad"])
+            good.refresh_from_db()
+            self.assertEqual(good.status, models.QueuedTask.DONE)
+            # A failed update means the task gets retried
+            bad.refresh_from_db()
+            self.assertEqual(bad.status, models.QueuedTask.PENDING)
+            self.assertIn("Failed to send", bad.error)
+
+            # An update that failed outside of the task doesn't fail it
+            status_task("bad")
+            dispatcher.flush(5)
+            other = TaskQueue.enqueue(status_task, value="other")
+            TaskQueue.run_task(TaskQueue.claim_next())
+            other.refresh_from_db()
+            self.assertEqual(other.status, models.QueuedTask.DONE)
+            StatusDispatcher.forget()
+
+    def test_claim_next(self):
+        task = TaskQueue.enqueue(record_task, value=1)
+        claimed = TaskQueue.claim_next()
+        self.assertEqual(claimed.pk, task.pk)
+        self.assertEqual(claimed.status, models.QueuedTask.RUNNING)
+        self.assertIsNone(TaskQueue.claim_next())
+
+        # The worker running it died
+        old = timezone.now() - timedelta(days=1)
+        models.QueuedTask.objects.filter(pk=task.pk).update(last_modified=old)
+        claimed = TaskQueue.claim_next()
+        self.assertEqual(claimed.pk, task.pk)
+        self.assertEqual(claimed.attempts, 2)
+
+    def test_process_tasks(self):
+        TaskQueue.enqueue(record_task, value=1)
+        done = TaskQueue.enqueue(record_task, value=2)
+        TaskQueue.run_pending()
+        models.QueuedTask.objects.filter(pk=done.pk).update(last_modified=timezone.now() - timedelta(days=10))
+        TaskQueue.enqueue(record_task, value=3)
+
+        out = StringIO()
+        management.call_command("process_tasks", "--once", stdout=out)
+        self.assertIn("Removed 1 old tasks", out.getvalue())
+        self.assertIn("Ran 1 tasks", out.getvalue())
+        self.assertEqual(task_calls, [1, 2, 3])
+        self.assertEqual(models.QueuedTask.objects.count(), 2)
@@ -16,6 +16,7 @@
 from __future__ import unicode_literals, absolute_import
 from django.test import override_settings
 from ci.git_api import GitAPI
+from ci import git_api
 from ci.tests import utils
 from mock import patch
 from ci.tests import DBTester
@@ -88,3 +89,96 @@ class Tests(DBTester.DBTester):
         mock_get.side_effect = [response3, response4]
         data = self.api.get_all_pages("url")
         self.assertEqual(data, data3)
+
+    @patch.object(requests, 'get')
+    def test_get_conditional(self, mock_get):
+        git_api.get_response_cache().clear()
+        response = utils.Response(["foo"], headers={"ETag": '"abc"'})
+        mock_get.return_value = response
+        self.assertIs(self.api.get("url", params={"a": 1}), response)
+        self.assertNotIn("If-None-Match", mock_get.call_args[1]["headers"])
+
+        # Not modified, so we get the cached response
+        mock_get.return_value = utils.Response(status_code=304)
+        self.assertIs(self.api.get("url", params={"a": 1}), response)
+        self.assertEqual(mock_get.call_args[1]["headers"]["If-None-Match"], '"abc"')
+        self.assertIs(self.api._bad_response, False)
+
+        # Different params aren't cached
+        mock_get.return_value = utils.Response(["bar"])
+        self.assertEqual(self.api.get("url", params={"a": 2}).json(), ["bar"])
+        self.assertNotIn("If-None-Match", mock_get.call_args[1]["headers"])
+
+        # Modified
+        new_response = utils.Response(["baz"], headers={"Last-Modified": "Tue, 01 Jan 2019 00:00:00 GMT"})
+        mock_get.return_value = new_response
+        self.assertIs(self.api.get("url", params={"a": 1}), new_response)
+        mock_get.return_value = utils.Response(status_code=304)
+        self.assertIs(self.api.get("url", params={"a": 1}), new_response)
+        headers = mock_get.call_args[1]["headers"]
+        self.assertNotIn("If-None-Match", headers)
+        self.assertEqual(headers["If-Modified-Since"], "Tue, 01 Jan 2019 00:00:00 GMT")
+
+        # Another token doesn't share the cache
+        other_api = self.server.api()
+        other_api._token = "other"
+        mock_get.return_value = utils.Response(["other"])
+        self.assertEqual(other_api.get("url", params={"a": 1}).json(), ["other"])
+        self.assertNotIn("If-Modified-Since", mock_get.call_args[1]["headers"])
+
+    def test_response_cache(self):
+        cache = git_api.ResponseCache(2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.set("c", 3)
+        # "b" was the least recently used
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+
+        cache = git_api.ResponseCache(0)
+        cache.set("a", 1)
+        self.assertIsNone(cache.get("a"))
+
+    @patch.object(requests, 'get')
+    def test_get_all_pages_concurrent(self, mock_get):
+        def page_response(url, **kwargs):
+            if "page=" not in url:
+                response = utils.Response(["page1"])
+                response.links = {"next": {"url": "https://host/items?per_page=50&page=2"},
+                        "last": {"url": "https://host/items?per_page=50&page=4"}}
+                return response
+            page = url.split("page=")[-1]
+            if page == "3" and fail_page_3:
+                return utils.Response(status_code=500)
+            return utils.Response(["page%s" % page])
+
+        fail_page_3 = False
+        mock_get.side_effect = page_response
+        data = self.api.get_all_pages("https://host/items")
+        self.assertEqual(data, ["page1", "page2", "page3", "page4"])
+        self.assertEqual(mock_get.call_count, 4)
+        self.assertIs(self.api._bad_response, False)
+
+        self.assertEqual(self.api.errors(), [])
+
+        # Stops at the first page that failed
+        fail_page_3 = True
+        copies = []
+        thread_copy = self.api._thread_copy
+        def record_copy():
+            api = thread_copy()
+            copies.append(api)
+            return api
+        with patch.object(self.api, "_thread_copy", side_effect=record_copy):
+            data = self.api.get_all_pages("https://host/items")
+        self.assertEqual(data, ["page1", "page2"])
+        self.assertIs(self.api._bad_response, True)
+        # Each page had its own copy and the errors of the failed page are kept
+        self.assertEqual(len(copies), 3)
+        for api in copies:
+            self.assertIsNot(api._headers, self.api._headers)
+            self.assertIsNot(api._errors, self.api._errors)
+        self.assertEqual(len(self.api.errors()), 1)
+        self.assertIn("Status code: 500", self.api.errors()[0])
@@ -17,9 +17,10 @@ from __future__ import unicode_literals, absolute_import
 from django.test import TestCase
 from django.conf import settings
 from django.test import override_settings
-from ci import models
+from ci import models, ReadyJobsNotifier
 from . import utils
 import math
+from mock import patch
 
 @override_settings(INSTALLED_GITSERVERS=[utils.github_config()])
 class Tests(TestCase):
@@ -174,6 +175,84 @@ class Tests(TestCase):
         self.assertEqual(len(unrunnable), 1)
         self.assertIn(j2, unrunnable)
 
+    def test_event_job_graph(self):
+        event = utils.create_event()
+
+        r0 = utils.create_recipe(name='precheck')
+        r1 = utils.create_recipe(name='test')
+        r2 = utils.create_recipe(name='merge')
+        r3 = utils.create_recipe(name='loop0')
+        r4 = utils.create_recipe(name='loop1')
+        r2.depends_on.add(r1)
+        r1.depends_on.add(r0)
+        # circular dependency
+        r3.depends_on.add(r4)
+        r4.depends_on.add(r3)
+        j0 = utils.create_job(recipe=r0, event=event)
+        j1 = utils.create_job(recipe=r1, event=event)
+        j2 = utils.create_job(recipe=r2, event=event)
+        j3 = utils.create_job(recipe=r3, event=event)
+        j4 = utils.create_job(recipe=r4, event=event)
+
+        with self.assertNumQueries(2):
+            graph = event.get_job_graph()
+        with self.assertNumQueries(0):
+            self.assertEqual(graph.depends_on[j0], [])
+            self.assertEqual(graph.depends_on[j1], [j0])
+            self.assertEqual(graph.depends_on[j2], [j1])
+            self.assertEqual(graph.dependents[j0], [j1])
+            groups = graph.job_groups()
+            self.assertEqual(len(groups), 4)
+            self.assertEqual(groups[0], [j0])
+            self.assertEqual(groups[1], [j1])
+            self.assertEqual(groups[2], [j2])
+            self.assertEqual(sorted(groups[3], key=lambda j: j.pk), [j3, j4])
+            self.assertEqual(graph.unrunnable_jobs(), [])
+            self.assertEqual(len(event.get_sorted_jobs(graph)), 4)
+            self.assertFalse(event.check_done(graph))
+
+        j0.status = models.JobStatus.FAILED
+        j0.complete = True
+        j0.save()
+        graph = event.get_job_graph()
+        self.assertEqual(sorted(graph.unrunnable_jobs(), key=lambda j: j.pk), [j1, j2])
+        self.assertTrue(graph.is_unrunnable(j2))
+        self.assertFalse(graph.is_unrunnable(j3))
+        self.assertFalse(event.check_done(graph))
+
+        for j in [j3, j4]:
+            j.status = models.JobStatus.SUCCESS
+            j.complete = True
+            j.save()
+        graph = event.get_job_graph()
+        self.assertTrue(event.set_complete_if_done(graph))
+        event.refresh_from_db()
+        self.assertTrue(event.complete)
+        self.assertEqual(event.status, models.JobStatus.FAILED)
+
+    def test_event_make_jobs_ready(self):
+        event = utils.create_event()
+        r0 = utils.create_recipe(name='r0')
+        r1 = utils.create_recipe(name='r1')
+        r1.depends_on.add(r0)
+        j0 = utils.create_job(recipe=r0, event=event)
+        j1 = utils.create_job(recipe=r1, event=event)
+        utils.update_job(j0, ready=False)
+        utils.update_job(j1, ready=False)
+
+        with patch.object(ReadyJobsNotifier, 'notify_on_commit') as mock_notify:
+            event.make_jobs_ready()
+            j0.refresh_from_db()
+            j1.refresh_from_db()
+            self.assertTrue(j0.ready)
+            self.assertFalse(j1.ready)
+            self.assertEqual(mock_notify.call_count, 1)
+            self.assertEqual(list(mock_notify.call_args[0][0]), [r0.build_user.build_key])
+
+            # Nothing new is ready
+            event.make_jobs_ready()
+            self.assertEqual(mock_notify.call_count, 1)
+
     def test_event(self):
         event = utils.create_event()
         self.assertTrue(isinstance(event, models.Event))
@@ -468,6 +547,128 @@ class Tests(TestCase):
         sr.save()
         self.assertTrue(sr.clean_output().startswith("Output too large"))
 
+    def test_stepresult_chunks(self):
+        sr = utils.create_step_result()
+        sr.output = 'foo'
+        sr.save()
+        sr.append_output('bar')
+        self.assertEqual(sr.output, 'foobar')
+        sr.save()
+        sr.append_output('')
+        sr.append_output('baz')
+        sr.save()
+        self.assertEqual(sr.output_chunks.count(), 2)
+        self.assertEqual(sr.output, 'foobarbaz')
+
+        # Only the new output is written, the stored output is untouched
+        sr = models.StepResult.objects.get(pk=sr.pk)
+        self.assertEqual(sr.stored_output, 'foo')
+        self.assertEqual(sr.output, 'foobarbaz')
+        self.assertEqual(sr.plain_output(), 'foobarbaz')
+        self.assertEqual(sr.output_size(), '9.0 B')
+        self.assertEqual(models.StepResult.objects.get(pk=sr.pk).output_size(), '9.0 B')
+
+        sr = models.StepResult.objects.defer('stored_output').get(pk=sr.pk)
+        sr.append_output('\n')
+        sr.save()
+        sr.refresh_from_db()
+        self.assertEqual(sr.output, 'foobarbaz\n')
+        self.assertEqual([c.sequence for c in sr.output_chunks.all()], [0, 1, 2])
+
+        # Sequence numbers keep going up even if there is a gap
+        sr.output_chunks.filter(sequence=1).delete()
+        other = models.StepResult.objects.get(pk=sr.pk)
+        other.append_output('more')
+        sr.append_output('last')
+        other.save()
+        sr.save()
+        self.assertEqual([c.sequence for c in sr.output_chunks.all()], [0, 2, 3, 4])
+        sr.refresh_from_db()
+        self.assertEqual(sr.output, 'foobar\nmorelast')
+
+        # Setting the output replaces all the chunks
+        sr.output = 'new'
+        sr.save()
+        sr.refresh_from_db()
+        self.assertEqual(sr.output_chunks.count(), 0)
+        self.assertEqual(sr.output, 'new')
+
+        # Refreshing drops output that wasn't saved
+        sr.append_output('unsaved')
+        sr.output = 'replaced'
+        sr.append_output('unsaved')
+        sr.refresh_from_db()
+        self.assertEqual(sr.output, 'new')
+        self.assertEqual(sr.clean_output(), sr.output_html)
+        sr.save()
+        sr.refresh_from_db()
+        self.assertEqual(sr.output, 'new')
+        self.assertEqual(sr.output_chunks.count(), 0)
+
+    def test_stepresult_rendered_output(self):
+        sr = utils.create_step_result()
+        self.assertEqual(sr.render_state, "")
+        sr.append_output("<a>\n\33[31mred")
+        sr.save()
+        sr.append_output(" still red\33[")
+        sr.save()
+        sr.append_output("0m plain\n")
+        sr.save()
+        sr = models.StepResult.objects.get(pk=sr.pk)
+        self.assertEqual(sr.render_state, "")
+        chunks = [c.html for c in sr.output_chunks.all()]
+        self.assertEqual(chunks, ['&lt;a&gt;<br/><span class="ansi31">red</span>',
+            '<span class="ansi31"> still red</span>',
+            '<span class="ansi31"></span> plain<br/>'])
+        # No conversion when viewing
+        with patch.object(models, "terminalize_output") as mock_terminalize:
+            # The size of the output and the HTML of the chunks, the raw output isn't loaded
+            with self.assertNumQueries(2):
+                self.assertEqual(sr.clean_output(), "".join(chunks))
+            self.assertIsNone(sr._output)
+            self.assertEqual(mock_terminalize.call_count, 0)
+        self.assertEqual(sr.output_length(), len("<a>\n\33[31mred still red\33[0m plain\n"))
+        self.assertEqual(sr.output_length(), len(sr.output))
+        other = models.StepResult.objects.get(pk=sr.pk)
+        other.append_output("more")
+        self.assertEqual(other.output_length(), len(sr.output) + 4)
+
+        # Replacing the output with the same thing keeps what was rendered
+        with patch.object(models, "terminalize_output_chunk") as mock_terminalize:
+            sr.output = sr.output
+            sr.save()
+            self.assertEqual(mock_terminalize.call_count, 0)
+        self.assertEqual(sr.output_chunks.count(), 0)
+        self.assertEqual(sr.clean_output(), "".join(chunks))
+
+        # Replacing the output renders it all again
+        sr.output = "\33[1mbold"
+        sr.save()
+        self.assertEqual(sr.render_state, "\33[1m")
+        self.assertEqual(sr.clean_output(), models.terminalize_output("\33[1mbold"))
+
+        # Not rendered
+        sr.render_state = None
+        sr.save()
+        sr.append_output(" more")
+        sr.save()
+        self.assertEqual(sr.output_chunks.first().html, "")
+        self.assertEqual(sr.clean_output(), models.terminalize_output("\33[1mbold more"))
+
+    def test_terminalize_output_chunk(self):
+        html, state = models.terminalize_output_chunk("\33[1m\33[32mfoo\33[", "")
+        self.assertEqual(state, "\33[1m\33[32m\33[")
+        html, state = models.terminalize_output_chunk("0;33mbar", state)
+        self.assertEqual(state, "\33[33m")
+        self.assertIn("bar", html)
+        html, state = models.terminalize_output_chunk("\33[m", state)
+        self.assertEqual(state, "")
+
+        state = ""
+        for i in range(models.MAX_RENDER_STATE_CODES + 5):
+            html, state = models.terminalize_output_chunk("\33[3%sm" % (i % 8), state)
+        self.assertEqual(state.count("\33"), models.MAX_RENDER_STATE_CODES)
+
     def test_generate_build_key(self):
         build_key = models.generate_build_key()
         self.assertNotEqual('', build_key)
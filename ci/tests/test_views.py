@@ -17,7 +17,7 @@ from __future__ import unicode_literals, absolute_import
 from django.urls import reverse
 from django.test import override_settings
 from mock import patch
-from ci import models, views, Permissions, PullRequestEvent, GitCommitData
+from ci import models, views, Permissions, PullRequestEvent, GitCommitData, RequestStats
 from ci.tests import utils, DBTester
 from ci.github import api
 import datetime
@@ -1197,3 +1197,40 @@ class Tests(DBTester.DBTester):
 
         response = self.client.get(url)
         self.assertEqual(response.status_code, 200)
+
+    @patch.object(Permissions, 'is_allowed_to_see_clients')
+    def test_request_stats(self, mock_allowed):
+        RequestStats.get_store().clear()
+        RequestStats.get_store().add(RequestStats.Sample(view="ci:view_pr", method="GET", status=200,
+            duration=.5, queries=10, query_time=.1, duplicate_queries=3, size=100, timestamp=0))
+        mock_allowed.return_value = False
+        url = reverse('ci:request_stats')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, "ci:view_pr")
+
+        mock_allowed.return_value = True
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "ci:view_pr")
+
+        url = reverse('ci:request_stats_metrics')
+        mock_allowed.return_value = False
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 403)
+
+        mock_allowed.return_value = True
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'civet_request_duplicate_queries_total{view="ci:view_pr"} 3')
+
+        # Only when explicitly allowed by IP
+        mock_allowed.return_value = False
+        with self.settings(REQUEST_STATS_METRICS_IPS=["10.0.0.1"]):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 403)
+
+            response = self.client.get(url, REMOTE_ADDR="10.0.0.1")
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        RequestStats.get_store().clear()
@@ -295,9 +295,10 @@ class RequestInResponse(object):
         self.method = "HTTP METHOD"
 
 class Response(object):
-    def __init__(self, json_data=None, content=None, use_links=False, status_code=200, do_raise=False):
+    def __init__(self, json_data=None, content=None, use_links=False, status_code=200, do_raise=False, headers=None):
         self.status_code = status_code
         self.do_raise = do_raise
+        self.headers = headers or {}
         self.reason = "some reason"
         if use_links:
             self.links = {'next': {'url': 'next_url'}}
@@ -60,6 +60,8 @@ urlpatterns = [
     url(r'^pullrequests/', views.pr_list, name='pullrequest_list'),
     url(r'^branches/', views.branch_list, name='branch_list'),
     url(r'^clients/', views.client_list, name='client_list'),
+    url(r'^request_stats/metrics/$', views.request_stats_metrics, name='request_stats_metrics'),
+    url(r'^request_stats/$', views.request_stats, name='request_stats'),
     url(r'^mooseframework/', views.mooseframework, name='mooseframework'),
     url(r'^scheduled/', views.scheduled_events, name='scheduled'),
     url(r'^github/', include('ci.github.urls')),
@@ -23,12 +23,12 @@ from django.conf import settings
 from ci import models, event, forms
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.contrib import messages
-from django.db.models import Prefetch
+from django.db.models import Prefetch, Max
 from datetime import timedelta
 import time
 import tarfile
 from io import BytesIO
-from ci import RepositoryStatus, EventsStatus, Permissions, PullRequestEvent, ManualEvent, TimeUtils
+from ci import RepositoryStatus, EventsStatus, Permissions, PullRequestEvent, ManualEvent, TimeUtils, RequestStats
 from django.utils.html import escape
 from django.utils.text import get_valid_filename
 from django.views.decorators.cache import never_cache
@@ -292,6 +292,16 @@ def get_job_results(request, job_id):
     tar.close()
     return response
 
+def chunk_watermark(job):
+    """
+    Input:
+      job[models.Job]: The job
+    Return:
+      int: The pk of the latest output chunk of the job, 0 if there are none
+    """
+    chunk_q = models.StepResultChunk.objects.filter(step_result__job=job)
+    return chunk_q.aggregate(Max("pk"))["pk__max"] or 0
+
 def view_job(request, job_id):
     """
     View the details of a job, along
@@ -317,6 +327,10 @@ def view_job(request, job_id):
     perms['job'] = job
     perms['clients'] = clients
     perms['update_interval'] = settings.JOB_PAGE_UPDATE_INTERVAL
+    # Get this before the output gets loaded. Output added after this is
+    # streamed to the page, possibly overlapping what is rendered.
+    perms['last_chunk'] = chunk_watermark(job)
+    perms['stream_output'] = settings.JOB_OUTPUT_STREAM
     return render(request, 'ci/job.html', perms)
 
 def get_paginated(request, obj_list, obj_per_page=30):
@@ -498,6 +512,24 @@ def client_list(request):
     data = {'clients': client_list, 'allowed': True, 'update_interval': settings.HOME_PAGE_UPDATE_INTERVAL, }
     return render(request, 'ci/clients.html', data)
 
+def request_stats(request):
+    allowed = Permissions.is_allowed_to_see_clients(request.session)
+    if not allowed:
+        return render(request, 'ci/request_stats.html', {'stats': None, 'allowed': False})
+
+    data = {'stats': RequestStats.get_store().summary(),
+            'allowed': True,
+            'buffer_size': settings.REQUEST_STATS_BUFFER_SIZE,
+            }
+    return render(request, 'ci/request_stats.html', data)
+
+@never_cache
+def request_stats_metrics(request):
+    if (request.META.get('REMOTE_ADDR') not in settings.REQUEST_STATS_METRICS_IPS
+            and not Permissions.is_allowed_to_see_clients(request.session)):
+        return HttpResponseForbidden('Not allowed')
+    return HttpResponse(RequestStats.prometheus_text(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 def clients_info():
     """
     Gets the information on all the currently active clients.
@@ -241,9 +241,87 @@ GITSERVER_BITBUCKET = 2
 # Instead of checking the Git server each time to check if the
 # user is a collaborator on a repo, we cache the results
 # for this amount of time. Once this has expired then we
-# recheck.
+# recheck. The results are cached in the user's session as
+# well as in the Django cache, so they are shared between sessions.
 COLLABORATOR_CACHE_TIMEOUT = 60*60
 
+# The rendered status of repositories shown on the main page
+# is cached for this many seconds. Events use ci.models.EventSnapshot
+# instead. The cache keys include the last_modified times of the
+# records involved, so updates show up immediately.
+EVENTS_INFO_CACHE_TIMEOUT = 60*60
+
+# Work like updating the Git server after a job finishes can be
+# queued in the database and done by a separate worker, instead of
+# during the client's request. If this is False then a
+# "manage.py process_tasks" worker MUST be kept running, otherwise
+# PR statuses, issues and job info will never be updated.
+# Note that most Git server errors are logged by the Git API instead
+# of raised, so only failures that raise (like a failed status update
+# when "async_status_update" is set) cause a task to be retried.
+TASK_QUEUE_INLINE = True
+# How many times a task is tried before giving up
+TASK_QUEUE_MAX_ATTEMPTS = 5
+# Seconds to wait before retrying a failed task. This doubles with each attempt.
+TASK_QUEUE_RETRY_DELAY = 30
+# A task that has been running for this many seconds is assumed to
+# belong to a worker that died, and will be run again.
+TASK_QUEUE_STALE_TIMEOUT = 60*60
+
+# Git servers with "async_status_update" set send commit status updates from
+# this many background threads. Updates for the same commit and context that
+# haven't been sent yet are combined.
+GIT_STATUS_THREADS = 4
+# Status updates to all git servers are limited to this many per second
+# on average, with bursts of up to GIT_STATUS_BURST.
+GIT_STATUS_RATE = 5
+GIT_STATUS_BURST = 20
+# When a process exits it waits up to this many seconds for queued
+# status updates to be sent.
+GIT_STATUS_EXIT_TIMEOUT = 30
+
+# GET responses from the git servers that have an ETag or Last-Modified
+# header are kept so that later requests for the same URL can be conditional.
+# This is the maximum number of responses kept.
+GIT_API_RESPONSE_CACHE_SIZE = 500
+
+# When a git server says how many pages a listing has, this many
+# pages are fetched at the same time.
+GIT_API_PAGE_THREADS = 4
+
+# The part of the job payload sent to clients that only depends on the recipe
+# (scripts, environment, steps) is cached for this many seconds.
+# The cache key includes the SHA of the recipe repository so a change
+# to the recipes will not use an old payload.
+JOB_PAYLOAD_CACHE_TIMEOUT = 60*60
+
+# Clients can ask for ready jobs and have the request held until
+# there are jobs available. This is the maximum number of seconds a
+# request will be held.
+READY_JOBS_LONG_POLL_MAX_WAIT = 60
+# While a request is held, waiters are woken up through the cache.
+# If the server processes don't share a cache backend then they will
+# only notice new jobs when they recheck the database this often (in seconds).
+READY_JOBS_LONG_POLL_RECHECK = 10
+# The maximum number of requests held at once in each server process.
+# Each held request ties up a worker thread so once this is reached
+# clients get an immediate reply and fall back to polling.
+# Set to 0 to disable holding requests.
+READY_JOBS_LONG_POLL_MAX_WAITERS = 4
+
+# Per view request statistics (duration, database queries, response size).
+# This is off by default. To enable it add
+# "ci.RequestStats.RequestStatsMiddleware" to MIDDLEWARE.
+# The stats are shown on the request_stats page to users that can see the clients.
+# The number of most recent requests kept for the summary on the page.
+REQUEST_STATS_BUFFER_SIZE = 5000
+# Running totals are available in the Prometheus text format at request_stats/metrics/
+# to users that can see the clients.
+# To let a scraper read them without logging in, list its IP addresses here.
+# This trusts REMOTE_ADDR, so don't add the address of a reverse proxy
+# in front of the server, since then every request would be allowed.
+REQUEST_STATS_METRICS_IPS = []
+
 # The absolute url for the server. This is used
 # in places where we need to send links to outside
 # sources that will point to the server and we
@@ -254,6 +332,22 @@ ABSOLUTE_BASE_URL = "https://localhost"
 # Put here so that we can dynamically change these while testing
 HOME_PAGE_UPDATE_INTERVAL = 20000
 JOB_PAGE_UPDATE_INTERVAL = 20000
+
+# Whether the job page streams new output with server-sent events instead
+# of polling every JOB_PAGE_UPDATE_INTERVAL. Each open stream keeps a server
+# worker busy, so only turn this on when the server has workers to spare
+# (or uses async workers).
+JOB_OUTPUT_STREAM = False
+# How often (in seconds) the database is checked for changes
+JOB_OUTPUT_STREAM_INTERVAL = 5
+# The stream is closed after this many seconds and the browser reconnects
+JOB_OUTPUT_STREAM_TIMEOUT = 5*60
+# The maximum number of streams open at once in each server process.
+# Browsers that go over this fall back to polling.
+JOB_OUTPUT_STREAM_MAX = 10
+# How often (in seconds) to send something when nothing has changed so
+# that proxies don't close the connection
+JOB_OUTPUT_STREAM_KEEPALIVE = 15
 EVENT_PAGE_UPDATE_INTERVAL = 20000
 
 # This allows for cross origin resource sharing.
@@ -314,6 +408,7 @@ github_config = {"type": GITSERVER_GITHUB,
         "post_job_status": False,
         "remote_update": False,
         "install_webhook": False,
+        "async_status_update": False,
         "remove_pr_label_prefix": ["PR: [TODO]",],
         "pr_wip_prefix": ["WIP:", "[WIP]"],
         "failed_but_allowed_label_name": None,
@@ -337,6 +432,7 @@ gitlab_config = {"type": GITSERVER_GITLAB,
         "post_job_status": False,
         "remote_update": False,
         "install_webhook": False,
+        "async_status_update": False,
         "pr_wip_prefix": ["WIP:", "[WIP]"],
         "failed_but_allowed_label_name": None,
         "recipe_label_activation": {},
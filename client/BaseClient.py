@@ -18,6 +18,8 @@ import logging, logging.handlers
 from client.JobGetter import JobGetter
 from client.JobRunner import JobRunner
 from client.ServerUpdater import ServerUpdater
+from client.ServerSessions import ServerSessions
+from client.ScriptCache import ScriptCache
 from client.InterruptHandler import InterruptHandler
 import os, signal
 import time
@@ -105,6 +107,11 @@ class BaseClient(object):
         if self.client_info["ssl_cert"]:
             self.client_info["ssl_verify"] = self.client_info["ssl_cert"]
 
+        # Keeps connections to the servers alive between requests
+        self.sessions = ServerSessions(self.client_info)
+        # Keeps the scripts of the jobs so we don't have to get them every time
+        self.script_cache = ScriptCache(self.client_info, self.sessions)
+
     def set_log_dir(self, log_dir):
         """
         Sets the log dir. If log_dir is set
@@ -149,15 +156,38 @@ class BaseClient(object):
         self.check_log_dir(log_dir)
         self.client_info["log_file"] = log_file
 
+    def create_job_runner(self, job_info, message_q):
+        """
+        Input:
+          job_info: dict: The job information from the server
+          message_q: Queue: Where the runner puts the messages for the server
+        Return:
+          The JobRunner that runs the job
+        """
+        return JobRunner(self.client_info, job_info, message_q, self.command_q)
+
+    def create_server_updater(self, server, message_q, control_q, output_encoding):
+        """
+        Input:
+          server: str: The server the job is from
+          message_q: Queue: Where the runner puts the messages for the server
+          control_q: Queue: Used to control the updater
+          output_encoding: str: How to compress the output, as negotiated with the server
+        Return:
+          The ServerUpdater that sends the messages to the server
+        """
+        return ServerUpdater(server, self.client_info, message_q, self.command_q, control_q, self.sessions,
+                output_encoding)
+
     def run_claimed_job(self, server, servers, claimed):
         job_info = claimed["job_info"]
         job_id = job_info["job_id"]
         message_q = Queue()
-        runner = JobRunner(self.client_info, job_info, message_q, self.command_q)
+        runner = self.create_job_runner(job_info, message_q)
         self.cancel_signal.set_message({"job_id": job_id, "command": "cancel"})
 
         control_q = Queue()
-        updater = ServerUpdater(server, self.client_info, message_q, self.command_q, control_q)
+        updater = self.create_server_updater(server, message_q, control_q, claimed.get("output_encoding"))
         for entry in servers:
             if entry != server:
                 control_q.put({"server": entry, "message": "Running job on another server"})
@@ -178,7 +208,7 @@ class BaseClient(object):
         # However, we don't want to hang forever.
         logger.info("Joining ServerUpdater")
         updater_thread.join(self.thread_join_wait)
-        if updater_thread.isAlive():
+        if updater_thread.is_alive():
             logger.warning("Failed to join ServerUpdater thread. Job {}: '{}' not updated correctly".format(
                 job_id, job_info["recipe_name"]))
         self.command_q.queue.clear()
@@ -192,7 +222,7 @@ class BaseClient(object):
         while True:
             do_poll = True
             try:
-                getter = JobGetter(self.client_info)
+                getter = JobGetter(self.client_info, self.sessions, self.script_cache)
                 claimed = getter.find_job()
                 if claimed:
                     server = self.client_info["server"]
@@ -214,4 +244,16 @@ class BaseClient(object):
                 break
 
             if do_poll:
-                time.sleep(self.client_info["poll"])
+                self.wait_for_jobs(getter)
+
+    def wait_for_jobs(self, getter):
+        """
+        Wait until there might be jobs available.
+        If long polling is enabled and the server supports it then the server
+        holds the request until jobs are ready. Otherwise just sleep.
+        Input:
+          getter[JobGetter]: Used to wait on the server
+        """
+        if self.client_info.get("long_poll") and getter.wait_for_jobs(self.client_info["long_poll"]) is not None:
+            return
+        time.sleep(self.client_info["poll"])
@@ -43,7 +43,7 @@ class INLClient(BaseClient.BaseClient):
         self.client_info["server"] = server[0]
         self.client_info["build_key"] = server[1]
         self.client_info["ssl_verify"] = server[2]
-        getter = JobGetter(self.client_info)
+        getter = JobGetter(self.client_info, self.sessions, self.script_cache)
         claimed = getter.find_job()
         if claimed:
             load_modules = settings.CONFIG_MODULES[claimed['config']]
@@ -122,4 +122,18 @@ class INLClient(BaseClient.BaseClient):
             if single:
                 break
             if not ran_job:
-                time.sleep(self.client_info["poll"])
+                self.wait_for_server_jobs()
+
+    def wait_for_server_jobs(self):
+        """
+        Wait until there might be jobs available.
+        Waiting on a server would hold up checking the other servers,
+        so the server is only asked to wait when there is just one.
+        """
+        if len(settings.SERVERS) == 1:
+            self.client_info["server"] = settings.SERVERS[0][0]
+            self.client_info["build_key"] = settings.SERVERS[0][1]
+            self.client_info["ssl_verify"] = settings.SERVERS[0][2]
+            self.wait_for_jobs(JobGetter(self.client_info, self.sessions, self.script_cache))
+        else:
+            time.sleep(self.client_info["poll"])
@@ -18,13 +18,17 @@ import requests
 import traceback
 import json
 import logging
+from client.ServerSessions import ServerSessions
+from client import ServerUpdater, ScriptCache
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 
 logger = logging.getLogger("civet_client")
 
+OUTPUT_ENCODINGS_HEADER = "X-CIVET-Output-Encodings"
+
 class JobGetter(object):
-    def __init__(self, client_info):
+    def __init__(self, client_info, sessions=None, script_cache=None):
         """
         Input:
           client_info: A dictionary containing the following keys
@@ -34,9 +38,18 @@ class JobGetter(object):
             ssl_verify: Whether to use SSL verification when making a request.
             request_timeout: The timeout when making a request
             build_key: The build_key to be used.
+            claim_next_job: Optional. If False then always get the list of ready jobs and
+                try to claim them one by one like with older servers. Defaults to True.
+          sessions: A ServerSessions to make the requests with. If None then a new one is created.
+          script_cache: A ScriptCache. If given then the server only sends the SHA of the scripts
+            and they are filled in from the cache.
         """
         super(JobGetter, self).__init__()
         self.client_info = client_info
+        if sessions is None:
+            sessions = ServerSessions(client_info)
+        self.sessions = sessions
+        self.script_cache = script_cache
         self._headers = {b"User-Agent": b"INL-CIVET-Client/1.0 (+https://github.com/idaholab/civet)"}
 
     def find_job(self):
@@ -45,6 +58,12 @@ class JobGetter(object):
         Return:
           The job information if a job was successfully claimed. Otherwise None
         """
+        if self.client_info.get("claim_next_job", True):
+            claimed = self.claim_next_job()
+            if claimed is not False:
+                return claimed
+
+        # Older servers can only give us a list of jobs to try to claim
         jobs = self.get_possible_jobs()
 
         if jobs:
@@ -53,6 +72,109 @@ class JobGetter(object):
             return job
         return None
 
+    def claim_next_job(self):
+        """
+        Ask the server to claim the next job that matches one of our configs.
+        The server picks and claims the job in one request so we don't
+        have to get a list of jobs and then try to claim each one.
+        Return:
+          The dict of job data that we claimed, None if there wasn't a job or an error occurred,
+          or False if the server doesn't support claiming the next job.
+        """
+        url = "{}/client/claim_next_job/{}/{}/".format(self.client_info["server"],
+                self.client_info["build_key"],
+                self.client_info["client_name"])
+        claim_json = {
+          'configs': self.client_info["build_configs"],
+          'client_name': self.client_info["client_name"],
+          'script_cache': self.script_cache is not None,
+        }
+
+        logger.debug('Trying to claim the next job at {}'.format(url))
+        try:
+            in_json = json.dumps(claim_json, separators=(',', ': '))
+            response = self.sessions.post(url,
+                    in_json,
+                    headers=self._headers,
+                    verify=self.client_info["ssl_verify"],
+                    timeout=self.client_info["request_timeout"])
+            if response.status_code == 404:
+                logger.info("Server at %s doesn't support claiming the next job" % self.client_info["server"])
+                return False
+            response.raise_for_status()
+            claim = response.json()
+            if claim.get('success'):
+                logger.info("Claimed job %s config %s on recipe %s" % (claim['job_id'],
+                    claim['config'],
+                    claim['job_info']['recipe_name']))
+                claim['output_encoding'] = self.choose_output_encoding(response)
+                if not self.resolve_scripts(claim):
+                    return None
+                return claim
+            logger.info('No jobs to run')
+        except Exception:
+            logger.warning("Can't claim the next job at %s. Error: %s" % (self.client_info["server"], traceback.format_exc()))
+        return None
+
+    def resolve_scripts(self, claim):
+        """
+        Fill in the scripts that the server only sent the SHA for.
+        The job is already claimed so if a script couldn't be found
+        then the job is released so that it can be run again.
+        Input:
+          claim: The claim response from the server
+        Return:
+          bool: True if the job has all of its scripts
+        """
+        if self.script_cache is None:
+            return True
+        try:
+            self.script_cache.resolve(claim['job_info'])
+            return True
+        except ScriptCache.ScriptCacheException as e:
+            logger.warning("Can't get the scripts for job %s: %s" % (claim['job_id'], e))
+            self.release_job(claim['job_id'], str(e))
+            return False
+
+    def release_job(self, job_id, message):
+        """
+        Tell the server that we won't run a job that we claimed.
+        Input:
+          job_id: The ID of the job
+          message: The reason we can't run it
+        """
+        url = "{}/client/release_job/{}/{}/{}/".format(self.client_info["server"],
+                self.client_info["build_key"],
+                self.client_info["client_name"],
+                job_id)
+        try:
+            in_json = json.dumps({'message': message}, separators=(',', ': '))
+            response = self.sessions.post(url,
+                    in_json,
+                    headers=self._headers,
+                    verify=self.client_info["ssl_verify"],
+                    timeout=self.client_info["request_timeout"])
+            response.raise_for_status()
+            logger.info("Released job %s" % job_id)
+        except Exception as e:
+            logger.warning("Failed to release job %s at %s. Error: %s" % (job_id, self.client_info["server"], e))
+
+    def choose_output_encoding(self, response):
+        """
+        The server lists the encodings it accepts for step output in a header
+        of the claim response. Pick the best one that we also support.
+        Input:
+          response: The requests.Response of claiming a job
+        Return:
+          The name of the encoding or None if the output shouldn't be encoded
+        """
+        accepted = response.headers.get(OUTPUT_ENCODINGS_HEADER, "")
+        accepted = [enc.strip() for enc in accepted.split(",")]
+        for encoding in ServerUpdater.output_encoders().keys():
+            if encoding in accepted:
+                return encoding
+        return None
+
     def get_possible_jobs(self):
         """
         Request a list of jobs from the server.
@@ -69,7 +191,7 @@ class JobGetter(object):
 
         logger.debug('Trying to get jobs at {}'.format(job_url))
         try:
-            response = requests.get(job_url,
+            response = self.sessions.get(job_url,
                     headers=self._headers,
                     verify=self.client_info["ssl_verify"],
                     timeout=self.client_info.get("request_timeout", 30))
@@ -85,6 +207,38 @@ class JobGetter(object):
             logger.warning(err_str)
             return None
 
+    def wait_for_jobs(self, timeout):
+        """
+        Ask the server to hold the request until there is a job
+        we could run, instead of repeatedly polling for jobs.
+        Input:
+          timeout: Maximum number of seconds that the server should wait
+        Return:
+          True if there are jobs available, False if the server timed out,
+          or None if an error occurred or the server doesn't support waiting.
+        """
+        job_url = "{}/client/ready_jobs/{}/{}/".format(self.client_info["server"],
+                self.client_info["build_key"],
+                self.client_info["client_name"])
+        params = {"wait": timeout, "configs": self.client_info["build_configs"]}
+
+        logger.debug('Waiting up to {} seconds for jobs at {}'.format(timeout, job_url))
+        try:
+            response = self.sessions.get(job_url,
+                    params=params,
+                    headers=self._headers,
+                    verify=self.client_info["ssl_verify"],
+                    timeout=timeout + self.client_info.get("request_timeout", 30))
+            response.raise_for_status()
+            data = response.json()
+            if not data.get('long_poll') or 'jobs' not in data:
+                logger.info("Server at %s doesn't support waiting for jobs" % self.client_info["server"])
+                return None
+            return len(data['jobs']) > 0
+        except Exception as e:
+            logger.warning("Can't wait for jobs at {}.\nError: {}".format(self.client_info["server"], e))
+            return None
+
     def claim_job(self, jobs):
         """
         We have a list of jobs from the server. Now try
@@ -106,6 +260,7 @@ class JobGetter(object):
               'job_id': job['id'],
               'config': config,
               'client_name': self.client_info["client_name"],
+              'script_cache': self.script_cache is not None,
             }
 
             try:
@@ -114,7 +269,7 @@ class JobGetter(object):
                         config,
                         self.client_info["client_name"])
                 in_json = json.dumps(claim_json, separators=(',', ': '))
-                response = requests.post(url,
+                response = self.sessions.post(url,
                         in_json,
                         headers=self._headers,
                         verify=self.client_info["ssl_verify"],
@@ -125,6 +280,9 @@ class JobGetter(object):
                     logger.info("Claimed job %s config %s on recipe %s" % (job['id'],
                         config,
                         claim['job_info']['recipe_name']))
+                    claim['output_encoding'] = self.choose_output_encoding(response)
+                    if not self.resolve_scripts(claim):
+                        return None
                     return claim
                 else:
                     logger.info("Failed to claim job %s. Response: %s" % (job['id'], claim))
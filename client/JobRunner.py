@@ -22,14 +22,13 @@ import contextlib
 import signal
 import traceback
 from distutils import spawn
+from client import OutputReader
 logger = logging.getLogger("civet_client")
 
 try:
-    from queue import Queue, Empty
+    from queue import Empty
 except ImportError:
-    from Queue import Queue, Empty
-
-from threading import Thread
+    from Queue import Empty
 
 @contextlib.contextmanager
 def temp_file(*args, **kwargs):
@@ -163,17 +162,24 @@ class JobRunner(object):
         logger.info("Finished Job {}: {}".format(job_id, self.job_data['recipe_name']))
         return job_msg
 
-    def add_message(self, url, msg):
+    def add_message(self, url, msg, stage=None, stepresult_id=None):
         """
         Puts a message on the message queue that will be read in by the ServerUpdater.
         Input:
           url: str: URL the ServerUpdater will post to.
           msg: dict: Payload to post to the URL
+          stage: str: For step result updates, one of "start", "complete", or "update".
+              This allows the ServerUpdater to send them in batches.
+          stepresult_id: int: For step result updates, the ID of the step result
         """
-        self.message_q.put({"server": self.client_info["server"],
+        item = {"server": self.client_info["server"],
             "job_id": self.job_data["job_id"],
             "url": url,
-            "payload": msg.copy()})
+            "payload": msg.copy()}
+        if stage:
+            item["stage"] = stage
+            item["stepresult_id"] = stepresult_id
+        self.message_q.put(item)
 
     def update_step(self, stage, step, chunk_data):
         """
@@ -185,46 +191,16 @@ class JobRunner(object):
           chunk_data: This will be the payload that is posted to the server
         """
         options = {"start": "start_step_result", "complete": "complete_step_result", "update": "update_step_result"}
-        keyword = options.get(stage, "update_step_result")
+        if stage not in options:
+            stage = "update"
+        keyword = options[stage]
 
         url = "{}/client/{}/{}/{}/{}/".format(self.client_info["server"],
                 keyword,
                 self.client_info["build_key"],
                 self.client_info["client_name"],
                 step["stepresult_id"])
-        self.add_message(url, chunk_data)
-
-    def get_output_from_queue(self, q, timeout=1):
-        """
-        Grabs all the available output from the queue and returns it.
-        This is used with reading the output of a subprocess so everything on
-        the queue should just be strings.
-
-        On the first run through we block if timeout is non zero. This will slow down the overall
-        read process loop so that we are not constantly busy waiting trying
-        to read the output.
-        Input:
-          q: Queue to read from
-          timeout: int: How long to block while trying to read
-        Return:
-          list: str: Output read.
-        """
-        output = []
-        block = False
-        if timeout:
-            block = True
-
-        try:
-            while True:
-                line = q.get(block=block, timeout=timeout)
-                output.append(line)
-                block = False
-        except Empty:
-            """
-            We always return from here since eventually we will
-            read all the messages on the queue and trigger an Empty exception.
-            """
-            return output
+        self.add_message(url, chunk_data, stage, step["stepresult_id"])
 
     def read_command(self):
         """
@@ -247,6 +223,25 @@ class JobRunner(object):
         except Empty:
             pass
 
+    def add_output(self, out, data):
+        """
+        Adds output of a process to the output buffer, along
+        with a message if it just went over the maximum size.
+        Input:
+          out: OutputReader.OutputBuffer: Holds the output
+          data: bytes: Output that was read
+        Return:
+          str: The output that was kept
+        """
+        was_over = out.over_max
+        text = out.add(data)
+        if out.over_max and not was_over:
+            out.append("\n\n*****************************************************\n\n")
+            out.append("CIVET: Output size exceeded limit (%s bytes), further output will not be displayed!\n"
+                    % self.max_output_size)
+            out.append("\n*****************************************************\n")
+        return text
+
     def read_process_output(self, proc, step, step_data):
         """
         This reads the output of a process and adds messages
@@ -258,29 +253,16 @@ class JobRunner(object):
         Return:
           dict: An updated step_data
         """
-        out = []
+        out = OutputReader.OutputBuffer(self.max_output_size)
         chunk_out = []
         start_time = time.time()
         max_end_time = start_time + int(step["environment"].get("CIVET_MAX_STEP_TIME", self.max_step_time))
         chunk_start_time = time.time()
         step_data["canceled"] = False
-        over_max = False
         keep_output = False
 
-        # This allows non-blocking read on Unix & Windows
-        # See: http://stackoverflow.com/questions/375427/non-blocking-read-on-a-subprocess-pipe-in-python
-        def enqueue_output(out, queue):
-            for line in iter(out.readline, b''):
-                if line:
-                    # Make sure it doesn't have any bad unicode characters
-                    line = line.decode("utf-8", "replace")
-                queue.put(line)
-            out.close()
-
-        q = Queue()
-        t = Thread(target=enqueue_output, args=(proc.stdout, q))
-        t.daemon = True
-        t.start();
+        # Windows pipes can't be used with select() so a thread reads them instead
+        reader = OutputReader.create_reader(proc.stdout, self.is_windows())
 
         while proc.poll() is None:
             if self.canceled or self.stopped:
@@ -290,19 +272,10 @@ class JobRunner(object):
                 step_data['output'] = ""
                 break
 
-            output = self.get_output_from_queue(q)
-            if output and not over_max:
-                out.extend(output)
-                chunk_out.extend(output)
-
-            # Don't worry that "out" might contain multibyte characters, we
-            # just want a rough size check
-            if not over_max and len("".join(out)) >= self.max_output_size:
-                over_max = True
-                out.append("\n\n*****************************************************\n\n")
-                out.append("CIVET: Output size exceeded limit (%s bytes), further output will not be displayed!\n"
-                        % self.max_output_size)
-                out.append("\n*****************************************************\n")
+            # Blocks for a little bit if there isn't any output so we are not busy waiting
+            output = reader.read(1)
+            if output and not out.over_max:
+                chunk_out.append(self.add_output(out, output))
 
             diff = time.time() - chunk_start_time
             if diff > self.client_info["update_step_time"]: # Report some output every x seconds
@@ -322,12 +295,12 @@ class JobRunner(object):
 
             self.read_command() # this will set the internal flags to cancel or stop
 
-        t.join() # make sure the step has no more output
-
-        # we might not have gotten everything
-        out.extend(self.get_output_from_queue(q, timeout=0))
+        # make sure the step has no more output
+        for output in reader.finish():
+            self.add_output(out, output)
+        out.flush()
         if not step_data['canceled'] or keep_output:
-            step_data['output'] = ''.join(out)
+            step_data['output'] = out.getvalue()
         step_data['complete'] = True
         step_data['time'] = int(time.time() - start_time) #would be float
         return step_data
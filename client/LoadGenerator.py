@@ -0,0 +1,454 @@
+
+# Copyright 2016 Battelle Energy Alliance, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import unicode_literals, absolute_import
+import logging
+import math
+import multiprocessing
+import os
+import threading
+import time
+from client.BaseClient import BaseClient
+from client.InterruptHandler import InterruptHandler
+from client.JobRunner import JobRunner
+from client.ServerSessions import ServerSessions
+from client.ScriptCache import ScriptCache
+from client.ServerUpdater import ServerUpdater
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+logger = logging.getLogger("civet_client")
+
+# Simulates a fleet of clients against a server to measure how it holds up.
+# Each simulated client is a BaseClient that runs in its own thread. It uses the real
+# JobGetter and ServerUpdater to talk to the server, but the steps of the jobs
+# are not run. Instead a FakeJobRunner produces output at a configurable rate
+# for a configurable amount of time.
+
+class LoadStats(object):
+    """
+    The measurements shared by all the simulated clients in a process
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.claims = 0
+        self.failed_claims = 0
+        self.jobs = 0
+        self.job_times = []
+        self.update_lags = []
+
+    def add_request(self, endpoint, seconds, ok):
+        """
+        Input:
+          endpoint: str: The client API endpoint, like "claim_job"
+          seconds: float: How long the request took
+          ok: bool: Whether the request succeeded
+        """
+        with self._lock:
+            entry = self.requests.setdefault(endpoint, {"count": 0, "errors": 0, "times": []})
+            entry["count"] += 1
+            entry["times"].append(seconds)
+            if not ok:
+                entry["errors"] += 1
+
+    def add_claim(self, success):
+        with self._lock:
+            if success:
+                self.claims += 1
+            else:
+                self.failed_claims += 1
+
+    def add_job(self, seconds):
+        with self._lock:
+            self.jobs += 1
+            self.job_times.append(seconds)
+
+    def add_update_lags(self, lags):
+        with self._lock:
+            self.update_lags.extend(lags)
+
+    def to_dict(self):
+        """
+        Return:
+          dict: The raw measurements, to be passed between processes
+        """
+        with self._lock:
+            return {"requests": dict([(k, dict(v, times=list(v["times"]))) for k, v in self.requests.items()]),
+                "claims": self.claims,
+                "failed_claims": self.failed_claims,
+                "jobs": self.jobs,
+                "job_times": list(self.job_times),
+                "update_lags": list(self.update_lags),
+                }
+
+def merge_stats(stats_list):
+    """
+    Input:
+      stats_list: list of dicts as returned by LoadStats.to_dict()
+    Return:
+      dict: All of them combined
+    """
+    merged = LoadStats().to_dict()
+    for stats in stats_list:
+        for endpoint, entry in stats["requests"].items():
+            m = merged["requests"].setdefault(endpoint, {"count": 0, "errors": 0, "times": []})
+            m["count"] += entry["count"]
+            m["errors"] += entry["errors"]
+            m["times"].extend(entry["times"])
+        for key in ["claims", "failed_claims", "jobs"]:
+            merged[key] += stats[key]
+        for key in ["job_times", "update_lags"]:
+            merged[key].extend(stats[key])
+    return merged
+
+def percentile(values, pct):
+    """
+    Nearest rank percentile, 0 if there are no values
+    """
+    if not values:
+        return 0
+    ordered = sorted(values)
+    rank = int(math.ceil(pct / 100.0 * len(ordered))) - 1
+    return ordered[min(max(rank, 0), len(ordered) - 1)]
+
+def endpoint_name(url):
+    """
+    Input:
+      url: str: URL of a client API request, like <server>/client/claim_job/...
+    Return:
+      str: The name of the endpoint, like "claim_job"
+    """
+    parts = [p for p in urlparse(url).path.split("/") if p]
+    if "client" in parts and parts.index("client") + 1 < len(parts):
+        return parts[parts.index("client") + 1]
+    return parts[0] if parts else ""
+
+class CountingSessions(ServerSessions):
+    """
+    ServerSessions that records every request in a LoadStats
+    """
+    def __init__(self, client_info, stats):
+        super(CountingSessions, self).__init__(client_info)
+        self.stats = stats
+
+    def _record(self, url, start, response):
+        name = endpoint_name(url)
+        ok = response.status_code < 400
+        self.stats.add_request(name, time.time() - start, ok)
+        if name == "claim_job":
+            # Anything besides a successful claim means somebody else got the job first
+            self.stats.add_claim(ok and response.json().get("success", False))
+        elif name == "claim_next_job" and ok and response.json().get("success"):
+            self.stats.add_claim(True)
+
+    def get(self, url, **kwargs):
+        start = time.time()
+        response = super(CountingSessions, self).get(url, **kwargs)
+        self._record(url, start, response)
+        return response
+
+    def post(self, url, data, **kwargs):
+        start = time.time()
+        response = super(CountingSessions, self).post(url, data, **kwargs)
+        self._record(url, start, response)
+        return response
+
+class TimestampedQueue(object):
+    """
+    Wraps the message queue of a JobRunner so that each message
+    records the time it was added.
+    """
+    def __init__(self, queue):
+        self.queue = queue
+
+    def put(self, item):
+        item["queued_time"] = time.time()
+        self.queue.put(item)
+
+class FakeJobRunner(JobRunner):
+    """
+    A JobRunner that doesn't run the step scripts.
+    Each step takes step_time seconds and produces output_rate bytes of output
+    per second, which is sent to the server like real output.
+    The time the messages are queued is recorded so that the update lag can be measured.
+    """
+    def __init__(self, client_info, job, message_q, command_q, step_time=1, output_rate=1024):
+        super(FakeJobRunner, self).__init__(client_info, job, TimestampedQueue(message_q), command_q)
+        self.step_time = step_time
+        self.output_rate = output_rate
+
+    def fake_output(self, num_bytes, line_num):
+        """
+        Input:
+          num_bytes: int: Roughly how many bytes of output to generate
+          line_num: int: Number of the first line
+        Return:
+          (str, int): The output and the number of the next line
+        """
+        lines = []
+        size = 0
+        while size < num_bytes:
+            line = "Line %s: %s\n" % (line_num, "x" * 60)
+            lines.append(line)
+            size += len(line)
+            line_num += 1
+        return "".join(lines), line_num
+
+    def run_platform_process(self, step, step_env, step_data):
+        start_time = time.time()
+        end_time = start_time + self.step_time
+        chunk_start_time = start_time
+        out = []
+        line_num = 0
+        step_data["canceled"] = False
+        while time.time() < end_time:
+            time.sleep(min(0.1, max(end_time - time.time(), 0)))
+            self.read_command()
+            if self.canceled or self.stopped:
+                step_data["canceled"] = True
+                step_data["output"] = ""
+                break
+
+            now = time.time()
+            if now - chunk_start_time >= self.client_info["update_step_time"] or now >= end_time:
+                output, line_num = self.fake_output(int((now - chunk_start_time) * self.output_rate), line_num)
+                out.append(output)
+                step_data["output"] = output
+                step_data["time"] = int(now - start_time)
+                self.update_step("update", step, step_data)
+                chunk_start_time = now
+
+        if not step_data["canceled"]:
+            step_data["output"] = "".join(out)
+        step_data["complete"] = True
+        step_data["exit_status"] = 0
+        step_data["time"] = int(time.time() - start_time)
+        self.update_step("complete", step, step_data)
+        return step_data
+
+class TimedServerUpdater(ServerUpdater):
+    """
+    A ServerUpdater that records how long messages waited before they were sent
+    """
+    def __init__(self, stats, *args, **kwargs):
+        super(TimedServerUpdater, self).__init__(*args, **kwargs)
+        self.stats = stats
+        self._queued_times = []
+
+    def next_message(self):
+        item, count = super(TimedServerUpdater, self).next_message()
+        self._queued_times = [msg.get("queued_time") for msg in self.messages[:count]]
+        return item, count
+
+    def post_message(self, item):
+        sent = super(TimedServerUpdater, self).post_message(item)
+        if sent:
+            now = time.time()
+            self.stats.add_update_lags([now - t for t in self._queued_times if t is not None])
+        return sent
+
+class SimulatedClient(BaseClient):
+    """
+    A BaseClient that runs jobs with a FakeJobRunner and records what happens.
+    It doesn't set up logging or signal handlers so that many can run in one process.
+    """
+    def __init__(self, client_info, stats, step_time=1, output_rate=1024):
+        self.client_info = client_info
+        self.command_q = Queue()
+        self.runner_error = False
+        self.thread_join_wait = 60
+        self.cancel_signal = InterruptHandler(self.command_q, sig=[])
+        self.graceful_signal = InterruptHandler(self.command_q, sig=[])
+        self.sessions = CountingSessions(client_info, stats)
+        self.script_cache = ScriptCache(client_info, self.sessions)
+        self.stats = stats
+        self.step_time = step_time
+        self.output_rate = output_rate
+
+    def create_job_runner(self, job_info, message_q):
+        return FakeJobRunner(self.client_info, job_info, message_q, self.command_q,
+                step_time=self.step_time, output_rate=self.output_rate)
+
+    def create_server_updater(self, server, message_q, control_q, output_encoding):
+        return TimedServerUpdater(self.stats, server, self.client_info, message_q, self.command_q, control_q,
+                self.sessions, output_encoding)
+
+    def run_claimed_job(self, server, servers, claimed):
+        start = time.time()
+        super(SimulatedClient, self).run_claimed_job(server, servers, claimed)
+        self.stats.add_job(time.time() - start)
+
+    def stop(self):
+        """
+        Stop after the current job, like on SIGUSR2
+        """
+        self.graceful_signal.triggered = True
+
+def client_info(server, build_key, configs, name, poll=1, long_poll=0, update_step_time=1, claim_next_job=True):
+    """
+    Input:
+      server: str: URL of the server
+      build_key: str: The build key
+      configs: list: The build configs to run
+      name: str: Name of the client
+      poll: int: Seconds between polling when there are no jobs
+      long_poll: int: Seconds to ask the server to hold the request, 0 to disable
+      update_step_time: int: Seconds between output updates
+      claim_next_job: bool: Whether to use claim_next_job or get the list of jobs and claim them one by one
+    Return:
+      dict: The information the client classes need
+    """
+    return {"url": server,
+        "client_name": name,
+        "server": server,
+        "servers": [server],
+        "build_configs": configs,
+        "ssl_verify": False,
+        "ssl_cert": None,
+        "log_file": None,
+        "log_dir": None,
+        "build_key": build_key,
+        "single_shot": False,
+        "poll": poll,
+        "long_poll": long_poll,
+        "claim_next_job": claim_next_job,
+        "request_timeout": 30,
+        "update_step_time": update_step_time,
+        "server_update_interval": 20,
+        "server_update_timeout": 1,
+        "max_output_size": 5*1024*1024,
+        }
+
+def run_clients(infos, duration, step_time=1, output_rate=1024):
+    """
+    Runs simulated clients in threads.
+    After duration seconds the clients are asked to stop and we wait for
+    them to finish their current job.
+    Input:
+      infos: list of dicts as returned by client_info()
+      duration: float: Seconds to run for
+      step_time: float: Seconds each step takes
+      output_rate: int: Bytes of output per second for each step
+    Return:
+      dict: As returned by LoadStats.to_dict()
+    """
+    stats = LoadStats()
+    clients = [SimulatedClient(info, stats, step_time, output_rate) for info in infos]
+    threads = [threading.Thread(target=c.run) for c in clients]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    time.sleep(duration)
+    for c in clients:
+        c.stop()
+    for t in threads:
+        t.join()
+    return stats.to_dict()
+
+def _run_clients_process(args):
+    return run_clients(*args)
+
+def process_cpu_seconds(pid):
+    """
+    Input:
+      pid: int: Process ID, for example of the server
+    Return:
+      float: The user + system CPU seconds used by the process, None if it couldn't be read.
+        This only works on systems with /proc.
+    """
+    try:
+        with open("/proc/%s/stat" % pid, "r") as f:
+            # The command name can have spaces so start after it
+            fields = f.read().rsplit(")", 1)[1].split()
+        ticks = os.sysconf(os.sysconf_names["SC_CLK_TCK"])
+        return (float(fields[11]) + float(fields[12])) / ticks
+    except Exception:
+        return None
+
+def run(server, build_key, configs, num_clients, duration, processes=1, step_time=1, output_rate=1024,
+        poll=1, long_poll=0, update_step_time=1, claim_next_job=True, server_pid=None):
+    """
+    Runs a fleet of simulated clients against a server.
+    Input:
+      server: str: URL of the server
+      build_key: str: The build key of the jobs to run
+      configs: list: The build configs the clients support
+      num_clients: int: Total number of clients
+      duration: float: Seconds to run for. Clients finish their current job after that.
+      processes: int: Number of processes to spread the clients over
+      server_pid: int: If given then the CPU used by this process is measured
+      The rest are as in client_info() and run_clients()
+    Return:
+      dict: The combined measurements as returned by merge_stats() and
+        "elapsed" with the number of seconds it took and "server_cpu" with the
+        server CPU seconds used, or None if not measured.
+    """
+    infos = [client_info(server, build_key, configs, "load-client-%s-%s" % (os.getpid(), i), poll, long_poll,
+        update_step_time, claim_next_job) for i in range(num_clients)]
+    cpu_start = process_cpu_seconds(server_pid) if server_pid else None
+    start = time.time()
+    if processes > 1:
+        groups = [infos[i::processes] for i in range(processes)]
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_run_clients_process,
+                    [(group, duration, step_time, output_rate) for group in groups if group])
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [run_clients(infos, duration, step_time, output_rate)]
+    stats = merge_stats(results)
+    stats["elapsed"] = time.time() - start
+    stats["server_cpu"] = None
+    if cpu_start is not None:
+        cpu_end = process_cpu_seconds(server_pid)
+        if cpu_end is not None:
+            stats["server_cpu"] = cpu_end - cpu_start
+    return stats
+
+def format_stats(stats):
+    """
+    Input:
+      stats: dict: As returned by run()
+    Return:
+      str: A report of the measurements
+    """
+    elapsed = stats["elapsed"] or 1
+    lines = ["Elapsed: %.1f s" % stats["elapsed"],
+        "Jobs finished: %s (%.2f jobs/min)" % (stats["jobs"], stats["jobs"] * 60.0 / elapsed),
+        "Job time p50/p95: %.2f/%.2f s" % (percentile(stats["job_times"], 50), percentile(stats["job_times"], 95)),
+        "Claims: %s, failed claims: %s (%.2f failed per success)" % (stats["claims"], stats["failed_claims"],
+            float(stats["failed_claims"]) / stats["claims"] if stats["claims"] else 0),
+        "Update lag p50/p95/max: %.3f/%.3f/%.3f s" % (percentile(stats["update_lags"], 50),
+            percentile(stats["update_lags"], 95), max(stats["update_lags"] or [0])),
+        ]
+    if stats["server_cpu"] is not None:
+        lines.append("Server CPU: %.1f s (%.1f%%)" % (stats["server_cpu"], stats["server_cpu"] * 100.0 / elapsed))
+    lines.append("%-22s %8s %8s %9s %9s" % ("endpoint", "requests", "errors", "p50 ms", "p95 ms"))
+    for name in sorted(stats["requests"].keys()):
+        entry = stats["requests"][name]
+        lines.append("%-22s %8d %8d %9.1f %9.1f" % (name, entry["count"], entry["errors"],
+            percentile(entry["times"], 50) * 1000, percentile(entry["times"], 95) * 1000))
+    return "\n".join(lines)
@@ -0,0 +1,255 @@
+
+# Copyright 2016 Battelle Energy Alliance, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import unicode_literals, absolute_import
+import os
+import codecs
+from threading import Thread
+
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+
+try:
+    import selectors
+except ImportError:
+    selectors = None
+
+# Reading the output of a step.
+# The output is read in large chunks of bytes instead of line by line since
+# steps can print millions of short lines. On Unix the pipe is read with
+# non blocking reads. Windows pipes don't work with select() so a thread
+# does blocking reads on the pipe instead.
+
+# How many bytes to ask for with each read
+READ_SIZE = 64*1024
+
+# The most bytes that read() will return at a time so that the
+# caller still gets to check for commands while there is a lot of output.
+MAX_READ = 16*READ_SIZE
+
+class OutputBuffer(object):
+    """
+    Holds the output of a step, up to a maximum number of bytes.
+    Once the maximum is reached any further output is dropped.
+    The output is decoded as UTF-8 as it comes in. A multibyte character that
+    is split between reads is decoded once the rest of it is read.
+    """
+    def __init__(self, max_size):
+        """
+        Input:
+          max_size[int]: Maximum number of bytes of output to keep
+        """
+        self.max_size = max_size
+        self.size = 0
+        self.over_max = False
+        self._parts = []
+        self._decoder = codecs.getincrementaldecoder("utf-8")("replace")
+
+    def add(self, data):
+        """
+        Input:
+          data[bytes]: Output that was read
+        Return:
+          str: The part of data that was kept, decoded
+        """
+        if self.over_max or not data:
+            return ""
+        remaining = self.max_size - self.size
+        if len(data) >= remaining:
+            # Keep the rest of the line that reaches the limit
+            end = data.find(b"\n", max(remaining - 1, 0))
+            if end < 0 or end - remaining >= READ_SIZE:
+                end = remaining + READ_SIZE
+            data = data[:end + 1]
+        self.size += len(data)
+        text = self._decoder.decode(data)
+        if self.size >= self.max_size:
+            self.over_max = True
+            text += self._decoder.decode(b"", True)
+        self._parts.append(text)
+        return text
+
+    def append(self, text):
+        """
+        Add a message to the output. This isn't counted against the maximum size.
+        Input:
+          text[str]: Message to add
+        """
+        self._parts.append(text)
+
+    def flush(self):
+        """
+        Decodes any partial character left over. Used once there is no more output.
+        Return:
+          str: The text that was added
+        """
+        text = self._decoder.decode(b"", True)
+        if text:
+            self._parts.append(text)
+        return text
+
+    def getvalue(self):
+        """
+        Return:
+          str: All the output kept
+        """
+        return "".join(self._parts)
+
+class SelectOutputReader(object):
+    """
+    Reads a pipe using select()
+    """
+    def __init__(self, stream):
+        """
+        Input:
+          stream[file]: The stdout of a subprocess
+        """
+        self.stream = stream
+        self.fd = stream.fileno()
+        self.eof = False
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.fd, selectors.EVENT_READ)
+
+    def _read_available(self, timeout):
+        """
+        Input:
+          timeout[float]: How long to wait for output, None to wait until there is some
+        Return:
+          bytes: Output read, up to MAX_READ bytes
+        """
+        chunks = []
+        size = 0
+        while not self.eof and size < MAX_READ:
+            if self.stream.closed:
+                # The job got killed
+                self.eof = True
+                break
+            if not self.selector.select(timeout):
+                break
+            data = os.read(self.fd, READ_SIZE)
+            if not data:
+                self.eof = True
+                break
+            chunks.append(data)
+            size += len(data)
+            timeout = 0
+        return b"".join(chunks)
+
+    def read(self, timeout):
+        """
+        Input:
+          timeout[float]: How long to wait for output
+        Return:
+          bytes: Output that is available, b"" if there isn't any
+        """
+        return self._read_available(timeout)
+
+    def finish(self):
+        """
+        Reads until the end of the output. Used after the process has exited.
+        Return:
+          list[bytes]: The rest of the output
+        """
+        output = []
+        while not self.eof:
+            data = self._read_available(None)
+            if data:
+                output.append(data)
+        self.close()
+        return output
+
+    def close(self):
+        self.selector.close()
+        if not self.stream.closed:
+            self.stream.close()
+
+class ThreadOutputReader(object):
+    """
+    Reads a pipe with a thread that does blocking reads.
+    """
+    def __init__(self, stream):
+        """
+        Input:
+          stream[file]: The stdout of a subprocess
+        """
+        self.stream = stream
+        self.queue = Queue()
+        self.thread = Thread(target=self._enqueue_output)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _enqueue_output(self):
+        try:
+            for data in iter(lambda: os.read(self.stream.fileno(), READ_SIZE), b""):
+                self.queue.put(data)
+        except (OSError, ValueError):
+            # The job got killed and the pipe closed
+            pass
+        if not self.stream.closed:
+            self.stream.close()
+
+    def read(self, timeout):
+        """
+        Grabs all the output currently on the queue.
+        Only blocks for the first chunk so that we are not
+        constantly busy waiting trying to read the output.
+        Input:
+          timeout[float]: How long to wait for output
+        Return:
+          bytes: Output that is available, b"" if there isn't any
+        """
+        output = []
+        size = 0
+        block = bool(timeout)
+        try:
+            while size < MAX_READ:
+                data = self.queue.get(block=block, timeout=timeout)
+                output.append(data)
+                size += len(data)
+                block = False
+        except Empty:
+            pass
+        return b"".join(output)
+
+    def finish(self):
+        """
+        Waits for the end of the output. Used after the process has exited.
+        Return:
+          list[bytes]: The rest of the output
+        """
+        self.thread.join()
+        output = []
+        try:
+            while True:
+                output.append(self.queue.get(block=False))
+        except Empty:
+            return output
+
+    def close(self):
+        pass
+
+def create_reader(stream, use_thread=False):
+    """
+    Input:
+      stream[file]: The stdout of a subprocess
+      use_thread[bool]: Whether to read with a thread, needed on Windows
+    Return:
+      SelectOutputReader or ThreadOutputReader
+    """
+    if use_thread or selectors is None:
+        return ThreadOutputReader(stream)
+    return SelectOutputReader(stream)
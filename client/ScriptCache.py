@@ -0,0 +1,175 @@
+
+# Copyright 2016 Battelle Energy Alliance, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import unicode_literals, absolute_import
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+logger = logging.getLogger("civet_client")
+
+class ScriptCacheException(Exception):
+    pass
+
+def content_sha(contents):
+    """
+    Input:
+      contents[str]: The contents of a script
+    Return:
+      str: The SHA of the contents, the same as "git hash-object" would give.
+    """
+    data = contents.encode("utf-8")
+    header = ("blob %d\0" % len(data)).encode("utf-8")
+    return hashlib.sha1(header + data).hexdigest()
+
+class ScriptCache(object):
+    """
+    Keeps copies of the step scripts and prestep sources by the SHA of their contents.
+    The server only sends the SHA of the scripts when we say that we have a cache,
+    and we only need to fetch the ones that we haven't seen before.
+    Scripts are always kept in memory and if script_cache_dir is set they are
+    also written there so that they survive a restart of the client.
+    """
+    def __init__(self, client_info, sessions):
+        """
+        Input:
+          client_info: A dictionary containing the following keys
+            server: The URL of the server.
+            build_key: The build_key to be used.
+            client_name: The name of the running client
+            ssl_verify: Whether to use SSL verification when making a request.
+            request_timeout: The timeout when making a request
+            script_cache_dir: Optional. Directory to store the scripts in.
+          sessions: The ServerSessions to make the requests with.
+        """
+        self.client_info = client_info
+        self.sessions = sessions
+        self.cache_dir = client_info.get("script_cache_dir")
+        self._scripts = {}
+        self._lock = threading.Lock()
+        self._headers = {b"User-Agent": b"INL-CIVET-Client/1.0 (+https://github.com/idaholab/civet)"}
+
+    def _path(self, sha):
+        return os.path.join(self.cache_dir, sha[:2], sha)
+
+    def get(self, sha):
+        """
+        Input:
+          sha[str]: The content SHA
+        Return:
+          str: The contents if we have them, else None
+        """
+        with self._lock:
+            contents = self._scripts.get(sha)
+        if contents is not None or not self.cache_dir:
+            return contents
+
+        try:
+            with open(self._path(sha), "rb") as f:
+                contents = f.read().decode("utf-8")
+        except (IOError, OSError):
+            return None
+        if content_sha(contents) != sha:
+            logger.warning("Ignoring corrupt cached script %s" % sha)
+            return None
+        with self._lock:
+            self._scripts[sha] = contents
+        return contents
+
+    def put(self, sha, contents):
+        """
+        Input:
+          sha[str]: The content SHA
+          contents[str]: The contents
+        """
+        with self._lock:
+            self._scripts[sha] = contents
+        if not self.cache_dir:
+            return
+
+        dirname = os.path.dirname(self._path(sha))
+        try:
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            # Write to a temporary file first so that other clients sharing
+            # the directory never see a partial file.
+            f = tempfile.NamedTemporaryFile(dir=dirname, delete=False)
+            with f:
+                f.write(contents.encode("utf-8"))
+            os.rename(f.name, self._path(sha))
+        except (IOError, OSError) as e:
+            logger.warning("Failed to write cached script %s: %s" % (sha, e))
+
+    def fetch(self, job_id, sha):
+        """
+        Get a script from the server and put it in the cache.
+        Input:
+          job_id[int]: The ID of the claimed job that uses the script
+          sha[str]: The content SHA
+        Return:
+          str: The contents
+        Exceptions:
+          ScriptCacheException if we couldn't get the script
+        """
+        url = "{}/client/script/{}/{}/{}/{}/".format(self.client_info["server"],
+                self.client_info["build_key"],
+                self.client_info["client_name"],
+                job_id,
+                sha)
+        logger.debug("Fetching script %s" % url)
+        try:
+            response = self.sessions.get(url,
+                    headers=self._headers,
+                    verify=self.client_info["ssl_verify"],
+                    timeout=self.client_info["request_timeout"])
+            response.raise_for_status()
+        except Exception as e:
+            raise ScriptCacheException("Failed to get script %s: %s" % (sha, e))
+
+        contents = response.content.decode("utf-8")
+        if content_sha(contents) != sha:
+            raise ScriptCacheException("Script %s from the server doesn't match its SHA" % sha)
+        self.put(sha, contents)
+        return contents
+
+    def get_script(self, job_id, sha):
+        """
+        Input:
+          job_id[int]: The ID of the claimed job that uses the script
+          sha[str]: The content SHA
+        Return:
+          str: The contents, from the cache or from the server
+        """
+        contents = self.get(sha)
+        if contents is None:
+            contents = self.fetch(job_id, sha)
+        return contents
+
+    def resolve(self, job_info):
+        """
+        Fills in the scripts of a job where the server only sent their SHA
+        so that job_info looks like the server sent the full scripts.
+        Input:
+          job_info[dict]: The job information from the server. Modified in place.
+        Exceptions:
+          ScriptCacheException if a script couldn't be found
+        """
+        if "prestep_source_shas" in job_info:
+            job_info["prestep_sources"] = [self.get_script(job_info["job_id"], sha)
+                    for sha in job_info.pop("prestep_source_shas")]
+        for step in job_info.get("steps", []):
+            if "script_sha" in step:
+                step["script"] = self.get_script(job_info["job_id"], step.pop("script_sha"))
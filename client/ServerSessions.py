@@ -0,0 +1,142 @@
+
+# Copyright 2016 Battelle Energy Alliance, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import unicode_literals, absolute_import
+import requests
+import gzip
+import io
+import threading
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+from requests.packages.urllib3.exceptions import InsecureRequestWarning
+requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+def gzip_data(data):
+    """
+    Input:
+      data[bytes]: Data to compress
+    Return:
+      bytes: The gzip compressed data
+    """
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode="wb") as f:
+        f.write(data)
+    return buf.getvalue()
+
+class ServerSessions(object):
+    """
+    Holds a requests.Session for each server so that connections
+    are kept alive and reused instead of doing a new connection
+    (and TLS handshake) for every request.
+    """
+    def __init__(self, client_info):
+        """
+        Input:
+          client_info: A dictionary containing the following optional keys
+            request_retries: How many times to retry a request that couldn't connect
+                or got a 502/503 response. Defaults to 3.
+            request_backoff: Backoff factor in seconds between retries. Defaults to 0.5.
+            gzip_requests: Whether to gzip the body of POST requests. Defaults to False.
+        """
+        self.client_info = client_info
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def create_session(self):
+        """
+        Creates a new session with our retry policy.
+        Connection failures are retried for any request since the server never got them.
+        A 502/503 can come from a proxy after the server already processed the
+        request, so those are only retried for GETs. Otherwise retrying something
+        like an output update or a claim could apply it twice.
+        Return:
+          requests.Session
+        """
+        retries = self.client_info.get("request_retries", 3)
+        retry = Retry(total=retries,
+                connect=retries,
+                read=0,
+                status=retries,
+                status_forcelist=[502, 503],
+                method_whitelist=frozenset(["GET"]),
+                backoff_factor=self.client_info.get("request_backoff", 0.5),
+                raise_on_status=False)
+        adapter = HTTPAdapter(max_retries=retry)
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def session(self, url):
+        """
+        Gets the session for the server of a URL, creating it if needed.
+        Input:
+          url[str]: A URL on the server
+        Return:
+          requests.Session
+        """
+        parsed = urlparse(url)
+        key = "%s://%s" % (parsed.scheme, parsed.netloc)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = self.create_session()
+                self._sessions[key] = session
+            return session
+
+    def get(self, url, **kwargs):
+        """
+        Does a GET request on the server's session.
+        Input:
+          url[str]: The URL to GET
+          kwargs: Passed to requests.Session.get
+        Return:
+          requests.Response
+        """
+        return self.session(url).get(url, **kwargs)
+
+    def post(self, url, data, **kwargs):
+        """
+        Does a POST request on the server's session.
+        If gzip_requests is set then the body is compressed.
+        Input:
+          url[str]: The URL to POST to
+          data[bytes]: The body of the request
+          kwargs: Passed to requests.Session.post
+        Return:
+          requests.Response
+        """
+        if self.client_info.get("gzip_requests") and data:
+            if not isinstance(data, bytes):
+                data = data.encode("utf-8")
+            data = gzip_data(data)
+            headers = dict(kwargs.pop("headers", None) or {})
+            headers[b"Content-Encoding"] = b"gzip"
+            kwargs["headers"] = headers
+        return self.session(url).post(url, data, **kwargs)
+
+    def close(self):
+        """
+        Closes all the sessions
+        """
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions = {}
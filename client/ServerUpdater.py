@@ -19,29 +19,66 @@ import time
 import json, requests
 import traceback
 import logging
+import base64
+from collections import OrderedDict
+from client.ServerSessions import ServerSessions, gzip_data
 
 try:
     from queue import Empty
 except ImportError:
     from Queue import Empty
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 
 logger = logging.getLogger("civet_client")
 
+# Step output smaller than this isn't worth compressing
+MIN_ENCODE_SIZE = 1024
+
+def zstd_compress(data):
+    return zstandard.ZstdCompressor().compress(data)
+
+def output_encoders():
+    """
+    The encodings we can use to compress step output.
+    zstd is only available if the zstandard module is installed.
+    Returns:
+      OrderedDict: encoding name -> function to compress bytes, in order of preference
+    """
+    encoders = OrderedDict()
+    if zstandard is not None:
+        encoders["zstd"] = zstd_compress
+    encoders["gzip"] = gzip_data
+    return encoders
+
 class StopException(Exception):
     pass
 
 class ServerUpdater(object):
-    def __init__(self, server, client_info, message_q, command_q, control_q):
+    def __init__(self, server, client_info, message_q, command_q, control_q, sessions=None, output_encoding=None):
         self.message_q = message_q
+        # How the step output is compressed, as negotiated with the server when claiming the job
+        self.output_encoding = output_encoding
         self.command_q = command_q
         self.control_q = control_q
         self.messages = []
         self.client_info = client_info
         self.servers = {}
         self.main_server = server
+        if sessions is None:
+            sessions = ServerSessions(client_info)
+        self.sessions = sessions
+
+        # Consecutive step result updates are sent in a single request.
+        # This gets turned off if the server doesn't support it.
+        self.batch_updates = True
+        self.max_batch_size = client_info.get("max_batch_size", 50)
 
         self.update_servers()
         self.running = True
@@ -135,22 +172,68 @@ class ServerUpdater(object):
         Just tries to clear the messages that we haven't sent yet.
         """
         try:
-            last_success = 0
-            for idx, msg in enumerate(self.messages):
-                sent = self.post_message(msg)
-                if sent:
-                    last_success = idx+1
-                    self.message_q.task_done()
-                else:
+            while self.messages:
+                item, count = self.next_message()
+                sent = self.post_message(item)
+                if sent is None:
+                    # The server doesn't know about batches, send them individually
+                    logger.info("Server doesn't support batched updates")
+                    self.batch_updates = False
+                    continue
+                if not sent:
                     break
-            #self.messages = self.messages[last_success:]
-            self.messages = self.messages[last_success:]
+                for i in range(count):
+                    self.message_q.task_done()
+                self.messages = self.messages[count:]
         except StopException:
-            for msg in self.messages[last_success:]:
+            for msg in self.messages:
                 self.message_q.task_done()
             self.messages = []
         self.servers[self.main_server]["last_time"] = time.time()
 
+    def next_message(self):
+        """
+        Gets the next message to send.
+        Consecutive step result updates for the same job are combined
+        into a single batch and consecutive "update" messages for the
+        same step result are merged into one.
+        Returns:
+          (dict, int): The message to send and the number of messages in self.messages it covers
+        """
+        first = self.messages[0]
+        if not self.batch_updates or "stage" not in first:
+            return first, 1
+
+        updates = []
+        count = 0
+        for msg in self.messages[:self.max_batch_size]:
+            if "stage" not in msg or msg["server"] != first["server"] or msg["job_id"] != first["job_id"]:
+                break
+            count += 1
+            prev = updates[-1] if updates else None
+            if (prev and prev["stage"] == "update" and msg["stage"] == "update"
+                    and prev["stepresult_id"] == msg["stepresult_id"]):
+                payload = msg["payload"].copy()
+                payload["output"] = prev["payload"]["output"] + payload["output"]
+                prev["payload"] = payload
+            else:
+                updates.append({"stage": msg["stage"], "stepresult_id": msg["stepresult_id"], "payload": msg["payload"]})
+
+        if count == 1:
+            return first, 1
+
+        url = "{}/client/update_step_results/{}/{}/{}/".format(first["server"],
+                self.client_info["build_key"],
+                self.client_info["client_name"],
+                first["job_id"])
+        batch = {"server": first["server"],
+            "job_id": first["job_id"],
+            "url": url,
+            "batch": True,
+            "payload": {"updates": updates},
+            }
+        return batch, count
+
     def post_message(self, item):
         """
         Sends a list of updates to the server.
@@ -161,15 +244,19 @@ class ServerUpdater(object):
           job_data: A list of updates to send to the server
 
         Returns:
-          True if we could talk to the server, False otherwise
+          True if we could talk to the server, False otherwise.
+          None if this was a batch of updates and the server doesn't support them.
         """
-        reply = self.post_json(item["url"], item["payload"])
+        reply = self.post_json(item["url"], self.encode_payload(item), not_found_ok=item.get("batch", False))
 
         if not reply:
             # Since all messages here are on the same server, if there is no
             # reply then there isn't any point in trying with others
             return False
 
+        if reply.get("status") == "NOT_FOUND":
+            return None
+
         if "status" not in reply:
             err_str = "While posting to {}, server gave invalid JSON : {}".format(item["url"], reply)
             logger.error(err_str)
@@ -186,6 +273,48 @@ class ServerUpdater(object):
 
         return True
 
+    def encode_output(self, payload):
+        """
+        Compress the output of a step result update if the server supports it.
+        Input:
+          payload[dict]: Step result data
+        Returns:
+          dict: The payload to send
+        """
+        output = payload.get("output")
+        if not self.output_encoding or not output or len(output) < MIN_ENCODE_SIZE:
+            return payload
+        if not isinstance(output, bytes):
+            output = output.encode("utf-8", "replace")
+        compress = output_encoders()[self.output_encoding]
+        payload = payload.copy()
+        payload["output"] = base64.b64encode(compress(output)).decode("ascii")
+        payload["output_encoding"] = self.output_encoding
+        return payload
+
+    def encode_payload(self, item):
+        """
+        Get the payload of a message to send to the server, with
+        any step result output compressed.
+        The message itself isn't changed since it might need to be resent.
+        Input:
+          item[dict]: The message to send
+        Returns:
+          dict: The payload to send
+        """
+        if item.get("batch"):
+            updates = []
+            for update in item["payload"]["updates"]:
+                update = update.copy()
+                update["payload"] = self.encode_output(update["payload"])
+                updates.append(update)
+            payload = item["payload"].copy()
+            payload["updates"] = updates
+            return payload
+        if "stage" in item:
+            return self.encode_output(item["payload"])
+        return item["payload"]
+
     def ping_servers(self):
         """
         Updates all servers with a status message.
@@ -233,13 +362,14 @@ class ServerUpdater(object):
             logger.warning("Failed to convert to json: \n%s\nData:%s" % (traceback.format_exc(), data))
             return {"status": "OK", "command": "stop"}, False
 
-    def post_json(self, request_url, data):
+    def post_json(self, request_url, data, not_found_ok=False):
         """
         Post the supplied dict holding JSON data to the url and return a dict
         with the JSON.
         Input:
           request_url: The URL to post to.
           data: dict of data to post.
+          not_found_ok: If True then a 404 response returns {"status": "NOT_FOUND"}
         Returns:
           A dict of the JSON reply if successful, otherwise None
         """
@@ -250,11 +380,14 @@ class ServerUpdater(object):
             in_json, good = self.data_to_json(data)
             if not good:
                 return in_json
-            response = requests.post(request_url,
+            response = self.sessions.post(request_url,
                     in_json,
                     headers=self._headers,
                     verify=self.client_info["ssl_verify"],
                     timeout=self.client_info["request_timeout"])
+            if not_found_ok and response.status_code == 404:
+                logger.info("Got a 404 response while posting to: %s" % request_url)
+                return {"status": "NOT_FOUND"}
             if response.status_code == 400:
                 # This means that we shouldn't retry this request
                 logger.warning("Stopping because we got a 400 response while posting to: %s" % request_url)
@@ -59,6 +59,18 @@ def commandline_client(args):
             type=int,
             default=30,
             help="Number of seconds to wait before polling for more jobs in continuous mode")
+    parser.add_argument("--long-poll",
+            dest='long_poll',
+            type=int,
+            default=60,
+            help="Number of seconds to ask the server to wait for new jobs before polling again. 0 to disable.")
+    parser.add_argument("--gzip-requests",
+            dest='gzip_requests',
+            action='store_true',
+            help="Compress the data sent to the server. The server needs to support it.")
+    parser.add_argument("--script-cache-dir",
+            dest='script_cache_dir',
+            help="Where to keep copies of the job scripts between runs. By default they are only kept in memory.")
     parser.add_argument("--daemon", dest='daemon', choices=['start', 'stop', 'restart'], help="Start a UNIX daemon.")
     parser.add_argument("--log-dir",
             dest='log_dir',
@@ -84,6 +96,9 @@ def commandline_client(args):
         "build_key": parsed.build_key,
         "single_shot": parsed.single_shot,
         "poll": parsed.poll,
+        "long_poll": parsed.long_poll,
+        "gzip_requests": parsed.gzip_requests,
+        "script_cache_dir": parsed.script_cache_dir,
         "daemon_cmd": parsed.daemon,
         "request_timeout": 30,
         "update_step_time": 20,
@@ -52,6 +52,8 @@ def commandline_client(args):
         "build_key": "",
         "single_shot": False,
         "poll": 30,
+        "long_poll": 60,
+        "gzip_requests": False,
         "daemon_cmd": parsed.daemon,
         "request_timeout": 120,
         "update_step_time": 20,
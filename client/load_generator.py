@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+# Copyright 2016 Battelle Energy Alliance, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import unicode_literals, absolute_import
+import argparse
+import json
+import sys, os
+# Need to add parent directory to the path so that imports work
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from client import LoadGenerator
+
+def commandline_args(args):
+    parser = argparse.ArgumentParser(description="Run a fleet of simulated clients against a CIVET server. "
+            "Jobs to run can be created on the server with the create_load_jobs management command.")
+    parser.add_argument("--url", dest='url', help="The URL of the CIVET site.", required=True)
+    parser.add_argument("--build-key", dest='build_key', help="The build_key of the jobs", required=True)
+    parser.add_argument("--configs", dest='configs', nargs='+', help="The configurations the clients support",
+            required=True)
+    parser.add_argument("--clients", dest='clients', type=int, default=100, help="Number of clients")
+    parser.add_argument("--processes", dest='processes', type=int, default=1,
+            help="Number of processes to spread the clients over")
+    parser.add_argument("--duration", dest='duration', type=float, default=60,
+            help="Seconds to run for. Clients finish their current job after that.")
+    parser.add_argument("--step-time", dest='step_time', type=float, default=1, help="Seconds each step takes")
+    parser.add_argument("--output-rate", dest='output_rate', type=int, default=1024,
+            help="Bytes of output per second for each step")
+    parser.add_argument("--update-step-time", dest='update_step_time', type=float, default=1,
+            help="Seconds between step output updates")
+    parser.add_argument("--poll", dest='poll', type=float, default=1,
+            help="Seconds to wait before polling again when there are no jobs")
+    parser.add_argument("--long-poll", dest='long_poll', type=int, default=0,
+            help="Seconds to ask the server to hold the request for jobs. 0 to disable.")
+    parser.add_argument("--claim-list",
+            dest='claim_next_job',
+            action='store_false',
+            help="Get the list of ready jobs and claim them one by one instead of using claim_next_job")
+    parser.add_argument("--server-pid", dest='server_pid', type=int,
+            help="PID of a local server process to measure the CPU usage of")
+    parser.add_argument("--json", dest='json', action='store_true', help="Print the raw measurements as JSON")
+    return parser.parse_args(args)
+
+def main(args):
+    parsed = commandline_args(args)
+    stats = LoadGenerator.run(parsed.url,
+            parsed.build_key,
+            parsed.configs,
+            parsed.clients,
+            parsed.duration,
+            processes=parsed.processes,
+            step_time=parsed.step_time,
+            output_rate=parsed.output_rate,
+            poll=parsed.poll,
+            long_poll=parsed.long_poll,
+            update_step_time=parsed.update_step_time,
+            claim_next_job=parsed.claim_next_job,
+            server_pid=parsed.server_pid)
+    if parsed.json:
+        print(json.dumps(stats))
+    else:
+        print(LoadGenerator.format_stats(stats))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -16,9 +16,10 @@
 from __future__ import unicode_literals, absolute_import
 from django.test import SimpleTestCase
 from django.test import override_settings
-from client import BaseClient
+from client import BaseClient, JobGetter
 from client.tests import utils
 from ci.tests import utils as test_utils
+from mock import patch
 
 @override_settings(INSTALLED_GITSERVERS=[test_utils.github_config()])
 class Tests(SimpleTestCase):
@@ -58,3 +59,26 @@ class Tests(SimpleTestCase):
 
         # not set, should just return
         c.set_log_file("")
+
+    @patch.object(BaseClient.time, 'sleep')
+    def test_wait_for_jobs(self, mock_sleep):
+        c = utils.create_base_client()
+        getter = JobGetter.JobGetter(c.client_info)
+        with patch.object(JobGetter.JobGetter, 'wait_for_jobs') as mock_wait:
+            # long polling not enabled
+            c.wait_for_jobs(getter)
+            self.assertEqual(mock_wait.call_count, 0)
+            mock_sleep.assert_called_once_with(c.client_info["poll"])
+
+            # server waited for us
+            c.client_info["long_poll"] = 10
+            mock_wait.return_value = False
+            c.wait_for_jobs(getter)
+            mock_wait.assert_called_once_with(10)
+            self.assertEqual(mock_sleep.call_count, 1)
+
+            # server doesn't support waiting
+            mock_wait.return_value = None
+            c.wait_for_jobs(getter)
+            self.assertEqual(mock_wait.call_count, 2)
+            self.assertEqual(mock_sleep.call_count, 2)
@@ -18,7 +18,8 @@ import requests
 from . import utils
 from django.test import override_settings
 from ci.tests import utils as test_utils
-from client import JobGetter, BaseClient
+from client import JobGetter, BaseClient, ScriptCache, ServerSessions
+import json
 from mock import patch
 from ci.tests import DBTester
 BaseClient.setup_logger()
@@ -30,7 +31,7 @@ class Tests(DBTester.DBTester):
         getter = JobGetter.JobGetter(self.client_info)
         return getter
 
-    @patch.object(requests, 'get')
+    @patch.object(requests.Session, 'get')
     def test_get_possible_jobs(self, mock_get):
         g = self.create_getter()
 
@@ -57,7 +58,39 @@ class Tests(DBTester.DBTester):
         self.compare_counts()
         self.assertEqual(jobs, None)
 
-    @patch.object(requests, 'post')
+    @patch.object(requests.Session, 'get')
+    def test_wait_for_jobs(self, mock_get):
+        g = self.create_getter()
+
+        # jobs became ready
+        mock_get.return_value = test_utils.Response({"jobs": [{"id": 1}], "long_poll": True})
+        self.assertTrue(g.wait_for_jobs(10))
+        self.assertEqual(mock_get.call_args[1]["params"],
+                {"wait": 10, "configs": self.client_info["build_configs"]})
+        self.assertEqual(mock_get.call_args[1]["timeout"], 10 + self.client_info["request_timeout"])
+
+        # timed out
+        mock_get.return_value = test_utils.Response({"jobs": [], "long_poll": True})
+        self.assertFalse(g.wait_for_jobs(10))
+
+        # server doesn't support waiting
+        mock_get.return_value = test_utils.Response({"jobs": []})
+        self.assertIsNone(g.wait_for_jobs(10))
+
+        # bad status code
+        mock_get.return_value = test_utils.Response({"jobs": []}, do_raise=True)
+        self.assertIsNone(g.wait_for_jobs(10))
+
+    def test_choose_output_encoding(self):
+        g = self.create_getter()
+        response = test_utils.Response({})
+        self.assertEqual(g.choose_output_encoding(response), None)
+        response = test_utils.Response({}, headers={JobGetter.OUTPUT_ENCODINGS_HEADER: "foo, gzip"})
+        self.assertEqual(g.choose_output_encoding(response), "gzip")
+        response = test_utils.Response({}, headers={JobGetter.OUTPUT_ENCODINGS_HEADER: "foo"})
+        self.assertEqual(g.choose_output_encoding(response), None)
+
+    @patch.object(requests.Session, 'post')
     def test_claim_job(self, mock_post):
         g = self.create_getter()
         j0 = {"config": "unknown_config", "id": 1}
@@ -94,8 +127,86 @@ class Tests(DBTester.DBTester):
         self.compare_counts()
         self.assertEqual(ret, None)
 
-    @patch.object(requests, 'get')
-    @patch.object(requests, 'post')
+    @patch.object(requests.Session, 'post')
+    def test_claim_next_job(self, mock_post):
+        g = self.create_getter()
+        response_data = utils.create_json_response()
+        response_data['job_id'] = 1
+        response_data['config'] = g.client_info["build_configs"][0]
+        response_data['job_info'] = {'recipe_name': 'test'}
+        mock_post.return_value = test_utils.Response(response_data)
+        # successfull operation
+        self.set_counts()
+        ret = g.claim_next_job()
+        self.compare_counts()
+        self.assertEqual(response_data, ret)
+        self.assertIn(g.client_info["build_configs"][0], mock_post.call_args[0][1])
+
+        # no job
+        response_data["success"] = False
+        mock_post.return_value = test_utils.Response(response_data)
+        self.set_counts()
+        ret = g.claim_next_job()
+        self.compare_counts()
+        self.assertEqual(ret, None)
+
+        # server doesn't support it
+        mock_post.return_value = test_utils.Response(status_code=404)
+        self.set_counts()
+        ret = g.claim_next_job()
+        self.compare_counts()
+        self.assertIs(ret, False)
+
+        # try when server problems
+        mock_post.return_value = test_utils.Response(response_data, do_raise=True)
+        self.set_counts()
+        ret = g.claim_next_job()
+        self.compare_counts()
+        self.assertEqual(ret, None)
+
+    @patch.object(requests.Session, 'post')
+    def test_claim_next_job_script_cache(self, mock_post):
+        client_info = utils.default_client_info()
+        sessions = ServerSessions.ServerSessions(client_info)
+        script_cache = ScriptCache.ScriptCache(client_info, sessions)
+        g = JobGetter.JobGetter(client_info, sessions, script_cache)
+        sha = ScriptCache.content_sha("echo hi")
+        script_cache.put(sha, "echo hi")
+        response_data = utils.create_json_response()
+        response_data['job_id'] = 1
+        response_data['config'] = client_info["build_configs"][0]
+        response_data['job_info'] = {'recipe_name': 'test',
+                'job_id': 1,
+                'prestep_source_shas': [sha],
+                'steps': [{'script_sha': sha}],
+                }
+        mock_post.return_value = test_utils.Response(response_data)
+        ret = g.claim_next_job()
+        self.assertTrue(json.loads(mock_post.call_args[0][1])['script_cache'])
+        self.assertEqual(ret['job_info']['prestep_sources'], ['echo hi'])
+        self.assertEqual(ret['job_info']['steps'], [{'script': 'echo hi'}])
+
+        # A script that can't be fetched releases the job
+        response_data['job_info'] = {'recipe_name': 'test',
+                'job_id': 1,
+                'steps': [{'script_sha': "1"*40}],
+                }
+        with patch.object(requests.Session, 'get') as mock_get:
+            mock_get.return_value = test_utils.Response(status_code=404)
+            ret = g.claim_next_job()
+        self.assertIsNone(ret)
+        self.assertIn("/client/release_job/", mock_post.call_args[0][0])
+        self.assertTrue(mock_post.call_args[0][0].endswith("/1/"))
+        self.assertIn("1"*40, json.loads(mock_post.call_args[0][1])['message'])
+
+        # Without a cache we don't ask for SHAs
+        g = self.create_getter()
+        response_data['job_info'] = {'recipe_name': 'test'}
+        g.claim_next_job()
+        self.assertFalse(json.loads(mock_post.call_args[0][1])['script_cache'])
+
+    @patch.object(requests.Session, 'get')
+    @patch.object(requests.Session, 'post')
     def test_find_job(self, mock_post, mock_get):
         g = self.create_getter()
 
@@ -104,6 +215,8 @@ class Tests(DBTester.DBTester):
         jobs = [j0, j1]
         mock_get.return_value = test_utils.Response({"jobs": jobs})
         response_data = utils.create_json_response()
+        response_data['job_id'] = 2
+        response_data['config'] = j1["config"]
         response_data['job_info'] = {'recipe_name': 'test'}
         mock_post.return_value = test_utils.Response(response_data)
 
@@ -112,8 +225,37 @@ class Tests(DBTester.DBTester):
         result = g.find_job()
         self.compare_counts()
         self.assertEqual(result, response_data)
+        self.assertEqual(mock_get.call_count, 0)
+
+        # no jobs
+        no_job_data = utils.create_json_response(success=False)
+        mock_post.return_value = test_utils.Response(no_job_data)
+        self.set_counts()
+        result = g.find_job()
+        self.compare_counts()
+        self.assertEqual(result, None)
+        self.assertEqual(mock_get.call_count, 0)
+
+        # server doesn't support claiming the next job
+        mock_post.side_effect = [test_utils.Response(status_code=404), test_utils.Response(response_data)]
+        self.set_counts()
+        result = g.find_job()
+        self.compare_counts()
+        self.assertEqual(result, response_data)
+        self.assertEqual(mock_get.call_count, 1)
+
+        # claim_next_job turned off, only the one claim_job request is done
+        g.client_info["claim_next_job"] = False
+        mock_post.side_effect = [test_utils.Response(response_data)]
+        result = g.find_job()
+        self.assertEqual(result, response_data)
+        self.assertEqual(mock_get.call_count, 2)
+        self.assertIn("/claim_job/", mock_post.call_args[0][0])
+        g.client_info["claim_next_job"] = True
 
         # no jobs
+        mock_post.side_effect = None
+        mock_post.return_value = test_utils.Response(status_code=404)
         mock_get.return_value = test_utils.Response([])
         self.set_counts()
         result = g.find_job()
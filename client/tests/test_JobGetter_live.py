@@ -14,7 +14,7 @@
 # limitations under the License.
 
 from __future__ import unicode_literals, absolute_import
-from client import JobGetter, BaseClient
+from client import JobGetter, BaseClient, ServerUpdater
 from django.test import override_settings
 from ci.tests import utils as test_utils
 from ci import models
@@ -49,6 +49,8 @@ class Tests(LiveClientTester.LiveClientTester):
             data["job_info"]["environment"]["recipe_id"] = self.job.recipe.pk
             data["job_info"]["environment"]["CIVET_JOB_ID"] = self.job.pk
             data["job_info"]["environment"]["CIVET_RECIPE_ID"] = self.job.recipe.pk
+            # Added by the client from the response header
+            data["output_encoding"] = list(ServerUpdater.output_encoders().keys())[0]
             return data
 
     def test_get_possible_jobs(self):
@@ -68,7 +70,7 @@ class Tests(LiveClientTester.LiveClientTester):
         self.assertEqual(jobs, [response])
 
         # bad server
-        with patch.object(requests, "get") as mock_get:
+        with patch.object(requests.Session, "get") as mock_get:
             mock_get.return_value = test_utils.Response(json_data={})
             self.client_info["server"] = "dummy_server"
             jobs = self.getter.get_possible_jobs()
@@ -127,7 +129,7 @@ class Tests(LiveClientTester.LiveClientTester):
         self.assertEqual(ret, None)
 
         # bad server
-        with patch.object(requests, "post") as mock_post:
+        with patch.object(requests.Session, "post") as mock_post:
             mock_post.return_value = test_utils.Response(json_data={})
             self.client_info["server"] = "dummy_server"
             self.set_counts()
@@ -141,6 +143,42 @@ class Tests(LiveClientTester.LiveClientTester):
             self.compare_counts()
             self.assertEqual(ret, None)
 
+    def test_claim_next_job(self):
+        # no jobs to claim
+        self.set_counts()
+        ret = self.getter.claim_next_job()
+        self.compare_counts(num_clients=1)
+        self.assertEqual(ret, None)
+
+        # successfull operation
+        self.job.ready = True
+        self.job.active = True
+        self.job.complete = False
+        self.job.save()
+        self.set_counts()
+        ret = self.getter.claim_next_job()
+        self.compare_counts(active_branches=1)
+        data = self.claim_job_dict(self.job)
+        self.assertEqual(ret, data)
+
+        # already claimed
+        self.client_info["client_name"] = "other_client"
+        self.set_counts()
+        ret = self.getter.claim_next_job()
+        self.compare_counts(num_clients=1)
+        self.assertEqual(ret, None)
+
+        # bad server
+        with patch.object(requests.Session, "post") as mock_post:
+            mock_post.return_value = test_utils.Response(json_data={})
+            self.client_info["server"] = "dummy_server"
+            ret = self.getter.claim_next_job()
+            self.assertEqual(ret, None)
+
+            mock_post.side_effect = Exception("BAM!")
+            ret = self.getter.claim_next_job()
+            self.assertEqual(ret, None)
+
     def test_find_job(self):
         # no jobs to claim
         ret = self.getter.find_job()
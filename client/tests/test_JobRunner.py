@@ -114,24 +114,15 @@ class Tests(SimpleTestCase):
             r.update_step(stage, step, chunk_data)
             self.assertEqual(self.message_q.qsize(), 1)
             msg = self.message_q.get(block=False)
-            self.assertEqual(len(msg), 4)
+            self.assertEqual(len(msg), 6)
             server = r.client_info["server"]
             self.assertEqual(msg["server"], server)
             self.assertTrue(msg["url"].startswith(server))
             self.assertIn(stage, msg["url"])
             self.assertEqual(msg["job_id"], r.job_data["job_id"])
             self.assertEqual(msg["payload"], chunk_data)
-
-    def test_get_output_from_queue(self):
-        r = self.create_runner()
-        q0 = {"msg": 1}
-        q1 = {"msg": 2}
-        self.message_q.put(q0)
-        self.message_q.put(q1)
-        output = r.get_output_from_queue(self.message_q)
-        self.assertEqual(len(output), 2)
-        self.assertEqual(output[0], q0)
-        self.assertEqual(output[1], q1)
+            self.assertEqual(msg["stage"], stage)
+            self.assertEqual(msg["stepresult_id"], step["stepresult_id"])
 
     def test_read_command(self):
         r = self.create_runner()
@@ -218,6 +209,29 @@ class Tests(SimpleTestCase):
                 proc.wait()
                 self.assertEqual(r.canceled, True)
 
+    def test_read_process_output_large(self):
+        r = self.create_runner()
+        r.client_info["update_step_time"] = 1
+        expected = "".join("%s\n" % i for i in range(1, 200001)) + "caf\u00e9\n"
+        with JobRunner.temp_file() as script_file:
+            script_file.write(b"seq 200000; echo caf\xc3\xa9")
+            script_file.close()
+            with open(os.devnull, "wb") as devnull:
+                proc = r.create_process(script_file.name, {}, devnull)
+                out = r.read_process_output(proc, r.job_data["steps"][0], {})
+                proc.wait()
+                self.assertEqual(out["output"], expected)
+
+                r.max_output_size = 1000
+                proc = r.create_process(script_file.name, {}, devnull)
+                out = r.read_process_output(proc, r.job_data["steps"][0], {})
+                proc.wait()
+                self.assertEqual(proc.returncode, 0)
+                # Stops after the line that went over the limit
+                self.assertTrue(out["output"].startswith(expected[:expected.index("\n", 999) + 1] + "\n\n****"))
+                self.assertIn("Output size exceeded limit (1000 bytes)", out["output"])
+                self.assertLess(len(out["output"]), 2000)
+
     def test_kill_job(self):
         with JobRunner.temp_file() as script:
             script.write(b"sleep 30")
@@ -0,0 +1,129 @@
+
+# Copyright 2016 Battelle Energy Alliance, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import unicode_literals, absolute_import
+from django.test import SimpleTestCase
+from client import LoadGenerator
+from client.tests import utils
+from mock import patch
+import os
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+class Tests(SimpleTestCase):
+    def test_endpoint_name(self):
+        self.assertEqual(LoadGenerator.endpoint_name("http://host:80/client/claim_job/1/config/name/"), "claim_job")
+        self.assertEqual(LoadGenerator.endpoint_name("http://host/prefix/client/ping/name/"), "ping")
+        self.assertEqual(LoadGenerator.endpoint_name("http://host/other/"), "other")
+        self.assertEqual(LoadGenerator.endpoint_name("http://host/"), "")
+
+    def test_percentile(self):
+        self.assertEqual(LoadGenerator.percentile([], 50), 0)
+        self.assertEqual(LoadGenerator.percentile([3, 1, 2], 50), 2)
+        self.assertEqual(LoadGenerator.percentile(list(range(1, 101)), 95), 95)
+
+    def test_stats(self):
+        stats = LoadGenerator.LoadStats()
+        stats.add_request("claim_job", 0.5, True)
+        stats.add_request("claim_job", 0.1, False)
+        stats.add_claim(True)
+        stats.add_claim(False)
+        stats.add_claim(False)
+        stats.add_job(10)
+        stats.add_update_lags([0.1, 0.2])
+        data = stats.to_dict()
+        self.assertEqual(data["requests"]["claim_job"], {"count": 2, "errors": 1, "times": [0.5, 0.1]})
+
+        merged = LoadGenerator.merge_stats([data, data])
+        self.assertEqual(merged["requests"]["claim_job"]["count"], 4)
+        self.assertEqual(merged["requests"]["claim_job"]["errors"], 2)
+        self.assertEqual(merged["claims"], 2)
+        self.assertEqual(merged["failed_claims"], 4)
+        self.assertEqual(merged["jobs"], 2)
+        self.assertEqual(merged["update_lags"], [0.1, 0.2, 0.1, 0.2])
+        # The originals aren't changed
+        self.assertEqual(data["requests"]["claim_job"]["count"], 2)
+
+        merged["elapsed"] = 60
+        merged["server_cpu"] = 30
+        report = LoadGenerator.format_stats(merged)
+        self.assertIn("Jobs finished: 2 (2.00 jobs/min)", report)
+        self.assertIn("(2.00 failed per success)", report)
+        self.assertIn("Server CPU: 30.0 s (50.0%)", report)
+
+    def test_fake_job_runner(self):
+        message_q = Queue()
+        client_info = utils.default_client_info()
+        client_info["update_step_time"] = 0.1
+        job_info = utils.create_job_dict(num_steps=2)
+        runner = LoadGenerator.FakeJobRunner(client_info, job_info, message_q, Queue(), step_time=0.3,
+                output_rate=1000)
+        results = runner.run_job()
+        self.assertFalse(results["failed"])
+        self.assertFalse(results["canceled"])
+
+        messages = []
+        while not message_q.empty():
+            messages.append(message_q.get())
+        stages = [m.get("stage") for m in messages]
+        self.assertEqual(stages[0], "start")
+        self.assertIn("update", stages)
+        self.assertEqual(stages.count("complete"), 2)
+        self.assertIsNone(stages[-1]) # job_finished
+        for msg in messages:
+            self.assertIn("queued_time", msg)
+            self.assertNotIn("queued_time", msg["payload"])
+
+        # The complete message has all the output of the step
+        updates = [m["payload"]["output"] for m in messages if m.get("stage") == "update" and m["stepresult_id"] == 0]
+        complete = [m["payload"] for m in messages if m.get("stage") == "complete" and m["stepresult_id"] == 0][0]
+        self.assertEqual(complete["output"], "".join(updates))
+        self.assertGreaterEqual(len(complete["output"]), 200)
+        self.assertEqual(complete["exit_status"], 0)
+
+    def test_fake_job_runner_cancel(self):
+        message_q = Queue()
+        command_q = Queue()
+        runner = LoadGenerator.FakeJobRunner(utils.default_client_info(), utils.create_job_dict(), message_q,
+                command_q, step_time=5)
+        command_q.put({"command": "cancel"})
+        results = runner.run_job()
+        self.assertTrue(results["canceled"])
+
+    @patch.object(LoadGenerator, "run_clients")
+    def test_run(self, mock_run_clients):
+        stats = LoadGenerator.LoadStats()
+        stats.add_job(1)
+        mock_run_clients.return_value = stats.to_dict()
+        results = LoadGenerator.run("http://server", "123", ["config"], 4, 0, server_pid=os.getpid())
+        self.assertEqual(results["jobs"], 1)
+        infos = mock_run_clients.call_args[0][0]
+        self.assertEqual(len(infos), 4)
+        self.assertEqual(len(set([info["client_name"] for info in infos])), 4)
+        if os.path.exists("/proc/%s/stat" % os.getpid()):
+            self.assertIsNotNone(results["server_cpu"])
+
+    def test_client_info(self):
+        info = LoadGenerator.client_info("http://server", "123", ["config"], "name", claim_next_job=False)
+        self.assertEqual(info["servers"], ["http://server"])
+        self.assertIs(info["claim_next_job"], False)
+        # Can be used to make a client without setting up logging
+        client = LoadGenerator.SimulatedClient(info, LoadGenerator.LoadStats())
+        client.stop()
+        self.assertTrue(client.graceful_signal.triggered)
+        self.assertIsInstance(client.create_job_runner(utils.create_job_dict(), Queue()), LoadGenerator.FakeJobRunner)
@@ -0,0 +1,40 @@
+
+# Copyright 2016 Battelle Energy Alliance, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import unicode_literals, absolute_import
+from django.test import override_settings
+from ci import models
+from ci.client import Benchmark
+from client import LoadGenerator
+from client.tests import LiveClientTester
+
+@override_settings(INSTALLED_GITSERVERS=[])
+class Tests(LiveClientTester.LiveClientTester):
+    def test_run(self):
+        build_user = Benchmark.create_data(1, 2, 3, 2, pull_requests=False)
+        stats = LoadGenerator.run(self.live_server_url,
+                build_user.build_key,
+                [Benchmark.BUILD_CONFIG],
+                1, # SQLite doesn't handle concurrent clients well
+                3,
+                step_time=0.2,
+                poll=0.2,
+                update_step_time=0.1)
+        self.assertGreater(stats["jobs"], 0)
+        self.assertEqual(stats["jobs"], models.Job.objects.filter(complete=True).count())
+        self.assertGreaterEqual(stats["claims"], stats["jobs"])
+        self.assertGreater(len(stats["update_lags"]), 0)
+        self.assertIn("claim_next_job", stats["requests"])
+        self.assertEqual(stats["requests"]["job_finished"]["errors"], 0)
@@ -0,0 +1,95 @@
+
+# Copyright 2016 Battelle Energy Alliance, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import unicode_literals, absolute_import
+from django.test import SimpleTestCase
+import os
+from client import OutputReader
+
+class Tests(SimpleTestCase):
+    def test_buffer(self):
+        out = OutputReader.OutputBuffer(10)
+        self.assertEqual(out.add(b"line 1\n"), "line 1\n")
+        self.assertFalse(out.over_max)
+        # The line that goes over the limit is kept
+        self.assertEqual(out.add(b"line 2\nline 3\n"), "line 2\n")
+        self.assertTrue(out.over_max)
+        self.assertEqual(out.size, 14)
+        self.assertEqual(out.add(b"line 4\n"), "")
+        out.append("done\n")
+        self.assertEqual(out.getvalue(), "line 1\nline 2\ndone\n")
+
+        # multibyte character split between reads
+        data = "café ✓\n".encode("utf-8")
+        out = OutputReader.OutputBuffer(100)
+        self.assertEqual(out.add(data[:4]), "caf")
+        self.assertEqual(out.add(data[4:8]), "é ")
+        self.assertEqual(out.add(data[8:]), "✓\n")
+        # bad UTF-8 gets replaced
+        self.assertEqual(out.add(b"\xff\n"), "�\n")
+        # partial character at the end
+        self.assertEqual(out.add(data[:4]), "caf")
+        self.assertEqual(out.flush(), "�")
+        self.assertEqual(out.getvalue(), "café ✓\n�\ncaf�")
+
+        # A really long line doesn't get kept forever
+        out = OutputReader.OutputBuffer(10)
+        out.add(b"a"*(3*OutputReader.READ_SIZE))
+        self.assertTrue(out.over_max)
+        self.assertEqual(out.size, 10 + OutputReader.READ_SIZE + 1)
+
+    def check_reader(self, use_thread):
+        read_fd, write_fd = os.pipe()
+        stream = os.fdopen(read_fd, "rb")
+        reader = OutputReader.create_reader(stream, use_thread)
+        if use_thread:
+            self.assertIsInstance(reader, OutputReader.ThreadOutputReader)
+        else:
+            self.assertIsInstance(reader, OutputReader.SelectOutputReader)
+
+        self.assertEqual(reader.read(0.1), b"")
+        os.write(write_fd, b"line 1\nline 2\n")
+        self.assertEqual(reader.read(1), b"line 1\nline 2\n")
+
+        # Large output is returned in pieces
+        data = b"x\n"*OutputReader.MAX_READ
+        os.write(write_fd, b"start\n")
+        written = 0
+        output = []
+        while written < len(data):
+            written += os.write(write_fd, data[written:written + OutputReader.READ_SIZE//2])
+            output.append(reader.read(1))
+        os.close(write_fd)
+        output.extend(reader.finish())
+        self.assertTrue(all(len(o) <= OutputReader.MAX_READ for o in output))
+        self.assertEqual(b"".join(output), b"start\n" + data)
+        self.assertTrue(stream.closed)
+
+    def test_select_reader(self):
+        self.check_reader(False)
+
+    def test_thread_reader(self):
+        self.check_reader(True)
+
+    def test_closed(self):
+        read_fd, write_fd = os.pipe()
+        stream = os.fdopen(read_fd, "rb")
+        reader = OutputReader.SelectOutputReader(stream)
+        os.write(write_fd, b"output\n")
+        # Like when the job is killed
+        stream.close()
+        self.assertEqual(reader.read(1), b"")
+        self.assertEqual(reader.finish(), [])
+        os.close(write_fd)
@@ -0,0 +1,116 @@
+
+# Copyright 2016 Battelle Energy Alliance, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import unicode_literals, absolute_import
+from django.test import SimpleTestCase
+import requests
+import os
+import shutil
+import subprocess
+import tempfile
+from client import ScriptCache, ServerSessions
+from client.tests import utils
+from ci.tests import utils as test_utils
+from mock import patch
+
+class Tests(SimpleTestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def create_cache(self, cache_dir=None):
+        client_info = utils.default_client_info()
+        client_info["script_cache_dir"] = cache_dir
+        return ScriptCache.ScriptCache(client_info, ServerSessions.ServerSessions(client_info))
+
+    def test_content_sha(self):
+        contents = "echo é\n"
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(contents.encode("utf-8"))
+            f.flush()
+            git_sha = subprocess.check_output(["git", "hash-object", f.name]).decode("utf-8").strip()
+        self.assertEqual(ScriptCache.content_sha(contents), git_sha)
+
+    @patch.object(requests.Session, 'get')
+    def test_get_script(self, mock_get):
+        contents = "echo hello\n"
+        sha = ScriptCache.content_sha(contents)
+        mock_get.return_value = test_utils.Response(content=contents.encode("utf-8"))
+        cache = self.create_cache(self.cache_dir)
+        self.assertIsNone(cache.get(sha))
+        self.assertEqual(cache.get_script(1, sha), contents)
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertIn("/client/script/", mock_get.call_args[0][0])
+        self.assertTrue(mock_get.call_args[0][0].endswith("/1/%s/" % sha))
+
+        # Now in the cache
+        self.assertEqual(cache.get_script(1, sha), contents)
+        self.assertEqual(mock_get.call_count, 1)
+
+        # A new cache using the same directory doesn't need to fetch it
+        cache = self.create_cache(self.cache_dir)
+        self.assertEqual(cache.get_script(1, sha), contents)
+        self.assertEqual(mock_get.call_count, 1)
+
+        # Only kept in memory
+        cache = self.create_cache()
+        self.assertEqual(cache.get_script(1, sha), contents)
+        self.assertEqual(mock_get.call_count, 2)
+        self.assertEqual(cache.get_script(1, sha), contents)
+        self.assertEqual(mock_get.call_count, 2)
+
+        # Corrupt file on disk gets fetched again
+        with open(os.path.join(self.cache_dir, sha[:2], sha), "w") as f:
+            f.write("corrupt")
+        cache = self.create_cache(self.cache_dir)
+        self.assertEqual(cache.get_script(1, sha), contents)
+        self.assertEqual(mock_get.call_count, 3)
+
+        # Content doesn't match the SHA
+        mock_get.return_value = test_utils.Response(content=b"bad")
+        with self.assertRaises(ScriptCache.ScriptCacheException):
+            cache.get_script(1, "1"*40)
+
+        # Server error
+        mock_get.return_value = test_utils.Response(content=b"", status_code=404)
+        with self.assertRaises(ScriptCache.ScriptCacheException):
+            cache.get_script(1, "2"*40)
+
+    @patch.object(requests.Session, 'get')
+    def test_resolve(self, mock_get):
+        scripts = ["prestep", "step0", "step1"]
+        shas = [ScriptCache.content_sha(s) for s in scripts]
+        cache = self.create_cache()
+        cache.put(shas[0], scripts[0])
+        cache.put(shas[1], scripts[1])
+        mock_get.return_value = test_utils.Response(content=b"step1")
+
+        job_info = {"job_id": 1,
+                "prestep_source_shas": [shas[0]],
+                "steps": [{"script_sha": shas[1]}, {"script_sha": shas[2]}],
+                }
+        cache.resolve(job_info)
+        self.assertEqual(job_info, {"job_id": 1,
+            "prestep_sources": ["prestep"],
+            "steps": [{"script": "step0"}, {"script": "step1"}],
+            })
+        self.assertEqual(mock_get.call_count, 1)
+
+        # Servers that send the full scripts
+        job_info = utils.create_job_dict()
+        cache.resolve(job_info)
+        self.assertEqual(job_info, utils.create_job_dict())
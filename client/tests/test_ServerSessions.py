@@ -0,0 +1,58 @@
+
+# Copyright 2016 Battelle Energy Alliance, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import unicode_literals, absolute_import
+from django.test import SimpleTestCase
+import requests
+import gzip
+import io
+from client import ServerSessions
+from client.tests import utils
+from mock import patch
+
+class Tests(SimpleTestCase):
+    def test_session(self):
+        s = ServerSessions.ServerSessions(utils.default_client_info())
+        s0 = s.session("https://server0/client/ready_jobs/1/client/")
+        self.assertEqual(s0, s.session("https://server0/client/ping/client/"))
+        s1 = s.session("https://server1/client/ping/client/")
+        self.assertNotEqual(s0, s1)
+        self.assertNotEqual(s0, s.session("http://server0/client/ping/client/"))
+        retry = s0.get_adapter("https://server0/").max_retries
+        self.assertEqual(retry.total, 3)
+        self.assertEqual(retry.read, 0)
+        self.assertEqual(retry.connect, 3)
+        # POSTs that get a bad status aren't retried
+        self.assertTrue(retry.is_retry("GET", 502))
+        self.assertFalse(retry.is_retry("POST", 502))
+        s.close()
+        self.assertNotEqual(s0, s.session("https://server0/client/ping/client/"))
+
+    @patch.object(requests.Session, 'post')
+    def test_post(self, mock_post):
+        client_info = utils.default_client_info()
+        s = ServerSessions.ServerSessions(client_info)
+        headers = {b"User-Agent": b"agent"}
+        s.post("https://server0/", b"data", headers=headers, timeout=5)
+        mock_post.assert_called_once_with("https://server0/", b"data", headers=headers, timeout=5)
+
+        client_info["gzip_requests"] = True
+        s.post("https://server0/", b"data", headers=headers, timeout=5)
+        args, kwargs = mock_post.call_args
+        with gzip.GzipFile(fileobj=io.BytesIO(args[1])) as f:
+            self.assertEqual(f.read(), b"data")
+        self.assertEqual(kwargs["headers"], {b"User-Agent": b"agent", b"Content-Encoding": b"gzip"})
+        # The caller's headers aren't changed
+        self.assertEqual(headers, {b"User-Agent": b"agent"})
@@ -18,6 +18,7 @@ from django.test import SimpleTestCase
 from django.test import override_settings
 from ci.tests import utils as test_utils
 import requests, time
+import base64, gzip, io
 from client import ServerUpdater, BaseClient
 from client.tests import utils
 from mock import patch
@@ -39,8 +40,8 @@ class Tests(SimpleTestCase):
         self.thread = None
         self.updater = None
 
-    @patch.object(requests, 'post')
-    @patch.object(requests, 'get')
+    @patch.object(requests.Session, 'post')
+    @patch.object(requests.Session, 'get')
     def tearDown(self, mock_get, mock_post):
         if self.thread:
             self.control_q.put("Quit")
@@ -63,7 +64,7 @@ class Tests(SimpleTestCase):
         self.assertEqual(updater.messages, [])
         return updater
 
-    @patch.object(requests, 'post')
+    @patch.object(requests.Session, 'post')
     def test_run(self, mock_post):
         u = self.create_updater()
         u.client_info["server_update_timeout"] = 1
@@ -106,7 +107,7 @@ class Tests(SimpleTestCase):
         u.update_server_message("bad_server", msg)
         self.assertEqual(u.servers.get("bad_server", None), None)
 
-    @patch.object(requests, 'post')
+    @patch.object(requests.Session, 'post')
     def test_read_queue(self, mock_post):
         u = self.create_updater()
         server = u.client_info["servers"][0]
@@ -130,7 +131,7 @@ class Tests(SimpleTestCase):
         u.read_queue()
         return items
 
-    @patch.object(requests, 'post')
+    @patch.object(requests.Session, 'post')
     def test_send_messages_ok(self, mock_post):
         u = self.create_updater()
         mock_post.return_value = test_utils.Response({"status": "OK"})
@@ -142,7 +143,7 @@ class Tests(SimpleTestCase):
         self.assertEqual(u.messages, [])
         self.assertEqual(mock_post.call_count, 3)
 
-    @patch.object(requests, 'post')
+    @patch.object(requests.Session, 'post')
     def test_send_messages_400(self, mock_post):
         u = self.create_updater()
         # got the stop signal
@@ -153,7 +154,7 @@ class Tests(SimpleTestCase):
         self.assertEqual(u.messages, [])
         self.assertEqual(mock_post.call_count, 2)
 
-    @patch.object(requests, 'post')
+    @patch.object(requests.Session, 'post')
     def test_send_messages_413(self, mock_post):
         u = self.create_updater()
         # got the stop signal
@@ -164,7 +165,7 @@ class Tests(SimpleTestCase):
         self.assertEqual(u.messages, [])
         self.assertEqual(mock_post.call_count, 2)
 
-    @patch.object(requests, 'post')
+    @patch.object(requests.Session, 'post')
     def test_send_messages_500(self, mock_post):
         u = self.create_updater()
         mock_post.return_value = test_utils.Response({"status": "OK"}, status_code=500)
@@ -176,7 +177,7 @@ class Tests(SimpleTestCase):
         self.assertEqual(u.messages, [])
         self.assertEqual(mock_post.call_count, 3)
 
-    @patch.object(requests, 'post')
+    @patch.object(requests.Session, 'post')
     def test_send_messages_cancel(self, mock_post):
         u = self.create_updater()
         # got the cancel signal
@@ -187,7 +188,7 @@ class Tests(SimpleTestCase):
         self.assertEqual(u.messages, [])
         self.assertEqual(mock_post.call_count, 3)
 
-    @patch.object(requests, 'post')
+    @patch.object(requests.Session, 'post')
     def test_send_messages_bad_first(self, mock_post):
         u = self.create_updater()
         # server not responding on first response
@@ -199,7 +200,7 @@ class Tests(SimpleTestCase):
         self.assertEqual(u.messages, items)
         self.assertEqual(mock_post.call_count, 1)
 
-    @patch.object(requests, 'post')
+    @patch.object(requests.Session, 'post')
     def test_send_messages_bad_last(self, mock_post):
         u = self.create_updater()
         # server not responding on last response
@@ -213,7 +214,7 @@ class Tests(SimpleTestCase):
         self.assertEqual(u.messages, items[2:])
         self.assertEqual(mock_post.call_count, 3)
 
-    @patch.object(requests, 'post')
+    @patch.object(requests.Session, 'post')
     def test_send_messages_invalid_json(self, mock_post):
         u = self.create_updater()
         # server not responding correctly
@@ -225,7 +226,119 @@ class Tests(SimpleTestCase):
         self.assertEqual(u.messages, [])
         self.assertEqual(mock_post.call_count, 3)
 
-    @patch.object(requests, 'post')
+    def load_step_messages(self, u):
+        u.messages = []
+        items = []
+        for stage, stepresult_id, output in [("start", 1, ""),
+                ("update", 1, "out1"),
+                ("update", 1, "out2"),
+                ("complete", 1, "out1out2"),
+                ("update", 2, "out3"),
+                ("update", 2, "out4")]:
+            item = {"server": u.main_server,
+                "job_id": 1,
+                "url": "url_%s" % stage,
+                "stage": stage,
+                "stepresult_id": stepresult_id,
+                "payload": {"output": output, "time": len(items)}}
+            items.append(item)
+            u.message_q.put(item)
+        # Not a step result update
+        item = {"server": u.main_server, "job_id": 1, "url": "url", "payload": {"message": "message"}}
+        items.append(item)
+        u.message_q.put(item)
+        u.read_queue()
+        return items
+
+    def test_next_message(self):
+        u = self.create_updater()
+        items = self.load_step_messages(u)
+        batch, count = u.next_message()
+        self.assertEqual(count, 6)
+        self.assertTrue(batch["batch"])
+        self.assertIn("update_step_results", batch["url"])
+        updates = batch["payload"]["updates"]
+        self.assertEqual([(up["stage"], up["stepresult_id"]) for up in updates],
+                [("start", 1), ("update", 1), ("complete", 1), ("update", 2)])
+        self.assertEqual(updates[1]["payload"], {"output": "out1out2", "time": 2})
+        self.assertEqual(updates[3]["payload"], {"output": "out3out4", "time": 5})
+        # The original messages aren't changed
+        self.assertEqual(items[1]["payload"], {"output": "out1", "time": 1})
+
+        u.messages = u.messages[count:]
+        self.assertEqual(u.next_message(), (items[-1], 1))
+
+        # limit the batch size
+        u.messages = items[:]
+        u.max_batch_size = 2
+        batch, count = u.next_message()
+        self.assertEqual(count, 2)
+
+        # messages for different jobs aren't combined
+        u.messages = [items[0].copy(), items[1].copy()]
+        u.messages[1]["job_id"] = 2
+        self.assertEqual(u.next_message(), (u.messages[0], 1))
+
+        u.batch_updates = False
+        u.messages = items[:]
+        self.assertEqual(u.next_message(), (items[0], 1))
+
+    def test_encode_payload(self):
+        u = self.create_updater()
+        output = "output\n" * 1000
+        item = {"server": u.main_server, "job_id": 1, "url": "url", "stage": "update", "stepresult_id": 1,
+                "payload": {"output": output, "time": 1}}
+        # nothing negotiated with the server
+        self.assertEqual(u.encode_payload(item), item["payload"])
+
+        u.output_encoding = "gzip"
+        payload = u.encode_payload(item)
+        self.assertEqual(payload["output_encoding"], "gzip")
+        self.assertEqual(payload["time"], 1)
+        compressed = base64.b64decode(payload["output"])
+        self.assertLess(len(compressed), len(output))
+        with gzip.GzipFile(fileobj=io.BytesIO(compressed)) as f:
+            self.assertEqual(f.read().decode("utf-8"), output)
+        # original isn't changed
+        self.assertEqual(item["payload"]["output"], output)
+
+        # small output isn't worth it
+        small = item.copy()
+        small["payload"] = {"output": "output", "time": 1}
+        self.assertEqual(u.encode_payload(small), small["payload"])
+
+        # Not a step result
+        other = {"server": u.main_server, "job_id": 1, "url": "url", "payload": {"output": output}}
+        self.assertEqual(u.encode_payload(other), other["payload"])
+
+        batch = {"server": u.main_server, "job_id": 1, "url": "url", "batch": True,
+                "payload": {"updates": [{"stage": "update", "stepresult_id": 1, "payload": item["payload"]}]}}
+        payload = u.encode_payload(batch)
+        self.assertEqual(payload["updates"][0]["payload"]["output_encoding"], "gzip")
+        self.assertEqual(batch["payload"]["updates"][0]["payload"]["output"], output)
+
+    @patch.object(requests.Session, 'post')
+    def test_send_messages_batch(self, mock_post):
+        u = self.create_updater()
+        self.load_step_messages(u)
+        mock_post.return_value = test_utils.Response({"status": "OK"})
+        u.send_messages()
+        self.assertEqual(u.messages, [])
+        self.assertEqual(mock_post.call_count, 2)
+        self.assertEqual(u.message_q.unfinished_tasks, 0)
+
+        # server doesn't support batches
+        mock_post.call_count = 0
+        self.load_step_messages(u)
+        mock_post.side_effect = [test_utils.Response({"status": "OK"}, status_code=404)] + \
+                [test_utils.Response({"status": "OK"})]*7
+        u.send_messages()
+        self.assertEqual(u.messages, [])
+        self.assertFalse(u.batch_updates)
+        self.assertEqual(mock_post.call_count, 8)
+        self.assertEqual(u.message_q.unfinished_tasks, 0)
+
+    @patch.object(requests.Session, 'post')
     def test_send_messages_invalid(self, mock_post):
         u = self.create_updater()
         # server not responding correctly
@@ -238,7 +351,7 @@ class Tests(SimpleTestCase):
         self.assertEqual(u.messages, [])
         self.assertEqual(mock_post.call_count, 3)
 
-    @patch.object(requests, 'post')
+    @patch.object(requests.Session, 'post')
     def test_ping_servers(self, mock_post):
         u = self.create_updater()
         mock_post.return_value = test_utils.Response({"not_empty": True})
@@ -255,7 +368,7 @@ class Tests(SimpleTestCase):
         u.ping_servers()
         self.assertEqual(mock_post.call_count, 2)
 
-    @patch.object(requests, 'post')
+    @patch.object(requests.Session, 'post')
     def test_ping_server(self, mock_post):
         u = self.create_updater()
         mock_post.return_value = test_utils.Response({"not_empty": True})
@@ -267,7 +380,7 @@ class Tests(SimpleTestCase):
         ret = u.ping_server("server", "message")
         self.assertEqual(ret, False)
 
-    @patch.object(requests, 'post')
+    @patch.object(requests.Session, 'post')
     def test_post_json(self, mock_post):
         u = self.create_updater()
         in_data = {'foo': 'bar'}
@@ -288,7 +401,7 @@ class Tests(SimpleTestCase):
         ret = u.post_json(url, in_data)
         self.assertEqual(ret, {"status": "OK", "command": "stop"})
 
-    @patch.object(requests, 'post')
+    @patch.object(requests.Session, 'post')
     def test_bad_output(self, mock_post):
         u = self.create_updater()
         mock_post.return_value = test_utils.Response({"not_empty": True})